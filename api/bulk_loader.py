@@ -0,0 +1,151 @@
+"""
+Carga masiva compartida — COPY en PostgreSQL, executemany en SQLite
+===================================================================
+Los importadores (pagos, pólizas, etapas) entregan filas como dicts y este
+módulo elige el camino más rápido según la conexión:
+  - psycopg2 (Cloud SQL): COPY tabla (cols) FROM STDIN en formato CSV,
+    por bloques de `batch_size` filas sin pasar por el compilador de SQLAlchemy.
+  - Otros drivers (SQLite local): INSERT ... VALUES con executemany.
+
+No depende de api.database para poder usarse desde los jobs de Cloud Run
+que crean su propio engine.
+"""
+import csv
+import io
+from typing import Callable, Iterable, Optional, Union
+
+from sqlalchemy import Table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+BATCH_SIZE = 50000          # Filas por COPY / executemany
+NULL_COPY = r"\N"           # Marcador de NULL en el CSV enviado a COPY
+
+
+def _conexion(db: Union[Session, Connection]) -> Connection:
+    """Acepta Session o Connection y retorna la Connection (misma transacción)."""
+    return db.connection() if isinstance(db, Session) else db
+
+
+def soporta_copy(db: Union[Session, Connection]) -> bool:
+    """True si la conexión es PostgreSQL vía psycopg2 (tiene copy_expert)."""
+    dialect = _conexion(db).dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def defaults_python(tabla: Table, columnas: list) -> dict:
+    """
+    Defaults del lado Python (p.ej. created_at=lambda: now) de las columnas que no
+    vienen en las filas. COPY no los ejecuta, así que se calculan aquí.
+    """
+    defaults = {}
+    for c in tabla.columns:
+        if c.name in columnas or c.primary_key or c.default is None:
+            continue
+        if c.default.is_scalar:
+            defaults[c.name] = (lambda v: lambda: v)(c.default.arg)
+        elif c.default.is_callable:
+            defaults[c.name] = (lambda fn: lambda: fn(None))(c.default.arg)
+    return defaults
+
+
+def _valor_csv(v):
+    if v is None:
+        return NULL_COPY
+    if isinstance(v, bool):
+        return "t" if v else "f"
+    return v
+
+
+def _copy_lote(conn: Connection, tabla: str, columnas: list, filas: list) -> None:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for f in filas:
+        writer.writerow([_valor_csv(f.get(c)) for c in columnas])
+    buf.seek(0)
+
+    sql = (
+        f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN "
+        f"WITH (FORMAT csv, NULL '{NULL_COPY}')"
+    )
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(sql, buf)
+    finally:
+        cursor.close()
+
+
+def _cargar_lote(conn: Connection, usar_copy: bool, tabla: str, columnas: list,
+                 stmt, filas: list) -> None:
+    if usar_copy:
+        _copy_lote(conn, tabla, columnas, filas)
+    else:
+        conn.execute(stmt, filas)
+
+
+def bulk_insert(
+    db: Union[Session, Connection],
+    tabla: Union[str, Table],
+    filas: Iterable[dict],
+    columnas: Optional[list] = None,
+    batch_size: int = BATCH_SIZE,
+    progreso: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Inserta `filas` (iterable de dicts, puede ser un generador) en `tabla`.
+
+    Args:
+        db: Session o Connection; no hace commit (el llamador controla la transacción).
+        tabla: nombre de la tabla o Table de SQLAlchemy. Con Table se descartan
+            llaves que no son columnas y se aplican los defaults del modelo.
+        columnas: columnas a cargar; por defecto las llaves de la primera fila.
+        batch_size: filas por COPY / executemany.
+        progreso: callback opcional con el total acumulado tras cada lote.
+
+    Returns:
+        Número de filas insertadas.
+    """
+    conn = _conexion(db)
+    usar_copy = soporta_copy(conn)
+    filas = iter(filas)
+
+    primera = next(filas, None)
+    if primera is None:
+        return 0
+
+    nombre = tabla.name if isinstance(tabla, Table) else tabla
+    if columnas is None:
+        columnas = list(primera.keys())
+    defaults = {}
+    if isinstance(tabla, Table):
+        columnas = [c for c in columnas if c in tabla.columns]
+        defaults = defaults_python(tabla, columnas)
+    todas = columnas + list(defaults)
+
+    stmt = text(
+        f"INSERT INTO {nombre} ({', '.join(todas)}) "
+        f"VALUES ({', '.join(':' + c for c in todas)})"
+    )
+
+    def _completar(f: dict) -> dict:
+        fila = {c: f.get(c) for c in columnas}
+        for c, fn in defaults.items():
+            fila[c] = fn()
+        return fila
+
+    total = 0
+    lote = [_completar(primera)]
+    for f in filas:
+        lote.append(_completar(f))
+        if len(lote) >= batch_size:
+            _cargar_lote(conn, usar_copy, nombre, todas, stmt, lote)
+            total += len(lote)
+            lote = []
+            if progreso:
+                progreso(total)
+    if lote:
+        _cargar_lote(conn, usar_copy, nombre, todas, stmt, lote)
+        total += len(lote)
+        if progreso:
+            progreso(total)
+    return total
@@ -0,0 +1,234 @@
+"""
+Búsqueda de pólizas, contratantes, solicitudes y agentes
+========================================================
+Cada tabla buscable tiene la columna `busqueda`: sus campos de texto
+normalizados (sin acentos, mayúsculas, sin puntuación) en un solo texto.
+Sobre ella hay un índice de trigramas, así que buscar una subcadena no
+recorre la tabla:
+
+  PostgreSQL  GIN pg_trgm (busqueda gin_trgm_ops): LIKE '%término%' usa el índice
+  SQLite      tabla FTS5 <tabla>_fts (tokenizer trigram, external content
+              sincronizada por triggers)
+
+Los índices se crean con la tabla (ver ddl_busqueda en api/database.py) o con
+scripts/migrar_busqueda.py en una BD existente.
+
+Los escritores llenan la columna (con_busqueda / serie_busqueda /
+texto_busqueda); las filas que llegan sin ella (scripts, BD previa) las
+completa completar_busqueda, que GET /buscar corre cuando cambia la versión
+de los datos.
+"""
+import unicodedata
+from typing import Iterable, Optional
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cache_respuestas import version_datos
+
+# tabla → campos que forman la columna busqueda
+CAMPOS_BUSQUEDA = {
+    "polizas": ("poliza_original", "asegurado_nombre", "contratante_nombre", "rfc"),
+    "contratantes": ("nombre", "rfc", "email"),
+    "solicitudes": ("nosol", "folio", "contratante_nombre", "poliza_numero", "idagente"),
+    "agentes": ("codigo_agente", "nombre_completo"),
+}
+
+# tabla → (título, subtítulo) de cada resultado de /buscar (expresiones sobre el alias t)
+RESULTADOS = {
+    "polizas": ("t.poliza_original", "t.asegurado_nombre"),
+    "contratantes": ("t.nombre", "t.rfc"),
+    "solicitudes": ("COALESCE(t.nosol, t.folio)", "t.contratante_nombre"),
+    "agentes": ("t.codigo_agente", "t.nombre_completo"),
+}
+
+MIN_TERMINO = 3          # Los trigramas no indexan subcadenas más cortas
+LOTE_COMPLETAR = 5000
+
+_version_completada = {}   # url de la BD → versión de datos ya completada
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. NORMALIZACIÓN
+# ══════════════════════════════════════════════════════════════════
+
+def normalizar_busqueda(valor) -> str:
+    """'José  Pérez-López' → 'JOSE PEREZ LOPEZ' (sin acentos, mayúsculas, solo letras/dígitos)."""
+    if valor is None:
+        return ""
+    sin_acentos = "".join(c for c in unicodedata.normalize("NFKD", str(valor)) if not unicodedata.combining(c))
+    limpio = "".join(c if c.isalnum() else " " for c in sin_acentos.upper())
+    return " ".join(limpio.split())
+
+
+def texto_busqueda(*valores) -> Optional[str]:
+    """Columna busqueda a partir de los valores de los campos (None si todos vienen vacíos)."""
+    texto = " ".join(n for n in (normalizar_busqueda(v) for v in valores) if n)
+    return texto or None
+
+
+def con_busqueda(tabla: str, fila: dict) -> dict:
+    """Agrega `busqueda` a una fila (dict) que trae campos buscables. Modifica y retorna la fila."""
+    campos = [c for c in CAMPOS_BUSQUEDA[tabla] if c in fila]
+    if campos:
+        fila["busqueda"] = texto_busqueda(*(fila[c] for c in campos))
+    return fila
+
+
+def busqueda_de(tabla: str, objeto) -> Optional[str]:
+    """Columna busqueda de un objeto ORM de `tabla` (para asignarla antes del commit)."""
+    return texto_busqueda(*(getattr(objeto, c, None) for c in CAMPOS_BUSQUEDA[tabla]))
+
+
+def serie_busqueda(*series: pd.Series) -> pd.Series:
+    """Versión vectorizada de texto_busqueda para los importadores (NA si la fila no tiene texto)."""
+    texto = series[0].fillna("").astype(str)
+    for s in series[1:]:
+        texto = texto + " " + s.fillna("").astype(str)
+    normal = texto.map(normalizar_busqueda)
+    return normal.where(normal != "")
+
+
+def terminos(q: str) -> list:
+    """Palabras normalizadas de la consulta indexables por trigramas; si ninguna lo es, la frase completa."""
+    normal = normalizar_busqueda(q)
+    largos = [t for t in normal.split() if len(t) >= MIN_TERMINO]
+    return largos or ([normal] if normal else [])
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. PREDICADOS
+# ══════════════════════════════════════════════════════════════════
+
+def usa_fts(db: Session, tabla: str, terms: list) -> bool:
+    """True si la BD es SQLite, tiene la tabla FTS5 de `tabla` y los términos alcanzan un trigrama."""
+    if db.get_bind().dialect.name != "sqlite" or any(len(t) < MIN_TERMINO for t in terms):
+        return False
+    return db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"),
+                      {"n": f"{tabla}_fts"}).first() is not None
+
+
+def _match_fts(terms: list) -> str:
+    """Consulta FTS5: cada término como frase entre comillas (AND implícito)."""
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def filtro_busqueda(db: Session, tabla: str, alias: str, q: str, params: dict) -> str:
+    """
+    Predicado sobre `alias` (fila de `tabla`) para las filas que contienen todos
+    los términos de `q`. Agrega sus parámetros (bq_<tabla>...) a `params`.
+    """
+    terms = terminos(q)
+    if not terms:
+        return "1=1"
+    if usa_fts(db, tabla, terms):
+        params[f"bq_{tabla}"] = _match_fts(terms)
+        return f"{alias}.id IN (SELECT rowid FROM {tabla}_fts WHERE {tabla}_fts MATCH :bq_{tabla})"
+    condiciones = []
+    for i, t in enumerate(terms):
+        params[f"bq_{tabla}{i}"] = f"%{t}%"
+        condiciones.append(f"{alias}.busqueda LIKE :bq_{tabla}{i}")
+    return "(" + " AND ".join(condiciones) + ")"
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. BÚSQUEDA UNIFICADA
+# ══════════════════════════════════════════════════════════════════
+
+def _puntaje(busqueda: str, consulta: str, posicion: int) -> float:
+    """
+    Puntaje comparable entre tablas: la fila que empieza con la consulta va
+    primero, luego la que tiene una palabra que empieza con ella; dentro de cada
+    nivel manda el orden del motor (bm25 en FTS5, similarity en pg_trgm).
+    """
+    busqueda = busqueda or ""
+    if busqueda.startswith(consulta):
+        nivel = 3
+    elif f" {consulta}" in f" {busqueda}":
+        nivel = 2
+    else:
+        nivel = 1
+    return round(nivel + 1 / (2 + posicion), 4)
+
+
+def _candidatos(db: Session, tabla: str, terms: list, consulta: str, limite: int) -> list:
+    titulo, subtitulo = RESULTADOS[tabla]
+    columnas = f"t.id, {titulo} AS titulo, {subtitulo} AS subtitulo, t.busqueda"
+    if usa_fts(db, tabla, terms):
+        return db.execute(text(f"""
+            SELECT {columnas}
+            FROM {tabla}_fts f JOIN {tabla} t ON t.id = f.rowid
+            WHERE {tabla}_fts MATCH :bq
+            ORDER BY f.rank
+            LIMIT :limite
+        """), {"bq": _match_fts(terms), "limite": limite}).mappings().all()
+
+    params = {"consulta": consulta, "limite": limite}
+    where = filtro_busqueda(db, tabla, "t", " ".join(terms), params)
+    orden = ("similarity(t.busqueda, :consulta) DESC" if db.get_bind().dialect.name == "postgresql"
+             else "LENGTH(t.busqueda)")
+    return db.execute(text(f"""
+        SELECT {columnas} FROM {tabla} t
+        WHERE {where}
+        ORDER BY {orden}
+        LIMIT :limite
+    """), params).mappings().all()
+
+
+def buscar(db: Session, q: str, tablas: Iterable[str] = tuple(CAMPOS_BUSQUEDA), limite: int = 10) -> list:
+    """Resultados de `q` en `tablas` ordenados por puntaje: [{tipo, id, titulo, subtitulo, puntaje}]."""
+    terms = terminos(q)
+    if not terms:
+        return []
+    consulta = normalizar_busqueda(q)
+    hits = []
+    for tabla in tablas:
+        for posicion, r in enumerate(_candidatos(db, tabla, terms, consulta, limite)):
+            hits.append({
+                "tipo": tabla, "id": r["id"], "titulo": r["titulo"], "subtitulo": r["subtitulo"],
+                "puntaje": _puntaje(r["busqueda"], consulta, posicion),
+            })
+    hits.sort(key=lambda h: -h["puntaje"])
+    return hits
+
+
+# ══════════════════════════════════════════════════════════════════
+# 4. FILAS SIN COLUMNA DE BÚSQUEDA
+# ══════════════════════════════════════════════════════════════════
+
+def completar_busqueda(db: Session, tablas: Iterable[str] = tuple(CAMPOS_BUSQUEDA),
+                       lote: int = LOTE_COMPLETAR) -> int:
+    """
+    Calcula `busqueda` en lotes por id para las filas que no la tienen.
+    Las filas sin texto quedan con '' para no volver a procesarlas. No hace commit.
+    """
+    total = 0
+    for tabla in tablas:
+        campos = CAMPOS_BUSQUEDA[tabla]
+        ultimo_id = 0
+        while True:
+            filas = db.execute(text(f"""
+                SELECT id, {", ".join(campos)} FROM {tabla}
+                WHERE busqueda IS NULL AND id > :ultimo
+                ORDER BY id LIMIT :lote
+            """), {"ultimo": ultimo_id, "lote": lote}).fetchall()
+            if not filas:
+                break
+            ultimo_id = filas[-1][0]
+            db.execute(text(f"UPDATE {tabla} SET busqueda = :b WHERE id = :id"),
+                       [{"id": f[0], "b": texto_busqueda(*f[1:]) or ""} for f in filas])
+            total += len(filas)
+    return total
+
+
+def asegurar_busqueda(db: Session) -> int:
+    """Completa las filas pendientes una vez por versión de los datos (por proceso). Hace commit."""
+    url = str(db.get_bind().url)
+    version = version_datos(db)
+    if _version_completada.get(url) == version:
+        return 0
+    n = completar_busqueda(db)
+    db.commit()
+    _version_completada[url] = version
+    return n
@@ -0,0 +1,205 @@
+"""
+Caché de respuestas de los endpoints de lectura pesada
+======================================================
+Los dashboards solo cambian cuando corre una importación o un recálculo de
+reglas, así que su respuesta se guarda con la clave
+
+    endpoint + parámetros normalizados + versión de los datos
+
+La versión vive en la tabla version_datos (una fila) y la suben, dentro de su
+misma transacción, los importadores, el recálculo de reglas y los endpoints de
+escritura (`invalidar`). Al cambiar la versión las claves viejas dejan de
+usarse y salen solas por LRU/TTL; como la versión está en la BD, la invalidación
+alcanza a todas las instancias.
+
+Niveles:
+  1. LRU en proceso con TTL (MAG_CACHE_TTL segundos, MAG_CACHE_MAX entradas)
+  2. Opcional: almacén compartido en disco (MAG_CACHE_DIR) — sustituto local de
+     un Redis/Memorystore; cualquier instancia que monte el directorio lo reutiliza.
+
+MAG_CACHE_TTL=0 desactiva la caché.
+"""
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+CACHE_TTL = int(os.getenv("MAG_CACHE_TTL", "300"))
+CACHE_MAX = int(os.getenv("MAG_CACHE_MAX", "256"))
+CACHE_DIR = os.getenv("MAG_CACHE_DIR", "")
+
+_estadisticas = {"aciertos": 0, "aciertos_compartido": 0, "fallos": 0}
+
+
+# ══════════════════════════════════════════════════════════════════
+# VERSIÓN DE LOS DATOS
+# ══════════════════════════════════════════════════════════════════
+
+def version_datos(db: Session) -> int:
+    return db.execute(text("SELECT version FROM version_datos WHERE id = 1")).scalar() or 0
+
+
+def invalidar(db: Session) -> None:
+    """Sube la versión de los datos. No hace commit: se publica con la transacción del llamador."""
+    ahora = datetime.now().isoformat()
+    r = db.execute(text("UPDATE version_datos SET version = version + 1, updated_at = :ahora WHERE id = 1"),
+                   {"ahora": ahora})
+    if not r.rowcount:
+        db.execute(text("INSERT INTO version_datos (id, version, updated_at) VALUES (1, 1, :ahora)"),
+                   {"ahora": ahora})
+
+
+def bloquear_reconstruccion(db: Session, recurso: str) -> None:
+    """
+    Serializa hasta el fin de la transacción la reconstrucción de una tabla
+    derivada (DELETE + INSERT desde un GET). En PostgreSQL toma un advisory lock
+    por recurso: sin él, dos requests concurrentes no ven las filas que inserta
+    el otro y ambos INSERT quedan. El llamador debe volver a comprobar si la
+    tabla sigue desactualizada después de tomarlo. En SQLite la escritura ya es
+    exclusiva y no hace nada.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    clave = int.from_bytes(hashlib.sha256(recurso.encode()).digest()[:8], "big", signed=True)
+    db.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": clave})
+
+
+# ══════════════════════════════════════════════════════════════════
+# ALMACENES
+# ══════════════════════════════════════════════════════════════════
+
+class _LRU:
+    """LRU con expiración por entrada, seguro entre hilos (endpoints sync corren en el threadpool)."""
+
+    def __init__(self, maximo: int, ttl: int):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: str):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave: str, valor) -> None:
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class _AlmacenArchivos:
+    """Un JSON por clave en un directorio compartido; escritura atómica (tmp + rename)."""
+
+    def __init__(self, directorio: str, ttl: int):
+        self.directorio = directorio
+        self.ttl = ttl
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, hashlib.sha1(clave.encode()).hexdigest() + ".json")
+
+    def obtener(self, clave: str):
+        try:
+            with open(self._ruta(clave), encoding="utf-8") as f:
+                entrada = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entrada.get("clave") != clave or entrada.get("expira", 0) < time.time():
+            return None
+        return entrada["valor"]
+
+    def guardar(self, clave: str, valor) -> None:
+        ruta = self._ruta(clave)
+        tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"clave": clave, "expira": time.time() + self.ttl, "valor": valor}, f)
+            os.replace(tmp, ruta)
+        except OSError:
+            pass    # El almacén compartido es best-effort; la respuesta ya está calculada
+
+
+_local = _LRU(CACHE_MAX, CACHE_TTL)
+_compartido: Optional[_AlmacenArchivos] = _AlmacenArchivos(CACHE_DIR, CACHE_TTL) if CACHE_DIR and CACHE_TTL > 0 else None
+
+
+def limpiar() -> None:
+    """Vacía la caché en proceso (el almacén compartido expira por TTL)."""
+    _local.limpiar()
+
+
+def estadisticas() -> dict:
+    return {**_estadisticas, "entradas": len(_local), "ttl_segundos": CACHE_TTL,
+            "compartido": bool(_compartido)}
+
+
+# ══════════════════════════════════════════════════════════════════
+# DECORADOR
+# ══════════════════════════════════════════════════════════════════
+
+def _clave(nombre: str, version: int, kwargs: dict) -> str:
+    params = sorted((k, v) for k, v in kwargs.items() if not isinstance(v, Session))
+    return f"{nombre}|v{version}|{json.dumps(params, default=str, ensure_ascii=False)}"
+
+
+def cacheado(nombre: str):
+    """
+    Cachea un endpoint síncrono de solo lectura. Debe recibir la sesión como `db`
+    (Depends(get_db)); el resto de argumentos forman la clave.
+
+        @router.get("", response_model=X)
+        @cacheado("dashboard")
+        def get_dashboard(anio: int = Query(...), db: Session = Depends(get_db)): ...
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def envoltura(*args, **kwargs):
+            if CACHE_TTL <= 0:
+                return func(*args, **kwargs)
+            clave = _clave(nombre, version_datos(kwargs["db"]), kwargs)
+
+            valor = _local.obtener(clave)
+            if valor is not None:
+                _estadisticas["aciertos"] += 1
+                return valor
+            if _compartido is not None:
+                valor = _compartido.obtener(clave)
+                if valor is not None:
+                    _estadisticas["aciertos_compartido"] += 1
+                    _local.guardar(clave, valor)
+                    return valor
+
+            _estadisticas["fallos"] += 1
+            valor = func(*args, **kwargs)
+            _local.guardar(clave, valor)
+            if _compartido is not None:
+                _compartido.guardar(clave, jsonable_encoder(valor))
+            return valor
+        return envoltura
+    return decorador
@@ -0,0 +1,135 @@
+"""
+Motor de conciliación AXA ↔ base interna (set-based)
+====================================================
+Cruza los indicadores AXA de un periodo contra las pólizas internas en una
+sola consulta:
+
+  1. FULL OUTER JOIN por match_key (clave_cruce, indexada en ambas tablas)
+     entre los indicadores del periodo y las pólizas candidatas (del periodo
+     o con clave reportada por AXA); el status COINCIDE / DIFERENCIA /
+     SOLO_AXA / SOLO_INTERNO se calcula en SQL
+  2. El resultado se persiste en `conciliaciones` (se reemplaza el periodo)
+
+GET /conciliacion lee lo persistido mientras siga vigente: se recalcula solo
+si la versión de los datos (version_datos, ver api/cache_respuestas.py) cambió
+después de la última conciliación del periodo. El recálculo toma un lock por
+periodo (bloquear_reconstruccion) para que dos requests concurrentes no
+inserten el periodo dos veces.
+"""
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cache_respuestas import bloquear_reconstruccion
+from .produccion_agg import SQL_ES_NUEVA
+
+DIF_SOLO_AXA = "Póliza en AXA no encontrada en base interna"
+DIF_SOLO_INTERNO = "Póliza interna no reportada en indicadores AXA"
+
+
+def conciliar_periodo(db: Session, periodo: str) -> int:
+    """
+    Recalcula y persiste la conciliación del periodo. No hace commit.
+    Retorna el número de filas conciliadas.
+    """
+    db.execute(text("DELETE FROM conciliaciones WHERE periodo = :periodo"), {"periodo": periodo})
+
+    # Una póliza interna por clave (la de menor id) participa en el cruce;
+    # el resto de duplicados del periodo solo cuentan como SOLO_INTERNO si AXA no reporta la clave.
+    insertadas = db.execute(text(f"""
+        WITH axa AS (
+            SELECT i.id AS indicador_id, i.match_key AS clave, i.prima_primer_anio,
+                   CASE WHEN i.es_nueva_axa THEN 1 ELSE 0 END AS es_nueva
+            FROM indicadores_axa i
+            WHERE i.periodo = :periodo
+        ),
+        candidatas AS (
+            SELECT p.id, p.match_key AS clave, p.periodo_aplicacion, p.prima_neta,
+                   CASE WHEN {SQL_ES_NUEVA} THEN 1 ELSE 0 END AS es_nueva,
+                   ROW_NUMBER() OVER (PARTITION BY p.match_key ORDER BY p.id) AS rn
+            FROM polizas p
+            WHERE p.periodo_aplicacion = :periodo
+               OR p.match_key IN (SELECT clave FROM axa)
+        ),
+        internas AS (
+            SELECT c.*, CASE WHEN c.rn = 1 THEN c.clave END AS clave_cruce FROM candidatas c
+        ),
+        cruce AS (
+            SELECT axa.indicador_id, axa.prima_primer_anio, axa.es_nueva AS axa_nueva,
+                   p.id AS poliza_id, p.prima_neta, p.es_nueva AS int_nueva,
+                   CASE WHEN axa.indicador_id IS NULL THEN 'SOLO_INTERNO'
+                        WHEN p.id IS NULL THEN 'SOLO_AXA'
+                        WHEN p.es_nueva = axa.es_nueva THEN 'COINCIDE'
+                        ELSE 'DIFERENCIA' END AS status
+            FROM axa
+            FULL OUTER JOIN internas p ON p.clave_cruce = axa.clave
+            WHERE axa.indicador_id IS NOT NULL
+               OR (p.periodo_aplicacion = :periodo
+                   AND (p.clave IS NULL OR p.clave NOT IN (SELECT clave FROM axa WHERE clave IS NOT NULL)))
+        )
+        INSERT INTO conciliaciones
+            (periodo, fecha_conciliacion, poliza_id, indicador_axa_id, status, tipo_diferencia,
+             clasificacion_interna, clasificacion_axa, prima_interna, prima_axa, resuelto, created_at)
+        SELECT :periodo, :ahora, poliza_id, indicador_id, status,
+               CASE status
+                   WHEN 'SOLO_AXA' THEN :dif_solo_axa
+                   WHEN 'SOLO_INTERNO' THEN :dif_solo_interno
+                   WHEN 'DIFERENCIA' THEN 'Interno: '
+                        || CASE WHEN int_nueva = 1 THEN 'NUEVA' ELSE 'SUBSECUENTE' END
+                        || ', AXA: ' || CASE WHEN axa_nueva = 1 THEN 'NUEVA' ELSE 'NO NUEVA' END
+               END,
+               CASE WHEN poliza_id IS NULL THEN NULL WHEN int_nueva = 1 THEN 'NUEVA' ELSE 'SUBSECUENTE' END,
+               CASE WHEN indicador_id IS NULL THEN NULL WHEN axa_nueva = 1 THEN 'NUEVA' ELSE 'NO NUEVA' END,
+               prima_neta, prima_primer_anio, :resuelto, :ahora
+        FROM cruce
+        ORDER BY CASE WHEN indicador_id IS NULL THEN 1 ELSE 0 END, indicador_id, poliza_id
+    """), {
+        "periodo": periodo, "ahora": datetime.now().isoformat(), "resuelto": False,
+        "dif_solo_axa": DIF_SOLO_AXA, "dif_solo_interno": DIF_SOLO_INTERNO,
+    }).rowcount
+    return insertadas
+
+
+def conciliacion_vigente(db: Session, periodo: str) -> bool:
+    """True si la conciliación persistida del periodo es posterior al último cambio de datos."""
+    ultima = db.execute(text("SELECT MAX(fecha_conciliacion) FROM conciliaciones WHERE periodo = :periodo"),
+                        {"periodo": periodo}).scalar()
+    if not ultima:
+        return False
+    cambio = db.execute(text("SELECT updated_at FROM version_datos WHERE id = 1")).scalar()
+    return cambio is None or ultima >= cambio
+
+
+def asegurar_conciliacion(db: Session, periodo: str, recalcular: bool = False) -> bool:
+    """Recalcula y confirma el periodo si está desactualizado (o si se pide). Retorna True si lo recalculó."""
+    if not recalcular and conciliacion_vigente(db, periodo):
+        return False
+    bloquear_reconstruccion(db, f"conciliaciones:{periodo}")
+    # Otro request pudo recalcularlo mientras se esperaba el lock
+    if not recalcular and conciliacion_vigente(db, periodo):
+        db.commit()
+        return False
+    conciliar_periodo(db, periodo)
+    db.commit()
+    return True
+
+
+def leer_conciliacion(db: Session, periodo: str) -> list:
+    """Filas persistidas del periodo con los datos de la póliza AXA o interna para la respuesta."""
+    return db.execute(text("""
+        SELECT c.status, c.tipo_diferencia, c.clasificacion_interna, c.indicador_axa_id,
+               i.poliza AS axa_poliza, i.agente_codigo AS axa_agente_codigo,
+               ai.nombre_completo AS axa_agente_nombre, i.ramo AS axa_ramo,
+               i.prima_primer_anio, i.es_nueva_axa,
+               p.poliza_original, ap.codigo_agente, ap.nombre_completo AS agente_nombre,
+               pr.ramo_nombre, p.prima_neta
+        FROM conciliaciones c
+        LEFT JOIN indicadores_axa i ON i.id = c.indicador_axa_id
+        LEFT JOIN agentes ai ON ai.codigo_agente = i.agente_codigo
+        LEFT JOIN polizas p ON p.id = c.poliza_id
+        LEFT JOIN agentes ap ON ap.id = p.agente_id
+        LEFT JOIN productos pr ON pr.id = p.producto_id
+        WHERE c.periodo = :periodo
+        ORDER BY c.id
+    """), {"periodo": periodo}).mappings().all()
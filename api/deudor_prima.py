@@ -0,0 +1,342 @@
+"""
+Cobranza: ledger de recibos esperados y semáforo de deudor por prima
+====================================================================
+GET /cobranza ya no recalcula en cada request los recibos, días de
+vencimiento y prioridad de cada póliza. Dos tablas los guardan:
+
+  recibos_cobranza  un recibo esperado por póliza según forma_pago
+                    (12 // meses del periodo, vencimiento = inicio + k periodos)
+                    con la parte de lo pagado que le toca: lo pagado se aplica
+                    a los recibos en orden de vencimiento
+  deudores_prima    una fila por póliza con el semáforo a la fecha de corte
+                    (recibo actual, próximo recibo, días vencido, prioridad)
+
+Lo pagado es lo mejor disponible: max(prima_acumulada_basica, suma de pagos
+por match_key, neta_acumulada). Una póliza sin ningún pago tiene DIAS_GRACIA
+días desde el vencimiento de su primer recibo antes de contar como vencida
+(igual que el cálculo anterior: hoy - fecha_inicio - 30 días).
+
+Refresco:
+  - refrescar_cobranza(anios | match_keys | poliza_ids): reconstruye las pólizas
+    de la partición. Lo llaman quienes llaman refrescar_produccion y los
+    importadores de pagos con las claves de cada bloque; sin partición, todo.
+  - asegurar_cobranza: al cambiar el día recalcula el semáforo solo de las
+    pólizas con recibos vencidos sin pagar o que vencieron desde el último corte.
+"""
+from datetime import date
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .bulk_loader import bulk_insert
+from .cache_respuestas import invalidar
+from .fechas_nativas import LECTURA_FECHAS, fecha_nativa
+
+TABLA_RECIBOS = "recibos_cobranza"
+TABLA_DEUDORES = "deudores_prima"
+
+# Subcadena de forma_pago → meses entre recibos (el resto se cobra anual)
+MESES_FORMA_PAGO = (("SEMEST", 6), ("TRIM", 3), ("MENS", 1), ("BIMEST", 2))
+PRIORIDADES = ("critico", "urgente", "atencion", "al_dia", "pagado")
+ORDEN_PRIORIDAD = {p: i for i, p in enumerate(PRIORIDADES)}
+TOLERANCIA = 0.01            # Diferencia de centavos: el recibo se considera pagado
+DIAS_GRACIA = 30             # Plazo de la póliza sin ningún pago antes de contar días vencidos
+LOTE_POLIZAS = 5000
+LOTE_CLAVES = 1000           # Claves por IN (...) en refrescos por match_key / poliza_id
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. CÁLCULO (vectorizado)
+# ══════════════════════════════════════════════════════════════════
+
+def meses_forma_pago(forma_pago) -> int:
+    fp = (forma_pago or "ANUAL").upper()
+    return next((m for clave, m in MESES_FORMA_PAGO if clave in fp), 12)
+
+
+def prioridades(dias: pd.Series, mystatus: pd.Series) -> pd.Series:
+    """
+    Semáforo: pagada/al corriente → pagado; cancelada o > 30 días → critico;
+    15-30 → urgente; 1-15 → atencion; sin vencer → al_dia.
+    """
+    ms = mystatus.fillna("").astype(str).str.upper()
+    condiciones = [
+        ms.str.contains("PAGADA", regex=False) | ms.str.contains("AL CORRIENTE", regex=False),
+        ms.str.contains("CANC", regex=False),
+        dias > 30,
+        dias > 15,
+        dias > 0,
+    ]
+    valores = ["pagado", "critico", "critico", "urgente", "atencion"]
+    return pd.Series(np.select(condiciones, valores, "al_dia"), index=dias.index)
+
+
+def _fecha_inicio(polizas: pd.DataFrame) -> pd.Series:
+    """Dual-read de fecha_inicio como datetime64 (NaT si no hay fecha válida)."""
+    valor = polizas["fecha_inicio_d"]
+    if LECTURA_FECHAS == "dual":
+        valor = valor.where(valor.notna(), polizas["fecha_inicio"])
+    return pd.to_datetime(valor.astype("string").str[:10], format="%Y-%m-%d", errors="coerce")
+
+
+def calcular_recibos(polizas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ledger de las pólizas (una fila por recibo esperado). `polizas` trae
+    poliza_id, fecha_inicio(_d), forma_pago, prima_neta y pagado.
+    """
+    fi = _fecha_inicio(polizas)
+    con_fecha = polizas[fi.notna()]
+    if con_fecha.empty:
+        return pd.DataFrame(columns=["poliza_id", "numero", "total_recibos", "fecha_vencimiento",
+                                     "prima_recibo", "prima_pagada"])
+    meses = con_fecha["forma_pago"].map(meses_forma_pago)
+    total = 12 // meses
+
+    rep = con_fecha.index.repeat(total)
+    k = pd.Series(rep, index=rep).groupby(level=0).cumcount().to_numpy()
+    inicio = fi[rep].to_numpy()
+    meses_rep = meses[rep].to_numpy()
+
+    # inicio + k periodos en meses de calendario (el día se ajusta al fin de mes)
+    fi_rep = pd.DatetimeIndex(inicio)
+    absoluto = fi_rep.year * 12 + fi_rep.month - 1 + k * meses_rep
+    primero = pd.to_datetime(pd.DataFrame({"year": absoluto // 12, "month": absoluto % 12 + 1, "day": 1}))
+    dia = np.minimum(fi_rep.day, primero.dt.days_in_month)
+    vencimiento = primero + pd.to_timedelta(dia - 1, unit="D")
+
+    n = total[rep].to_numpy()
+    prima_recibo = con_fecha["prima_neta"][rep].to_numpy() / n
+    pagado = con_fecha["pagado"][rep].to_numpy()
+    prima_pagada = np.minimum(np.clip(pagado - k * prima_recibo, 0, None), prima_recibo)
+
+    return pd.DataFrame({
+        "poliza_id": con_fecha["poliza_id"][rep].to_numpy(),
+        "numero": k + 1,
+        "total_recibos": n,
+        "fecha_vencimiento": vencimiento.to_numpy(),
+        "prima_recibo": np.round(prima_recibo, 2),
+        "prima_pagada": np.round(prima_pagada, 2),
+    })
+
+
+def calcular_semaforo(recibos: pd.DataFrame, polizas: pd.DataFrame, hoy: date) -> pd.DataFrame:
+    """
+    Columnas del semáforo que dependen del día, indexadas por poliza_id.
+    `polizas` trae poliza_id y mystatus; `recibos` es su ledger.
+    """
+    corte = pd.Timestamp(hoy)
+    ids = pd.Index(polizas["poliza_id"], name="poliza_id")
+    por_poliza = recibos.groupby("poliza_id")
+    vencimiento = pd.to_datetime(recibos["fecha_vencimiento"])
+
+    total = por_poliza["total_recibos"].max().reindex(ids)
+    vencidos = (vencimiento <= corte).groupby(recibos["poliza_id"]).sum().reindex(ids)
+    vencidos = vencidos.clip(lower=1).where(total.notna())
+
+    pendiente = recibos["prima_pagada"] < recibos["prima_recibo"] - TOLERANCIA
+    proximo = vencimiento[pendiente].groupby(recibos["poliza_id"][pendiente]).min().reindex(ids)
+    dias = (corte - proximo).dt.days
+    # Sin ningún pago el primer recibo tiene DIAS_GRACIA de plazo; con pagos parciales no
+    sin_pago = por_poliza["prima_pagada"].sum().reindex(ids) <= TOLERANCIA
+    dias = dias.where(~sin_pago, dias - DIAS_GRACIA).clip(lower=0).fillna(0).astype(int)
+
+    mystatus = pd.Series(polizas["mystatus"].to_numpy(), index=ids)
+    prioridad = prioridades(dias, mystatus)
+
+    # Pagada / al corriente según el estatus: nada vencido, el próximo es el siguiente por vencer
+    futuro = vencimiento > corte
+    siguiente = vencimiento[futuro].groupby(recibos["poliza_id"][futuro]).min().reindex(ids)
+    al_corriente = prioridad == "pagado"
+    proximo = proximo.where(~al_corriente, siguiente)
+    dias = dias.where(~al_corriente, 0)
+    actual = vencidos.astype("Int64").astype("string") + "/" + total.astype("Int64").astype("string")
+
+    return pd.DataFrame({
+        "total_recibos": total.fillna(0).astype(int),
+        "recibos_vencidos": vencidos.fillna(0).astype(int),
+        "recibo_actual": actual.fillna("-"),
+        "fecha_proximo_recibo": proximo.dt.date.astype(object).where(proximo.notna(), None),
+        "dias_vencimiento": dias,
+        "prioridad": prioridad,
+        "orden_prioridad": prioridad.map(ORDEN_PRIORIDAD),
+    }, index=ids)
+
+
+def _filas(df: pd.DataFrame) -> list:
+    """Filas de un DataFrame como dicts con tipos nativos (NA → None)."""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def calcular_cobranza(polizas: pd.DataFrame, hoy: date) -> tuple:
+    """(ledger, deudores) de un bloque de pólizas leído por _leer_polizas."""
+    polizas = polizas.reset_index(drop=True)
+    for c in ("prima_neta", "prima_total", "prima_acumulada_basica", "neta_acumulada", "pagos_total"):
+        polizas[c] = pd.to_numeric(polizas[c], errors="coerce").fillna(0.0)
+    polizas["pagado"] = polizas[["prima_acumulada_basica", "pagos_total", "neta_acumulada"]].max(axis=1)
+
+    recibos = calcular_recibos(polizas)
+    semaforo = calcular_semaforo(recibos, polizas, hoy)
+
+    prima_neta = polizas["prima_neta"]
+    deudores = pd.DataFrame({
+        "poliza_id": polizas["poliza_id"],
+        "anio_aplicacion": polizas["anio_aplicacion"],
+        "match_key": polizas["match_key"],
+        "mystatus": polizas["mystatus"],
+        "prima_neta": prima_neta.round(2),
+        "prima_total": polizas["prima_total"].where(polizas["prima_total"] != 0, prima_neta).round(2),
+        "prima_acumulada": polizas["pagado"].round(2),
+        "prima_pendiente": (prima_neta - polizas["pagado"]).clip(lower=0).round(2),
+        "fecha_corte": hoy,
+    })
+    deudores = deudores.join(semaforo, on="poliza_id")
+    recibos["fecha_vencimiento"] = pd.to_datetime(recibos["fecha_vencimiento"]).dt.date
+    return recibos, deudores
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. REFRESCO POR PARTICIÓN
+# ══════════════════════════════════════════════════════════════════
+
+def _leer_polizas(db: Session, where: str, params: dict, ultimo_id: int) -> pd.DataFrame:
+    res = db.execute(text(f"""
+        SELECT p.id AS poliza_id, p.anio_aplicacion, p.match_key, p.mystatus, p.forma_pago,
+               p.fecha_inicio, p.fecha_inicio_d, p.prima_neta, p.prima_total,
+               p.prima_acumulada_basica, p.neta_acumulada,
+               (SELECT SUM(pg.prima_neta) FROM pagos pg WHERE pg.match_key = p.match_key) AS pagos_total
+        FROM polizas p
+        WHERE ({where}) AND p.id > :ultimo_id
+        ORDER BY p.id
+        LIMIT :lote
+    """), {**params, "ultimo_id": ultimo_id, "lote": LOTE_POLIZAS})
+    return pd.DataFrame(res.fetchall(), columns=list(res.keys()))
+
+
+def _reconstruir(db: Session, where: str, params: dict, hoy: date) -> int:
+    """Borra y recalcula ledger y semáforo de las pólizas que cumplen `where` (alias p), por lotes de id."""
+    total = 0
+    ultimo_id = 0
+    while True:
+        polizas = _leer_polizas(db, where, params, ultimo_id)
+        if polizas.empty:
+            break
+        rango = {**params, "desde": ultimo_id, "hasta": int(polizas["poliza_id"].iloc[-1])}
+        ids = f"SELECT p.id FROM polizas p WHERE ({where}) AND p.id > :desde AND p.id <= :hasta"
+        db.execute(text(f"DELETE FROM {TABLA_RECIBOS} WHERE poliza_id IN ({ids})"), rango)
+        db.execute(text(f"DELETE FROM {TABLA_DEUDORES} WHERE poliza_id IN ({ids})"), rango)
+
+        recibos, deudores = calcular_cobranza(polizas, hoy)
+        bulk_insert(db, TABLA_RECIBOS, _filas(recibos))
+        bulk_insert(db, TABLA_DEUDORES, _filas(deudores))
+        total += len(deudores)
+        ultimo_id = rango["hasta"]
+    return total
+
+
+def _lista(prefijo: str, valores: list) -> tuple:
+    params = {f"{prefijo}_{i}": v for i, v in enumerate(valores)}
+    return ", ".join(f":{k}" for k in params), params
+
+
+def refrescar_cobranza(db: Session, anios: Optional[Iterable] = None,
+                       match_keys: Optional[Iterable] = None,
+                       poliza_ids: Optional[Iterable] = None,
+                       hoy: Optional[date] = None) -> int:
+    """
+    Reconstruye ledger y semáforo de las pólizas de los `anios`, `match_keys` o
+    `poliza_ids` dados (sin ninguno, las tablas completas). No hace commit.
+    Retorna las pólizas recalculadas.
+    """
+    hoy = hoy or date.today()
+    if anios is None and match_keys is None and poliza_ids is None:
+        db.execute(text(f"DELETE FROM {TABLA_RECIBOS}"))
+        db.execute(text(f"DELETE FROM {TABLA_DEUDORES}"))
+        return _reconstruir(db, "1=1", {}, hoy)
+
+    particiones = []
+    if anios is not None:
+        particiones.append(("anio_aplicacion", sorted({int(a) for a in anios if a is not None})))
+    if match_keys is not None:
+        particiones.append(("match_key", sorted({k for k in match_keys if k})))
+    if poliza_ids is not None:
+        particiones.append(("id", sorted({int(i) for i in poliza_ids if i is not None})))
+
+    total = 0
+    for columna, valores in particiones:
+        for i in range(0, len(valores), LOTE_CLAVES):
+            lista, params = _lista(columna, valores[i:i + LOTE_CLAVES])
+            # Filas de la partición cuya póliza ya no existe o cambió de partición
+            columna_d = "poliza_id" if columna == "id" else columna
+            huerfanas = f"SELECT d.poliza_id FROM {TABLA_DEUDORES} d WHERE d.{columna_d} IN ({lista})"
+            db.execute(text(f"DELETE FROM {TABLA_RECIBOS} WHERE poliza_id IN ({huerfanas})"), params)
+            db.execute(text(f"DELETE FROM {TABLA_DEUDORES} WHERE {columna_d} IN ({lista})"), params)
+            total += _reconstruir(db, f"p.{columna} IN ({lista})", params, hoy)
+    return total
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. CAMBIO DE DÍA
+# ══════════════════════════════════════════════════════════════════
+
+def actualizar_corte(db: Session, hoy: Optional[date] = None) -> int:
+    """
+    Lleva el semáforo a `hoy`. Solo cambian las pólizas con un recibo vencido sin
+    pagar (crecen sus días) o con un recibo que venció desde el último corte.
+    No hace commit. Retorna las pólizas recalculadas.
+    """
+    hoy = hoy or date.today()
+    corte = fecha_nativa(db.execute(text(f"SELECT MIN(fecha_corte) FROM {TABLA_DEUDORES}")).scalar())
+    if corte is None or corte >= hoy:
+        return 0
+    params = {"hoy": hoy.isoformat(), "corte": corte.isoformat(), "tol": TOLERANCIA}
+    # Sin DISTINCT/ORDER BY en SQL: así el rango sale de ix_recibos_cobranza_vencimiento
+    ids = sorted(set(db.execute(text(f"""
+        SELECT poliza_id FROM {TABLA_RECIBOS}
+        WHERE fecha_vencimiento <= :hoy
+          AND (fecha_vencimiento > :corte OR prima_pagada < prima_recibo - :tol)
+    """), params).scalars()))
+
+    for i in range(0, len(ids), LOTE_CLAVES):
+        lista, p = _lista("id", ids[i:i + LOTE_CLAVES])
+        res = db.execute(text(f"""
+            SELECT r.poliza_id, r.total_recibos, r.fecha_vencimiento, r.prima_recibo, r.prima_pagada
+            FROM {TABLA_RECIBOS} r WHERE r.poliza_id IN ({lista})
+        """), p)
+        recibos = pd.DataFrame(res.fetchall(), columns=list(res.keys()))
+        res = db.execute(text(f"SELECT poliza_id, mystatus FROM {TABLA_DEUDORES} WHERE poliza_id IN ({lista})"), p)
+        polizas = pd.DataFrame(res.fetchall(), columns=list(res.keys()))
+
+        semaforo = calcular_semaforo(recibos, polizas, hoy).drop(columns="total_recibos").reset_index()
+        db.execute(text(f"""
+            UPDATE {TABLA_DEUDORES} SET recibos_vencidos = :recibos_vencidos, recibo_actual = :recibo_actual,
+                   fecha_proximo_recibo = :fecha_proximo_recibo, dias_vencimiento = :dias_vencimiento,
+                   prioridad = :prioridad, orden_prioridad = :orden_prioridad
+            WHERE poliza_id = :poliza_id
+        """), _filas(semaforo))
+
+    db.execute(text(f"UPDATE {TABLA_DEUDORES} SET fecha_corte = :hoy WHERE fecha_corte < :hoy"), params)
+    return len(ids)
+
+
+def asegurar_cobranza(db: Session, hoy: Optional[date] = None) -> bool:
+    """
+    Construye las tablas si están vacías y ya hay pólizas (BD previa al ledger) o
+    las lleva al día de hoy. Sube la versión de los datos y hace commit.
+    Retorna True si hubo cambios.
+    """
+    hoy = hoy or date.today()
+    corte = fecha_nativa(db.execute(text(f"SELECT MIN(fecha_corte) FROM {TABLA_DEUDORES}")).scalar())
+    if corte is None:
+        if not db.execute(text("SELECT 1 FROM polizas LIMIT 1")).first():
+            return False
+        refrescar_cobranza(db, hoy=hoy)
+    elif corte < hoy:
+        actualizar_corte(db, hoy)
+    else:
+        return False
+    invalidar(db)   # Las respuestas cacheadas de cobranza traen el semáforo anterior
+    db.commit()
+    return True
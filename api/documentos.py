@@ -0,0 +1,302 @@
+"""
+Proxy de documentos PDF (/documentos/poliza, /documentos/solicitud)
+===================================================================
+Los PDF viven en un servidor HTTP interno; el proxy los sirve por HTTPS:
+
+  1. Un solo httpx.AsyncClient por proceso (keep-alive, límites de conexiones)
+     en lugar de abrir un cliente y una conexión TCP por cada PDF
+  2. Streaming real: cada bloque del origen (aiter_bytes) se envía al cliente
+     en cuanto llega, sin juntar el PDF completo en memoria
+  3. ETag / Last-Modified / Range / If-None-Match pasan de un lado a otro
+     (el visor de PDF del navegador pide rangos y revalida con 304)
+  4. Caché LRU en disco de los PDF vistos recientemente (MAG_DOC_CACHE_DIR,
+     MAG_DOC_CACHE_MB): volver a abrir el mismo documento no va al origen.
+     Pasados MAG_DOC_CACHE_TTL segundos la copia se revalida con el ETag.
+     Los accesos a disco de la caché (y su threading.Lock) corren en el
+     threadpool de anyio, nunca en el event loop.
+
+La URL base (configuración doc_url_base) se memoriza MAG_DOC_CONFIG_TTL
+segundos; PUT /configuracion/doc_url_base la olvida en la instancia que lo atiende.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import anyio
+import httpx
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session
+
+from .database import Configuracion
+
+# URL base por defecto (se puede sobrescribir desde BD)
+DEFAULT_DOC_BASE = "http://54.184.22.19:7070/cartera-0.1/static/archivos"
+
+# ── Configuración ──────────────────────────────────────────────────
+DOC_CACHE_DIR = os.getenv("MAG_DOC_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "mag_documentos")
+DOC_CACHE_MB = int(os.getenv("MAG_DOC_CACHE_MB", "512"))          # 0 desactiva la caché en disco
+DOC_CACHE_TTL = int(os.getenv("MAG_DOC_CACHE_TTL", "86400"))      # Segundos antes de revalidar
+DOC_CONFIG_TTL = int(os.getenv("MAG_DOC_CONFIG_TTL", "60"))
+BLOQUE_DOC = 64 * 1024
+
+TIMEOUT_ORIGEN = httpx.Timeout(30.0, connect=5.0)
+LIMITES_ORIGEN = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0)
+
+# Cabeceras del origen que se reenvían al navegador
+CABECERAS_ORIGEN = ("content-length", "content-range", "accept-ranges", "etag", "last-modified")
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. URL BASE (memorizada)
+# ══════════════════════════════════════════════════════════════════
+
+_url_base = {"valor": None, "expira": 0.0}
+
+
+def url_base(db: Session) -> str:
+    """Lee la URL base de documentos desde configuración, con fallback."""
+    ahora = time.monotonic()
+    if _url_base["valor"] and _url_base["expira"] > ahora:
+        return _url_base["valor"]
+    cfg = db.query(Configuracion).filter(Configuracion.clave == "doc_url_base").first()
+    valor = (cfg.valor if cfg and cfg.valor else DEFAULT_DOC_BASE).rstrip("/")
+    _url_base.update(valor=valor, expira=ahora + DOC_CONFIG_TTL)
+    return valor
+
+
+def olvidar_url_base() -> None:
+    _url_base.update(valor=None, expira=0.0)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. CLIENTE HTTP COMPARTIDO
+# ══════════════════════════════════════════════════════════════════
+
+_cliente: Optional[httpx.AsyncClient] = None
+_cliente_loop = None
+
+
+def cliente() -> httpx.AsyncClient:
+    """El AsyncClient del proceso; se recrea si cambia el event loop (p. ej. otro TestClient)."""
+    global _cliente, _cliente_loop
+    loop = asyncio.get_running_loop()
+    if _cliente is None or _cliente.is_closed or _cliente_loop is not loop:
+        _cliente = httpx.AsyncClient(timeout=TIMEOUT_ORIGEN, limits=LIMITES_ORIGEN, follow_redirects=True)
+        _cliente_loop = loop
+    return _cliente
+
+
+async def cerrar_cliente() -> None:
+    """Cierra las conexiones keep-alive (lifespan de la app)."""
+    global _cliente
+    if _cliente is not None and not _cliente.is_closed:
+        await _cliente.aclose()
+    _cliente = None
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. CACHÉ LRU EN DISCO
+# ══════════════════════════════════════════════════════════════════
+
+class _CacheDisco:
+    """
+    PDFs en `directorio` como <sha256(url)>.pdf + .json (etag, last_modified,
+    guardado). El orden LRU es el mtime del .pdf (se toca en cada acierto), así
+    sobrevive a reinicios; al pasar de `maximo` bytes se borran los más viejos.
+    """
+
+    def __init__(self, directorio: str, maximo: int):
+        self.directorio = directorio
+        self.maximo = maximo
+        self._indice = OrderedDict()       # clave → bytes, del menos al más reciente
+        self._total = 0
+        self._cargado = False
+        self._lock = threading.Lock()
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, f"{clave}.pdf")
+
+    def _cargar(self) -> None:
+        if self._cargado:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        archivos = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith(".pdf"):
+                st = os.stat(os.path.join(self.directorio, nombre))
+                archivos.append((st.st_mtime, nombre[:-4], st.st_size))
+        for _, clave, tam in sorted(archivos):
+            self._indice[clave] = tam
+            self._total += tam
+        self._cargado = True
+
+    def _borrar(self, clave: str) -> None:
+        self._total -= self._indice.pop(clave, 0)
+        for ruta in (self._ruta(clave), self._ruta(clave)[:-4] + ".json"):
+            try:
+                os.unlink(ruta)
+            except FileNotFoundError:
+                pass
+
+    def leer(self, clave: str) -> Optional[dict]:
+        """Metadatos + ruta del PDF en caché (y lo marca como recién usado), o None."""
+        if not self.maximo:
+            return None
+        with self._lock:
+            self._cargar()
+            if clave not in self._indice:
+                return None
+            ruta = self._ruta(clave)
+            try:
+                with open(ruta[:-4] + ".json") as f:
+                    meta = json.load(f)
+                os.utime(ruta)
+            except (OSError, ValueError):
+                self._borrar(clave)
+                return None
+            self._indice.move_to_end(clave)
+            return {**meta, "ruta": ruta}
+
+    def renovar(self, clave: str, meta: dict) -> None:
+        """El origen confirmó la copia (304): vuelve a contar el TTL."""
+        meta = {k: v for k, v in meta.items() if k != "ruta"}
+        meta["guardado"] = time.time()
+        with self._lock:
+            with open(self._ruta(clave)[:-4] + ".json", "w") as f:
+                json.dump(meta, f)
+
+    def abrir(self, clave: str):
+        """Archivo temporal donde se copia la respuesta mientras se retransmite (None sin caché)."""
+        if not self.maximo:
+            return None
+        os.makedirs(self.directorio, exist_ok=True)
+        return open(f"{self._ruta(clave)}.{uuid.uuid4().hex}.parcial", "wb")
+
+    def guardar(self, clave: str, archivo, completo: bool, meta: dict) -> None:
+        """Publica la copia si la descarga terminó y cabe; si no, la descarta."""
+        archivo.close()
+        tam = os.path.getsize(archivo.name)
+        if not completo or tam > self.maximo:
+            os.unlink(archivo.name)
+            return
+        with self._lock:
+            self._cargar()
+            self._borrar(clave)
+            with open(self._ruta(clave)[:-4] + ".json", "w") as f:
+                json.dump({**meta, "guardado": time.time()}, f)
+            os.replace(archivo.name, self._ruta(clave))
+            self._indice[clave] = tam
+            self._total += tam
+            while self._total > self.maximo and len(self._indice) > 1:
+                self._borrar(next(iter(self._indice)))
+
+
+_cache = _CacheDisco(DOC_CACHE_DIR, DOC_CACHE_MB * 1024 * 1024)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 4. PROXY
+# ══════════════════════════════════════════════════════════════════
+
+def _no_modificado(etag: Optional[str], if_none_match: Optional[str]) -> bool:
+    if not etag or not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [e.strip() for e in if_none_match.split(",")]
+
+
+def _desde_cache(entrada: dict, cabeceras: dict, request: Request) -> Response:
+    validadores = {k: entrada[k] for k in ("etag", "last-modified") if entrada.get(k)}
+    if _no_modificado(entrada.get("etag"), request.headers.get("if-none-match")):
+        return Response(status_code=304, headers={**cabeceras, **validadores})
+    # FileResponse atiende Range / If-Range sobre el archivo local
+    return FileResponse(entrada["ruta"], media_type="application/pdf",
+                        headers={**cabeceras, **validadores, "X-Cache": "HIT"})
+
+
+async def _retransmitir(resp: httpx.Response, clave: str, archivo, meta: dict):
+    completo = False
+    try:
+        async for trozo in resp.aiter_bytes(BLOQUE_DOC):
+            if archivo:
+                await anyio.to_thread.run_sync(archivo.write, trozo)
+            yield trozo
+        completo = True
+    finally:
+        await resp.aclose()
+        if archivo:
+            # Aunque el cliente se desconecte: cerrar y publicar o borrar el .parcial
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(_cache.guardar, clave, archivo, completo, meta)
+
+
+async def servir_pdf(request: Request, db: Session, ruta: str, nombre: str, descripcion: str) -> Response:
+    """
+    Sirve {doc_url_base}/{ruta}: desde la caché si hay copia vigente; si no,
+    retransmite la respuesta del origen en streaming (y la guarda si es completa).
+    """
+    url = f"{url_base(db)}/{ruta}"
+    clave = hashlib.sha256(url.encode()).hexdigest()
+    cabeceras = {
+        "Content-Disposition": f'inline; filename="{nombre}"',
+        "Cache-Control": "public, max-age=3600",
+    }
+    rango = request.headers.get("range")
+
+    entrada = await anyio.to_thread.run_sync(_cache.leer, clave)
+    if entrada and time.time() - entrada.get("guardado", 0) < DOC_CACHE_TTL:
+        return _desde_cache(entrada, cabeceras, request)
+
+    # Petición al origen: revalidar la copia vencida o reenviar los condicionales del navegador
+    hacia_origen = {}
+    if entrada and not rango:
+        if entrada.get("etag"):
+            hacia_origen["If-None-Match"] = entrada["etag"]
+        if entrada.get("last-modified"):
+            hacia_origen["If-Modified-Since"] = entrada["last-modified"]
+    else:
+        entrada = None
+        for h in ("range", "if-range", "if-none-match", "if-modified-since"):
+            if h in request.headers:
+                hacia_origen[h] = request.headers[h]
+
+    http = cliente()
+    try:
+        resp = await http.send(http.build_request("GET", url, headers=hacia_origen), stream=True)
+    except httpx.TimeoutException:
+        raise HTTPException(504, "Timeout al conectar con servidor de documentos")
+    except httpx.HTTPError:
+        raise HTTPException(502, "No se pudo conectar con el servidor de documentos")
+
+    pasar = {h: resp.headers[h] for h in CABECERAS_ORIGEN if h in resp.headers}
+    if "content-encoding" in resp.headers:          # aiter_bytes entrega el cuerpo ya descomprimido
+        pasar.pop("content-length", None)
+    if resp.status_code not in (200, 206):
+        await resp.aclose()
+        if resp.status_code == 304:
+            if entrada:
+                await anyio.to_thread.run_sync(_cache.renovar, clave, entrada)
+                return _desde_cache(entrada, cabeceras, request)
+            return Response(status_code=304, headers={**cabeceras, **pasar})
+        if resp.status_code == 404:
+            raise HTTPException(404, f"{descripcion} no encontrado")
+        if resp.status_code == 416:
+            return Response(status_code=416, headers=pasar)
+        raise HTTPException(502, f"Error al obtener documento: HTTP {resp.status_code}")
+
+    # Solo una respuesta completa va a la caché (un 206 es un pedazo del PDF)
+    archivo = await anyio.to_thread.run_sync(_cache.abrir, clave) if resp.status_code == 200 else None
+    meta = {k: resp.headers[k] for k in ("etag", "last-modified") if k in resp.headers}
+    return StreamingResponse(
+        _retransmitir(resp, clave, archivo, meta),
+        status_code=resp.status_code,
+        media_type="application/pdf",
+        headers={**cabeceras, **pasar, "X-Cache": "MISS"},
+    )
@@ -0,0 +1,149 @@
+"""
+Motor del Dashboard Ejecutivo — una sola pasada
+===============================================
+Lee la proyección angosta de produccion_mensual_agg (agente × año × ramo ×
+tipo × periodo) en streaming y, en un único recorrido, acumula:
+  - Comparativo interanual por ramo (NUEVA / SUBSECUENTE)
+  - Resumen por segmento del año actual
+  - Vista operativa por agente (año actual y anterior)
+  - Producción mensual comparativa por ramo
+
+Sustituye los rescaneos por sección de GET /dashboard/ejecutivo; el router
+solo convierte los acumulados en los modelos de respuesta.
+"""
+from collections import defaultdict
+from typing import Iterable
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+RAMOS = {11: "vida", 34: "gmm", 90: "autos"}
+TIPOS = ("NUEVA", "SUBSECUENTE")
+
+
+def _medidas() -> dict:
+    return {"polizas": 0, "asegurados": 0, "equivalencias": 0.0, "prima": 0.0}
+
+
+def _agente() -> dict:
+    agente = {
+        "clave": "", "nombre": "", "segmento": "", "segmento_agrupado": "",
+        "gestion": "", "estado": "",
+        # Actual (nuevas)
+        "polizas_vida": 0, "equiv_vida": 0.0, "prima_pagada_vida": 0.0,
+        "polizas_gmm": 0, "asegurados_gmm": 0, "prima_pagada_gmm": 0.0,
+        "polizas_autos": 0, "prima_pagada_autos": 0.0,
+        "vida_equiv_ant": 0.0, "vida_equiv_act": 0.0,
+    }
+    # {ramo}_polizas_{anio}, {ramo}_prima_nueva_{anio}, {ramo}_prima_sub_{anio}
+    for ramo in RAMOS.values():
+        for yr in ("ant", "act"):
+            agente.update({f"{ramo}_polizas_{yr}": 0, f"{ramo}_prima_nueva_{yr}": 0.0,
+                           f"{ramo}_prima_sub_{yr}": 0.0})
+    return agente
+
+
+def _segmento() -> dict:
+    return {
+        "agentes": set(), "polizas_vida": 0, "polizas_gmm": 0, "polizas_autos": 0,
+        "prima_vida": 0.0, "prima_gmm": 0.0, "prima_autos": 0.0, "equivalentes": 0.0,
+    }
+
+
+def consultar(db: Session, anio: int, anio_ant: int, filtro: str = "", params: dict = None):
+    """
+    Proyección angosta de los dos años, agrupada por agente × año × ramo × tipo × periodo.
+    `filtro` son condiciones extra sobre agentes a (p.ej. " AND a.segmento_agrupado = :seg").
+    Retorna un iterador de mappings (no materializa el resultado).
+    """
+    return db.execute(text(f"""
+        SELECT f.anio, f.ramo_codigo, f.tipo, f.periodo,
+               a.codigo_agente, a.nombre_completo, a.segmento_nombre, a.segmento_agrupado,
+               a.gestion_comercial, a.situacion, a.estado,
+               SUM(f.polizas) as polizas, SUM(f.asegurados) as asegurados,
+               SUM(f.equivalencias) as equivalencias, SUM(f.prima_neta) as prima
+        FROM produccion_mensual_agg f
+        LEFT JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio IN (:anio_act, :anio_ant) {filtro}
+        GROUP BY f.anio, f.ramo_codigo, f.tipo, f.periodo, a.id, a.codigo_agente,
+                 a.nombre_completo, a.segmento_nombre, a.segmento_agrupado,
+                 a.gestion_comercial, a.situacion, a.estado
+    """), {**(params or {}), "anio_act": anio, "anio_ant": anio_ant}).mappings()
+
+
+def acumular(filas: Iterable, anio: int, anio_ant: int) -> dict:
+    """
+    Recorre `filas` (ver consultar) una sola vez.
+
+    Returns:
+        {"comparativo": {ramo: {"act"|"ant": {tipo: medidas}}},
+         "segmentos": {segmento: acumulado},
+         "agentes": {clave: acumulado},
+         "mensual": {ramo: {"act"|"ant": {mes: {"polizas", "prima"}}}}}
+    """
+    comparativo = {ramo: {yr: {t: _medidas() for t in TIPOS} for yr in ("act", "ant")}
+                   for ramo in RAMOS.values()}
+    mensual = {ramo: {yr: defaultdict(lambda: {"polizas": 0, "prima": 0.0}) for yr in ("act", "ant")}
+               for ramo in RAMOS.values()}
+    segmentos = defaultdict(_segmento)
+    agentes = defaultdict(_agente)
+
+    for f in filas:
+        clave = f["codigo_agente"] or "SIN_AGENTE"
+        a = agentes[clave]
+        a["clave"] = clave
+        a["nombre"] = f["nombre_completo"] or ""
+        a["segmento"] = f["segmento_nombre"] or ""
+        a["segmento_agrupado"] = f["segmento_agrupado"] or ""
+        a["gestion"] = f["gestion_comercial"] or ""
+        a["estado"] = f["estado"] or f["situacion"] or ""
+
+        yr = "act" if f["anio"] == anio else "ant"
+        seg = None
+        if yr == "act":
+            seg = segmentos[f["segmento_agrupado"] or "SIN SEGMENTO"]
+            seg["agentes"].add(f["codigo_agente"])
+
+        ramo = RAMOS.get(f["ramo_codigo"])
+        tipo = f["tipo"]
+        if ramo is None or tipo not in TIPOS:
+            continue
+
+        n = f["polizas"] or 0
+        asegurados = f["asegurados"] or 0
+        equiv = f["equivalencias"] or 0
+        prima = f["prima"] or 0
+
+        m = comparativo[ramo][yr][tipo]
+        m["polizas"] += n
+        m["asegurados"] += asegurados
+        m["equivalencias"] += equiv
+        m["prima"] += prima
+
+        if tipo == "SUBSECUENTE":
+            a[f"{ramo}_prima_sub_{yr}"] += prima
+            continue
+
+        a[f"{ramo}_polizas_{yr}"] += n
+        a[f"{ramo}_prima_nueva_{yr}"] += prima
+        if ramo == "vida":
+            a[f"vida_equiv_{yr}"] += equiv
+        if seg is not None:
+            a[f"polizas_{ramo}"] += n
+            a[f"prima_pagada_{ramo}"] += prima
+            seg[f"polizas_{ramo}"] += n
+            seg[f"prima_{ramo}"] += prima
+            if ramo == "vida":
+                a["equiv_vida"] += equiv
+                seg["equivalentes"] += equiv
+            elif ramo == "gmm":
+                a["asegurados_gmm"] += asegurados
+
+        periodo = f["periodo"] or ""
+        if len(periodo) >= 7:
+            mes = mensual[ramo][yr][int(periodo[5:7])]
+            mes["polizas"] += n
+            mes["prima"] += prima
+
+    return {"comparativo": comparativo, "segmentos": segmentos,
+            "agentes": agentes, "mensual": mensual}
@@ -0,0 +1,411 @@
+"""
+Exportación en streaming (Excel / CSV / Parquet)
+================================================
+Una exportación de la cartera completa ya no pasa por lista de dicts →
+DataFrame → BytesIO (tres copias de los datos en RAM):
+
+  1. Lectura por lotes con cursor del lado del servidor (stream_results +
+     yield_per: en PostgreSQL un cursor con nombre; en SQLite el cursor ya es
+     perezoso)
+  2. Escritura de cada lote antes de leer el siguiente:
+       xlsx     xlsxwriter en modo constant_memory (fila por fila)
+       parquet  un row group por lote (pyarrow)
+       csv      se emite directo al cliente, lote por lote
+  3. xlsx/parquet se escriben en un SpooledTemporaryFile (memoria hasta
+     SPOOL_MAX, después disco) y se envían en bloques de BLOQUE_RESPUESTA
+
+xlsx y parquet solo son válidos completos (zip / footer), así que su primer
+bloque sale al terminar de escribir; el CSV empieza a descargarse con el
+primer lote. En todos los casos la memoria queda acotada por el tamaño de lote.
+"""
+import csv
+import io
+import logging
+import tempfile
+from datetime import datetime
+from typing import IO, Iterable, Iterator
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .produccion_agg import SQL_ES_NUEVA, SQL_ES_SUBSECUENTE
+from .rules_icp_2026 import generar_resumen_icp_2026, clasificar_tamano_cartera, obtener_detalle_recluta_2026
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:          # Está en requirements.txt; sin él solo parquet responde 400
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+# ── Configuración ──────────────────────────────────────────────────
+LOTE_EXPORTACION = 5000               # Filas por fetch del cursor
+BLOQUE_RESPUESTA = 1024 * 1024        # 1 MB por chunk de la respuesta
+SPOOL_MAX = 8 * 1024 * 1024           # Hasta 8 MB en memoria, después a disco
+
+# formato → (media type, extensión)
+FORMATOS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# tipo de columna → tipo Arrow (parquet) ; en xlsx los números se escriben como número
+TIPOS_ARROW = {"texto": "string", "numero": "float64", "entero": "int64"}
+
+
+def validar_formato(formato: str) -> str:
+    formato = (formato or "").lower()
+    if formato not in FORMATOS:
+        raise HTTPException(400, f"formato debe ser uno de: {', '.join(FORMATOS)}")
+    if formato == "parquet" and pa is None:
+        raise HTTPException(400, "La exportación Parquet requiere pyarrow (pip install pyarrow)")
+    return formato
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. CONSULTAS EXPORTABLES
+# ══════════════════════════════════════════════════════════════════
+
+# (columna, tipo) en el orden del archivo
+COLUMNAS_POLIZAS = (
+    ("poliza_original", "texto"), ("asegurado_nombre", "texto"), ("agente", "texto"),
+    ("codigo_agente", "texto"), ("segmento", "texto"), ("ramo_nombre", "texto"), ("gama", "texto"),
+    ("fecha_inicio", "texto"), ("fecha_fin", "texto"), ("prima_neta", "numero"), ("prima_total", "numero"),
+    ("iva", "numero"), ("forma_pago", "texto"), ("tipo_pago", "texto"), ("status_recibo", "texto"),
+    ("tipo_poliza", "texto"), ("tipo_prima", "texto"), ("pct_comision", "numero"),
+    ("num_asegurados", "entero"), ("suma_asegurada", "numero"), ("mystatus", "texto"),
+    ("periodo_aplicacion", "texto"),
+)
+
+
+def consulta_polizas(anio=None, ramo=None, tipo=None, segmento=None, gestion=None,
+                     agente_codigo=None) -> tuple:
+    """SQL y parámetros de la exportación de pólizas (GET /exportar/polizas-excel)."""
+    conditions = ["1=1"]
+    params: dict = {}
+    if anio:
+        conditions.append("p.anio_aplicacion = :anio")
+        params["anio"] = anio
+    if ramo == "vida":
+        conditions.append("pr.ramo_codigo = 11")
+    elif ramo == "gmm":
+        conditions.append("pr.ramo_codigo = 34")
+    elif ramo == "autos":
+        conditions.append("pr.ramo_codigo = 90")
+    if tipo:
+        if tipo.upper() == "NUEVA":
+            conditions.append(SQL_ES_NUEVA)
+        elif tipo.upper() == "SUBSECUENTE":
+            conditions.append(SQL_ES_SUBSECUENTE)
+    if segmento:
+        conditions.append("a.segmento_agrupado = :seg")
+        params["seg"] = segmento.upper()
+    if gestion:
+        conditions.append("a.gestion_comercial LIKE :gest")
+        params["gest"] = f"%{gestion}%"
+    if agente_codigo:
+        conditions.append("a.codigo_agente = :agc")
+        params["agc"] = agente_codigo
+
+    sql = f"""
+        SELECT p.poliza_original, p.asegurado_nombre, a.nombre_completo as agente,
+               a.codigo_agente, a.segmento_agrupado as segmento,
+               pr.ramo_nombre, p.gama, p.fecha_inicio, p.fecha_fin,
+               p.prima_neta, p.prima_total, p.iva, p.forma_pago, p.tipo_pago,
+               p.status_recibo, p.tipo_poliza, p.tipo_prima, p.pct_comision,
+               p.num_asegurados, p.suma_asegurada, p.mystatus, p.periodo_aplicacion
+        FROM polizas p
+        LEFT JOIN productos pr ON p.producto_id = pr.id
+        LEFT JOIN agentes a ON p.agente_id = a.id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY p.fecha_inicio DESC, p.id DESC
+    """
+    return sql, params
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. LECTURA POR LOTES
+# ══════════════════════════════════════════════════════════════════
+
+def lotes_consulta(db: Session, sql: str, params: dict, lote: int = LOTE_EXPORTACION) -> Iterator[list]:
+    """Filas (tuplas) de la consulta en lotes de `lote`, sin materializar el resultado completo."""
+    resultado = db.execute(text(sql), params,
+                           execution_options={"stream_results": True, "yield_per": lote})
+    try:
+        for particion in resultado.partitions():
+            yield [tuple(fila) for fila in particion]
+    finally:
+        resultado.close()
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. ESCRITORES
+# ══════════════════════════════════════════════════════════════════
+
+def escribir_xlsx(lotes: Iterable[list], columnas: tuple, destino: IO, hoja: str = "Datos") -> int:
+    """Libro xlsx en modo constant_memory (cada fila se escribe una vez, en orden). Retorna filas."""
+    import xlsxwriter
+
+    libro = xlsxwriter.Workbook(destino, {"constant_memory": True, "strings_to_numbers": False,
+                                          "strings_to_formulas": False, "strings_to_urls": False})
+    hoja_xlsx = libro.add_worksheet(hoja)
+    encabezado = libro.add_format({"bold": True, "bg_color": "#1e3a5f", "font_color": "white", "border": 1})
+    hoja_xlsx.set_column(0, len(columnas) - 1, 18)
+    hoja_xlsx.write_row(0, 0, [nombre for nombre, _ in columnas], encabezado)
+
+    n = 0
+    for filas in lotes:
+        for fila in filas:
+            n += 1
+            hoja_xlsx.write_row(n, 0, fila)
+    libro.close()
+    return n
+
+
+def escribir_parquet(lotes: Iterable[list], columnas: tuple, destino: IO) -> int:
+    """Parquet con un row group por lote y el esquema de `columnas`. Retorna filas."""
+    esquema = pa.schema([(nombre, TIPOS_ARROW[tipo]) for nombre, tipo in columnas])
+    n = 0
+    with pq.ParquetWriter(destino, esquema) as escritor:
+        for filas in lotes:
+            datos = [list(c) for c in zip(*filas)]
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(d, type=campo.type) for d, campo in zip(datos, esquema)], schema=esquema))
+            n += len(filas)
+        if n == 0:
+            escritor.write_table(esquema.empty_table())
+    return n
+
+
+def generar_csv(lotes: Iterable[list], columnas: tuple) -> Iterator[bytes]:
+    """CSV UTF-8 con BOM (Excel lo abre con acentos), un chunk por lote."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow([nombre for nombre, _ in columnas])
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    for filas in lotes:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerows(filas)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def escribir_csv(lotes: Iterable[list], columnas: tuple, destino: IO) -> int:
+    """CSV completo en `destino` (binario). Retorna filas."""
+    n = 0
+
+    def contando():
+        nonlocal n
+        for filas in lotes:
+            n += len(filas)
+            yield filas
+
+    for bloque in generar_csv(contando(), columnas):
+        destino.write(bloque)
+    return n
+
+
+def escribir(formato: str, lotes: Iterable[list], columnas: tuple, destino: IO, hoja: str = "Datos") -> int:
+    """Escribe el archivo completo en `destino` (xlsx, csv o parquet). Retorna filas."""
+    if formato == "xlsx":
+        return escribir_xlsx(lotes, columnas, destino, hoja)
+    if formato == "parquet":
+        return escribir_parquet(lotes, columnas, destino)
+    return escribir_csv(lotes, columnas, destino)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 4. RESPUESTA
+# ══════════════════════════════════════════════════════════════════
+
+def _trozos(archivo: IO) -> Iterator[bytes]:
+    """Contenido del archivo en bloques de BLOQUE_RESPUESTA. Cierra el archivo al terminar."""
+    try:
+        archivo.seek(0)
+        while True:
+            bloque = archivo.read(BLOQUE_RESPUESTA)
+            if not bloque:
+                break
+            yield bloque
+    finally:
+        archivo.close()
+
+
+def generar(db: Session, sql: str, params: dict, columnas: tuple, formato: str,
+            hoja: str = "Datos") -> Iterator[bytes]:
+    """Cuerpo de la respuesta: lee, escribe y emite por bloques. Corre en el threadpool de Starlette."""
+    lotes = lotes_consulta(db, sql, params, LOTE_EXPORTACION)
+    if formato == "csv":
+        yield from generar_csv(lotes, columnas)
+        return
+    archivo = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX)
+    try:
+        escribir(formato, lotes, columnas, archivo, hoja)
+    except Exception:
+        archivo.close()
+        logger.exception("Error generando la exportación %s", formato)
+        raise
+    yield from _trozos(archivo)
+
+
+def respuesta_exportacion(db: Session, sql: str, params: dict, columnas: tuple, formato: str,
+                          nombre: str, hoja: str = "Datos") -> StreamingResponse:
+    """StreamingResponse de la exportación `nombre`.<ext> en `formato` (ya validado)."""
+    media_type, extension = FORMATOS[formato]
+    return StreamingResponse(
+        generar(db, sql, params, columnas, formato, hoja),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}.{extension}"'},
+    )
+
+
+def respuesta_archivo(archivo: IO, formato: str, nombre: str) -> StreamingResponse:
+    """StreamingResponse de un archivo ya escrito (`nombre` con extensión); lo cierra al terminar."""
+    return StreamingResponse(
+        _trozos(archivo),
+        media_type=FORMATOS[formato][0],
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
+
+
+# ══════════════════════════════════════════════════════════════════
+# 5. CATÁLOGO (trabajos asíncronos, ver api/trabajos_exportacion.py)
+# ══════════════════════════════════════════════════════════════════
+# Cada exportación escribe el archivo completo en `destino` y retorna
+# {"filas", "nombre"}; `avance(n)` recibe las filas de cada lote escrito.
+
+def _con_avance(lotes: Iterable[list], avance) -> Iterator[list]:
+    for filas in lotes:
+        yield filas
+        if avance:
+            avance(len(filas))
+
+
+def contar_polizas(db: Session, filtros: dict) -> int:
+    sql, params = consulta_polizas(**filtros)
+    return db.execute(text(f"SELECT COUNT(*) FROM ({sql}) t"), params).scalar() or 0
+
+
+def escribir_polizas(db: Session, filtros: dict, formato: str, destino: IO, avance=None) -> dict:
+    sql, params = consulta_polizas(**filtros)
+    lotes = _con_avance(lotes_consulta(db, sql, params, LOTE_EXPORTACION), avance)
+    n = escribir(formato, lotes, COLUMNAS_POLIZAS, destino, "Pólizas")
+    nombre = f"polizas_{filtros.get('anio') or 'todas'}_{datetime.now():%Y%m%d}.{FORMATOS[formato][1]}"
+    return {"filas": n, "nombre": nombre}
+
+
+def escribir_icp_2026(db: Session, filtros: dict, formato: str, destino: IO, avance=None) -> dict:
+    """Reporte ICP 2026: hoja Resumen + hoja Detalle Reclutas (pocas filas: se arma con pandas)."""
+    import pandas as pd
+
+    anio = filtros.get("anio") or 2026
+
+    # ── 1. Resumen General ──
+    prima_total = db.execute(text("SELECT SUM(COALESCE(p.prima_neta, 0)) FROM polizas p WHERE p.anio_aplicacion = :anio"), {"anio": anio}).scalar() or 0.0
+    categoria = clasificar_tamano_cartera(prima_total)
+
+    # KPIs Rápidos
+    recluta_count = db.execute(text("SELECT COUNT(DISTINCT a.id) FROM agentes a JOIN polizas p ON a.id = p.agente_id WHERE a.fecha_alta >= '2023-01-01' AND p.anio_aplicacion = :anio"), {"anio": anio}).scalar() or 0
+    puntos_vida = db.execute(text("SELECT SUM(CASE WHEN COALESCE(p.prima_anual_pesos, 0) >= 100000 THEN 3 WHEN COALESCE(p.prima_anual_pesos, 0) >= 50000 THEN 2 WHEN COALESCE(p.prima_anual_pesos, 0) >= 16000 THEN 1 ELSE 0 END) FROM polizas p LEFT JOIN productos pr ON p.producto_id = pr.id WHERE p.anio_aplicacion = :anio AND pr.ramo_codigo = 11 AND " + SQL_ES_NUEVA), {"anio": anio}).scalar() or 0
+
+    data_actual = {
+        "recluta_productiva": recluta_count,
+        "polizas_vida_individual": puntos_vida,
+        "agentes_alfa_adicionales": 5, # Placeholder simplificado
+        "asegurados_gmmi": 100, # Placeholder simplificado
+        "crecimiento_cartera_pct": 0.15,
+        "agentes_ganadores_bono": 20
+    }
+    resumen_data = generar_resumen_icp_2026(data_actual, categoria)
+
+    # ── 2. Detalle de Reclutas ──
+    agentes_raw = db.execute(text("""
+        SELECT a.id, a.nombre_completo, a.codigo_agente, a.fecha_alta,
+               COUNT(DISTINCT p.id) as polizas_total,
+               SUM(CASE WHEN pr.ramo_codigo = 11 AND """ + SQL_ES_NUEVA + """ THEN 1 ELSE 0 END) as polizas_vida,
+               SUM(CASE WHEN """ + SQL_ES_NUEVA + """ THEN COALESCE(p.prima_neta, 0) ELSE 0 END) as prima_total
+        FROM agentes a
+        LEFT JOIN polizas p ON a.id = p.agente_id AND p.anio_aplicacion = :anio
+        LEFT JOIN productos pr ON p.producto_id = pr.id
+        WHERE a.fecha_alta >= '2023-01-01' AND a.situacion = 'ACTIVO'
+        GROUP BY a.id, a.nombre_completo, a.codigo_agente, a.fecha_alta
+    """), {"anio": anio}).mappings().all()
+    detalle_reclutas = obtener_detalle_recluta_2026(agentes_raw)
+
+    # ── 3. Excel ──
+    df_resumen = pd.DataFrame([
+        {"ID": ind["id"], "Indicador": ind["nombre"], "Actual": ind["actual"], "Meta": ind["meta"], "Cumple": "SÍ" if ind["cumple"] else "NO"}
+        for ind in resumen_data["indicadores"]
+    ])
+    df_detalle = pd.DataFrame(detalle_reclutas)
+    # Limpiar/renombrar columnas para el usuario final
+    if not df_detalle.empty:
+        df_detalle = df_detalle.rename(columns={
+            "nombre": "Agente", "codigo": "Código", "fecha_alta": "Alta", "anio_icp": "Año ICP",
+            "actual_vida": "Vida Actual", "meta_vida": "Meta Vida", "actual_prima": "Prima Actual", "meta_prima": "Meta Prima", "cumple": "Estatus Productivo"
+        })
+        df_detalle["Estatus Productivo"] = df_detalle["Estatus Productivo"].map({True: "PRODUCTIVO", False: "EN PROCESO"})
+
+    with pd.ExcelWriter(destino, engine="xlsxwriter") as writer:
+        df_resumen.to_excel(writer, sheet_name="Resumen ICP 2026", index=False)
+        df_detalle.to_excel(writer, sheet_name="Detalle Reclutas", index=False)
+        for sheet in writer.sheets.values():
+            sheet.set_column(0, 10, 20)
+
+    n = len(df_resumen) + len(df_detalle)
+    if avance:
+        avance(n)
+    return {"filas": n, "nombre": f"Reporte_ICP_2026_{categoria}.xlsx"}
+
+
+# tipo → filtros aceptados (los de `enteros` se convierten a int), formatos y funciones
+EXPORTACIONES = {
+    "polizas": {
+        "filtros": ("anio", "ramo", "tipo", "segmento", "gestion", "agente_codigo"),
+        "enteros": ("anio",),
+        "formatos": tuple(FORMATOS),
+        "escribir": escribir_polizas,
+        "contar": contar_polizas,
+    },
+    "icp-2026": {
+        "filtros": ("anio",),
+        "enteros": ("anio",),
+        "formatos": ("xlsx",),
+        "escribir": escribir_icp_2026,
+        "contar": None,
+    },
+}
+
+
+def normalizar_filtros(tipo: str, filtros: dict) -> dict:
+    """
+    Filtros de una exportación en forma canónica (para la clave del artefacto):
+    sin vacíos, texto sin espacios extremos, ramo en minúsculas, tipo/segmento
+    en mayúsculas y enteros como int. Claves desconocidas → 400.
+    """
+    definicion = EXPORTACIONES[tipo]
+    desconocidos = set(filtros) - set(definicion["filtros"])
+    if desconocidos:
+        raise HTTPException(400, f"Filtros no válidos para {tipo}: {', '.join(sorted(desconocidos))}")
+    normales = {}
+    for clave in sorted(filtros):
+        valor = filtros[clave]
+        if isinstance(valor, str):
+            valor = valor.strip()
+        if valor is None or valor == "":
+            continue
+        if clave in definicion["enteros"]:
+            try:
+                valor = int(valor)
+            except (TypeError, ValueError):
+                raise HTTPException(400, f"{clave} debe ser entero")
+        elif clave == "ramo":
+            valor = str(valor).lower()
+        elif clave in ("tipo", "segmento"):
+            valor = str(valor).upper()
+        normales[clave] = valor
+    return normales
@@ -0,0 +1,77 @@
+"""
+Fechas nativas (Date) con dual-write / dual-read
+================================================
+Las fechas de polizas, pagos y solicitudes se guardan como texto ISO
+('YYYY-MM-DD'). Durante la migración a tipos nativos cada fecha consultada en
+rangos o cálculos tiene una columna Date gemela (sufijo _d, indexada):
+
+  1. Dual-write: toda ingesta escribe el texto y la columna Date
+  2. Backfill: scripts/migrar_fechas_nativas.py rellena lo histórico
+  3. Dual-read: los lectores usan la columna Date; mientras la migración no
+     termine, una fila con la columna Date en NULL se lee por el texto
+
+MAG_LECTURA_FECHAS=dual    (default) Date con respaldo en el texto
+MAG_LECTURA_FECHAS=nativa  solo Date (una vez verificado el backfill)
+"""
+import os
+from datetime import date, datetime
+from typing import Optional
+
+import pandas as pd
+
+LECTURA_FECHAS = os.getenv("MAG_LECTURA_FECHAS", "dual").lower()
+
+# tabla → {columna Date: columna texto}
+COLUMNAS_FECHA = {
+    "polizas": {"fecha_inicio_d": "fecha_inicio", "fecha_fin_d": "fecha_fin"},
+    "pagos": {"fecha_aplicacion_d": "fecha_aplicacion"},
+    "solicitudes": {"fecrecepcion_d": "fecrecepcion", "fecha_ultima_etapa_d": "fecha_ultima_etapa"},
+}
+
+
+def fecha_nativa(valor) -> Optional[date]:
+    """date a partir de date/datetime/texto ISO (primeros 10 caracteres); None si no es una fecha válida."""
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    try:
+        return date.fromisoformat(str(valor).strip()[:10])
+    except ValueError:
+        return None
+
+
+def serie_fecha_nativa(s: pd.Series) -> pd.Series:
+    """Versión vectorizada de fecha_nativa para los importadores (NaT → None con a_python)."""
+    return pd.to_datetime(s.str[:10], format="%Y-%m-%d", errors="coerce").dt.date
+
+
+def con_fechas_nativas(tabla: str, fila: dict) -> dict:
+    """Dual-write: agrega a `fila` las columnas Date de las fechas texto que trae. Modifica y retorna la fila."""
+    for nativa, texto in COLUMNAS_FECHA[tabla].items():
+        if texto in fila:
+            fila[nativa] = fecha_nativa(fila[texto])
+    return fila
+
+
+def leer_fecha(fila, texto: str) -> Optional[date]:
+    """Dual-read de la fecha `texto` de una fila (mapping) que trae `texto` y `<texto>_d`."""
+    valor = fecha_nativa(fila.get(f"{texto}_d"))
+    if valor is None and LECTURA_FECHAS == "dual":
+        valor = fecha_nativa(fila.get(texto))
+    return valor
+
+
+def sql_rango_fecha(alias: str, texto: str, desde: str = "desde", hasta: str = "hasta") -> str:
+    """
+    Predicado BETWEEN :desde AND :hasta sobre la columna Date (usa su índice).
+    Los parámetros se pasan como texto ISO: compara igual contra Date y contra el texto.
+    En modo dual también acepta las filas aún sin migrar por la columna texto.
+    """
+    nativa = f"{alias}.{texto}_d"
+    predicado = f"{nativa} BETWEEN :{desde} AND :{hasta}"
+    if LECTURA_FECHAS == "dual":
+        predicado = (f"({predicado} OR ({nativa} IS NULL AND {alias}.{texto} BETWEEN :{desde} AND :{hasta}))")
+    return predicado
@@ -20,9 +20,14 @@ from api.database import (
     Meta, Importacion
 )
 from api.rules import (
-    normalizar_poliza, calcular_mystatus, es_reexpedicion, agrupar_segmento,
+    normalizar_poliza, clave_cruce, calcular_mystatus, es_reexpedicion, agrupar_segmento,
     clasificar_cy, aplicar_reglas_poliza, aplicar_reglas_batch, STATUS_PAGADOS
 )
+from api.produccion_agg import refrescar_produccion
+from api.deudor_prima import refrescar_cobranza
+from api.cache_respuestas import invalidar
+from api.fechas_nativas import fecha_nativa
+from api.busqueda import texto_busqueda
 
 # ── Configuración ──────────────────────────────────────────────────
 CUBO_PATH = os.path.join(BASE_DIR, "fuentes", "Reporte_Cubo_2025_ALL (3).xlsx")
@@ -178,6 +183,7 @@ def main():
             agente = Agente(
                 codigo_agente=codigo,
                 nombre_completo=nombre,
+                busqueda=texto_busqueda(codigo, nombre),
                 segmento_id=seg_id,
                 segmento_nombre=segmento_nombre,
                 segmento_agrupado=seg_agrupado,
@@ -244,6 +250,7 @@ def main():
                 ag = Agente(
                     codigo_agente=agente_codigo,
                     nombre_completo=nombre_agente or f"AGENTE {agente_codigo}",
+                    busqueda=texto_busqueda(agente_codigo, nombre_agente or f"AGENTE {agente_codigo}"),
                     segmento_nombre=segmento,
                     segmento_agrupado=agrupar_segmento(segmento),
                     nombre_promotoria="MAG",
@@ -292,12 +299,16 @@ def main():
                 poliza = Poliza(
                     poliza_original=poliza_num,
                     poliza_estandar=poliza_estandar,
+                    match_key=clave_cruce(poliza_num),
+                    busqueda=texto_busqueda(poliza_num, contratante),
                     agente_id=agente_id,
                     producto_id=producto_id,
                     contratante_nombre=contratante,
                     num_asegurados=num_asegurados if num_asegurados > 0 else 1,
                     fecha_inicio=fecha_inicio or "2025-01-01",
                     fecha_fin=fecha_fin,
+                    fecha_inicio_d=fecha_nativa(fecha_inicio or "2025-01-01"),
+                    fecha_fin_d=fecha_nativa(fecha_fin),
                     prima_neta=neta_total_contrato,
                     prima_total=neta_total_contrato,
                     forma_pago=forma_pago,
@@ -421,6 +432,12 @@ def main():
             usuario="sistema",
         ))
 
+        # ── Producción pre-agregada para los dashboards ─────────────
+        db.flush()
+        refrescar_produccion(db)
+        refrescar_cobranza(db)
+        invalidar(db)
+
         # ── Commit final ───────────────────────────────────────────
         db.commit()
         wb.close()
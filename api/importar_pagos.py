@@ -0,0 +1,279 @@
+"""
+Importación en streaming de PAGTOTAL (pagos)
+============================================
+El archivo subido se vuelca a un temporal en disco y se procesa en bloques
+de tamaño fijo, sin cargar el libro completo en memoria:
+  1. Spool del upload a un archivo temporal
+  2. Lectura por bloques (CSV con chunksize / XLSX con openpyxl read-only)
+  3. Parseo vectorizado de cada bloque
+  4. Inserción del bloque antes de leer el siguiente
+
+La memoria queda acotada por el tamaño de bloque, no por el tamaño del archivo.
+"""
+import codecs
+import os
+import shutil
+import tempfile
+from datetime import datetime, date
+from typing import Iterator
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .bulk_loader import bulk_insert
+from .cache_respuestas import invalidar
+from .importar_polizas import col, a_python
+from .rules import clave_cruce
+from .fechas_nativas import serie_fecha_nativa
+from .deudor_prima import refrescar_cobranza
+
+# ── Configuración ──────────────────────────────────────────────────
+CHUNK_SIZE = 20000                   # Filas por bloque
+SPOOL_BLOCK = 1024 * 1024            # 1 MB por lectura del upload
+ENCODINGS_CSV = ["utf-8", "latin-1"]
+FORMATOS_FECHA = ["%d-%b-%y", "%d/%m/%Y"]
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. SPOOL A DISCO
+# ══════════════════════════════════════════════════════════════════
+
+def spool_a_temporal(origen, nombre_archivo: str) -> str:
+    """
+    Copia un file-like (p.ej. UploadFile.file) a un temporal en bloques de 1 MB.
+    Conserva la extensión para elegir el lector. El llamador borra el archivo.
+    """
+    sufijo = os.path.splitext(nombre_archivo or "")[1].lower()
+    tmp = tempfile.NamedTemporaryFile(mode="wb", suffix=sufijo, delete=False)
+    try:
+        shutil.copyfileobj(origen, tmp, SPOOL_BLOCK)
+    finally:
+        tmp.close()
+    return tmp.name
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. LECTURA POR BLOQUES
+# ══════════════════════════════════════════════════════════════════
+
+def detectar_encoding(path: str) -> str:
+    """Valida el archivo completo con un decoder incremental (memoria constante)."""
+    for enc in ENCODINGS_CSV:
+        decoder = codecs.getincrementaldecoder(enc)()
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    bloque = f.read(SPOOL_BLOCK)
+                    if not bloque:
+                        decoder.decode(b"", final=True)
+                        break
+                    decoder.decode(bloque)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return ENCODINGS_CSV[-1]
+
+
+def _celda_str(v):
+    """Convierte una celda de openpyxl al texto que produciría read_excel(dtype=str)."""
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.strftime("%Y-%m-%d")
+    return str(v)
+
+
+def _iter_csv(path: str, chunk_size: int, info: list) -> Iterator[pd.DataFrame]:
+    enc = detectar_encoding(path)
+    info.append(f"INFO: CSV encoding {enc}, bloques de {chunk_size:,} filas")
+    with pd.read_csv(path, encoding=enc, dtype=str, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def _iter_xlsx(path: str, chunk_size: int, info: list) -> Iterator[pd.DataFrame]:
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        info.append(f"INFO: Leyendo hoja '{ws.title}' (read-only, bloques de {chunk_size:,} filas)")
+        filas = ws.iter_rows(values_only=True)
+        header = next(filas, None)
+        if header is None:
+            return
+        columnas = [str(c) if c is not None else f"COL_{i}" for i, c in enumerate(header)]
+        n = len(columnas)
+
+        inicio = 0
+        buf = []
+        for fila in filas:
+            valores = [_celda_str(v) for v in fila[:n]]
+            if len(valores) < n:
+                valores.extend([None] * (n - len(valores)))
+            buf.append(valores)
+            if len(buf) >= chunk_size:
+                yield pd.DataFrame(buf, columns=columnas, index=range(inicio, inicio + len(buf)))
+                inicio += len(buf)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=columnas, index=range(inicio, inicio + len(buf)))
+    finally:
+        wb.close()
+
+
+def _iter_excel_legacy(path: str, chunk_size: int, info: list) -> Iterator[pd.DataFrame]:
+    """.xls/.xlsb no tienen lector en streaming: se lee con pandas y se parte en bloques."""
+    xls = pd.ExcelFile(path)
+    hoja = xls.sheet_names[0]
+    info.append(f"INFO: Leyendo hoja '{hoja}' (formato sin streaming)")
+    df = pd.read_excel(xls, sheet_name=hoja, dtype=str)
+    for inicio in range(0, len(df), chunk_size):
+        yield df.iloc[inicio:inicio + chunk_size]
+
+
+def iter_bloques(path: str, nombre_archivo: str, chunk_size: int = CHUNK_SIZE,
+                 info: list = None) -> Iterator[pd.DataFrame]:
+    """
+    Itera el archivo en DataFrames de `chunk_size` filas (columnas en mayúsculas).
+    El índice de cada bloque es la posición global de la fila (0 = primera fila de datos).
+    """
+    info = info if info is not None else []
+    ext = os.path.splitext(nombre_archivo or path)[1].lower()
+    if ext == ".csv":
+        lector = _iter_csv
+    elif ext == ".xlsx":
+        lector = _iter_xlsx
+    else:
+        lector = _iter_excel_legacy
+
+    for chunk in lector(path, chunk_size, info):
+        chunk.columns = [str(c).strip().upper() for c in chunk.columns]
+        yield chunk
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. PARSEO VECTORIZADO
+# ══════════════════════════════════════════════════════════════════
+
+def _fecha_pagtotal(s: pd.Series) -> pd.Series:
+    """
+    Fecha 'YYYY-MM-DD' a partir de los primeros 10 caracteres.
+    Formatos: ISO, dd-MMM-yy, dd/mm/yyyy; si no parsea y mide 10, se conserva tal cual.
+    """
+    s10 = s.str[:10]
+    iso = pd.to_datetime(s10, format="%Y-%m-%d", errors="coerce")
+    out = iso.dt.strftime("%Y-%m-%d").astype("string")
+    for fmt in FORMATOS_FECHA:
+        faltan = out.isna() & s10.notna()
+        if not faltan.any():
+            break
+        parsed = pd.to_datetime(s10[faltan], format=fmt, errors="coerce")
+        out = out.fillna(parsed.dt.strftime("%Y-%m-%d").astype("string"))
+    crudo = s10.where(s10.str.len() >= 10)
+    return out.fillna(crudo)
+
+
+def _monto(df: pd.DataFrame, nombre: str) -> pd.Series:
+    s = col(df, nombre).str.replace(",", "", regex=False)
+    return pd.to_numeric(s, errors="coerce").fillna(0.0)
+
+
+def limpiar_pagos_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Mapea un bloque crudo de PAGTOTAL a las columnas de la tabla pagos (vectorizado)."""
+    poliza = col(df, "POLIZA")
+    poliza_match = col(df, "POLIZA_MATCH").fillna(poliza)
+    fec_apli = _fecha_pagtotal(col(df, "FECAPLI"))
+
+    out = pd.DataFrame({
+        "poliza_numero": poliza,
+        "endoso": col(df, "ENDOSO"),
+        "agente_codigo": col(df, "AGENTE"),
+        "contratante": col(df, "CONTRATANTE"),
+        "ramo": col(df, "RAMO"),
+        "moneda": col(df, "MON").fillna("MN"),
+        "fecha_inicio": _fecha_pagtotal(col(df, "PERINI")),
+        "fecha_aplicacion": fec_apli,
+        "fecha_aplicacion_d": serie_fecha_nativa(fec_apli),
+        "comprobante": col(df, "COMPROBANTE"),
+        "prima_neta": _monto(df, "NETA"),
+        "prima_total": _monto(df, "PRITOT"),
+        "comision": _monto(df, "COMISION"),
+        "comision_derecho": _monto(df, "COMDERECHO"),
+        "comision_recargo": _monto(df, "COMRECARGO"),
+        "comision_total": _monto(df, "TOTCOMISION"),
+        "promotor": col(df, "PROMOTOR"),
+        "poliza_match": poliza_match,
+        "match_key": poliza_match.map(clave_cruce, na_action="ignore"),
+        "anio_aplicacion": pd.to_numeric(fec_apli.str[:4], errors="coerce").astype("Int64"),
+        "periodo_aplicacion": fec_apli.str[:7],
+        "fuente": "PAGTOTAL",
+    }, index=df.index)
+    return out[poliza.notna()]
+
+
+def registros(df: pd.DataFrame) -> list:
+    """Filas de un DataFrame como dicts con tipos nativos (NA → None)."""
+    columnas = {c: a_python(df[c]) for c in df.columns}
+    nombres = list(columnas)
+    return [dict(zip(nombres, vals)) for vals in zip(*columnas.values())]
+
+
+# ══════════════════════════════════════════════════════════════════
+# 4. INSERCIÓN POR BLOQUE
+# ══════════════════════════════════════════════════════════════════
+
+def _insertar_bloque(db: Session, df: pd.DataFrame, errores: list) -> int:
+    """Inserta un bloque (COPY en PostgreSQL); si falla, reintenta fila por fila para reportar errores."""
+    filas = registros(df)
+    try:
+        with db.begin_nested():
+            return bulk_insert(db, "pagos", filas)
+    except Exception:
+        pass
+
+    insertadas = 0
+    for i, params in zip(df.index.tolist(), filas):
+        try:
+            with db.begin_nested():
+                bulk_insert(db, "pagos", [params])
+            insertadas += 1
+        except Exception as e:
+            errores.append(f"Fila {i+2}: {str(e)}")
+    return insertadas
+
+
+def importar_pagtotal_archivo(db: Session, path: str, nombre_archivo: str,
+                              errores: list, chunk_size: int = CHUNK_SIZE,
+                              refrescar: bool = True, confirmar_bloques: bool = True) -> int:
+    """
+    Importa un archivo PAGTOTAL desde disco bloque por bloque.
+    Con `confirmar_bloques` cada bloque se inserta y se confirma antes de leer
+    el siguiente: si un bloque falla, los anteriores ya quedaron en `pagos`.
+    Con `confirmar_bloques=False` no se hace ningún commit y el llamador
+    confirma o revierte todo el archivo en una sola transacción (así lo usa
+    /importar/pagtotal cuando vacía la tabla antes de cargar).
+    Con `refrescar` también recalcula la cobranza de las pólizas del bloque.
+    Retorna el número de pagos insertados.
+    """
+    nuevos = 0
+    bloques = 0
+    for chunk in iter_bloques(path, nombre_archivo, chunk_size, info=errores):
+        limpio = limpiar_pagos_df(chunk)
+        if not limpio.empty:
+            nuevos += _insertar_bloque(db, limpio, errores)
+            if refrescar:
+                refrescar_cobranza(db, match_keys=limpio["match_key"].dropna().unique().tolist())
+        if confirmar_bloques:
+            db.commit()
+        else:
+            db.flush()
+        bloques += 1
+    if nuevos:
+        invalidar(db)
+        if confirmar_bloques:
+            db.commit()
+    errores.append(f"INFO: {nuevos:,} pagos en {bloques} bloque(s)")
+    return nuevos
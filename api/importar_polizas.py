@@ -0,0 +1,324 @@
+"""
+Motor de importación masiva de pólizas — CSV POLIZAS_01
+=======================================================
+Reemplaza el recorrido fila por fila (iterrows + SELECT por agente/producto
++ INSERT individual) por:
+  1. Limpieza y parseo vectorizado de todas las columnas con pandas
+  2. Resolución de agentes y productos con mapas precargados (1 query c/u)
+  3. Reglas del AUTOMATICO en una sola pasada columnar (aplicar_reglas_dataframe)
+  4. Inserción en lotes grandes (bulk_insert: COPY en PostgreSQL)
+
+Los errores se siguen reportando por fila ("Fila N: ...") igual que antes.
+"""
+import io
+from typing import Optional
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .bulk_loader import bulk_insert
+from .produccion_agg import refrescar_produccion
+from .deudor_prima import refrescar_cobranza
+from .cache_respuestas import invalidar
+from .fechas_nativas import serie_fecha_nativa
+from .busqueda import serie_busqueda
+from .rules import normalizar_poliza, clave_cruce, calcular_mystatus, aplicar_reglas_dataframe
+
+# ── Configuración ──────────────────────────────────────────────────
+BATCH_SIZE = 5000
+ENCODINGS_CSV = ["utf-8-sig", "utf-8", "latin1", "cp1252"]
+FORMATOS_FECHA = ["%d-%b-%y", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y"]
+
+RAMO_NOMBRES = {
+    11: "VIDA",
+    34: "GASTOS MEDICOS MAYORES INDIVIDUAL",
+    90: "Individual Automoviles",
+}
+
+# Parámetro corto → columna de la tabla polizas
+COLUMNAS_POLIZA = {
+    "po": "poliza_original", "pe": "poliza_estandar", "mk": "match_key", "ai": "agente_id", "pi": "producto_id",
+    "an": "asegurado_nombre", "fi": "fecha_inicio", "ff": "fecha_fin", "fe": "fecha_emision",
+    "fi_d": "fecha_inicio_d", "ff_d": "fecha_fin_d", "bus": "busqueda",
+    "pt": "prima_total", "pn": "prima_neta", "iv": "iva", "re": "recargo", "su": "suma_asegurada",
+    "de": "deducible", "na": "num_asegurados", "fp": "forma_pago", "tp": "tipo_pago",
+    "sr": "status_recibo", "ga": "gama", "ms": "mystatus", "per": "periodo_aplicacion",
+    "anio": "anio_aplicacion", "mon": "moneda",
+    "largo": "largo_poliza", "raiz6": "raiz_poliza_6", "term": "terminacion", "id_comp": "id_compuesto",
+    "reexp": "es_reexpedicion", "primer": "primer_anio", "fec_apli": "fecha_aplicacion",
+    "mes_apli": "mes_aplicacion", "pend": "pendientes_pago", "trim": "trimestre",
+    "fpag": "flag_pagada", "fnueva": "flag_nueva_formal", "pap": "prima_anual_pesos",
+    "eqe": "equivalencias_emitidas", "eqp": "equivalencias_pagadas",
+    "fcanc": "flag_cancelada", "pprop": "prima_proporcional", "cprim": "condicional_prima",
+    "pacum": "prima_acumulada_basica",
+}
+
+# Parámetro corto → campo de entrada del motor de reglas
+ENTRADA_REGLAS = {
+    "po": "poliza_original", "fi": "fecha_inicio", "pn": "prima_neta", "mon": "moneda",
+    "ms": "mystatus", "sr": "status_recibo", "anio": "anio_aplicacion", "nueva": "es_nueva",
+    "ramo_codigo": "ramo_codigo",
+}
+
+# Campo calculado por el motor de reglas → parámetro corto
+SALIDA_REGLAS = {
+    "largo_poliza": "largo", "raiz_poliza_6": "raiz6", "terminacion": "term",
+    "id_compuesto": "id_comp", "es_reexpedicion": "reexp", "primer_anio": "primer",
+    "fecha_aplicacion": "fec_apli", "mes_aplicacion": "mes_apli", "pendientes_pago": "pend",
+    "trimestre": "trim", "flag_pagada": "fpag", "flag_nueva_formal": "fnueva",
+    "prima_anual_pesos": "pap", "equivalencias_emitidas": "eqe", "equivalencias_pagadas": "eqp",
+    "flag_cancelada": "fcanc", "prima_proporcional": "pprop", "condicional_prima": "cprim",
+    "prima_acumulada_basica": "pacum",
+}
+
+
+# ══════════════════════════════════════════════════════════════════
+# LECTURA Y LIMPIEZA VECTORIZADA
+# ══════════════════════════════════════════════════════════════════
+
+def leer_csv(contenido: bytes) -> Optional[pd.DataFrame]:
+    """Lee el CSV como texto auto-detectando encoding. None si no se pudo decodificar."""
+    for enc in ENCODINGS_CSV:
+        try:
+            df = pd.read_csv(io.BytesIO(contenido), dtype=str, encoding=enc, on_bad_lines="skip")
+        except Exception:
+            continue
+        df.columns = [c.strip().upper() for c in df.columns]
+        return df
+    return None
+
+
+def col(df: pd.DataFrame, nombre: str) -> pd.Series:
+    """Columna limpia (strip, ''/'nan' → NA). Si no existe, una serie vacía del mismo largo."""
+    if nombre not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype="string")
+    s = df[nombre].astype("string").str.strip()
+    return s.mask(s.isna() | (s == "") | (s.str.lower() == "nan"))
+
+
+def a_float(s: pd.Series) -> pd.Series:
+    """Convierte texto a float quitando separadores de miles; inválidos → NaN."""
+    return pd.to_numeric(s.str.replace(",", "", regex=False), errors="coerce")
+
+
+def a_fecha_iso(s: pd.Series) -> pd.Series:
+    """
+    Normaliza fechas a 'YYYY-MM-DD'.
+    Acepta ISO (se recorta a 10 chars), dd-MMM-yy estilo Oracle y
+    dd/mm/yyyy, mm/dd/yyyy, dd-mm-yyyy (en ese orden de prioridad).
+    """
+    out = pd.Series(pd.NA, index=s.index, dtype="string")
+    # Cada operando se rellena por separado: con cadenas de pyarrow (pandas 3 +
+    # pyarrow) una celda vacía da NA en ambos lados y `NA & NA` no es booleano
+    es_iso = (s.str.len() >= 10).fillna(False) & (s.str[4] == "-").fillna(False)
+    es_iso = es_iso.astype(bool)
+    out[es_iso] = s[es_iso].str[:10]
+
+    pendientes = s.notna() & ~es_iso
+    for fmt in FORMATOS_FECHA:
+        if not pendientes.any():
+            break
+        parsed = pd.to_datetime(s[pendientes], format=fmt, errors="coerce")
+        ok = parsed.notna()
+        idx = ok[ok].index
+        out[idx] = parsed[idx].dt.strftime("%Y-%m-%d")
+        pendientes[idx] = False
+    return out
+
+
+def a_python(s: pd.Series) -> list:
+    """Lista de valores nativos de Python con NA → None (apto para executemany)."""
+    return s.astype(object).where(s.notna(), None).tolist()
+
+
+def limpiar_polizas_df(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
+    """
+    Parsea y limpia todas las columnas del CSV POLIZAS_01 de forma vectorizada.
+
+    Returns:
+        (DataFrame con columnas destino, lista de errores "Fila N: ...").
+        Las filas sin POLIZA o con error de conversión se excluyen.
+    """
+    errores = []
+    poliza = col(df, "POLIZA")
+
+    # Ramo: columna RAMO (código numérico) o fallback por NOMRAMO
+    nomramo = col(df, "NOMRAMO").str.upper().fillna("")
+    ramo_fallback = pd.Series(34, index=df.index, dtype="int64")
+    ramo_fallback[nomramo.str.contains("AUTO", regex=False)] = 90
+    ramo_fallback[nomramo.str.contains("VIDA", regex=False)] = 11
+    ramo_num = pd.to_numeric(col(df, "RAMO"), errors="coerce")
+    ramo_codigo = ramo_num.fillna(ramo_fallback).astype("int64")
+
+    fecha_ini = a_fecha_iso(col(df, "FECINI"))
+    fecha_fin = a_fecha_iso(col(df, "FECFIN"))
+    anio = pd.to_numeric(fecha_ini.str[:4], errors="coerce").astype("Int64")
+    periodo = (anio.astype("string") + "-" + fecha_ini.str[5:7])
+
+    status = col(df, "STATUS").fillna("VIGENTE")
+    # calcular_mystatus solo depende de status aquí: se evalúa una vez por valor distinto
+    mystatus_calc = status.map({s: calcular_mystatus(s) for s in status.unique()})
+    mystatus = col(df, "MYSTATUS").fillna(mystatus_calc)
+
+    # ASEGS inválido era un error de fila en el importador anterior
+    asegs_raw = col(df, "ASEGS")
+    asegs = pd.to_numeric(asegs_raw, errors="coerce")
+    asegs_invalidos = asegs_raw.notna() & asegs.isna()
+    for i, v in asegs_raw[asegs_invalidos].items():
+        errores.append(f"Fila {i+2}: could not convert string to float: '{v}'")
+
+    poliza_strip = poliza.str.strip()
+    asegurado = col(df, "ASEGURADO")
+    out = pd.DataFrame({
+        "po": poliza_strip,
+        "pe": poliza_strip.map(normalizar_poliza, na_action="ignore"),
+        "mk": poliza_strip.map(clave_cruce, na_action="ignore"),
+        "agente_codigo": col(df, "AGENTE"),
+        "ramo_codigo": ramo_codigo,
+        "nomramo": nomramo,
+        "an": asegurado,
+        "bus": serie_busqueda(poliza_strip, asegurado),
+        "fi": fecha_ini,
+        "ff": fecha_fin,
+        "fi_d": serie_fecha_nativa(fecha_ini),
+        "ff_d": serie_fecha_nativa(fecha_fin),
+        "fe": a_fecha_iso(col(df, "FECEMI")),
+        "pt": a_float(col(df, "PRIMA_TOT")),
+        "pn": a_float(col(df, "PRIMANETA")),
+        "iv": a_float(col(df, "IVA")).fillna(0),
+        "re": a_float(col(df, "RECARGO")).fillna(0),
+        "su": a_float(col(df, "SUMA")),
+        "de": a_float(col(df, "DEDUCIBLE")),
+        "na": asegs.fillna(1).astype("int64"),
+        "fp": col(df, "FP"),
+        "tp": col(df, "TIPPAG"),
+        "sr": status,
+        "ga": col(df, "GAMA"),
+        "ms": mystatus,
+        "per": periodo,
+        "anio": anio,
+        "mon": col(df, "MON").fillna("MN"),
+        "nueva": col(df, "NUEVA"),
+    }, index=df.index)
+
+    out = out[poliza.notna() & ~asegs_invalidos]
+    return out, errores
+
+
+# ══════════════════════════════════════════════════════════════════
+# CATÁLOGOS PRECARGADOS
+# ══════════════════════════════════════════════════════════════════
+
+def mapa_agentes(db: Session) -> dict:
+    """{codigo_agente: id} en una sola consulta."""
+    rows = db.execute(text("SELECT codigo_agente, id FROM agentes")).all()
+    return {str(codigo).strip(): aid for codigo, aid in rows if codigo is not None}
+
+
+def mapa_productos(db: Session, ramos: dict) -> dict:
+    """
+    {ramo_codigo: producto_id} (primer producto por ramo).
+    Crea un producto genérico para los ramos que aún no existen;
+    `ramos` es {ramo_codigo: NOMRAMO crudo} para nombrar los nuevos.
+    """
+    rows = db.execute(text(
+        "SELECT ramo_codigo, MIN(id) FROM productos GROUP BY ramo_codigo"
+    )).all()
+    productos = {int(rc): pid for rc, pid in rows if rc is not None}
+
+    faltantes = sorted(r for r in ramos if r not in productos)
+    if faltantes:
+        nombres = {rc: RAMO_NOMBRES.get(rc, ramos[rc] or f"RAMO_{rc}") for rc in faltantes}
+        nuevos = [{"rc": rc, "rn": nombre, "pl": nombre} for rc, nombre in nombres.items()]
+        db.execute(text(
+            "INSERT INTO productos (ramo_codigo, ramo_nombre, plan) VALUES (:rc, :rn, :pl)"
+        ), nuevos)
+        db.flush()
+        return mapa_productos(db, {})
+    return productos
+
+
+# ══════════════════════════════════════════════════════════════════
+# REGLAS + INSERCIÓN EN LOTES
+# ══════════════════════════════════════════════════════════════════
+
+def aplicar_reglas_lote(limpio: pd.DataFrame) -> pd.DataFrame:
+    """Agrega a `limpio` las columnas del AUTOMATICO calculadas en una sola pasada columnar."""
+    entrada = limpio[list(ENTRADA_REGLAS)].rename(columns=ENTRADA_REGLAS)
+    reglas = aplicar_reglas_dataframe(entrada)
+    return limpio.join(reglas[list(SALIDA_REGLAS)].rename(columns=SALIDA_REGLAS))
+
+
+def _params_poliza(rec: dict) -> dict:
+    """Construye la fila (columnas de polizas) a partir del registro con reglas ya aplicadas."""
+    fila = {columna: rec[k] for k, columna in COLUMNAS_POLIZA.items()}
+    fila["fuente"] = "CSV_IMPORT"
+    return fila
+
+
+def _insertar_lote(db: Session, lote: list, errores: list) -> int:
+    """
+    Inserta un lote con bulk_insert (COPY en PostgreSQL) dentro de un savepoint.
+    Si el lote falla, reintenta fila por fila para aislar y reportar la(s) fila(s) con error.
+    """
+    filas = [p for _, p in lote]
+    try:
+        with db.begin_nested():
+            return bulk_insert(db, "polizas", filas)
+    except Exception:
+        pass
+
+    insertadas = 0
+    for i, params in lote:
+        try:
+            with db.begin_nested():
+                bulk_insert(db, "polizas", [params])
+            insertadas += 1
+        except Exception as e:
+            errores.append(f"Fila {i+2}: {str(e)}")
+    return insertadas
+
+
+def importar_polizas_df(db: Session, df: pd.DataFrame, errores: list,
+                        batch_size: int = BATCH_SIZE) -> int:
+    """
+    Importa un DataFrame crudo de POLIZAS_01 (columnas en mayúsculas).
+    Agrega a `errores` los mensajes por fila y retorna el número de pólizas insertadas.
+    Refresca produccion_mensual_agg para los años importados.
+    No hace commit: el llamador controla la transacción.
+    """
+    limpio, errores_parseo = limpiar_polizas_df(df)
+    errores.extend(errores_parseo)
+    if limpio.empty:
+        return 0
+
+    agentes = mapa_agentes(db)
+    nombres_ramo = limpio.drop_duplicates("ramo_codigo").set_index("ramo_codigo")["nomramo"]
+    productos = mapa_productos(db, nombres_ramo.to_dict())
+    limpio["ai"] = limpio["agente_codigo"].map(agentes)
+    limpio["pi"] = limpio["ramo_codigo"].map(productos)
+    limpio = aplicar_reglas_lote(limpio.drop(columns=["agente_codigo", "nomramo"]))
+
+    columnas = {c: a_python(limpio[c]) for c in limpio.columns}
+    nombres = list(columnas)
+    registros = (dict(zip(nombres, vals)) for vals in zip(*columnas.values()))
+
+    nuevos = 0
+    lote = []
+    for i, rec in zip(limpio.index.tolist(), registros):
+        try:
+            lote.append((i, _params_poliza(rec)))
+        except Exception as e:
+            errores.append(f"Fila {i+2}: {str(e)}")
+            continue
+        if len(lote) >= batch_size:
+            nuevos += _insertar_lote(db, lote, errores)
+            lote = []
+    if lote:
+        nuevos += _insertar_lote(db, lote, errores)
+    if nuevos:
+        refrescar_produccion(db, limpio["anio"].dropna().tolist())
+        refrescar_cobranza(db, anios=limpio["anio"].dropna().tolist())
+        invalidar(db)
+    return nuevos
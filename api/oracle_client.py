@@ -1,6 +1,7 @@
 import oracledb
 import os
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -10,52 +11,136 @@ ORACLE_PASS = os.getenv("ORACLE_PASS")
 ORACLE_DSN = os.getenv("ORACLE_DSN")
 ORACLE_CLIENT_PATH = os.getenv("ORACLE_CLIENT_PATH")
 
+# Pool de sesiones y array-fetch
+ORACLE_POOL_MIN = int(os.getenv("ORACLE_POOL_MIN", "1"))
+ORACLE_POOL_MAX = int(os.getenv("ORACLE_POOL_MAX", "4"))
+ORACLE_ARRAYSIZE = int(os.getenv("ORACLE_ARRAYSIZE", "5000"))       # Filas por round-trip
+ORACLE_PREFETCHROWS = int(os.getenv("ORACLE_PREFETCHROWS", "5000"))  # Filas en el primer execute
+
 logger.info(f"Oracle Config Check: USER={'SET' if ORACLE_USER else 'MISSING'}, DSN={'SET' if ORACLE_DSN else 'MISSING'}")
 
-def get_oracle_connection(thick_mode=None):
+_lock = threading.Lock()
+_pool = None
+_modo_inicializado = False
+
+
+def _inicializar_modo(thick_mode):
     """
-    Retorna una conexión a la base de datos Oracle.
-    Si thick_mode es None, lo activa automáticamente si ORACLE_CLIENT_PATH está presente.
+    Inicializa el modo Thick una sola vez por proceso.
+    oracledb no permite cambiar de modo después de la primera conexión,
+    así que el primer llamador decide; los siguientes solo reutilizan.
     """
+    global _modo_inicializado
+    if _modo_inicializado:
+        return
     if thick_mode is None:
         thick_mode = bool(ORACLE_CLIENT_PATH)
-    
+    if thick_mode:
+        try:
+            oracledb.init_oracle_client(lib_dir=ORACLE_CLIENT_PATH)
+            logger.info(f"Modo Thick inicializado con {ORACLE_CLIENT_PATH}")
+        except oracledb.ProgrammingError as e:
+            # Ya inicializado o error de configuración
+            logger.warning(f"Aviso al inicializar Thick mode: {e}")
+    _modo_inicializado = True
+
+
+def get_pool(thick_mode=None):
+    """Pool de sesiones del proceso (se crea en el primer uso)."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _lock:
+        if _pool is None:
+            _inicializar_modo(thick_mode)
+            _pool = oracledb.create_pool(
+                user=ORACLE_USER,
+                password=ORACLE_PASS,
+                dsn=ORACLE_DSN,
+                min=ORACLE_POOL_MIN,
+                max=ORACLE_POOL_MAX,
+                increment=1,
+                getmode=oracledb.POOL_GETMODE_WAIT,
+            )
+            logger.info(f"Pool Oracle creado ({ORACLE_POOL_MIN}-{ORACLE_POOL_MAX}): {ORACLE_DSN}")
+    return _pool
+
+
+def cerrar_pool():
+    """Cierra el pool (apagado de la API)."""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.close(force=True)
+            _pool = None
+
+
+def estado_pool() -> dict:
+    if _pool is None:
+        return {"creado": False}
+    return {"creado": True, "modo": "thin" if oracledb.is_thin_mode() else "thick",
+            "abiertas": _pool.opened, "ocupadas": _pool.busy,
+            "min": _pool.min, "max": _pool.max}
+
+
+def get_oracle_connection(thick_mode=None):
+    """
+    Retorna una conexión del pool de Oracle; `close()` la devuelve al pool.
+    thick_mode solo aplica la primera vez (None = Thick si ORACLE_CLIENT_PATH está presente).
+    """
     try:
-        if thick_mode:
-            try:
-                # Inicializar modo thick si no se ha hecho
-                oracledb.init_oracle_client(lib_dir=ORACLE_CLIENT_PATH)
-                logger.info(f"Modo Thick inicializado con {ORACLE_CLIENT_PATH}")
-            except oracledb.ProgrammingError as e:
-                # Ya inicializado o error de configuración
-                logger.warning(f"Aviso al inicializar Thick mode: {e}")
-        
-        conn = oracledb.connect(
-            user=ORACLE_USER,
-            password=ORACLE_PASS,
-            dsn=ORACLE_DSN
-        )
-        logger.info(f"Conexión exitosa a Oracle: {ORACLE_DSN}")
-        return conn
+        return get_pool(thick_mode).acquire()
     except Exception as e:
         logger.error(f"Error conectando a Oracle: {e}")
         raise
 
-def execute_query(query, params=None, fetch_all=True):
-    """Ejecuta una consulta y retorna los resultados."""
+
+def configurar_cursor(cursor, arraysize=None, prefetchrows=None):
+    """Aplica el tamaño de array-fetch y prefetch al cursor."""
+    cursor.arraysize = arraysize or ORACLE_ARRAYSIZE
+    cursor.prefetchrows = prefetchrows or ORACLE_PREFETCHROWS
+    return cursor
+
+
+def stream_query(query, params=None, columnas=None, lotes=False, arraysize=None):
+    """
+    Ejecuta una consulta y genera los resultados sin materializarlos.
+
+    Args:
+        columnas: lista opcional que se llena con los nombres de columna antes de la primera fila.
+        lotes: False → genera tuplas fila por fila;
+               True → genera un dict {columna: [valores]} por cada fetchmany.
+        arraysize: filas por round-trip (default ORACLE_ARRAYSIZE).
+    """
     conn = get_oracle_connection()
     try:
-        cursor = conn.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        
-        if fetch_all:
-            # Obtener nombres de columnas
-            columns = [col[0] for col in cursor.description]
-            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-            return results
-        return None
+        cursor = configurar_cursor(conn.cursor(), arraysize)
+        cursor.execute(query, params or {})
+        nombres = [col[0] for col in cursor.description]
+        if columnas is not None:
+            columnas[:] = nombres
+        while True:
+            filas = cursor.fetchmany()
+            if not filas:
+                break
+            if lotes:
+                yield {c: list(v) for c, v in zip(nombres, zip(*filas))}
+            else:
+                yield from filas
+        cursor.close()
     finally:
         conn.close()
+
+
+def execute_query(query, params=None, fetch_all=True):
+    """Ejecuta una consulta y retorna los resultados."""
+    if not fetch_all:
+        conn = get_oracle_connection()
+        try:
+            conn.cursor().execute(query, params or {})
+            return None
+        finally:
+            conn.close()
+
+    columnas = []
+    return [dict(zip(columnas, row)) for row in stream_query(query, params, columnas=columnas)]
@@ -0,0 +1,110 @@
+"""
+Paginación por cursor (keyset) y conteos baratos para los listados
+==================================================================
+Con LIMIT/OFFSET la BD recorre y descarta todas las filas de las páginas
+anteriores, así que cada página profunda cuesta más que la anterior. Con
+keyset la página siguiente se pide con el cursor de la última fila recibida:
+
+    after='<valor de orden>,<id>'
+    WHERE (orden, id) < (:cursor_valor, :cursor_id)
+    ORDER BY orden DESC, id DESC LIMIT n
+
+y con un índice sobre (orden, id) cada página cuesta lo mismo. La comparación
+por row value la resuelven como rango del índice PostgreSQL y SQLite (>= 3.15);
+escrita con OR, SQLite recorre el índice completo.
+
+Para órdenes de varias columnas con direcciones mezcladas (p.ej. la cobranza:
+prioridad ASC, días DESC) el cursor lleva un valor por columna y el predicado
+se escribe anidado (`sql_keyset_orden`); con un índice en el mismo orden y
+direcciones el planner lo resuelve sobre el índice sin ordenar.
+
+El total del listado se pide con `conteo`:
+  exacto    COUNT(*) sobre los filtros (default, compatible)
+  estimado  estimación del planner (PostgreSQL); SQLite no la tiene y cuenta exacto
+  ninguno   sin total: solo next_cursor
+"""
+import json
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+MODOS_CONTEO = ("exacto", "estimado", "ninguno")
+
+
+def leer_cursor(after: Optional[str]) -> Optional[tuple]:
+    """Cursor 'valor,id' → (valor, id). El valor puede traer comas (p.ej. nombres)."""
+    if not after:
+        return None
+    valor, coma, ident = after.rpartition(",")
+    if not coma or not ident.strip().isdigit():
+        raise HTTPException(400, "Cursor inválido: se espera 'valor,id'")
+    return valor, int(ident)
+
+
+def crear_cursor(valor, ident) -> str:
+    return f"{valor if valor is not None else ''},{ident}"
+
+
+def sql_keyset(columna: str, columna_id: str, descendente: bool = True) -> str:
+    """Predicado de la página siguiente al cursor (parámetros :cursor_valor y :cursor_id)."""
+    op = "<" if descendente else ">"
+    return f"({columna}, {columna_id}) {op} (:cursor_valor, :cursor_id)"
+
+
+def contar(db: Session, desde: str, params: dict, modo: str = "exacto") -> tuple:
+    """
+    Total de filas de `desde` ('FROM ... WHERE ...') según el modo de conteo.
+    Retorna (total o None, es_estimado).
+    """
+    if modo not in MODOS_CONTEO:
+        raise HTTPException(400, f"conteo debe ser uno de: {', '.join(MODOS_CONTEO)}")
+    if modo == "ninguno":
+        return None, False
+    if modo == "estimado" and db.get_bind().dialect.name == "postgresql":
+        plan = db.execute(text(f"EXPLAIN (FORMAT JSON) SELECT 1 {desde}"), params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"]), True
+    return db.execute(text(f"SELECT COUNT(*) {desde}"), params).scalar() or 0, False
+
+
+def leer_cursor_orden(after: Optional[str], tipos: tuple) -> Optional[list]:
+    """
+    Cursor 'v1,v2,...,id' de un orden de varias columnas → valores convertidos
+    con `tipos` (uno por columna, el último es el id). El primer valor puede traer comas.
+    """
+    if not after:
+        return None
+    partes = after.rsplit(",", len(tipos) - 1)
+    try:
+        if len(partes) != len(tipos):
+            raise ValueError
+        return [tipo(valor) for tipo, valor in zip(tipos, partes)]
+    except ValueError:
+        raise HTTPException(400, f"Cursor inválido: se esperan {len(tipos)} valores separados por coma")
+
+
+def crear_cursor_orden(valores) -> str:
+    return ",".join("" if v is None else str(v) for v in valores)
+
+
+def sql_keyset_orden(orden: tuple) -> str:
+    """
+    Predicado de la página siguiente para `orden` = ((columna, descendente), ...),
+    la última columna única (id). Parámetros :cursor_0 ... :cursor_n.
+    Con una sola dirección es el row value de sql_keyset; con direcciones
+    mezcladas, la comparación lexicográfica anidada.
+    """
+    if len({desc for _, desc in orden}) == 1:
+        op = "<" if orden[0][1] else ">"
+        columnas = ", ".join(c for c, _ in orden)
+        cursores = ", ".join(f":cursor_{i}" for i in range(len(orden)))
+        return f"({columnas}) {op} ({cursores})"
+    predicado = ""
+    for i in reversed(range(len(orden))):
+        columna, descendente = orden[i]
+        mayor = f"{columna} {'<' if descendente else '>'} :cursor_{i}"
+        predicado = mayor if not predicado else f"{mayor} OR ({columna} = :cursor_{i} AND ({predicado}))"
+    return f"({predicado})"
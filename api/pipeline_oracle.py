@@ -0,0 +1,263 @@
+"""
+Pipeline de sincronización Oracle — orquestador en proceso
+==========================================================
+Corre las etapas como un grafo de dependencias dentro del mismo proceso
+(sin un intérprete por etapa ni imports en frío):
+
+    polizas ──┐
+              ├──> solicitudes ──> reglas
+    pagtotal ─┘
+
+Las etapas sin dependencias pendientes corren en paralelo (hilos) sobre el
+engine compartido de api.database; cada etapa usa su propia Session y toma
+una conexión del pool de Oracle (api.oracle_client).
+Por etapa se reportan filas, duración, filas/s y memoria pico del proceso.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .oracle_client import stream_query
+from .recalculo_reglas import recalcular_reglas
+from .rules import clave_cruce
+from .fechas_nativas import con_fechas_nativas
+from .busqueda import con_busqueda
+from .deudor_prima import refrescar_cobranza
+from .sync_incremental import consulta_incremental, sincronizar
+
+try:
+    import resource
+except ImportError:          # Windows (desarrollo local)
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+MAX_HILOS = 2
+
+
+# ══════════════════════════════════════════════════════════════════
+# MAPEO ORACLE → TABLAS LOCALES
+# ══════════════════════════════════════════════════════════════════
+
+def mapear_poliza(data: dict) -> dict:
+    """UCARTERA.POLIZAS_01 → polizas (ajustar según nombres reales en Oracle)."""
+    poliza = str(data.get("POLIZA") or data.get("POLIZA_ORIGINAL") or "")
+    return con_busqueda("polizas", con_fechas_nativas("polizas", {
+        "poliza_original": poliza,
+        "poliza_estandar": str(data.get("POLIZA_ESTANDAR") or data.get("POLIZA") or ""),
+        "match_key": clave_cruce(poliza),
+        "asegurado_nombre": data.get("ASEGURADO") or data.get("NOMBRE_ASEGURADO"),
+        "contratante_nombre": data.get("CONTRATANTE"),
+        "fecha_inicio": str(data.get("FECHA_INICIO") or data.get("FECINI") or "")[:10],
+        "fecha_emision": str(data.get("FECHA_EMISION") or data.get("FECEMI") or "")[:10],
+        "moneda": data.get("MONEDA") or "MN",
+        "prima_neta": float(data.get("PRIMA_NETA") or data.get("NETA") or 0),
+        "prima_total": float(data.get("PRIMA_TOTAL") or data.get("TOTAL") or 0),
+        "fuente": "ORACLE_MAESTRO",
+        "updated_at": datetime.now().isoformat(),
+    }))
+
+
+def mapear_pago(data: dict):
+    """PAGTOTAL → pagos. None si no trae número de póliza."""
+    pago = {
+        "poliza_numero": str(data.get("POLIZA") or ""),
+        "endoso": str(data.get("ENDOSO") or ""),
+        "agente_codigo": str(data.get("AGENTE") or ""),
+        "contratante": data.get("CONTRATANTE"),
+        "ramo": data.get("RAMO"),
+        "moneda": data.get("MON") or data.get("MONEDA") or "MN",
+        "fecha_inicio": str(data.get("PERINI") or "")[:10],
+        "fecha_aplicacion": str(data.get("FECAPLI") or "")[:10],
+        "comprobante": data.get("COMPROBANTE"),
+        "prima_neta": float(data.get("NETA") or 0),
+        "prima_total": float(data.get("PRITOT") or data.get("TOTAL") or 0),
+        "comision": float(data.get("COMISION") or 0),
+        "comision_total": float(data.get("TOTCOMISION") or 0),
+        "poliza_match": str(data.get("POLIZA") or ""),
+        "match_key": clave_cruce(data.get("POLIZA")),
+        "fuente": "ORACLE_PAGTOTAL",
+        "created_at": datetime.now().isoformat(),
+    }
+    return con_fechas_nativas("pagos", pago) if pago["poliza_numero"] else None
+
+
+def mapear_solicitud(data: dict):
+    """VW_CONCENTRADO_ULT_ETAPAS → solicitudes. None si no trae NOSOL."""
+    nosol = str(data.get("NOSOL") or "")
+    if not nosol:
+        return None
+    return con_busqueda("solicitudes", con_fechas_nativas("solicitudes", {
+        "nosol": nosol,
+        "nomramo": data.get("NOMRAMO") or data.get("RAMO"),
+        "contratante_nombre": data.get("CONTRATANTE"),
+        "idagente": str(data.get("IDAGENTE") or ""),
+        "ultima_etapa": data.get("ETAPA"),
+        "ultima_subetapa": data.get("SUBETAPA"),
+        "fecha_ultima_etapa": str(data.get("FECETAPA") or "")[:10],
+        "fuente": "ORACLE_VW_CONCENTRADO",
+        "updated_at": datetime.now().isoformat(),
+    }))
+
+
+# ══════════════════════════════════════════════════════════════════
+# ETAPAS
+# ══════════════════════════════════════════════════════════════════
+
+def _sincronizar_fuente(db: Session, fuente: str, mapear, completo: bool,
+                        filtro: str = None) -> dict:
+    """
+    Extrae el delta en streaming (array-fetch, conexión del pool) y lo sincroniza.
+    Si hubo cambios recalcula la cobranza de las pólizas del delta (por match_key).
+    """
+    sql, params = consulta_incremental(db, fuente, completo=completo, filtro=filtro)
+    logger.info(f"[ORACLE SYNC] {fuente}: {sql}")
+    columnas = []
+    claves = set()
+
+    def mapear_y_anotar(data):
+        fila = mapear(data)
+        if fila and fila.get("match_key"):
+            claves.add(fila["match_key"])
+        return fila
+
+    registros = (dict(zip(columnas, row)) for row in stream_query(sql, params, columnas=columnas))
+    stats = sincronizar(db, fuente, registros, mapear_y_anotar, completo=completo)
+    if fuente in ("polizas", "pagos") and (stats["insertadas"] or stats["actualizadas"]):
+        refrescar_cobranza(db, match_keys=claves)
+    db.commit()
+    stats["filas"] = stats["leidas"]
+    return stats
+
+
+def etapa_polizas(db: Session, completo: bool = False) -> dict:
+    return _sincronizar_fuente(db, "polizas", mapear_poliza, completo)
+
+
+def etapa_pagtotal(db: Session, completo: bool = False) -> dict:
+    # Excluye ramos de autos (asumo RAMO no en (listado de autos))
+    return _sincronizar_fuente(
+        db, "pagos", mapear_pago, completo,
+        filtro="RAMO NOT LIKE '%AUTO%' AND RAMO NOT IN ('AUTOS', 'MOTOS')",
+    )
+
+
+def etapa_solicitudes(db: Session, completo: bool = False) -> dict:
+    return _sincronizar_fuente(db, "solicitudes", mapear_solicitud, completo)
+
+
+def etapa_reglas(db: Session, completo: bool = False) -> dict:
+    # Igual que el antiguo reprocesar_reglas_mag.py: también reclasifica tipo_poliza
+    actualizadas = recalcular_reglas(db, incluir_tipo=True)
+    db.commit()
+    return {"filas": actualizadas}
+
+
+# Etapa → (función, dependencias)
+ETAPAS = {
+    "polizas": (etapa_polizas, ()),
+    "pagtotal": (etapa_pagtotal, ()),
+    "solicitudes": (etapa_solicitudes, ("polizas", "pagtotal")),
+    "reglas": (etapa_reglas, ("solicitudes",)),
+}
+
+
+# ══════════════════════════════════════════════════════════════════
+# ORQUESTADOR
+# ══════════════════════════════════════════════════════════════════
+
+def _memoria_pico_mb():
+    """RSS pico del proceso en MB (ru_maxrss está en KB en Linux)."""
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _es_sqlite(session_factory) -> bool:
+    db = session_factory()
+    try:
+        return db.get_bind().dialect.name == "sqlite"
+    finally:
+        db.close()
+
+
+def _correr_etapa(nombre: str, fn, completo: bool, session_factory, metricas: dict) -> bool:
+    metricas.update({"estado": "corriendo", "inicio": datetime.now().isoformat()})
+    mem_antes = _memoria_pico_mb()
+    inicio = time.time()
+    db = session_factory()
+    try:
+        stats = fn(db, completo) or {}
+        ok = True
+        metricas["estado"] = "ok"
+    except Exception as e:
+        db.rollback()
+        stats = {}
+        ok = False
+        metricas.update({"estado": "error", "error": str(e)})
+        logger.error(f"[ORACLE SYNC] Etapa {nombre} falló: {e}")
+    finally:
+        db.close()
+
+    duracion = time.time() - inicio
+    filas = stats.pop("filas", 0)
+    mem_despues = _memoria_pico_mb()
+    metricas.update({
+        "filas": filas,
+        "duracion_segundos": round(duracion, 2),
+        "filas_por_segundo": round(filas / duracion, 1) if duracion > 0 else None,
+        "memoria_pico_mb": mem_despues,
+        "memoria_crecimiento_mb": (round(mem_despues - mem_antes, 1)
+                                   if mem_antes is not None else None),
+        "detalle": stats,
+    })
+    return ok
+
+
+def ejecutar_pipeline(completo: bool = False, estado: dict = None,
+                      session_factory=SessionLocal, etapas: dict = ETAPAS) -> dict:
+    """
+    Ejecuta las etapas respetando sus dependencias; las independientes en paralelo.
+    Si una etapa falla, sus dependientes quedan como "omitida".
+
+    Args:
+        estado: dict donde se publican las métricas por etapa (p.ej. el estatus del endpoint).
+
+    Returns:
+        `estado` con estado["etapas"][nombre] = métricas de la etapa.
+    """
+    estado = estado if estado is not None else {}
+    metricas = {nombre: {"estado": "pendiente"} for nombre in etapas}
+    estado["etapas"] = metricas
+
+    # SQLite no admite escrituras concurrentes: las etapas corren en serie
+    hilos = 1 if _es_sqlite(session_factory) else MAX_HILOS
+
+    pendientes = dict(etapas)
+    hechas, fallidas = set(), set()
+    en_curso = {}
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="oracle-sync") as pool:
+        while pendientes or en_curso:
+            for nombre, (fn, deps) in list(pendientes.items()):
+                if any(d in fallidas for d in deps):
+                    metricas[nombre]["estado"] = "omitida"
+                    fallidas.add(nombre)
+                    del pendientes[nombre]
+                elif all(d in hechas for d in deps):
+                    futuro = pool.submit(_correr_etapa, nombre, fn, completo,
+                                         session_factory, metricas[nombre])
+                    en_curso[futuro] = nombre
+                    del pendientes[nombre]
+            if not en_curso:
+                break
+            listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                nombre = en_curso.pop(futuro)
+                (hechas if futuro.result() else fallidas).add(nombre)
+
+    estado["exito"] = not fallidas
+    return estado
@@ -0,0 +1,119 @@
+"""
+Producción mensual pre-agregada (tabla de hechos de los dashboards)
+===================================================================
+`produccion_mensual_agg` guarda la cartera agregada por
+
+    (anio, periodo, ramo_codigo, agente_id, gama, moneda, tipo, trimestre, forma_pago)
+
+con las medidas pólizas, asegurados, equivalencias y primas. La clasificación
+NUEVA / SUBSECUENTE (SQL_ES_NUEVA) se resuelve una sola vez al refrescar, así
+que los dashboards leen unas cuantas filas por agente y mes en lugar de
+re-agregar la tabla polizas en cada request.
+
+Refresco incremental por año: se borran y reconstruyen solo las particiones
+(anio_aplicacion) afectadas. Lo llaman los importadores, el recálculo de reglas
+y la carga de datos demo; sin años se reconstruye la tabla completa.
+"""
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+TABLA = "produccion_mensual_agg"
+
+# flag_nueva_formal (reglas de negocio) tiene prioridad sobre tipo_poliza (dato crudo de importación)
+SQL_ES_NUEVA = "(p.flag_nueva_formal=1 OR (p.flag_nueva_formal IS NULL AND p.tipo_poliza='NUEVA'))"
+SQL_ES_SUBSECUENTE = "(p.flag_nueva_formal=0 OR (p.flag_nueva_formal IS NULL AND p.tipo_poliza='SUBSECUENTE'))"
+
+# Dimensión → expresión sobre polizas p / productos pr
+DIMENSIONES = {
+    "anio": "p.anio_aplicacion",
+    "periodo": "p.periodo_aplicacion",
+    "mes": "p.mes_periodo",                  # Columna generada de periodo_aplicacion
+    "ramo_codigo": "pr.ramo_codigo",
+    "agente_id": "p.agente_id",
+    "gama": "p.gama",
+    "moneda": "p.moneda",
+    "tipo": f"CASE WHEN {SQL_ES_NUEVA} THEN 'NUEVA' WHEN {SQL_ES_SUBSECUENTE} THEN 'SUBSECUENTE' ELSE 'OTRA' END",
+    "trimestre": "p.trimestre",
+    "forma_pago": "p.forma_pago",
+}
+
+# Medida → valor por póliza (se suma al agregar)
+MEDIDAS = {
+    "polizas": "1",
+    "polizas_nueva_formal": "CASE WHEN p.flag_nueva_formal = 1 THEN 1 ELSE 0 END",
+    "canceladas": "CASE WHEN p.status_recibo NOT IN ('PAGADA', 'AL CORRIENTE') THEN 1 ELSE 0 END",
+    # Sin dato (NULL) cuenta como 1; un 0 explícito cuenta como 0. Es la misma
+    # regla que COALESCE(num_asegurados, 1) del indicador de asegurados GMMI y
+    # del detalle de asegurados, que leen polizas directo
+    "asegurados": "COALESCE(p.num_asegurados, 1)",
+    "equivalencias": "COALESCE(p.equivalencias_emitidas, 0)",
+    "prima_neta": "COALESCE(p.prima_neta, 0)",
+    "prima_acumulada": "COALESCE(p.neta_acumulada, p.prima_neta, 0)",
+    "prima_anual_pesos": "COALESCE(p.prima_anual_pesos, 0)",
+    "prima_sin_fp": "COALESCE(p.neta_sin_forma, 0)",
+}
+
+
+def filas_produccion(where: str = "1=1") -> str:
+    """
+    SELECT de una fila por póliza con las columnas de la tabla de hechos.
+    Sirve para el refresco y como fuente equivalente cuando un filtro necesita
+    columnas de la póliza que el agregado no conserva (p.ej. primer_anio).
+    """
+    columnas = [f"{expr} AS {nombre}" for nombre, expr in {**DIMENSIONES, **MEDIDAS}.items()]
+    return f"""
+        SELECT {", ".join(columnas)}
+        FROM polizas p
+        LEFT JOIN productos pr ON p.producto_id = pr.id
+        WHERE ({where})
+    """
+
+
+def refrescar_produccion(db: Session, anios: Optional[Iterable] = None) -> int:
+    """
+    Reconstruye las particiones de `anios` en produccion_mensual_agg
+    (None = la tabla completa). No hace commit. Retorna las filas agregadas.
+    """
+    params = {}
+    if anios is None:
+        db.execute(text(f"DELETE FROM {TABLA}"))
+        where = "p.anio_aplicacion IS NOT NULL"
+    else:
+        anios = sorted({int(a) for a in anios if a is not None})
+        if not anios:
+            return 0
+        params = {f"anio_{i}": a for i, a in enumerate(anios)}
+        lista = ", ".join(f":{k}" for k in params)
+        db.execute(text(f"DELETE FROM {TABLA} WHERE anio IN ({lista})"), params)
+        where = f"p.anio_aplicacion IN ({lista})"
+
+    dimensiones = ", ".join(DIMENSIONES)
+    sumas = ", ".join(f"SUM({m})" for m in MEDIDAS)
+    return db.execute(text(f"""
+        INSERT INTO {TABLA} ({dimensiones}, {", ".join(MEDIDAS)})
+        SELECT {dimensiones}, {sumas}
+        FROM ({filas_produccion(where)}) f
+        GROUP BY {dimensiones}
+    """), params).rowcount
+
+
+def anios_polizas(db: Session, where: str = "1=1", params: dict = None) -> set:
+    """Años de aplicación presentes en las pólizas que cumplen `where` (alias p / pr)."""
+    return set(db.execute(text(f"""
+        SELECT DISTINCT p.anio_aplicacion FROM polizas p
+        LEFT JOIN productos pr ON p.producto_id = pr.id
+        WHERE ({where}) AND p.anio_aplicacion IS NOT NULL
+    """), params or {}).scalars())
+
+
+def inicializar_produccion(db: Session) -> bool:
+    """Construye la tabla si está vacía y ya hay pólizas (BD previa a la tabla de hechos). Hace commit."""
+    if db.execute(text(f"SELECT 1 FROM {TABLA} LIMIT 1")).first():
+        return False
+    if not db.execute(text("SELECT 1 FROM polizas WHERE anio_aplicacion IS NOT NULL LIMIT 1")).first():
+        return False
+    refrescar_produccion(db)
+    db.commit()
+    return True
@@ -0,0 +1,386 @@
+"""
+Recálculo de reglas del AUTOMATICO sobre las pólizas en BD
+==========================================================
+Ruta set-based con memoria acotada:
+  1. Recorre las pólizas por keyset (id > último id) en bloques de CHUNK_SIZE
+  2. Aplica el motor de reglas columnar (aplicar_reglas_dataframe) al bloque
+     y carga el resultado a una tabla staging temporal (COPY en PostgreSQL,
+     executemany en SQLite)
+  3. num_reexpediciones se calcula en SQL sobre el staging completo
+     (COUNTIF de raiz_poliza_6 sobre todo el conjunto recalculado)
+  4. Un solo UPDATE polizas ... FROM staging aplica todos los cambios
+
+Modo paralelo (recalcular_reglas_paralelo) para el reprocesamiento completo:
+  - Las pólizas se parten en shards por rango de id; cada shard se calcula en
+    un proceso del ProcessPoolExecutor y se confirma con su propio commit junto
+    con su checkpoint en `recalculo_shards`
+  - Reduce: num_reexpediciones se calcula al final con un GROUP BY sobre los
+    raiz_poliza_6 ya persistidos por todos los shards
+  - Con reanudar=True una corrida interrumpida retoma sus shards pendientes,
+    solo si es reciente (REANUDAR_HORAS) y la planificó la misma versión del
+    motor de reglas; las corridas pendientes que no se retoman se expiran
+  - Las pólizas insertadas después de planificar (id > último shard) se cubren
+    con shards adicionales antes de terminar
+
+Lo usan POST /importar/aplicar-reglas, scripts/reprocesar_reglas_mag.py
+y la etapa "reglas" del pipeline Oracle.
+"""
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session, sessionmaker
+
+from .bulk_loader import bulk_insert
+from .database import RecalculoShard, SessionLocal
+from .produccion_agg import refrescar_produccion
+from .deudor_prima import refrescar_cobranza
+from .cache_respuestas import invalidar
+from . import rules
+from .rules import aplicar_reglas_dataframe
+
+CHUNK_SIZE = 20000
+SHARD_SIZE = 50000          # Ids por shard del modo paralelo
+REANUDAR_HORAS = 24         # Antigüedad máxima de una corrida para retomarla
+STAGING = "stg_reglas"
+
+# Columnas derivadas que se persisten (mismo nombre en el resultado de reglas y en polizas)
+COLUMNAS_REGLAS = [
+    "largo_poliza", "raiz_poliza_6", "terminacion", "id_compuesto",
+    "es_reexpedicion", "primer_anio", "fecha_aplicacion", "mes_aplicacion",
+    "pendientes_pago", "trimestre", "flag_pagada", "flag_nueva_formal",
+    "prima_anual_pesos", "equivalencias_emitidas", "equivalencias_pagadas",
+    "flag_cancelada", "prima_proporcional", "condicional_prima",
+    "prima_acumulada_basica",
+]
+
+
+def _crear_staging(db: Session) -> None:
+    columnas = ", ".join(["id", "num_reexpediciones", "tipo_poliza"] + COLUMNAS_REGLAS)
+    db.execute(text(f"DROP TABLE IF EXISTS {STAGING}"))
+    db.execute(text(f"CREATE TEMP TABLE {STAGING} AS SELECT {columnas} FROM polizas WHERE 1=0"))
+
+
+def _cargar_bloque(db: Session, polizas: pd.DataFrame) -> None:
+    """Calcula las reglas de un bloque y lo vuelca al staging."""
+    reglas = aplicar_reglas_dataframe(polizas)
+    staging = reglas[COLUMNAS_REGLAS].assign(
+        id=polizas["id"],
+        num_reexpediciones=0,
+        tipo_poliza=reglas["tipo_poliza_nuevo"],
+    )
+    bulk_insert(db, STAGING, staging.to_dict("records"))
+
+
+def _contar_reexpediciones(db: Session) -> None:
+    """BF: COUNTIF(raiz_poliza_6) sobre todo el conjunto recalculado."""
+    db.execute(text(f"""
+        UPDATE {STAGING} SET num_reexpediciones = c.n
+        FROM (
+            SELECT raiz_poliza_6, COUNT(*) AS n FROM {STAGING}
+            WHERE raiz_poliza_6 IS NOT NULL AND raiz_poliza_6 <> ''
+            GROUP BY raiz_poliza_6
+        ) c
+        WHERE {STAGING}.raiz_poliza_6 = c.raiz_poliza_6
+    """))
+
+
+def _aplicar_staging(db: Session, ahora: str, columnas: list) -> int:
+    asignaciones = ", ".join(f"{c} = s.{c}" for c in columnas)
+    return db.execute(text(f"""
+        UPDATE polizas SET {asignaciones}, updated_at = :ahora
+        FROM {STAGING} AS s
+        WHERE polizas.id = s.id
+    """), {"ahora": ahora}).rowcount
+
+
+def recalcular_reglas(db: Session, where: str = "1=1", params: dict = None,
+                      chunk_size: int = CHUNK_SIZE,
+                      progreso: Optional[Callable[[int], None]] = None,
+                      incluir_tipo: bool = False,
+                      contar_reexpediciones: bool = True,
+                      refrescar_agregados: bool = True) -> int:
+    """
+    Recalcula las columnas derivadas de las pólizas que cumplen `where`
+    (alias p = polizas, pr = productos). No hace commit.
+
+    Args:
+        progreso: callback opcional con el total de pólizas calculadas tras cada bloque.
+        incluir_tipo: también reescribe tipo_poliza con la clasificación recalculada
+            (reprocesamiento completo; el endpoint conserva el tipo importado).
+        contar_reexpediciones: False deja num_reexpediciones sin tocar (el modo
+            paralelo lo calcula en el reduce, sobre todos los shards).
+        refrescar_agregados: reconstruye produccion_mensual_agg y la cobranza
+            (api/deudor_prima.py) para los años recalculados (el modo paralelo
+            las refresca completas al final).
+
+    Returns:
+        Número de pólizas actualizadas.
+    """
+    params = dict(params or {})
+    _crear_staging(db)
+
+    calculadas = 0
+    ultimo_id = 0
+    anios = set()
+    while True:
+        res = db.execute(text(f"""
+            SELECT p.*, pr.ramo_codigo, pr.ramo_nombre
+            FROM polizas p
+            LEFT JOIN productos pr ON p.producto_id = pr.id
+            WHERE ({where}) AND p.id > :ultimo_id
+            ORDER BY p.id
+            LIMIT :limite
+        """), {**params, "ultimo_id": ultimo_id, "limite": chunk_size})
+        polizas = pd.DataFrame(res.fetchall(), columns=list(res.keys()))
+        if polizas.empty:
+            break
+        _cargar_bloque(db, polizas)
+        anios.update(polizas["anio_aplicacion"].dropna().tolist())
+        calculadas += len(polizas)
+        ultimo_id = int(polizas["id"].iloc[-1])
+        if progreso:
+            progreso(calculadas)
+
+    actualizadas = 0
+    if calculadas:
+        columnas = list(COLUMNAS_REGLAS)
+        if contar_reexpediciones:
+            _contar_reexpediciones(db)
+            columnas.append("num_reexpediciones")
+        if incluir_tipo:
+            columnas.append("tipo_poliza")
+        actualizadas = _aplicar_staging(db, datetime.now().isoformat(), columnas)
+    db.execute(text(f"DROP TABLE {STAGING}"))
+    if actualizadas and refrescar_agregados:
+        refrescar_produccion(db, anios)
+        refrescar_cobranza(db, anios=anios)
+        invalidar(db)
+    return actualizadas
+
+
+# ══════════════════════════════════════════════════════════════════
+# MODO PARALELO POR SHARDS (reprocesamiento completo)
+# ══════════════════════════════════════════════════════════════════
+
+_sesion_proceso = None      # sessionmaker propio de cada proceso del pool
+
+
+def _inicializar_proceso(url: str) -> None:
+    """Cada proceso abre su propio engine (las conexiones no se comparten entre procesos)."""
+    global _sesion_proceso
+    _sesion_proceso = sessionmaker(autocommit=False, autoflush=False, bind=create_engine(url))
+
+
+def _procesar_shard(session_factory, shard_id: int, id_desde: int, id_hasta: int,
+                    incluir_tipo: bool) -> tuple:
+    """Recalcula un shard y marca su checkpoint en la misma transacción."""
+    inicio = time.time()
+    db = session_factory()
+    try:
+        filas = recalcular_reglas(
+            db, "p.id BETWEEN :id_desde AND :id_hasta",
+            {"id_desde": id_desde, "id_hasta": id_hasta},
+            incluir_tipo=incluir_tipo, contar_reexpediciones=False,
+            refrescar_agregados=False,
+        )
+        db.execute(text("""
+            UPDATE recalculo_shards
+            SET estado = 'ok', filas = :filas, duracion_segundos = :dur, updated_at = :ahora
+            WHERE id = :id
+        """), {"filas": filas, "dur": round(time.time() - inicio, 2),
+               "ahora": datetime.now().isoformat(), "id": shard_id})
+        db.commit()
+        return shard_id, filas
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _shard_en_proceso(shard_id: int, id_desde: int, id_hasta: int, incluir_tipo: bool) -> tuple:
+    return _procesar_shard(_sesion_proceso, shard_id, id_desde, id_hasta, incluir_tipo)
+
+
+def _version_reglas(incluir_tipo: bool) -> str:
+    """Huella del motor de reglas (código de api/rules.py y de este módulo) y de incluir_tipo."""
+    h = hashlib.sha1()
+    for modulo in (rules.__file__, __file__):
+        with open(modulo, "rb") as f:
+            h.update(f.read())
+    h.update(b"tipo" if incluir_tipo else b"")
+    return h.hexdigest()[:20]
+
+
+def _agregar_shards(db: Session, corrida: str, version: str, shard_size: int) -> int:
+    """
+    Registra shards para los ids de polizas posteriores al último shard de la
+    corrida (todos, si aún no tiene). Retorna cuántos agregó.
+    """
+    ultimo = db.execute(text(
+        "SELECT MAX(id_hasta) FROM recalculo_shards WHERE corrida = :corrida"
+    ), {"corrida": corrida}).scalar()
+    minimo, maximo = db.execute(text(
+        "SELECT MIN(id), MAX(id) FROM polizas WHERE id > :ultimo"
+    ), {"ultimo": ultimo if ultimo is not None else -1}).one()
+    if minimo is None:
+        return 0
+    nuevos = [
+        RecalculoShard(corrida=corrida, version_reglas=version, id_desde=desde,
+                       id_hasta=min(desde + shard_size - 1, maximo))
+        for desde in range(minimo, maximo + 1, shard_size)
+    ]
+    db.add_all(nuevos)
+    db.commit()
+    return len(nuevos)
+
+
+def _corrida_pendiente(db: Session, version: str) -> Optional[str]:
+    """
+    Última corrida con shards pendientes que se puede retomar: planificada por
+    la misma versión de reglas hace menos de REANUDAR_HORAS (None si no hay).
+    """
+    limite = (datetime.now() - timedelta(hours=REANUDAR_HORAS)).isoformat()
+    return db.execute(text("""
+        SELECT corrida FROM recalculo_shards
+        WHERE estado = 'pendiente' AND version_reglas = :version AND corrida >= :limite
+        ORDER BY id DESC LIMIT 1
+    """), {"version": version, "limite": limite}).scalar()
+
+
+def _expirar_corridas(db: Session, vigente: Optional[str]) -> int:
+    """Marca como expirados los shards pendientes de corridas distintas a `vigente`."""
+    expirados = db.execute(text("""
+        UPDATE recalculo_shards SET estado = 'expirado', updated_at = :ahora
+        WHERE estado = 'pendiente' AND corrida <> :vigente
+    """), {"ahora": datetime.now().isoformat(), "vigente": vigente or ""}).rowcount
+    db.commit()
+    return expirados
+
+
+def _reducir_reexpediciones(db: Session) -> int:
+    """BF sobre toda la tabla: COUNTIF(raiz_poliza_6) con las raíces ya persistidas por los shards."""
+    sin_raiz = db.execute(text("""
+        UPDATE polizas SET num_reexpediciones = 0
+        WHERE (raiz_poliza_6 IS NULL OR raiz_poliza_6 = '')
+          AND COALESCE(num_reexpediciones, -1) <> 0
+    """)).rowcount
+    con_raiz = db.execute(text("""
+        UPDATE polizas SET num_reexpediciones = c.n
+        FROM (
+            SELECT raiz_poliza_6, COUNT(*) AS n FROM polizas
+            WHERE raiz_poliza_6 IS NOT NULL AND raiz_poliza_6 <> ''
+            GROUP BY raiz_poliza_6
+        ) c
+        WHERE polizas.raiz_poliza_6 = c.raiz_poliza_6
+          AND COALESCE(polizas.num_reexpediciones, -1) <> c.n
+    """)).rowcount
+    return sin_raiz + con_raiz
+
+
+def _ejecutar_shards(session_factory, url, procesos: int, pendientes: list, incluir_tipo: bool,
+                     hechos: int, total: int, progreso) -> int:
+    """Corre los shards pendientes (en línea o en el pool). Retorna las filas actualizadas."""
+    actualizadas = 0
+    # SQLite no admite escrituras concurrentes: los shards corren en línea
+    if procesos <= 1 or url.get_backend_name() == "sqlite" or len(pendientes) <= 1:
+        for shard in pendientes:
+            _, filas = _procesar_shard(session_factory, *shard, incluir_tipo)
+            actualizadas += filas
+            hechos += 1
+            if progreso:
+                progreso(hechos, total, filas)
+    else:
+        with ProcessPoolExecutor(max_workers=min(procesos, len(pendientes)),
+                                 initializer=_inicializar_proceso,
+                                 initargs=(url.render_as_string(hide_password=False),)) as pool:
+            futuros = [pool.submit(_shard_en_proceso, *shard, incluir_tipo) for shard in pendientes]
+            for futuro in as_completed(futuros):
+                _, filas = futuro.result()
+                actualizadas += filas
+                hechos += 1
+                if progreso:
+                    progreso(hechos, total, filas)
+    return actualizadas
+
+
+def recalcular_reglas_paralelo(session_factory=SessionLocal, procesos: int = None,
+                               shard_size: int = SHARD_SIZE, incluir_tipo: bool = False,
+                               reanudar: bool = False,
+                               progreso: Optional[Callable[[int, int, int], None]] = None) -> dict:
+    """
+    Recalcula las reglas de toda la tabla polizas en paralelo por shards de id.
+
+    Cada shard se confirma con su checkpoint. Con reanudar=True se retoman los
+    shards pendientes de la última corrida interrumpida, si tiene menos de
+    REANUDAR_HORAS y la planificó la misma versión de reglas; las demás
+    corridas pendientes se expiran y se planifica una nueva. Antes de terminar
+    se agregan shards para las pólizas insertadas después del plan. Con
+    procesos=1 o sobre SQLite los shards corren en línea con `session_factory`.
+
+    Args:
+        procesos: procesos del pool (default: todos los vCPU).
+        progreso: callback (shards_terminados, shards_totales, filas_del_shard).
+
+    Returns:
+        {"corrida", "shards", "reanudados", "actualizadas", "reexpediciones",
+         "polizas", "duracion_segundos"}
+    """
+    inicio = time.time()
+    procesos = procesos or os.cpu_count() or 1
+    version = _version_reglas(incluir_tipo)
+    db = session_factory()
+    try:
+        corrida = _corrida_pendiente(db, version) if reanudar else None
+        _expirar_corridas(db, corrida)
+        if corrida is None:
+            corrida = datetime.now().isoformat()
+        url = db.get_bind().url
+    finally:
+        db.close()
+
+    reanudados = None
+    actualizadas = 0
+    while True:
+        # Cada vuelta cubre las pólizas insertadas mientras corría la anterior
+        db = session_factory()
+        try:
+            _agregar_shards(db, corrida, version, shard_size)
+            shards = db.query(RecalculoShard).filter_by(corrida=corrida).order_by(RecalculoShard.id_desde).all()
+            pendientes = [(s.id, s.id_desde, s.id_hasta) for s in shards if s.estado != "ok"]
+        finally:
+            db.close()
+        total = len(shards)
+        if reanudados is None:
+            reanudados = total - len(pendientes)
+        if not pendientes:
+            break
+        actualizadas += _ejecutar_shards(session_factory, url, procesos, pendientes, incluir_tipo,
+                                         total - len(pendientes), total, progreso)
+
+    db = session_factory()
+    try:
+        reexpediciones = _reducir_reexpediciones(db)
+        refrescar_produccion(db)
+        refrescar_cobranza(db)
+        invalidar(db)
+        db.commit()
+        polizas = db.execute(text("SELECT COUNT(*) FROM polizas")).scalar()
+    finally:
+        db.close()
+
+    return {
+        "corrida": corrida,
+        "shards": total,
+        "reanudados": reanudados,
+        "actualizadas": actualizadas,
+        "reexpediciones": reexpediciones,
+        "polizas": polizas,
+        "duracion_segundos": round(time.time() - inicio, 2),
+    }
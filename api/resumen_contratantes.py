@@ -0,0 +1,52 @@
+"""
+Rollup por contratante (num_polizas, prima_total)
+=================================================
+GET /contratantes mostraba por fila el número de pólizas y la prima total con
+un GROUP BY de todos los contratantes contra polizas en cada página.
+`contratantes_resumen` guarda esos totales precalculados; el listado pagina
+sobre contratantes y solo lee la fila del rollup de cada contratante.
+
+El rollup se recalcula completo (un solo INSERT ... SELECT) cuando la versión
+de los datos (version_datos, ver api/cache_respuestas.py) cambió después del
+último cálculo: importadores, recálculos y endpoints de escritura ya la suben.
+La reconstrucción se serializa con bloquear_reconstruccion: dos GET que la
+encuentran vencida a la vez no insertan dos veces la misma llave.
+"""
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cache_respuestas import bloquear_reconstruccion, version_datos
+
+TABLA = "contratantes_resumen"
+
+
+def refrescar_resumen(db: Session) -> int:
+    """Recalcula el rollup de todos los contratantes. No hace commit. Retorna las filas escritas."""
+    db.execute(text(f"DELETE FROM {TABLA}"))
+    return db.execute(text(f"""
+        INSERT INTO {TABLA} (contratante_id, num_polizas, prima_total, version)
+        SELECT c.id, COUNT(p.id), COALESCE(SUM(p.prima_neta), 0), :version
+        FROM contratantes c
+        LEFT JOIN polizas p ON p.contratante_id = c.id
+        GROUP BY c.id
+    """), {"version": version_datos(db)}).rowcount
+
+
+def resumen_vigente(db: Session) -> bool:
+    """True si el rollup se calculó con la versión actual de los datos."""
+    calculado = db.execute(text(f"SELECT MIN(version) FROM {TABLA}")).scalar()
+    return calculado is not None and calculado >= version_datos(db)
+
+
+def asegurar_resumen(db: Session) -> bool:
+    """Recalcula y confirma el rollup si está desactualizado. Retorna True si lo recalculó."""
+    if resumen_vigente(db):
+        return False
+    bloquear_reconstruccion(db, TABLA)
+    # Otro request pudo recalcularlo mientras se esperaba el lock
+    if resumen_vigente(db):
+        db.commit()
+        return False
+    refrescar_resumen(db)
+    db.commit()
+    return True
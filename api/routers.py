@@ -1,13 +1,13 @@
 """
 Routers FastAPI para MAG Sistema
 """
-from fastapi import APIRouter, Depends, Query, HTTPException, UploadFile, File, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Query, HTTPException, UploadFile, File, BackgroundTasks, Request
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func, case
 from typing import Optional, List
 import pandas as pd
-import io, os, re, subprocess, sys
+import io, os, re, tempfile
 from collections import defaultdict
 
 from .database import (
@@ -27,6 +27,8 @@ from .schemas import (
     ProduccionMensualComparativo,
     CobranzaResponse, CobranzaResumen, DeudorPrima, RenovacionPendiente,
     PolizaCancelada, AlertaCobranza, SeguimientoMensual,
+    CobranzaResumenResponse, DeudoresPagina, RenovacionesPagina, CanceladasPagina,
+    TrabajoExportacionCreate, TrabajoExportacionOut,
     FinanzasResponse, ResumenFinanciero, IngresoEgresoMensual,
     ProyeccionCierre, PresupuestoMensualComp, TendenciaAnual,
     ContratanteOut, ContratanteCreate,
@@ -38,9 +40,29 @@ from .schemas import (
     CrecimientoDetalle, BonoDetalle,
 )
 from .rules import (
-    normalizar_poliza, calcular_mystatus, es_reexpedicion, agrupar_segmento,
-    clasificar_cy, aplicar_reglas_poliza, aplicar_reglas_batch
+    normalizar_poliza, clave_cruce, calcular_mystatus, es_reexpedicion, agrupar_segmento,
+    clasificar_cy
 )
+from .importar_polizas import leer_csv as leer_csv_polizas, importar_polizas_df
+from .importar_pagos import spool_a_temporal, importar_pagtotal_archivo
+from .recalculo_reglas import recalcular_reglas
+from .produccion_agg import SQL_ES_NUEVA, SQL_ES_SUBSECUENTE, filas_produccion, refrescar_produccion
+from .ejecutivo import acumular, consultar as consultar_ejecutivo
+from .cache_respuestas import cacheado, invalidar
+from .conciliacion import asegurar_conciliacion, leer_conciliacion
+from .fechas_nativas import fecha_nativa, leer_fecha, sql_rango_fecha
+from .paginacion import (
+    leer_cursor, crear_cursor, sql_keyset, contar, leer_cursor_orden, crear_cursor_orden, sql_keyset_orden
+)
+from .resumen_contratantes import asegurar_resumen
+from .busqueda import busqueda_de, filtro_busqueda, buscar, asegurar_busqueda, CAMPOS_BUSQUEDA
+from .exportacion import (
+    COLUMNAS_POLIZAS, SPOOL_MAX, consulta_polizas, respuesta_exportacion, respuesta_archivo,
+    validar_formato, escribir_icp_2026, FORMATOS
+)
+from . import trabajos_exportacion
+from .documentos import servir_pdf, olvidar_url_base
+from .deudor_prima import asegurar_cobranza, refrescar_cobranza, PRIORIDADES, ORDEN_PRIORIDAD
 from .rules_icp_2026 import (
     generar_resumen_icp_2026, clasificar_tamano_cartera, calcular_pct_crecimiento,
     obtener_detalle_recluta_2026, obtener_detalle_alfa_2026
@@ -52,9 +74,8 @@ from .rules_icp_2026 import (
 # HELPER: Detección de póliza NUEVA vs SUBSECUENTE
 # ═══════════════════════════════════════════════════════════════════
 # flag_nueva_formal (reglas de negocio) tiene prioridad sobre tipo_poliza (dato crudo de importación)
-# SQL: usar estas expresiones en CASE WHEN para filtrar nueva/subsecuente
-SQL_ES_NUEVA = "(p.flag_nueva_formal=1 OR (p.flag_nueva_formal IS NULL AND p.tipo_poliza='NUEVA'))"
-SQL_ES_SUBSECUENTE = "(p.flag_nueva_formal=0 OR (p.flag_nueva_formal IS NULL AND p.tipo_poliza='SUBSECUENTE'))"
+# SQL: SQL_ES_NUEVA / SQL_ES_SUBSECUENTE (api/produccion_agg.py) en CASE WHEN sobre polizas p;
+# en produccion_mensual_agg la clasificación ya viene resuelta en la columna `tipo`
 
 
 def _es_nueva(p) -> bool:
@@ -64,13 +85,6 @@ def _es_nueva(p) -> bool:
     return p.get("tipo_poliza") == "NUEVA"
 
 
-def _es_subsecuente(p) -> bool:
-    """Determina si una póliza es SUBSECUENTE. flag_nueva_formal tiene prioridad."""
-    if p.get("flag_nueva_formal") is not None:
-        return p["flag_nueva_formal"] == 0
-    return p.get("tipo_poliza") == "SUBSECUENTE"
-
-
 # ═══════════════════════════════════════════════════════════════════
 # HELPER: Auto-cálculo de Metas (15% sobre año anterior + recovery)
 # ═══════════════════════════════════════════════════════════════════
@@ -101,20 +115,17 @@ def calcular_metas_auto(db: Session, anio: int):
     anio_ant = anio - 1
     anio_2yr = anio - 2
 
-    # Traer producción de los 2 años anteriores
+    # Traer producción de los 2 años anteriores (tabla pre-agregada)
     rows = db.execute(text("""
-        SELECT pr.ramo_codigo, p.anio_aplicacion as anio_prod,
-               CAST(SUBSTR(p.periodo_aplicacion, 6, 2) AS INTEGER) as mes,
-               COUNT(CASE WHEN """ + SQL_ES_NUEVA + """ THEN 1 END) as polizas_nuevas,
-               SUM(COALESCE(p.equivalencias_emitidas, 0)) as equivalencias,
-               SUM(COALESCE(p.num_asegurados, 1)) as asegurados,
-               SUM(COALESCE(p.prima_neta, 0)) as prima_total
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE p.anio_aplicacion IN (:anio_ant, :anio_2yr)
-          AND p.periodo_aplicacion IS NOT NULL
-        GROUP BY pr.ramo_codigo, p.anio_aplicacion,
-                 CAST(SUBSTR(p.periodo_aplicacion, 6, 2) AS INTEGER)
+        SELECT f.ramo_codigo, f.anio as anio_prod, f.mes,
+               SUM(CASE WHEN f.tipo = 'NUEVA' THEN f.polizas ELSE 0 END) as polizas_nuevas,
+               SUM(f.equivalencias) as equivalencias,
+               SUM(f.asegurados) as asegurados,
+               SUM(f.prima_neta) as prima_total
+        FROM produccion_mensual_agg f
+        WHERE f.anio IN (:anio_ant, :anio_2yr)
+          AND f.periodo IS NOT NULL
+        GROUP BY f.ramo_codigo, f.anio, f.mes
     """), {"anio_ant": anio_ant, "anio_2yr": anio_2yr}).mappings().all()
 
     # Organizar por ramo/mes/año
@@ -203,13 +214,18 @@ _oracle_sync_status = {
     "last_message": None,
     "last_duration_seconds": None,
     "details": [],
+    "etapas": {},          # Métricas por etapa: filas, duración, filas/s, memoria
 }
 
 
 @router_dashboard.post("/sync-oracle", response_model=ImportacionResult)
-async def sync_oracle(background_tasks: BackgroundTasks):
+async def sync_oracle(
+    background_tasks: BackgroundTasks,
+    completo: bool = Query(False, description="Re-extraer todo en lugar del delta desde la última marca"),
+):
     """
-    Inicia el pipeline de sincronización completa con Oracle en segundo plano.
+    Inicia el pipeline de sincronización con Oracle en segundo plano.
+    Por defecto es incremental: cada fuente solo trae lo nuevo desde su marca de agua.
     """
     if _oracle_sync_status["running"]:
         return {
@@ -219,42 +235,36 @@ async def sync_oracle(background_tasks: BackgroundTasks):
 
     def run_oracle_pipeline():
         import time
+        from .pipeline_oracle import ejecutar_pipeline
         _oracle_sync_status["running"] = True
         _oracle_sync_status["last_run"] = _dt.now().isoformat()
         _oracle_sync_status["details"] = []
         start = time.time()
 
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        script_path = os.path.join(base_dir, "scripts", "importar_todo_oracle.py")
-
         try:
-            result = subprocess.run(
-                [sys.executable, script_path],
-                capture_output=True, text=True, timeout=600
-            )
+            # En proceso: etapas en paralelo según dependencias, métricas en "etapas"
+            ejecutar_pipeline(completo=completo, estado=_oracle_sync_status)
             duration = round(time.time() - start, 1)
             _oracle_sync_status["last_duration_seconds"] = duration
 
-            # Capturar las últimas líneas de salida
-            stdout_lines = (result.stdout or "").strip().split("\n")[-20:]
-            stderr_lines = (result.stderr or "").strip().split("\n")[-10:]
-            _oracle_sync_status["details"] = stdout_lines
+            etapas = _oracle_sync_status["etapas"]
+            _oracle_sync_status["details"] = [
+                f"{nombre}: {m['estado']}, {m.get('filas', 0):,} filas en {m.get('duracion_segundos', 0)}s"
+                + (f" — {m['error']}" if m.get("error") else "")
+                for nombre, m in etapas.items()
+            ]
+            fallidas = [n for n, m in etapas.items() if m["estado"] == "error"]
 
-            if result.returncode == 0:
+            if not fallidas:
                 _oracle_sync_status["last_status"] = "success"
                 _oracle_sync_status["last_message"] = f"Pipeline completado en {duration}s"
                 logger.info(f"[ORACLE SYNC] Éxito en {duration}s")
             else:
                 _oracle_sync_status["last_status"] = "error"
-                error_msg = stderr_lines[-1] if stderr_lines else "Error desconocido"
-                _oracle_sync_status["last_message"] = f"Error: {error_msg}"
+                error_msg = etapas[fallidas[0]]["error"]
+                _oracle_sync_status["last_message"] = f"Error en {fallidas[0]}: {error_msg}"
                 logger.error(f"[ORACLE SYNC] Falló en {duration}s: {error_msg}")
-                _oracle_sync_status["details"].extend(stderr_lines)
 
-        except subprocess.TimeoutExpired:
-            _oracle_sync_status["last_status"] = "error"
-            _oracle_sync_status["last_message"] = "Timeout: el proceso tardó más de 10 minutos"
-            logger.error("[ORACLE SYNC] Timeout después de 600s")
         except Exception as e:
             _oracle_sync_status["last_status"] = "error"
             _oracle_sync_status["last_message"] = f"Excepción: {str(e)}"
@@ -271,7 +281,7 @@ async def sync_oracle(background_tasks: BackgroundTasks):
 
 @router_dashboard.get("/sync-oracle/status")
 async def sync_oracle_status():
-    """Retorna el estatus de la última sincronización con Oracle."""
+    """Retorna el estatus de la última sincronización con Oracle (incluye métricas por etapa)."""
     return _oracle_sync_status
 
 
@@ -280,7 +290,7 @@ async def sync_oracle_status():
 @router_dashboard.get("/ping-oracle")
 async def ping_oracle():
     """Prueba rápida de conexión a Oracle."""
-    from .oracle_client import get_oracle_connection, ORACLE_USER, ORACLE_DSN
+    from .oracle_client import get_oracle_connection, estado_pool, ORACLE_USER, ORACLE_DSN
     import os
     
     env_status = {
@@ -299,7 +309,8 @@ async def ping_oracle():
             "success": True, 
             "oracle_time": str(res[0]), 
             "env_status": env_status,
-            "mensaje": "Conexión exitosa a Oracle (Thick Mode)"
+            "pool": estado_pool(),
+            "mensaje": "Conexión exitosa a Oracle"
         }
     except Exception as e:
         return {
@@ -310,7 +321,71 @@ async def ping_oracle():
         }
 
 
+def _kpis_por_anio(db: Session, anios: list) -> dict:
+    """
+    Medidas de KPI por año en un solo round trip sobre produccion_mensual_agg.
+    Retorna {anio: {(ramo_codigo, tipo): {"polizas", "asegurados", "equivalencias", "prima"},
+                    "total", "canceladas", "ultimo_mes"}}; las combinaciones sin datos valen 0.
+    """
+    params = {f"anio_{i}": a for i, a in enumerate(anios)}
+    filas = db.execute(text(f"""
+        SELECT f.anio, f.ramo_codigo, f.tipo,
+               SUM(f.polizas) as polizas, SUM(f.asegurados) as asegurados,
+               SUM(f.equivalencias) as equivalencias, SUM(f.prima_neta) as prima,
+               SUM(f.canceladas) as canceladas,
+               MAX(CASE WHEN f.periodo IS NOT NULL THEN f.mes END) as ultimo_mes
+        FROM produccion_mensual_agg f
+        WHERE f.anio IN ({", ".join(":" + k for k in params)})
+        GROUP BY f.anio, f.ramo_codigo, f.tipo
+    """), params).mappings().all()
+
+    def vacio():
+        return {"polizas": 0, "asegurados": 0, "equivalencias": 0.0, "prima": 0.0}
+
+    kpis = {a: defaultdict(vacio, total=0, canceladas=0, ultimo_mes=None) for a in anios}
+    for r in filas:
+        k = kpis[r["anio"]]
+        k[r["ramo_codigo"], r["tipo"]] = {
+            "polizas": r["polizas"] or 0, "asegurados": r["asegurados"] or 0,
+            "equivalencias": r["equivalencias"] or 0.0, "prima": r["prima"] or 0.0,
+        }
+        k["total"] += r["polizas"] or 0
+        k["canceladas"] += r["canceladas"] or 0
+        if r["ultimo_mes"] and (k["ultimo_mes"] is None or r["ultimo_mes"] > k["ultimo_mes"]):
+            k["ultimo_mes"] = r["ultimo_mes"]
+    return kpis
+
+
+def _produccion_mensual(db: Session, anio: int) -> list:
+    """Pólizas y prima nueva por periodo y ramo (VIDA / GMM / AUTOS) desde la tabla pre-agregada."""
+    filas = db.execute(text("""
+        SELECT f.periodo,
+               SUM(CASE WHEN f.tipo = 'NUEVA' AND f.ramo_codigo=11 THEN f.polizas ELSE 0 END) as polizas_vida,
+               SUM(CASE WHEN f.tipo = 'NUEVA' AND f.ramo_codigo=34 THEN f.polizas ELSE 0 END) as polizas_gmm,
+               SUM(CASE WHEN f.tipo = 'NUEVA' AND f.ramo_codigo=90 THEN f.polizas ELSE 0 END) as polizas_autos,
+               SUM(CASE WHEN f.tipo = 'NUEVA' AND f.ramo_codigo=11 THEN f.prima_neta ELSE 0 END) as prima_vida,
+               SUM(CASE WHEN f.tipo = 'NUEVA' AND f.ramo_codigo=34 THEN f.prima_neta ELSE 0 END) as prima_gmm,
+               SUM(CASE WHEN f.tipo = 'NUEVA' AND f.ramo_codigo=90 THEN f.prima_neta ELSE 0 END) as prima_autos
+        FROM produccion_mensual_agg f
+        WHERE f.anio = :anio
+        GROUP BY f.periodo
+        ORDER BY f.periodo
+    """), {"anio": anio}).mappings().all()
+    return [
+        ProduccionMensual(
+            periodo=r["periodo"] or "",
+            polizas_vida=r["polizas_vida"] or 0,
+            polizas_gmm=r["polizas_gmm"] or 0,
+            polizas_autos=r["polizas_autos"] or 0,
+            prima_vida=round(r["prima_vida"] or 0, 2),
+            prima_gmm=round(r["prima_gmm"] or 0, 2),
+            prima_autos=round(r["prima_autos"] or 0, 2),
+        ) for r in filas
+    ]
+
+
 @router_dashboard.get("", response_model=DashboardResponse)
+@cacheado("dashboard")
 def get_dashboard(
     anio: int = Query(2025, description="Año de análisis"),
     db: Session = Depends(get_db)
@@ -318,37 +393,9 @@ def get_dashboard(
     """KPIs principales, producción mensual, top agentes y distribución por gama."""
     anio_ant = anio - 1
 
-    # ── Consulta base (año actual + anterior) ──
-    polizas_all = db.execute(text("""
-        SELECT p.*, pr.ramo_codigo, pr.ramo_nombre, pr.plan,
-               a.nombre_completo as agente_nombre, a.codigo_agente,
-               a.oficina, a.gerencia, a.territorio,
-               a.segmento_nombre, a.segmento_agrupado
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion IN (:anio, :anio_ant)
-    """), {"anio": anio, "anio_ant": anio_ant}).mappings().all()
-
-    polizas = [p for p in polizas_all if p["anio_aplicacion"] == anio]
-    pol_ant = [p for p in polizas_all if p["anio_aplicacion"] == anio_ant]
-
-    # ── KPIs (año actual) ──
-    nuevas_vida  = [p for p in polizas if p["ramo_codigo"]==11 and _es_nueva(p)]
-    nuevas_gmm   = [p for p in polizas if p["ramo_codigo"]==34 and _es_nueva(p)]
-    nuevas_autos = [p for p in polizas if p["ramo_codigo"]==90 and _es_nueva(p)]
-    subs_vida    = [p for p in polizas if p["ramo_codigo"]==11 and _es_subsecuente(p)]
-    subs_gmm     = [p for p in polizas if p["ramo_codigo"]==34 and _es_subsecuente(p)]
-    subs_autos   = [p for p in polizas if p["ramo_codigo"]==90 and _es_subsecuente(p)]
-    canceladas   = [p for p in polizas if p["status_recibo"] not in ("PAGADA", "AL CORRIENTE", None)]
-
-    # KPIs año anterior
-    ant_nuevas_vida = [p for p in pol_ant if p["ramo_codigo"]==11 and _es_nueva(p)]
-    ant_nuevas_gmm  = [p for p in pol_ant if p["ramo_codigo"]==34 and _es_nueva(p)]
-    ant_nuevas_autos = [p for p in pol_ant if p["ramo_codigo"]==90 and _es_nueva(p)]
-    ant_subs_vida   = [p for p in pol_ant if p["ramo_codigo"]==11 and _es_subsecuente(p)]
-    ant_subs_gmm    = [p for p in pol_ant if p["ramo_codigo"]==34 and _es_subsecuente(p)]
-    ant_subs_autos  = [p for p in pol_ant if p["ramo_codigo"]==90 and _es_subsecuente(p)]
+    # ── KPIs de ambos años en una sola consulta agregada ──
+    kp = _kpis_por_anio(db, [anio, anio_ant])
+    act, ant = kp[anio], kp[anio_ant]
 
     meta = db.execute(text("SELECT * FROM metas WHERE anio=:a AND periodo IS NULL"), {"a": anio}).mappings().first()
 
@@ -357,9 +404,9 @@ def get_dashboard(
     if not meta:
         metas_auto = calcular_metas_auto(db, anio)
 
-    prima_nueva_vida_val = sum(p["prima_neta"] or 0 for p in nuevas_vida)
-    prima_sub_vida_val   = sum(p["prima_neta"] or 0 for p in subs_vida)
-    equiv_vida_val       = sum(p["equivalencias_emitidas"] or 0 for p in nuevas_vida)
+    prima_nueva_vida_val = act[11, "NUEVA"]["prima"]
+    prima_sub_vida_val   = act[11, "SUBSECUENTE"]["prima"]
+    equiv_vida_val       = act[11, "NUEVA"]["equivalencias"]
 
     # Metas: manual si existe, auto-calculado si no
     if meta:
@@ -376,29 +423,26 @@ def get_dashboard(
         mpg = round(gmm_anual.get("prima", 0), 2)
 
     # Pro-rata para metas (Slide 3)
-    # Buscamos el último mes con producción en el año actual
-    ultimo_mes = db.execute(text("""
-        SELECT MAX(CAST(SUBSTR(periodo_aplicacion, 6, 2) AS INTEGER))
-        FROM polizas WHERE anio_aplicacion = :anio AND periodo_aplicacion IS NOT NULL
-    """), {"anio": anio}).scalar() or datetime.now().month
+    # Último mes con producción en el año actual
+    ultimo_mes = act["ultimo_mes"] or _dt.now().month
 
     factor_pro = min(ultimo_mes, 12) / 12.0
 
     kpis = KPIs(
-        polizas_nuevas_vida   = len(nuevas_vida),
+        polizas_nuevas_vida   = act[11, "NUEVA"]["polizas"],
         equivalencias_vida    = round(equiv_vida_val, 1),
         prima_nueva_vida      = prima_nueva_vida_val,
         prima_total_nueva_vida= prima_nueva_vida_val + prima_sub_vida_val,
-        polizas_nuevas_gmm    = len(nuevas_gmm),
-        asegurados_nuevos_gmm = sum(p["num_asegurados"] or 1 for p in nuevas_gmm),
-        prima_nueva_gmm       = sum(p["prima_neta"] or 0 for p in nuevas_gmm),
-        polizas_nuevas_autos  = len(nuevas_autos),
-        prima_nueva_autos     = sum(p["prima_neta"] or 0 for p in nuevas_autos),
+        polizas_nuevas_gmm    = act[34, "NUEVA"]["polizas"],
+        asegurados_nuevos_gmm = act[34, "NUEVA"]["asegurados"],
+        prima_nueva_gmm       = act[34, "NUEVA"]["prima"],
+        polizas_nuevas_autos  = act[90, "NUEVA"]["polizas"],
+        prima_nueva_autos     = act[90, "NUEVA"]["prima"],
         prima_subsecuente_vida= prima_sub_vida_val,
-        prima_subsecuente_gmm = sum(p["prima_neta"] or 0 for p in subs_gmm),
-        prima_subsecuente_autos= sum(p["prima_neta"] or 0 for p in subs_autos),
-        polizas_canceladas    = len(canceladas),
-        total_polizas         = len(polizas),
+        prima_subsecuente_gmm = act[34, "SUBSECUENTE"]["prima"],
+        prima_subsecuente_autos= act[90, "SUBSECUENTE"]["prima"],
+        polizas_canceladas    = act["canceladas"],
+        total_polizas         = act["total"],
         meta_vida             = mv,
         meta_gmm              = mg,
         meta_prima_vida       = mpv,
@@ -409,88 +453,36 @@ def get_dashboard(
         meta_prima_vida_pro   = round(mpv * factor_pro, 2),
         meta_prima_gmm_pro    = round(mpg * factor_pro, 2),
         # Año anterior
-        polizas_vida_ant      = len(ant_nuevas_vida),
-        equivalencias_vida_ant= round(sum(p["equivalencias_emitidas"] or 0 for p in ant_nuevas_vida), 1),
-        prima_nueva_vida_ant  = sum(p["prima_neta"] or 0 for p in ant_nuevas_vida),
-        prima_total_nueva_vida_ant = sum(p["prima_neta"] or 0 for p in ant_nuevas_vida) + sum(p["prima_neta"] or 0 for p in ant_subs_vida),
-        polizas_gmm_ant       = len(ant_nuevas_gmm),
-        asegurados_gmm_ant    = sum(p["num_asegurados"] or 1 for p in ant_nuevas_gmm),
-        prima_nueva_gmm_ant   = sum(p["prima_neta"] or 0 for p in ant_nuevas_gmm),
-        prima_subsecuente_vida_ant = sum(p["prima_neta"] or 0 for p in ant_subs_vida),
-        prima_subsecuente_gmm_ant  = sum(p["prima_neta"] or 0 for p in ant_subs_gmm),
-        polizas_autos_ant     = len(ant_nuevas_autos),
-        prima_nueva_autos_ant = sum(p["prima_neta"] or 0 for p in ant_nuevas_autos),
-        prima_subsecuente_autos_ant = sum(p["prima_neta"] or 0 for p in ant_subs_autos),
+        polizas_vida_ant      = ant[11, "NUEVA"]["polizas"],
+        equivalencias_vida_ant= round(ant[11, "NUEVA"]["equivalencias"], 1),
+        prima_nueva_vida_ant  = ant[11, "NUEVA"]["prima"],
+        prima_total_nueva_vida_ant = ant[11, "NUEVA"]["prima"] + ant[11, "SUBSECUENTE"]["prima"],
+        polizas_gmm_ant       = ant[34, "NUEVA"]["polizas"],
+        asegurados_gmm_ant    = ant[34, "NUEVA"]["asegurados"],
+        prima_nueva_gmm_ant   = ant[34, "NUEVA"]["prima"],
+        prima_subsecuente_vida_ant = ant[11, "SUBSECUENTE"]["prima"],
+        prima_subsecuente_gmm_ant  = ant[34, "SUBSECUENTE"]["prima"],
+        polizas_autos_ant     = ant[90, "NUEVA"]["polizas"],
+        prima_nueva_autos_ant = ant[90, "NUEVA"]["prima"],
+        prima_subsecuente_autos_ant = ant[90, "SUBSECUENTE"]["prima"],
     )
 
-    # ── Producción mensual ──
-    mensual_raw = db.execute(text("""
-        SELECT p.periodo_aplicacion as periodo,
-               SUM(CASE WHEN pr.ramo_codigo=11 AND """ + SQL_ES_NUEVA + """ THEN 1 ELSE 0 END) as polizas_vida,
-               SUM(CASE WHEN pr.ramo_codigo=34 AND """ + SQL_ES_NUEVA + """ THEN 1 ELSE 0 END) as polizas_gmm,
-               SUM(CASE WHEN pr.ramo_codigo=90 AND """ + SQL_ES_NUEVA + """ THEN 1 ELSE 0 END) as polizas_autos,
-               SUM(CASE WHEN pr.ramo_codigo=11 AND """ + SQL_ES_NUEVA + """ THEN p.prima_neta ELSE 0 END) as prima_vida,
-               SUM(CASE WHEN pr.ramo_codigo=34 AND """ + SQL_ES_NUEVA + """ THEN p.prima_neta ELSE 0 END) as prima_gmm,
-               SUM(CASE WHEN pr.ramo_codigo=90 AND """ + SQL_ES_NUEVA + """ THEN p.prima_neta ELSE 0 END) as prima_autos
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE p.anio_aplicacion = :anio
-        GROUP BY p.periodo_aplicacion
-        ORDER BY p.periodo_aplicacion
-    """), {"anio": anio}).mappings().all()
-
-    produccion_mensual = [
-        ProduccionMensual(
-            periodo=r["periodo"] or "",
-            polizas_vida=r["polizas_vida"] or 0,
-            polizas_gmm=r["polizas_gmm"] or 0,
-            polizas_autos=r["polizas_autos"] or 0,
-            prima_vida=round(r["prima_vida"] or 0, 2),
-            prima_gmm=round(r["prima_gmm"] or 0, 2),
-            prima_autos=round(r["prima_autos"] or 0, 2),
-        ) for r in mensual_raw
-    ]
-
-    # ── Producción mensual (año anterior) ──
-    mensual_ant_raw = db.execute(text("""
-        SELECT p.periodo_aplicacion as periodo,
-               SUM(CASE WHEN pr.ramo_codigo=11 AND """ + SQL_ES_NUEVA + """ THEN 1 ELSE 0 END) as polizas_vida,
-               SUM(CASE WHEN pr.ramo_codigo=34 AND """ + SQL_ES_NUEVA + """ THEN 1 ELSE 0 END) as polizas_gmm,
-               SUM(CASE WHEN pr.ramo_codigo=90 AND """ + SQL_ES_NUEVA + """ THEN 1 ELSE 0 END) as polizas_autos,
-               SUM(CASE WHEN pr.ramo_codigo=11 AND """ + SQL_ES_NUEVA + """ THEN p.prima_neta ELSE 0 END) as prima_vida,
-               SUM(CASE WHEN pr.ramo_codigo=34 AND """ + SQL_ES_NUEVA + """ THEN p.prima_neta ELSE 0 END) as prima_gmm,
-               SUM(CASE WHEN pr.ramo_codigo=90 AND """ + SQL_ES_NUEVA + """ THEN p.prima_neta ELSE 0 END) as prima_autos
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE p.anio_aplicacion = :anio_ant
-        GROUP BY p.periodo_aplicacion
-        ORDER BY p.periodo_aplicacion
-    """), {"anio_ant": anio_ant}).mappings().all()
-
-    produccion_mensual_ant = [
-        ProduccionMensual(
-            periodo=r["periodo"] or "",
-            polizas_vida=r["polizas_vida"] or 0,
-            polizas_gmm=r["polizas_gmm"] or 0,
-            polizas_autos=r["polizas_autos"] or 0,
-            prima_vida=round(r["prima_vida"] or 0, 2),
-            prima_gmm=round(r["prima_gmm"] or 0, 2),
-            prima_autos=round(r["prima_autos"] or 0, 2),
-        ) for r in mensual_ant_raw
-    ]
+    # ── Producción mensual (año actual y anterior) ──
+    produccion_mensual = _produccion_mensual(db, anio)
+    produccion_mensual_ant = _produccion_mensual(db, anio_ant)
 
     # ── Top agentes (general) ──
     top_raw = db.execute(text("""
         SELECT a.nombre_completo, a.codigo_agente, a.oficina,
                a.segmento_nombre as segmento,
-               COUNT(CASE WHEN """ + SQL_ES_NUEVA + """ THEN 1 END) as polizas_nuevas,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """ THEN COALESCE(p.equivalencias_emitidas, 0) ELSE 0 END) as equivalencias,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """ THEN COALESCE(p.num_asegurados, 1) ELSE 0 END) as asegurados,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """ THEN p.prima_neta ELSE 0 END) as prima_nueva,
-               SUM(p.prima_neta) as prima_total
-        FROM polizas p
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion = :anio
+               SUM(CASE WHEN f.tipo = 'NUEVA' THEN f.polizas ELSE 0 END) as polizas_nuevas,
+               SUM(CASE WHEN f.tipo = 'NUEVA' THEN f.equivalencias ELSE 0 END) as equivalencias,
+               SUM(CASE WHEN f.tipo = 'NUEVA' THEN f.asegurados ELSE 0 END) as asegurados,
+               SUM(CASE WHEN f.tipo = 'NUEVA' THEN f.prima_neta ELSE 0 END) as prima_nueva,
+               SUM(f.prima_neta) as prima_total
+        FROM produccion_mensual_agg f
+        LEFT JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio = :anio
         GROUP BY a.id, a.nombre_completo, a.codigo_agente, a.oficina, a.segmento_nombre
         ORDER BY prima_total DESC
         LIMIT 10
@@ -513,15 +505,13 @@ def get_dashboard(
     # ── Top 5 GMM (por asegurados) ──
     top_gmm_raw = db.execute(text("""
         SELECT a.nombre_completo, a.codigo_agente, a.oficina,
-               COUNT(CASE WHEN """ + SQL_ES_NUEVA + """ THEN 1 END) as polizas_nuevas,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """ THEN COALESCE(p.num_asegurados, 1) ELSE 0 END) as asegurados,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """ THEN p.prima_neta ELSE 0 END) as prima_nueva
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion = :anio AND pr.ramo_codigo = 34
+               SUM(f.polizas) as polizas_nuevas,
+               SUM(f.asegurados) as asegurados,
+               SUM(f.prima_neta) as prima_nueva
+        FROM produccion_mensual_agg f
+        LEFT JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio = :anio AND f.ramo_codigo = 34 AND f.tipo = 'NUEVA'
         GROUP BY a.id, a.nombre_completo, a.codigo_agente, a.oficina
-        HAVING COUNT(CASE WHEN """ + SQL_ES_NUEVA + """ THEN 1 END) > 0
         ORDER BY asegurados DESC
         LIMIT 5
     """), {"anio": anio}).mappings().all()
@@ -540,17 +530,13 @@ def get_dashboard(
     # ── Top 5 VIDA (por equivalencias) ──
     top_vida_raw = db.execute(text("""
         SELECT a.nombre_completo, a.codigo_agente, a.oficina,
-               COUNT(CASE WHEN """ + SQL_ES_NUEVA + """ THEN 1 END) as polizas_nuevas,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """
-                   THEN COALESCE(p.equivalencias_emitidas, 0) ELSE 0 END) as equivalencias,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """
-                   THEN p.prima_neta ELSE 0 END) as prima_nueva
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion = :anio AND pr.ramo_codigo = 11
+               SUM(f.polizas) as polizas_nuevas,
+               SUM(f.equivalencias) as equivalencias,
+               SUM(f.prima_neta) as prima_nueva
+        FROM produccion_mensual_agg f
+        LEFT JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio = :anio AND f.ramo_codigo = 11 AND f.tipo = 'NUEVA'
         GROUP BY a.id, a.nombre_completo, a.codigo_agente, a.oficina
-        HAVING COUNT(CASE WHEN """ + SQL_ES_NUEVA + """ THEN 1 END) > 0
         ORDER BY equivalencias DESC
         LIMIT 5
     """), {"anio": anio}).mappings().all()
@@ -560,10 +546,9 @@ def get_dashboard(
     
     # Cruce con año anterior para crecimiento
     prod_ant_vida = db.execute(text("""
-        SELECT a.codigo_agente, SUM(p.prima_neta) as prima
-        FROM polizas p JOIN agentes a ON p.agente_id = a.id
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE p.anio_aplicacion = :anio_ant AND pr.ramo_codigo = 11 AND """ + SQL_ES_NUEVA + """
+        SELECT a.codigo_agente, SUM(f.prima_neta) as prima
+        FROM produccion_mensual_agg f JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio = :anio_ant AND f.ramo_codigo = 11 AND f.tipo = 'NUEVA'
         GROUP BY a.codigo_agente
     """), {"anio_ant": anio_ant}).mappings().all()
     map_ant_vida = {r["codigo_agente"]: r["prima"] or 1 for r in prod_ant_vida}
@@ -588,11 +573,10 @@ def get_dashboard(
 
     # ── Distribución por gama GMM ──
     gama_raw = db.execute(text("""
-        SELECT p.gama, COUNT(*) as total, SUM(p.prima_neta) as prima
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE pr.ramo_codigo=34 AND p.anio_aplicacion=:anio AND p.gama IS NOT NULL
-        GROUP BY p.gama
+        SELECT f.gama, SUM(f.polizas) as total, SUM(f.prima_neta) as prima
+        FROM produccion_mensual_agg f
+        WHERE f.ramo_codigo = 34 AND f.anio = :anio AND f.gama IS NOT NULL
+        GROUP BY f.gama
     """), {"anio": anio}).mappings().all()
 
     dist_gama = [
@@ -612,6 +596,7 @@ def get_dashboard(
 
 
 @router_dashboard.get("/icp-2026", response_model=ICP2026Response)
+@cacheado("dashboard/icp-2026")
 def get_icp_2026_status(
     anio: int = Query(2026, description="Año de análisis"),
     db: Session = Depends(get_db)
@@ -954,6 +939,7 @@ def post_importar_siniestros(
             sin_db.status = str(row.get("status", "PAGADO"))
             count += 1
         
+        invalidar(db)
         db.commit()
         return {"success": True, "procesados": count}
     except Exception as e:
@@ -1007,6 +993,7 @@ def post_importar_persistencia(
             snap.valor_k1 = float(val)
             count += 1
             
+        invalidar(db)
         db.commit()
         return {"success": True, "procesados": count}
     except Exception as e:
@@ -1037,17 +1024,17 @@ def get_top_agentes_ramo(
 ):
     """Top agentes por ramo con filtros granulares — cierra GAP de Looker págs 3-4."""
 
-    # ── Build dynamic filter ──
+    # ── Build dynamic filter (columnas de produccion_mensual_agg f / agentes a) ──
     filtro_ramo = ""
     params = {"anio": anio}
 
     ramo_map = {"vida": 11, "gmm": 34, "autos": 90}
     if ramo and ramo.lower() in ramo_map:
-        filtro_ramo += " AND pr.ramo_codigo = :ramo_codigo"
+        filtro_ramo += " AND f.ramo_codigo = :ramo_codigo"
         params["ramo_codigo"] = ramo_map[ramo.lower()]
 
     if gama:
-        filtro_ramo += " AND UPPER(p.gama) = :gama"
+        filtro_ramo += " AND UPPER(f.gama) = :gama"
         params["gama"] = gama.upper()
 
     if segmento:
@@ -1055,58 +1042,62 @@ def get_top_agentes_ramo(
         params["segmento"] = segmento.upper()
 
     if forma_pago:
-        filtro_ramo += " AND UPPER(p.forma_pago) = :forma_pago"
+        filtro_ramo += " AND UPPER(f.forma_pago) = :forma_pago"
         params["forma_pago"] = forma_pago.upper()
 
     if tipo and tipo.upper() in ("NUEVA", "SUBSECUENTE"):
-        filtro_ramo += " AND " + SQL_ES_NUEVA if tipo.upper() == "NUEVA" else " AND " + SQL_ES_SUBSECUENTE
-        # No necesitamos params["tipo_poliza"] porque las condiciones SQL son literales
+        filtro_ramo += " AND f.tipo = :tipo"
+        params["tipo"] = tipo.upper()
 
     if trimestre and trimestre.upper() in ("Q1", "Q2", "Q3", "Q4"):
-        filtro_ramo += " AND UPPER(p.trimestre) = :trimestre"
+        filtro_ramo += " AND UPPER(f.trimestre) = :trimestre"
         params["trimestre"] = trimestre.upper()
 
-    if primer_anio:
-        filtro_ramo += " AND p.primer_anio IS NOT NULL AND p.primer_anio != ''"
-
     if lider:
         filtro_ramo += " AND a.lider_codigo = :lider_codigo"
         params["lider_codigo"] = lider
 
     if moneda:
-        filtro_ramo += " AND UPPER(p.moneda) = :moneda"
+        filtro_ramo += " AND UPPER(f.moneda) = :moneda"
         params["moneda"] = moneda.upper()
 
+    # Filtros por columnas de la póliza que el agregado no conserva:
+    # misma consulta sobre las filas de polizas con la forma de la tabla de hechos
+    fuente = "produccion_mensual_agg"
+    filtro_poliza = ["p.anio_aplicacion = :anio"]
+    if primer_anio:
+        filtro_poliza.append("p.primer_anio IS NOT NULL AND p.primer_anio != ''")
     if nueva_formal:
-        filtro_ramo += " AND p.flag_nueva_formal = 1"
+        filtro_poliza.append("p.flag_nueva_formal = 1")
+    if len(filtro_poliza) > 1:
+        fuente = f"({filas_produccion(' AND '.join(filtro_poliza))})"
 
     # ── Query ──
-    sql = """
+    sql = f"""
         SELECT a.nombre_completo, a.codigo_agente, a.oficina,
                a.segmento_agrupado as segmento, a.gestion_comercial as gestion,
                a.lider_codigo,
-               COUNT(CASE WHEN """ + SQL_ES_NUEVA + """ THEN 1 END) as polizas_nuevas,
-               COUNT(CASE WHEN """ + SQL_ES_SUBSECUENTE + """ THEN 1 END) as polizas_subs,
-               COUNT(*) as polizas_total,
-               SUM(CASE WHEN p.flag_nueva_formal=1 THEN 1 ELSE 0 END) as polizas_nueva_formal,
-               SUM(COALESCE(p.num_asegurados, 1)) as asegurados,
-               SUM(COALESCE(p.equivalencias_emitidas, 0)) as equivalencias,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """ THEN COALESCE(p.prima_neta, 0) ELSE 0 END) as prima_nueva,
-               SUM(CASE WHEN """ + SQL_ES_SUBSECUENTE + """ THEN COALESCE(p.prima_neta, 0) ELSE 0 END) as prima_subs,
-               SUM(COALESCE(p.prima_neta, 0)) as prima_total,
-               SUM(COALESCE(p.neta_acumulada, p.prima_neta, 0)) as prima_acum,
-               SUM(COALESCE(p.prima_anual_pesos, 0)) as prima_anual_pesos,
-               SUM(COALESCE(p.neta_sin_forma, 0)) as prima_sin_fp,
-               p.gama as gama_val,
-               p.moneda as moneda_val
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion = :anio """ + filtro_ramo + """
+               SUM(CASE WHEN f.tipo = 'NUEVA' THEN f.polizas ELSE 0 END) as polizas_nuevas,
+               SUM(CASE WHEN f.tipo = 'SUBSECUENTE' THEN f.polizas ELSE 0 END) as polizas_subs,
+               SUM(f.polizas) as polizas_total,
+               SUM(f.polizas_nueva_formal) as polizas_nueva_formal,
+               SUM(f.asegurados) as asegurados,
+               SUM(f.equivalencias) as equivalencias,
+               SUM(CASE WHEN f.tipo = 'NUEVA' THEN f.prima_neta ELSE 0 END) as prima_nueva,
+               SUM(CASE WHEN f.tipo = 'SUBSECUENTE' THEN f.prima_neta ELSE 0 END) as prima_subs,
+               SUM(f.prima_neta) as prima_total,
+               SUM(f.prima_acumulada) as prima_acum,
+               SUM(f.prima_anual_pesos) as prima_anual_pesos,
+               SUM(f.prima_sin_fp) as prima_sin_fp,
+               f.gama as gama_val,
+               f.moneda as moneda_val
+        FROM {fuente} f
+        LEFT JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio = :anio {filtro_ramo}
           AND a.nombre_completo IS NOT NULL
         GROUP BY a.id, a.nombre_completo, a.codigo_agente, a.oficina,
                  a.segmento_agrupado, a.gestion_comercial, a.lider_codigo,
-                 p.gama, p.moneda
+                 f.gama, f.moneda
     """
     raw = db.execute(text(sql), params).mappings().all()
 
@@ -1149,13 +1140,12 @@ def get_top_agentes_ramo(
 
     # ── Get trimestre breakdown per agent ──
     trim_raw = db.execute(text(f"""
-        SELECT a.codigo_agente, COALESCE(p.trimestre, 'S/T') as trim,
-               SUM(COALESCE(p.prima_neta, 0)) as prima
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion = :anio {filtro_ramo} AND a.codigo_agente IS NOT NULL
-        GROUP BY a.codigo_agente, p.trimestre
+        SELECT a.codigo_agente, COALESCE(f.trimestre, 'S/T') as trim,
+               SUM(f.prima_neta) as prima
+        FROM {fuente} f
+        LEFT JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio = :anio {filtro_ramo} AND a.codigo_agente IS NOT NULL
+        GROUP BY a.codigo_agente, f.trimestre
     """), params).mappings().all()
 
     for t in trim_raw:
@@ -1185,13 +1175,12 @@ def get_top_agentes_ramo(
 
     # ── Filtros disponibles ──
     filtros_disp = db.execute(text(f"""
-        SELECT DISTINCT p.gama, p.forma_pago, p.trimestre, a.segmento_agrupado,
-               a.lider_codigo, p.moneda
-        FROM polizas p
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE p.anio_aplicacion = :anio
-          AND ({'pr.ramo_codigo = :ramo_codigo' if 'ramo_codigo' in params else '1=1'})
+        SELECT DISTINCT f.gama, f.forma_pago, f.trimestre, a.segmento_agrupado,
+               a.lider_codigo, f.moneda
+        FROM produccion_mensual_agg f
+        LEFT JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio = :anio
+          AND ({'f.ramo_codigo = :ramo_codigo' if 'ramo_codigo' in params else '1=1'})
     """), params).mappings().all()
 
     gamas_disp = sorted(set(r["gama"] for r in filtros_disp if r["gama"]))
@@ -1271,29 +1260,26 @@ def get_pivot_agentes(
 
     ramo_map = {"vida": 11, "gmm": 34, "autos": 90}
     if ramo and ramo.lower() in ramo_map:
-        filtro_extra += " AND pr.ramo_codigo = :ramo_codigo"
+        filtro_extra += " AND f.ramo_codigo = :ramo_codigo"
         params["ramo_codigo"] = ramo_map[ramo.lower()]
 
     if tipo and tipo.upper() in ("NUEVA", "SUBSECUENTE"):
-        if tipo.upper() == "NUEVA":
-            filtro_extra += " AND " + SQL_ES_NUEVA
-        else:
-            filtro_extra += " AND " + SQL_ES_SUBSECUENTE
+        filtro_extra += " AND f.tipo = :tipo"
+        params["tipo"] = tipo.upper()
 
     raw = db.execute(text(f"""
         SELECT a.nombre_completo, a.codigo_agente, a.segmento_agrupado as segmento,
-               p.periodo_aplicacion as periodo,
-               COUNT(*) as polizas,
-               SUM(COALESCE(p.prima_neta, 0)) as prima,
-               SUM(COALESCE(p.num_asegurados, 1)) as asegurados,
-               SUM(COALESCE(p.equivalencias_emitidas, 0)) as equivalencias
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion = :anio {filtro_extra}
+               f.periodo,
+               SUM(f.polizas) as polizas,
+               SUM(f.prima_neta) as prima,
+               SUM(f.asegurados) as asegurados,
+               SUM(f.equivalencias) as equivalencias
+        FROM produccion_mensual_agg f
+        LEFT JOIN agentes a ON f.agente_id = a.id
+        WHERE f.anio = :anio {filtro_extra}
           AND a.nombre_completo IS NOT NULL
-        GROUP BY a.id, a.nombre_completo, a.codigo_agente, a.segmento_agrupado, p.periodo_aplicacion
-        ORDER BY a.nombre_completo, p.periodo_aplicacion
+        GROUP BY a.id, a.nombre_completo, a.codigo_agente, a.segmento_agrupado, f.periodo
+        ORDER BY a.nombre_completo, f.periodo
     """), params).mappings().all()
 
     # ── Build pivot ──
@@ -1372,6 +1358,7 @@ def _var_pct(actual, anterior):
 
 
 @router_dashboard.get("/ejecutivo", response_model=EjecutivoResponse)
+@cacheado("dashboard/ejecutivo")
 def get_dashboard_ejecutivo(
     anio: int = Query(2025, description="Año actual de análisis"),
     segmento: Optional[str] = Query(None, description="Filtrar por segmento agrupado: ALFA, BETA, OMEGA"),
@@ -1399,43 +1386,19 @@ def get_dashboard_ejecutivo(
         filtro_extra += " AND a.codigo_agente = :agc"
         params_extra["agc"] = agente_codigo
 
-    # ── Datos del año actual y anterior ──
-    for yr_key, yr_val in [("act", anio), ("ant", anio_ant)]:
-        params_extra[f"anio_{yr_key}"] = yr_val
-
-    polizas_query = text(f"""
-        SELECT p.*, pr.ramo_codigo, pr.ramo_nombre,
-               a.codigo_agente, a.nombre_completo as agente_nombre,
-               a.segmento_nombre, a.segmento_agrupado, a.gestion_comercial,
-               a.situacion, a.estado as agente_estado
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion IN (:anio_act, :anio_ant) {filtro_extra}
-    """)
-    all_polizas = db.execute(polizas_query, params_extra).mappings().all()
-
-    # Separar por año
-    pol_act = [p for p in all_polizas if p["anio_aplicacion"] == anio]
-    pol_ant = [p for p in all_polizas if p["anio_aplicacion"] == anio_ant]
+    # ── Una sola pasada sobre la producción pre-agregada de ambos años ──
+    acum = acumular(consultar_ejecutivo(db, anio, anio_ant, filtro_extra, params_extra), anio, anio_ant)
 
     # ── 1. COMPARATIVO POR RAMO ──
-    def build_comparativo(ramo_nombre, ramo_codigo, p_act, p_ant):
-        act_nuevas = [p for p in p_act if p["ramo_codigo"] == ramo_codigo and _es_nueva(p)]
-        ant_nuevas = [p for p in p_ant if p["ramo_codigo"] == ramo_codigo and _es_nueva(p)]
-        act_subs = [p for p in p_act if p["ramo_codigo"] == ramo_codigo and _es_subsecuente(p)]
-        ant_subs = [p for p in p_ant if p["ramo_codigo"] == ramo_codigo and _es_subsecuente(p)]
-
-        pol_act_n = len(act_nuevas)
-        pol_ant_n = len(ant_nuevas)
-        aseg_act = sum(p["num_asegurados"] or 1 for p in act_nuevas)
-        aseg_ant = sum(p["num_asegurados"] or 1 for p in ant_nuevas)
-        eq_act = sum(p["equivalencias_emitidas"] or 0 for p in act_nuevas)
-        eq_ant = sum(p["equivalencias_emitidas"] or 0 for p in ant_nuevas)
-        pn_act = sum(p["prima_neta"] or 0 for p in act_nuevas)
-        pn_ant = sum(p["prima_neta"] or 0 for p in ant_nuevas)
-        ps_act = sum(p["prima_neta"] or 0 for p in act_subs)
-        ps_ant = sum(p["prima_neta"] or 0 for p in ant_subs)
+    def build_comparativo(ramo_nombre, ramo):
+        c = acum["comparativo"][ramo]
+        act_n, ant_n = c["act"]["NUEVA"], c["ant"]["NUEVA"]
+        ps_act = c["act"]["SUBSECUENTE"]["prima"]
+        ps_ant = c["ant"]["SUBSECUENTE"]["prima"]
+        pol_act_n, pol_ant_n = act_n["polizas"], ant_n["polizas"]
+        aseg_act, aseg_ant = act_n["asegurados"], ant_n["asegurados"]
+        eq_act, eq_ant = act_n["equivalencias"], ant_n["equivalencias"]
+        pn_act, pn_ant = act_n["prima"], ant_n["prima"]
         pt_act = pn_act + ps_act
         pt_ant = pn_ant + ps_ant
 
@@ -1455,30 +1418,12 @@ def get_dashboard_ejecutivo(
             prima_total_variacion=_var_pct(pt_act, pt_ant),
         )
 
-    comp_gmm = build_comparativo("GMM", 34, pol_act, pol_ant)
-    comp_vida = build_comparativo("VIDA", 11, pol_act, pol_ant)
-    comp_autos = build_comparativo("AUTOS", 90, pol_act, pol_ant)
+    comp_gmm = build_comparativo("GMM", "gmm")
+    comp_vida = build_comparativo("VIDA", "vida")
+    comp_autos = build_comparativo("AUTOS", "autos")
 
     # ── 2. RESUMEN POR SEGMENTO ──
-    seg_data = defaultdict(lambda: {
-        "agentes": set(), "polizas_vida": 0, "polizas_gmm": 0, "polizas_autos": 0,
-        "prima_vida": 0.0, "prima_gmm": 0.0, "prima_autos": 0.0, "equivalentes": 0.0,
-    })
-    for p in pol_act:
-        seg = p["segmento_agrupado"] or "SIN SEGMENTO"
-        ag_code = p["codigo_agente"]
-        seg_data[seg]["agentes"].add(ag_code)
-        if p["ramo_codigo"] == 11 and _es_nueva(p):
-            seg_data[seg]["polizas_vida"] += 1
-            seg_data[seg]["prima_vida"] += (p["prima_neta"] or 0)
-            seg_data[seg]["equivalentes"] += (p["equivalencias_emitidas"] or 0)
-        elif p["ramo_codigo"] == 34 and _es_nueva(p):
-            seg_data[seg]["polizas_gmm"] += 1
-            seg_data[seg]["prima_gmm"] += (p["prima_neta"] or 0)
-        elif p["ramo_codigo"] == 90 and _es_nueva(p):
-            seg_data[seg]["polizas_autos"] += 1
-            seg_data[seg]["prima_autos"] += (p["prima_neta"] or 0)
-
+    seg_data = acum["segmentos"]
     segmentos_res = []
     for seg_name in ["ALFA", "BETA", "OMEGA", "SIN SEGMENTO"]:
         if seg_name in seg_data:
@@ -1497,89 +1442,7 @@ def get_dashboard_ejecutivo(
             ))
 
     # ── 3. VISTA OPERATIVA POR AGENTE ──
-    agentes_map = defaultdict(lambda: {
-        "clave": "", "nombre": "", "segmento": "", "segmento_agrupado": "",
-        "gestion": "", "estado": "",
-        # Actual
-        "polizas_vida": 0, "equiv_vida": 0.0, "prima_pagada_vida": 0.0,
-        "polizas_gmm": 0, "asegurados_gmm": 0, "prima_pagada_gmm": 0.0,
-        "polizas_autos": 0, "prima_pagada_autos": 0.0,
-        # Anterior GMM
-        "gmm_polizas_ant": 0, "gmm_prima_nueva_ant": 0.0, "gmm_prima_sub_ant": 0.0,
-        # Actual GMM
-        "gmm_polizas_act": 0, "gmm_prima_nueva_act": 0.0, "gmm_prima_sub_act": 0.0,
-        # Anterior Vida
-        "vida_polizas_ant": 0, "vida_equiv_ant": 0.0,
-        "vida_prima_nueva_ant": 0.0, "vida_prima_sub_ant": 0.0,
-        # Actual Vida
-        "vida_polizas_act": 0, "vida_equiv_act": 0.0,
-        "vida_prima_nueva_act": 0.0, "vida_prima_sub_act": 0.0,
-        # Anterior Autos
-        "autos_polizas_ant": 0, "autos_prima_nueva_ant": 0.0, "autos_prima_sub_ant": 0.0,
-        # Actual Autos
-        "autos_polizas_act": 0, "autos_prima_nueva_act": 0.0, "autos_prima_sub_act": 0.0,
-    })
-
-    for p in all_polizas:
-        ag_code = p["codigo_agente"] or "SIN_AGENTE"
-        a = agentes_map[ag_code]
-        a["clave"] = ag_code
-        a["nombre"] = p["agente_nombre"] or ""
-        a["segmento"] = p["segmento_nombre"] or ""
-        a["segmento_agrupado"] = p["segmento_agrupado"] or ""
-        a["gestion"] = p["gestion_comercial"] or ""
-        a["estado"] = p["agente_estado"] or p["situacion"] or ""
-
-        is_act = p["anio_aplicacion"] == anio
-        is_ant = p["anio_aplicacion"] == anio_ant
-        is_vida = p["ramo_codigo"] == 11
-        is_gmm = p["ramo_codigo"] == 34
-        is_autos = p["ramo_codigo"] == 90
-        is_nueva = _es_nueva(p)
-        is_sub = _es_subsecuente(p)
-        prima = p["prima_neta"] or 0
-        equiv = p["equivalencias_emitidas"] or 0
-
-        if is_act and is_vida and is_nueva:
-            a["polizas_vida"] += 1
-            a["equiv_vida"] += equiv
-            a["prima_pagada_vida"] += prima
-            a["vida_polizas_act"] += 1
-            a["vida_equiv_act"] += equiv
-            a["vida_prima_nueva_act"] += prima
-        elif is_act and is_vida and is_sub:
-            a["vida_prima_sub_act"] += prima
-        elif is_act and is_gmm and is_nueva:
-            a["polizas_gmm"] += 1
-            a["asegurados_gmm"] += (p["num_asegurados"] or 1)
-            a["prima_pagada_gmm"] += prima
-            a["gmm_polizas_act"] += 1
-            a["gmm_prima_nueva_act"] += prima
-        elif is_act and is_gmm and is_sub:
-            a["gmm_prima_sub_act"] += prima
-        elif is_ant and is_vida and is_nueva:
-            a["vida_polizas_ant"] += 1
-            a["vida_equiv_ant"] += equiv
-            a["vida_prima_nueva_ant"] += prima
-        elif is_ant and is_vida and is_sub:
-            a["vida_prima_sub_ant"] += prima
-        elif is_ant and is_gmm and is_nueva:
-            a["gmm_polizas_ant"] += 1
-            a["gmm_prima_nueva_ant"] += prima
-        elif is_ant and is_gmm and is_sub:
-            a["gmm_prima_sub_ant"] += prima
-        elif is_act and is_autos and is_nueva:
-            a["polizas_autos"] += 1
-            a["prima_pagada_autos"] += prima
-            a["autos_polizas_act"] += 1
-            a["autos_prima_nueva_act"] += prima
-        elif is_act and is_autos and is_sub:
-            a["autos_prima_sub_act"] += prima
-        elif is_ant and is_autos and is_nueva:
-            a["autos_polizas_ant"] += 1
-            a["autos_prima_nueva_ant"] += prima
-        elif is_ant and is_autos and is_sub:
-            a["autos_prima_sub_ant"] += prima
+    agentes_map = acum["agentes"]
 
     # Buscar metas por agente
     metas_raw = db.execute(text("""
@@ -1661,24 +1524,9 @@ def get_dashboard_ejecutivo(
         agentes_operativo = agentes_operativo[:top_n]
 
     # ── 4. PRODUCCIÓN MENSUAL COMPARATIVA ──
-    def build_mensual_comp(ramo_codigo, p_act, p_ant):
-        act_by_month = defaultdict(lambda: {"polizas": 0, "prima": 0.0})
-        ant_by_month = defaultdict(lambda: {"polizas": 0, "prima": 0.0})
-        for p in p_act:
-            if p["ramo_codigo"] == ramo_codigo and _es_nueva(p):
-                per = p["periodo_aplicacion"] or ""
-                if len(per) >= 7:
-                    m = int(per[5:7])
-                    act_by_month[m]["polizas"] += 1
-                    act_by_month[m]["prima"] += (p["prima_neta"] or 0)
-        for p in p_ant:
-            if p["ramo_codigo"] == ramo_codigo and _es_nueva(p):
-                per = p["periodo_aplicacion"] or ""
-                if len(per) >= 7:
-                    m = int(per[5:7])
-                    ant_by_month[m]["polizas"] += 1
-                    ant_by_month[m]["prima"] += (p["prima_neta"] or 0)
-
+    def build_mensual_comp(ramo):
+        act_by_month = acum["mensual"][ramo]["act"]
+        ant_by_month = acum["mensual"][ramo]["ant"]
         result = []
         for m in range(1, 13):
             result.append(ProduccionMensualComparativo(
@@ -1690,9 +1538,9 @@ def get_dashboard_ejecutivo(
             ))
         return result
 
-    mensual_gmm = build_mensual_comp(34, pol_act, pol_ant)
-    mensual_vida = build_mensual_comp(11, pol_act, pol_ant)
-    mensual_autos = build_mensual_comp(90, pol_act, pol_ant)
+    mensual_gmm = build_mensual_comp("gmm")
+    mensual_vida = build_mensual_comp("vida")
+    mensual_autos = build_mensual_comp("autos")
 
     # ── Filtros disponibles ──
     segmentos_db = db.execute(text("SELECT DISTINCT segmento_agrupado FROM agentes WHERE segmento_agrupado IS NOT NULL")).scalars().all()
@@ -1727,273 +1575,253 @@ MESES_COMPLETOS = {
     7: "Julio", 8: "Agosto", 9: "Septiembre", 10: "Octubre", 11: "Noviembre", 12: "Diciembre",
 }
 
+# La vista se sirve en partes: GET /cobranza/resumen (KPIs, alertas, seguimiento)
+# y las listas paginadas por cursor /cobranza/deudores, /renovaciones y
+# /canceladas. Filtros y orden van en el SQL; GET /cobranza sigue entregando
+# todo junto para los clientes previos.
+#
+# Orden de cada lista: (expresión, clave en la fila, descendente, tipo del cursor);
+# la última es única y desempata. El semáforo usa ix_deudores_anio_semaforo.
+ORDEN_DEUDORES = {
+    "prioridad": (("d.orden_prioridad", "orden_prioridad", False, int),
+                  ("d.dias_vencimiento", "dias_vencimiento", True, int),
+                  ("d.poliza_id", "poliza_id", False, int)),
+    "dias": (("d.dias_vencimiento", "dias_vencimiento", True, int),
+             ("d.poliza_id", "poliza_id", True, int)),
+    "prima_pendiente": (("d.prima_pendiente", "prima_pendiente", True, float),
+                        ("d.poliza_id", "poliza_id", True, int)),
+}
+ORDEN_RENOVACIONES = (("p.fecha_fin", "fecha_fin", False, str), ("p.id", "id", False, int))
+ORDEN_CANCELADAS = (("COALESCE(p.prima_neta, 0)", "prima_orden", True, float), ("p.id", "id", True, int))
+
+ESTADOS_RENOVACION = ("por_vencer", "vencida", "renovada")
+SQL_ESTADO_RENOVACION = """CASE
+    WHEN UPPER(COALESCE(p.mystatus, '')) LIKE '%PAGADA%' OR UPPER(COALESCE(p.mystatus, '')) LIKE '%AL CORRIENTE%'
+         OR UPPER(COALESCE(p.mystatus, '')) LIKE '%REHABILITADA%' THEN 'renovada'
+    WHEN p.fecha_fin <= :hoy THEN 'vencida'
+    ELSE 'por_vencer' END"""
+SQL_PRIMA_COBRADA_CANCELADA = "COALESCE(NULLIF(p.prima_acumulada_basica, 0), NULLIF(p.neta_acumulada, 0), 0)"
+
+JOINS_CARTERA = """
+    LEFT JOIN productos pr ON p.producto_id = pr.id
+    LEFT JOIN agentes a ON p.agente_id = a.id"""
+
+SELECT_DEUDORES = f"""
+    SELECT d.*, p.poliza_original, p.contratante_nombre, p.asegurado_nombre, p.gama,
+           p.fecha_inicio, p.fecha_fin, p.status_recibo, p.moneda,
+           pr.ramo_nombre, pr.plan as producto_plan,
+           a.codigo_agente, a.nombre_completo as agente_nombre, a.segmento_nombre
+    FROM deudores_prima d
+    JOIN polizas p ON p.id = d.poliza_id {JOINS_CARTERA}"""
+
+SELECT_RENOVACIONES = f"""
+    SELECT p.id, p.poliza_original, p.contratante_nombre, p.fecha_fin, p.fecha_fin_d, p.prima_neta,
+           p.status_recibo, {SQL_ESTADO_RENOVACION} as estado_renovacion,
+           pr.ramo_nombre, a.codigo_agente, a.nombre_completo as agente_nombre
+    FROM polizas p {JOINS_CARTERA}"""
+
+SELECT_CANCELADAS = f"""
+    SELECT p.id, p.poliza_original, p.contratante_nombre, COALESCE(p.prima_neta, 0) as prima_orden,
+           {SQL_PRIMA_COBRADA_CANCELADA} as prima_cobrada, p.fecha_inicio,
+           p.mystatus, p.estatus_detalle,
+           pr.ramo_nombre, a.codigo_agente, a.nombre_completo as agente_nombre
+    FROM polizas p {JOINS_CARTERA}"""
+
+
+def _condiciones_cartera(db: Session, ramo: Optional[str], agente_codigo: Optional[str],
+                         q: Optional[str], params: dict) -> list:
+    """Filtros comunes de las listas de cobranza sobre polizas p / productos pr / agentes a."""
+    conditions = []
+    if ramo == "vida":
+        conditions.append("pr.ramo_codigo = 11")
+    elif ramo == "gmm":
+        conditions.append("pr.ramo_codigo = 34")
+    elif ramo == "autos":
+        conditions.append("pr.ramo_codigo = 90")
+    if agente_codigo:
+        conditions.append("a.codigo_agente = :agc")
+        params["agc"] = agente_codigo
+    if q:
+        # Como GET /polizas: índice de trigramas de polizas o código de agente
+        asegurar_busqueda(db)
+        conditions.append(f"""({filtro_busqueda(db, "polizas", "p", q, params)}
+            OR p.agente_id IN (SELECT id FROM agentes WHERE codigo_agente LIKE :q))""")
+        params["q"] = f"%{q}%"
+    return conditions
+
+
+def _where_deudores(db: Session, anio: int, ramo, prioridad, agente_codigo, q, params: dict) -> str:
+    params["anio"] = anio
+    conditions = ["d.anio_aplicacion = :anio"] + _condiciones_cartera(db, ramo, agente_codigo, q, params)
+    if prioridad:
+        if prioridad not in ORDEN_PRIORIDAD:
+            raise HTTPException(400, f"prioridad debe ser una de: {', '.join(ORDEN_PRIORIDAD)}")
+        # Por orden_prioridad (no por el texto): es la columna del índice del semáforo
+        conditions.append("d.orden_prioridad = :orden_prioridad")
+        params["orden_prioridad"] = ORDEN_PRIORIDAD[prioridad]
+    return " AND ".join(conditions)
+
+
+def _where_renovaciones(db: Session, ramo, estado, agente_codigo, q, params: dict, hoy) -> str:
+    from datetime import timedelta
+    params.update({"hoy": hoy.strftime("%Y-%m-%d"),
+                   "hoy_m60": (hoy - timedelta(days=60)).strftime("%Y-%m-%d"),
+                   "hoy_p90": (hoy + timedelta(days=90)).strftime("%Y-%m-%d")})
+    conditions = [sql_rango_fecha("p", "fecha_fin", "hoy_m60", "hoy_p90")]
+    conditions += _condiciones_cartera(db, ramo, agente_codigo, q, params)
+    if estado:
+        if estado not in ESTADOS_RENOVACION:
+            raise HTTPException(400, f"estado debe ser uno de: {', '.join(ESTADOS_RENOVACION)}")
+        conditions.append(f"({SQL_ESTADO_RENOVACION}) = :estado")
+        params["estado"] = estado
+    return " AND ".join(conditions)
+
 
-def _calcular_prioridad(dias_vencimiento, mystatus):
-    """Calcula el semáforo de prioridad del deudor por prima."""
-    ms = (mystatus or "").upper()
-    if "PAGADA" in ms or "AL CORRIENTE" in ms:
-        return "pagado"
-    if "CANCELADA" in ms or "CANC" in ms:
-        return "critico"
-    if dias_vencimiento > 30:
-        return "critico"       # 🔴 Vencido > 30 días
-    if dias_vencimiento > 15:
-        return "urgente"       # 🟠 15-30 días
-    if dias_vencimiento > 0:
-        return "atencion"      # 🟡 0-15 días
-    return "al_dia"            # 🟢 Al día
+def _where_canceladas(db: Session, anio: int, ramo, agente_codigo, q, params: dict) -> str:
+    params["anio"] = anio
+    conditions = ["p.anio_aplicacion = :anio",
+                  "(p.mystatus LIKE '%CANCELADA%' OR p.mystatus LIKE '%CANC%' OR p.flag_cancelada = 0)"]
+    return " AND ".join(conditions + _condiciones_cartera(db, ramo, agente_codigo, q, params))
 
 
-@router_cobranza.get("", response_model=CobranzaResponse)
-def get_cobranza(
-    anio: int = Query(2025, description="Año de análisis"),
-    ramo: Optional[str] = Query(None, description="Filtrar por ramo: vida, gmm"),
-    prioridad: Optional[str] = Query(None, description="Filtrar por prioridad: critico, urgente, atencion, al_dia, pagado"),
-    agente_codigo: Optional[str] = Query(None, description="Filtrar por código de agente"),
-    db: Session = Depends(get_db)
-):
+def _filas_ordenadas(db: Session, select: str, where: str, params: dict, orden: tuple,
+                     after: Optional[str] = None, limit: Optional[int] = None) -> tuple:
     """
-    Módulo de Cobranza y Deudor por Prima (Fase 2).
-    Vista de priorización visual con semáforo de urgencia.
+    Filas de `select` en el `orden` dado. Con `limit` es una página: desde el
+    cursor `after` (keyset) y con next_cursor si hay más. Retorna (filas, next_cursor).
     """
-    from datetime import datetime, timedelta
-
-    hoy = datetime.now()
-    hoy_str = hoy.strftime("%Y-%m-%d")
-
-    # ── Filtros ──
-    filtro_ramo = ""
-    if ramo == "vida":
-        filtro_ramo = " AND pr.ramo_codigo = 11"
-    elif ramo == "gmm":
-        filtro_ramo = " AND pr.ramo_codigo = 34"
-    elif ramo == "autos":
-        filtro_ramo = " AND pr.ramo_codigo = 90"
+    cursor = leer_cursor_orden(after, tuple(tipo for _, _, _, tipo in orden))
+    if cursor:
+        where += " AND " + sql_keyset_orden(tuple((expr, desc) for expr, _, desc, _ in orden))
+        params.update({f"cursor_{i}": v for i, v in enumerate(cursor)})
+    order_by = ", ".join(f"{expr} {'DESC' if desc else 'ASC'}" for expr, _, desc, _ in orden)
+    paginado = ""
+    if limit is not None:
+        paginado = "LIMIT :limit"
+        params["limit"] = limit + 1     # Una fila extra indica si hay página siguiente
+    rows = db.execute(text(f"{select} WHERE {where} ORDER BY {order_by} {paginado}"), params).mappings().all()
+
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, crear_cursor_orden(rows[-1][clave] for _, clave, _, _ in orden)
+
+
+def _deudor(p) -> DeudorPrima:
+    fecha_prox = fecha_nativa(p["fecha_proximo_recibo"])
+    return DeudorPrima(
+        poliza=p["poliza_original"],
+        contratante=p["contratante_nombre"],
+        asegurado=p["asegurado_nombre"],
+        agente_clave=p["codigo_agente"],
+        agente_nombre=p["agente_nombre"],
+        ramo=p["ramo_nombre"],
+        plan=p["producto_plan"],
+        gama=p["gama"],
+        segmento=p["segmento_nombre"],
+        prima_neta=p["prima_neta"],
+        prima_total=p["prima_total"],
+        prima_acumulada=p["prima_acumulada"],
+        prima_pendiente=p["prima_pendiente"],
+        fecha_inicio=p["fecha_inicio"] or "",
+        fecha_fin=p["fecha_fin"],
+        fecha_proximo_recibo=fecha_prox.isoformat() if fecha_prox else None,
+        status=p["status_recibo"],
+        mystatus=p["mystatus"] or "",
+        dias_vencimiento=p["dias_vencimiento"],
+        prioridad=p["prioridad"],
+        recibo_actual=p["recibo_actual"],
+        moneda=p["moneda"],
+    )
 
-    filtro_agente = ""
-    params = {"anio": anio}
-    if agente_codigo:
-        filtro_agente = " AND a.codigo_agente = :agc"
-        params["agc"] = agente_codigo
 
-    # ── 1. DEUDOR POR PRIMA ──
-    rows = db.execute(text(f"""
-        SELECT p.*, pr.ramo_codigo, pr.ramo_nombre, pr.plan as producto_plan,
-               a.codigo_agente, a.nombre_completo as agente_nombre,
-               a.segmento_nombre,
-               COALESCE(pag.total_pagado, 0) as pagos_total
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        LEFT JOIN (
-            SELECT poliza_match, SUM(prima_neta) as total_pagado
-            FROM pagos GROUP BY poliza_match
-        ) pag ON p.poliza_original = pag.poliza_match
-        WHERE p.anio_aplicacion = :anio {filtro_ramo} {filtro_agente}
-        ORDER BY p.fecha_inicio DESC
-    """), params).mappings().all()
+def _renovacion(r, hoy) -> RenovacionPendiente:
+    from datetime import datetime
+    ff = leer_fecha(r, "fecha_fin")
+    dias_ren = (datetime.combine(ff, datetime.min.time()) - hoy).days if ff else 0
+    return RenovacionPendiente(
+        poliza=r["poliza_original"],
+        contratante=r["contratante_nombre"],
+        agente_nombre=r["agente_nombre"],
+        agente_clave=r["codigo_agente"],
+        ramo=r["ramo_nombre"],
+        prima_neta=round(r["prima_neta"] or 0, 2),
+        fecha_fin=r["fecha_fin"] or "",
+        dias_para_renovar=dias_ren,
+        status=r["status_recibo"],
+        estado_renovacion=r["estado_renovacion"],
+    )
 
-    deudores = []
-    for p in rows:
-        prima_neta = p["prima_neta"] or 0
-        prima_total = p["prima_total"] or prima_neta
-        # Use best available data: poliza field, pagos aggregate, or neta_acumulada
-        prima_acum = max(
-            p["prima_acumulada_basica"] or 0,
-            p["pagos_total"] or 0,
-            p["neta_acumulada"] or 0,
-        )
-        prima_pendiente = max(0, prima_neta - prima_acum)
-        mystatus = p["mystatus"] or ""
-
-        # Calcular días de vencimiento
-        fecha_fin = p["fecha_fin"] or ""
-        fecha_inicio = p["fecha_inicio"] or ""
-        dias_venc = 0
-
-        # Heurística: calcular próximo recibo basado en forma de pago
-        fp = (p["forma_pago"] or "ANUAL").upper()
-        meses_fp = 12
-        if "SEMEST" in fp: meses_fp = 6
-        elif "TRIM" in fp: meses_fp = 3
-        elif "MENS" in fp: meses_fp = 1
-        elif "BIMEST" in fp: meses_fp = 2
-
-        # Calcular cuántos recibos debería tener y cuántos ha pagado
-        recibo_actual = "-"
-        fecha_prox = None
-        if fecha_inicio and len(fecha_inicio) >= 10:
-            try:
-                fi = datetime.strptime(fecha_inicio[:10], "%Y-%m-%d")
-                meses_desde_inicio = max(0, (hoy.year - fi.year) * 12 + hoy.month - fi.month)
-                recibos_esperados = min(12 // meses_fp, max(1, meses_desde_inicio // meses_fp + 1))
-                total_recibos = 12 // meses_fp
-                recibo_actual = f"{min(recibos_esperados, total_recibos)}/{total_recibos}"
-
-                # Fecha próximo recibo
-                proximo = fi + timedelta(days=meses_fp * 30 * recibos_esperados)
-                fecha_prox = proximo.strftime("%Y-%m-%d")
-
-                # Días de vencimiento (positivo = vencido)
-                if prima_acum < prima_neta and prima_acum > 0:
-                    dias_venc = max(0, (hoy - proximo).days)
-                elif prima_acum == 0 and "PAGADA" not in mystatus.upper() and "AL CORRIENTE" not in mystatus.upper():
-                    dias_venc = max(0, (hoy - fi - timedelta(days=30)).days)
-            except (ValueError, TypeError):
-                pass
-
-        prio = _calcular_prioridad(dias_venc, mystatus)
-
-        # Filtrar por prioridad si se solicita
-        if prioridad and prio != prioridad:
-            continue
 
-        deudores.append(DeudorPrima(
-            poliza=p["poliza_original"],
-            contratante=p["contratante_nombre"],
-            asegurado=p["asegurado_nombre"],
-            agente_clave=p["codigo_agente"],
-            agente_nombre=p["agente_nombre"],
-            ramo=p["ramo_nombre"],
-            plan=p["producto_plan"],
-            gama=p["gama"],
-            segmento=p["segmento_nombre"],
-            prima_neta=round(prima_neta, 2),
-            prima_total=round(prima_total, 2),
-            prima_acumulada=round(prima_acum, 2),
-            prima_pendiente=round(prima_pendiente, 2),
-            fecha_inicio=fecha_inicio,
-            fecha_fin=p["fecha_fin"],
-            fecha_proximo_recibo=fecha_prox,
-            status=p["status_recibo"],
-            mystatus=mystatus,
-            dias_vencimiento=dias_venc,
-            prioridad=prio,
-            recibo_actual=recibo_actual,
-            moneda=p["moneda"],
-        ))
+def _cancelada(c) -> PolizaCancelada:
+    prima_n = c["prima_orden"]
+    prima_a = c["prima_cobrada"]
+    return PolizaCancelada(
+        poliza=c["poliza_original"],
+        contratante=c["contratante_nombre"],
+        agente_nombre=c["agente_nombre"],
+        agente_clave=c["codigo_agente"],
+        ramo=c["ramo_nombre"],
+        prima_neta=round(prima_n, 2),
+        prima_acumulada=round(prima_a, 2),
+        prima_perdida=round(max(0, prima_n - prima_a), 2),
+        fecha_inicio=c["fecha_inicio"],
+        mystatus=c["mystatus"],
+        motivo=c["estatus_detalle"] or c["mystatus"],
+        estatus_detalle=c["estatus_detalle"],
+    )
 
-    # Ordenar por prioridad: critico > urgente > atencion > al_dia > pagado
-    orden_prio = {"critico": 0, "urgente": 1, "atencion": 2, "al_dia": 3, "pagado": 4}
-    deudores.sort(key=lambda d: (orden_prio.get(d.prioridad, 5), -d.dias_vencimiento))
 
-    # ── 2. RESUMEN ──
-    criticas = sum(1 for d in deudores if d.prioridad == "critico")
-    urgentes = sum(1 for d in deudores if d.prioridad == "urgente")
-    atencion = sum(1 for d in deudores if d.prioridad == "atencion")
-    al_dia = sum(1 for d in deudores if d.prioridad == "al_dia")
-    pagadas = sum(1 for d in deudores if d.prioridad == "pagado")
-    prima_por_cobrar = sum(d.prima_pendiente for d in deudores)
-    prima_cobrada = sum(d.prima_acumulada for d in deudores)
-    total_prima = prima_por_cobrar + prima_cobrada
+def _resumen_cobranza(db: Session, anio: int, ramo, prioridad, agente_codigo, hoy) -> dict:
+    """KPIs, alertas y seguimiento mensual con agregados SQL (sin traer las listas)."""
+    from datetime import timedelta
 
+    # ── Resumen del semáforo ──
+    params: dict = {}
+    where = _where_deudores(db, anio, ramo, prioridad, agente_codigo, None, params)
+    r = db.execute(text(f"""
+        SELECT COUNT(*) as total,
+               SUM(CASE WHEN d.prioridad = 'critico' THEN 1 ELSE 0 END) as criticas,
+               SUM(CASE WHEN d.prioridad = 'urgente' THEN 1 ELSE 0 END) as urgentes,
+               SUM(CASE WHEN d.prioridad = 'atencion' THEN 1 ELSE 0 END) as atencion,
+               SUM(CASE WHEN d.prioridad = 'al_dia' THEN 1 ELSE 0 END) as al_dia,
+               SUM(CASE WHEN d.prioridad = 'pagado' THEN 1 ELSE 0 END) as pagadas,
+               SUM(CASE WHEN d.prioridad = 'urgente' THEN d.prima_pendiente ELSE 0 END) as pendiente_urgente,
+               COALESCE(SUM(d.prima_pendiente), 0) as por_cobrar,
+               COALESCE(SUM(d.prima_acumulada), 0) as cobrada
+        FROM deudores_prima d JOIN polizas p ON p.id = d.poliza_id {JOINS_CARTERA}
+        WHERE {where}
+    """), params).mappings().one()
+    criticas, urgentes = r["criticas"] or 0, r["urgentes"] or 0
+    total_prima = r["por_cobrar"] + r["cobrada"]
     resumen = CobranzaResumen(
-        total_polizas=len(deudores),
+        total_polizas=r["total"],
         criticas=criticas,
         urgentes=urgentes,
-        atencion=atencion,
-        al_dia=al_dia,
-        pagadas=pagadas,
-        prima_por_cobrar=round(prima_por_cobrar, 2),
-        prima_cobrada=round(prima_cobrada, 2),
-        pct_cobranza=round((prima_cobrada / total_prima * 100) if total_prima > 0 else 0, 1),
+        atencion=r["atencion"] or 0,
+        al_dia=r["al_dia"] or 0,
+        pagadas=r["pagadas"] or 0,
+        prima_por_cobrar=round(r["por_cobrar"], 2),
+        prima_cobrada=round(r["cobrada"], 2),
+        pct_cobranza=round((r["cobrada"] / total_prima * 100) if total_prima > 0 else 0, 1),
     )
 
-    # ── 3. RENOVACIONES PENDIENTES ──
-    renovaciones_raw = db.execute(text(f"""
-        SELECT p.poliza_original, p.contratante_nombre, p.fecha_fin, p.prima_neta,
-               p.status_recibo, p.mystatus,
-               pr.ramo_nombre, a.codigo_agente, a.nombre_completo as agente_nombre
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.fecha_fin IS NOT NULL AND p.fecha_fin != ''
-          AND p.fecha_fin >= :hoy_m60 AND p.fecha_fin <= :hoy_p90
-          {filtro_ramo} {filtro_agente}
-        ORDER BY p.fecha_fin ASC
-    """), {**params, "hoy_m60": (hoy - timedelta(days=60)).strftime("%Y-%m-%d"),
-           "hoy_p90": (hoy + timedelta(days=90)).strftime("%Y-%m-%d")}).mappings().all()
-
-    renovaciones = []
-    for r in renovaciones_raw:
-        fecha_fin = r["fecha_fin"] or ""
-        dias_ren = 0
-        estado_ren = "por_vencer"
-        if fecha_fin and len(fecha_fin) >= 10:
-            try:
-                ff = datetime.strptime(fecha_fin[:10], "%Y-%m-%d")
-                dias_ren = (ff - hoy).days
-                if dias_ren < 0:
-                    estado_ren = "vencida"
-                elif dias_ren <= 30:
-                    estado_ren = "por_vencer"
-                else:
-                    estado_ren = "por_vencer"
-            except ValueError:
-                pass
-
-        ms = (r["mystatus"] or "").upper()
-        if "PAGADA" in ms or "AL CORRIENTE" in ms or "REHABILITADA" in ms:
-            estado_ren = "renovada"
-
-        renovaciones.append(RenovacionPendiente(
-            poliza=r["poliza_original"],
-            contratante=r["contratante_nombre"],
-            agente_nombre=r["agente_nombre"],
-            agente_clave=r["codigo_agente"],
-            ramo=r["ramo_nombre"],
-            prima_neta=round(r["prima_neta"] or 0, 2),
-            fecha_fin=fecha_fin,
-            dias_para_renovar=dias_ren,
-            status=r["status_recibo"],
-            estado_renovacion=estado_ren,
-        ))
-
-    # ── 4. PÓLIZAS CANCELADAS ──
-    canceladas_raw = db.execute(text(f"""
-        SELECT p.poliza_original, p.contratante_nombre, p.prima_neta,
-               p.prima_acumulada_basica, p.neta_acumulada, p.fecha_inicio,
-               p.mystatus, p.estatus_detalle,
-               pr.ramo_nombre, a.codigo_agente, a.nombre_completo as agente_nombre
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE p.anio_aplicacion = :anio
-          AND (p.mystatus LIKE '%CANCELADA%' OR p.mystatus LIKE '%CANC%'
-               OR p.flag_cancelada = 0)
-          {filtro_ramo} {filtro_agente}
-        ORDER BY p.prima_neta DESC
-    """), params).mappings().all()
-
-    canceladas = []
-    for c in canceladas_raw:
-        prima_n = c["prima_neta"] or 0
-        prima_a = c["prima_acumulada_basica"] or c["neta_acumulada"] or 0
-        canceladas.append(PolizaCancelada(
-            poliza=c["poliza_original"],
-            contratante=c["contratante_nombre"],
-            agente_nombre=c["agente_nombre"],
-            agente_clave=c["codigo_agente"],
-            ramo=c["ramo_nombre"],
-            prima_neta=round(prima_n, 2),
-            prima_acumulada=round(prima_a, 2),
-            prima_perdida=round(max(0, prima_n - prima_a), 2),
-            fecha_inicio=c["fecha_inicio"],
-            mystatus=c["mystatus"],
-            motivo=c["estatus_detalle"] or c["mystatus"],
-            estatus_detalle=c["estatus_detalle"],
-        ))
-
-    # ── 5. ALERTAS ──
+    # ── Alertas ──
     alertas = []
     if criticas > 0:
-        top_criticas = [d for d in deudores if d.prioridad == "critico"][:3]
+        top = db.execute(text(f"""
+            SELECT d.prima_pendiente, d.dias_vencimiento
+            FROM deudores_prima d JOIN polizas p ON p.id = d.poliza_id {JOINS_CARTERA}
+            WHERE {where} AND d.orden_prioridad = :orden_critico
+            ORDER BY d.dias_vencimiento DESC, d.poliza_id
+            LIMIT 3
+        """), {**params, "orden_critico": ORDEN_PRIORIDAD["critico"]}).fetchall()
         alertas.append(AlertaCobranza(
             tipo="vencido", icono="🔴",
             titulo=f"{criticas} póliza{'s' if criticas > 1 else ''} en estado CRÍTICO",
-            descripcion=f"Recibos vencidos por más de 30 días. Prima en riesgo: {round(sum(d.prima_pendiente for d in top_criticas), 2):,.0f} MXN",
-            dias=max((d.dias_vencimiento for d in top_criticas), default=0),
-            monto=sum(d.prima_pendiente for d in top_criticas),
+            descripcion=f"Recibos vencidos por más de 30 días. Prima en riesgo: {round(sum(t[0] for t in top), 2):,.0f} MXN",
+            dias=max((t[1] for t in top), default=0),
+            monto=sum(t[0] for t in top),
         ))
 
     if urgentes > 0:
@@ -2001,61 +1829,206 @@ def get_cobranza(
             tipo="por_cancelar", icono="🟠",
             titulo=f"{urgentes} póliza{'s' if urgentes > 1 else ''} URGENTES",
             descripcion=f"Recibos vencidos entre 15-30 días. Cobrar antes de que se cancelen.",
-            monto=sum(d.prima_pendiente for d in deudores if d.prioridad == "urgente"),
+            monto=r["pendiente_urgente"] or 0,
         ))
 
-    ren_por_vencer = [r for r in renovaciones if r.estado_renovacion == "por_vencer" and r.dias_para_renovar <= 30]
-    if len(ren_por_vencer) > 0:
+    p_ren: dict = {"hoy_p31": (hoy + timedelta(days=31)).strftime("%Y-%m-%d")}
+    where_ren = _where_renovaciones(db, ramo, "por_vencer", agente_codigo, None, p_ren, hoy)
+    n_ren, prima_ren = db.execute(text(f"""
+        SELECT COUNT(*), COALESCE(SUM(p.prima_neta), 0) FROM polizas p {JOINS_CARTERA}
+        WHERE {where_ren} AND p.fecha_fin <= :hoy_p31
+    """), p_ren).one()
+    if n_ren > 0:
         alertas.append(AlertaCobranza(
             tipo="renovacion", icono="🔄",
-            titulo=f"{len(ren_por_vencer)} renovación(es) en los próximos 30 días",
-            descripcion=f"Prima de renovación: {round(sum(r.prima_neta for r in ren_por_vencer), 2):,.0f} MXN",
-            monto=sum(r.prima_neta for r in ren_por_vencer),
+            titulo=f"{n_ren} renovación(es) en los próximos 30 días",
+            descripcion=f"Prima de renovación: {round(prima_ren, 2):,.0f} MXN",
+            monto=prima_ren,
         ))
 
-    if len(canceladas) > 0:
-        prima_perdida_total = sum(c.prima_perdida for c in canceladas)
+    p_canc: dict = {}
+    where_canc = _where_canceladas(db, anio, ramo, agente_codigo, None, p_canc)
+    n_canc, prima_perdida_total = db.execute(text(f"""
+        SELECT COUNT(*), COALESCE(SUM(CASE WHEN COALESCE(p.prima_neta, 0) > {SQL_PRIMA_COBRADA_CANCELADA}
+                                           THEN COALESCE(p.prima_neta, 0) - {SQL_PRIMA_COBRADA_CANCELADA}
+                                           ELSE 0 END), 0)
+        FROM polizas p {JOINS_CARTERA}
+        WHERE {where_canc}
+    """), p_canc).one()
+    if n_canc > 0:
         alertas.append(AlertaCobranza(
             tipo="cancelada", icono="⚠️",
-            titulo=f"{len(canceladas)} póliza{'s' if len(canceladas) > 1 else ''} cancelada{'s' if len(canceladas) > 1 else ''}",
+            titulo=f"{n_canc} póliza{'s' if n_canc > 1 else ''} cancelada{'s' if n_canc > 1 else ''}",
             descripcion=f"Prima perdida acumulada: ${prima_perdida_total:,.0f} MXN",
             monto=prima_perdida_total,
         ))
 
-    # ── 6. SEGUIMIENTO MENSUAL DE COBRANZA ──
+    # ── Seguimiento mensual de cobranza (por mes de inicio de la póliza) ──
+    por_mes = {row["periodo"]: row for row in db.execute(text(f"""
+        SELECT SUBSTR(p.fecha_inicio, 1, 7) as periodo, COUNT(*) as polizas,
+               SUM(d.prima_acumulada) as cobrado, SUM(d.prima_neta) as meta
+        FROM deudores_prima d JOIN polizas p ON p.id = d.poliza_id {JOINS_CARTERA}
+        WHERE {where}
+        GROUP BY SUBSTR(p.fecha_inicio, 1, 7)
+    """), params).mappings()}
     seguimiento = []
     for m in range(1, 13):
-        per = f"{anio}-{m:02d}"
-        pols_mes = [d for d in deudores if (d.fecha_inicio or "")[:7] == per]
-        cobrado = sum(d.prima_acumulada for d in pols_mes)
-        total = sum(d.prima_neta for d in pols_mes)
+        mes = por_mes.get(f"{anio}-{m:02d}")
+        cobrado = (mes["cobrado"] or 0) if mes else 0
+        total = (mes["meta"] or 0) if mes else 0
         seguimiento.append(SeguimientoMensual(
             mes=MESES_COMPLETOS.get(m, str(m)),
             mes_num=m,
             meta=round(total, 2),
             cobrado=round(cobrado, 2),
             pct=round((cobrado / total * 100) if total > 0 else 0, 1),
-            polizas=len(pols_mes),
+            polizas=mes["polizas"] if mes else 0,
         ))
 
     # ── Filtros disponibles ──
     ramos_db = db.execute(text("SELECT DISTINCT ramo_nombre FROM productos WHERE ramo_nombre IS NOT NULL")).scalars().all()
 
-    return CobranzaResponse(
-        resumen=resumen,
-        deudores=deudores,
-        renovaciones=renovaciones,
-        canceladas=canceladas,
-        alertas=alertas,
-        seguimiento_mensual=seguimiento,
-        filtros_disponibles={
+    return {
+        "resumen": resumen,
+        "alertas": alertas,
+        "seguimiento_mensual": seguimiento,
+        "filtros_disponibles": {
             "ramos": list(ramos_db),
-            "prioridades": ["critico", "urgente", "atencion", "al_dia", "pagado"],
+            "prioridades": list(PRIORIDADES),
+            "estados_renovacion": list(ESTADOS_RENOVACION),
+            "ordenes_deudores": list(ORDEN_DEUDORES),
             "anios": [2022, 2023, 2024, 2025, 2026],
-        }
+        },
+    }
+
+
+@router_cobranza.get("", response_model=CobranzaResponse)
+@cacheado("cobranza")
+def get_cobranza(
+    anio: int = Query(2025, description="Año de análisis"),
+    ramo: Optional[str] = Query(None, description="Filtrar por ramo: vida, gmm"),
+    prioridad: Optional[str] = Query(None, description="Filtrar por prioridad: critico, urgente, atencion, al_dia, pagado"),
+    agente_codigo: Optional[str] = Query(None, description="Filtrar por código de agente"),
+    db: Session = Depends(get_db)
+):
+    """
+    Módulo de Cobranza y Deudor por Prima (Fase 2).
+    Vista de priorización visual con semáforo de urgencia.
+    Entrega las listas completas: para pantallas usar /cobranza/resumen y las
+    listas paginadas (/deudores, /renovaciones, /canceladas).
+    """
+    from datetime import datetime
+
+    hoy = datetime.now()
+    asegurar_cobranza(db)
+
+    params: dict = {}
+    where = _where_deudores(db, anio, ramo, prioridad, agente_codigo, None, params)
+    deudores, _ = _filas_ordenadas(db, SELECT_DEUDORES, where, params, ORDEN_DEUDORES["prioridad"])
+
+    params = {}
+    where = _where_renovaciones(db, ramo, None, agente_codigo, None, params, hoy)
+    renovaciones, _ = _filas_ordenadas(db, SELECT_RENOVACIONES, where, params, ORDEN_RENOVACIONES)
+
+    params = {}
+    where = _where_canceladas(db, anio, ramo, agente_codigo, None, params)
+    canceladas, _ = _filas_ordenadas(db, SELECT_CANCELADAS, where, params, ORDEN_CANCELADAS)
+
+    return CobranzaResponse(
+        deudores=[_deudor(p) for p in deudores],
+        renovaciones=[_renovacion(r, hoy) for r in renovaciones],
+        canceladas=[_cancelada(c) for c in canceladas],
+        **_resumen_cobranza(db, anio, ramo, prioridad, agente_codigo, hoy),
     )
 
 
+@router_cobranza.get("/resumen", response_model=CobranzaResumenResponse)
+@cacheado("cobranza/resumen")
+def get_cobranza_resumen(
+    anio: int = Query(2025, description="Año de análisis"),
+    ramo: Optional[str] = Query(None, description="Filtrar por ramo: vida, gmm, autos"),
+    prioridad: Optional[str] = Query(None, description="Filtrar por prioridad: critico, urgente, atencion, al_dia, pagado"),
+    agente_codigo: Optional[str] = Query(None, description="Filtrar por código de agente"),
+    db: Session = Depends(get_db)
+):
+    """KPIs del semáforo, alertas y seguimiento mensual (primera carga de la pantalla de cobranza)."""
+    from datetime import datetime
+
+    asegurar_cobranza(db)
+    return CobranzaResumenResponse(**_resumen_cobranza(db, anio, ramo, prioridad, agente_codigo, datetime.now()))
+
+
+@router_cobranza.get("/deudores", response_model=DeudoresPagina)
+def list_deudores(
+    anio: int = Query(2025, description="Año de análisis"),
+    ramo: Optional[str] = Query(None, description="Filtrar por ramo: vida, gmm, autos"),
+    prioridad: Optional[str] = Query(None, description="Filtrar por prioridad: critico, urgente, atencion, al_dia, pagado"),
+    agente_codigo: Optional[str] = Query(None, description="Filtrar por código de agente"),
+    q: Optional[str] = Query(None, description="Búsqueda por póliza/asegurado/contratante/RFC o código de agente"),
+    orden: str = Query("prioridad", description="prioridad | dias | prima_pendiente"),
+    after: Optional[str] = Query(None, description="Cursor (next_cursor de la página anterior)"),
+    limit: int = Query(50, ge=1, le=500),
+    conteo: str = Query("exacto", description="Total: exacto | estimado | ninguno"),
+    db: Session = Depends(get_db)
+):
+    """Deudores por prima paginados por cursor, en el orden del semáforo o por días / prima pendiente."""
+    if orden not in ORDEN_DEUDORES:
+        raise HTTPException(400, f"orden debe ser uno de: {', '.join(ORDEN_DEUDORES)}")
+    asegurar_cobranza(db)
+    params: dict = {}
+    where = _where_deudores(db, anio, ramo, prioridad, agente_codigo, q, params)
+    # Sin filtros de póliza/producto/agente el conteo no necesita los JOIN
+    desde = (f"FROM deudores_prima d JOIN polizas p ON p.id = d.poliza_id {JOINS_CARTERA} WHERE {where}"
+             if ramo or agente_codigo or q else f"FROM deudores_prima d WHERE {where}")
+    total, estimado = contar(db, desde, params, conteo)
+    rows, next_cursor = _filas_ordenadas(db, SELECT_DEUDORES, where, params, ORDEN_DEUDORES[orden], after, limit)
+    return DeudoresPagina(data=[_deudor(p) for p in rows], total=total, limit=limit,
+                          total_estimado=estimado, next_cursor=next_cursor)
+
+
+@router_cobranza.get("/renovaciones", response_model=RenovacionesPagina)
+def list_renovaciones(
+    ramo: Optional[str] = Query(None, description="Filtrar por ramo: vida, gmm, autos"),
+    estado: Optional[str] = Query(None, description="por_vencer | vencida | renovada"),
+    agente_codigo: Optional[str] = Query(None, description="Filtrar por código de agente"),
+    q: Optional[str] = Query(None, description="Búsqueda por póliza/asegurado/contratante/RFC o código de agente"),
+    after: Optional[str] = Query(None, description="Cursor 'fecha_fin,id' (next_cursor de la página anterior)"),
+    limit: int = Query(50, ge=1, le=500),
+    conteo: str = Query("exacto", description="Total: exacto | estimado | ninguno"),
+    db: Session = Depends(get_db)
+):
+    """Pólizas con fin de vigencia entre hoy-60 y hoy+90 días, por fecha_fin."""
+    from datetime import datetime
+
+    hoy = datetime.now()
+    params: dict = {}
+    where = _where_renovaciones(db, ramo, estado, agente_codigo, q, params, hoy)
+    total, estimado = contar(db, f"FROM polizas p {JOINS_CARTERA} WHERE {where}", params, conteo)
+    rows, next_cursor = _filas_ordenadas(db, SELECT_RENOVACIONES, where, params, ORDEN_RENOVACIONES, after, limit)
+    return RenovacionesPagina(data=[_renovacion(r, hoy) for r in rows], total=total, limit=limit,
+                              total_estimado=estimado, next_cursor=next_cursor)
+
+
+@router_cobranza.get("/canceladas", response_model=CanceladasPagina)
+def list_canceladas(
+    anio: int = Query(2025, description="Año de análisis"),
+    ramo: Optional[str] = Query(None, description="Filtrar por ramo: vida, gmm, autos"),
+    agente_codigo: Optional[str] = Query(None, description="Filtrar por código de agente"),
+    q: Optional[str] = Query(None, description="Búsqueda por póliza/asegurado/contratante/RFC o código de agente"),
+    after: Optional[str] = Query(None, description="Cursor 'prima_neta,id' (next_cursor de la página anterior)"),
+    limit: int = Query(50, ge=1, le=500),
+    conteo: str = Query("exacto", description="Total: exacto | estimado | ninguno"),
+    db: Session = Depends(get_db)
+):
+    """Pólizas canceladas del año por prima neta descendente."""
+    params: dict = {}
+    where = _where_canceladas(db, anio, ramo, agente_codigo, q, params)
+    total, estimado = contar(db, f"FROM polizas p {JOINS_CARTERA} WHERE {where}", params, conteo)
+    rows, next_cursor = _filas_ordenadas(db, SELECT_CANCELADAS, where, params, ORDEN_CANCELADAS, after, limit)
+    return CanceladasPagina(data=[_cancelada(c) for c in rows], total=total, limit=limit,
+                            total_estimado=estimado, next_cursor=next_cursor)
+
+
 # ═══════════════════════════════════════════════════════════════════
 # PÓLIZAS
 # ═══════════════════════════════════════════════════════════════════
@@ -2072,8 +2045,14 @@ def list_polizas(
     agente: Optional[str] = None,
     anio: Optional[int] = None,
     q: Optional[str] = None,
+    after: Optional[str] = Query(None, description="Cursor 'fecha_inicio,id' (next_cursor de la página anterior)"),
+    conteo: str = Query("exacto", description="Total: exacto | estimado | ninguno"),
     db: Session = Depends(get_db)
 ):
+    """
+    Cartera paginada por fecha_inicio DESC, id DESC. Con `after` la página se
+    busca por cursor (keyset, costo constante) en lugar de OFFSET.
+    """
     conditions = ["1=1"]
     params: dict = {}
 
@@ -2095,23 +2074,31 @@ def list_polizas(
         conditions.append("p.anio_aplicacion = :anio")
         params["anio"] = anio
     if q:
-        conditions.append("(p.poliza_original LIKE :q OR p.asegurado_nombre LIKE :q OR a.codigo_agente LIKE :q)")
+        # Índice de trigramas sobre polizas.busqueda (api/busqueda.py) o código de agente
+        asegurar_busqueda(db)
+        conditions.append(f"""({filtro_busqueda(db, "polizas", "p", q, params)}
+            OR p.agente_id IN (SELECT id FROM agentes WHERE codigo_agente LIKE :q))""")
         params["q"] = f"%{q}%"
 
     where = " AND ".join(conditions)
 
-    total_row = db.execute(text(f"""
-        SELECT COUNT(*) as total
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE {where}
-    """), params).mappings().first()
-    total = total_row["total"] if total_row else 0
-
-    offset = (page - 1) * limit
-    params["limit"] = limit
-    params["offset"] = offset
+    # El conteo solo hace los JOIN que usan los filtros (son LEFT JOIN por PK: no cambian el total)
+    joins_conteo = ""
+    if ramo in ("vida", "gmm", "autos"):
+        joins_conteo += " LEFT JOIN productos pr ON p.producto_id = pr.id"
+    if agente:
+        joins_conteo += " LEFT JOIN agentes a ON p.agente_id = a.id"
+    total, estimado = contar(db, f"FROM polizas p {joins_conteo} WHERE {where}", params, conteo)
+
+    cursor = leer_cursor(after)
+    if cursor:
+        where += " AND " + sql_keyset("p.fecha_inicio", "p.id")
+        params["cursor_valor"], params["cursor_id"] = cursor
+        paginado = "LIMIT :limit"
+    else:
+        paginado = "LIMIT :limit OFFSET :offset"
+        params["offset"] = (page - 1) * limit
+    params["limit"] = limit + 1     # Una fila extra indica si hay página siguiente
 
     rows = db.execute(text(f"""
         SELECT p.*,
@@ -2122,14 +2109,18 @@ def list_polizas(
         LEFT JOIN productos pr ON p.producto_id = pr.id
         LEFT JOIN agentes a ON p.agente_id = a.id
         WHERE {where}
-        ORDER BY p.fecha_inicio DESC
-        LIMIT :limit OFFSET :offset
+        ORDER BY p.fecha_inicio DESC, p.id DESC
+        {paginado}
     """), params).mappings().all()
 
+    hay_mas = len(rows) > limit
+    rows = rows[:limit]
     data = [PolizaOut(**dict(r)) for r in rows]
-    pages = max(1, -(-total // limit))  # ceil division
+    pages = max(1, -(-total // limit)) if total is not None else None  # ceil division
+    next_cursor = crear_cursor(rows[-1]["fecha_inicio"], rows[-1]["id"]) if hay_mas else None
 
-    return PolizaListResponse(data=data, total=total, page=page, limit=limit, pages=pages)
+    return PolizaListResponse(data=data, total=total, page=page, limit=limit, pages=pages,
+                              total_estimado=estimado, next_cursor=next_cursor)
 
 
 @router_polizas.post("", status_code=201)
@@ -2137,12 +2128,15 @@ def create_poliza(poliza: PolizaCreate, db: Session = Depends(get_db)):
     nueva = Poliza(
         poliza_original=poliza.poliza_original,
         poliza_estandar=normalizar_poliza(poliza.poliza_original),
+        match_key=clave_cruce(poliza.poliza_original),
         agente_id=poliza.agente_id,
         producto_id=poliza.producto_id,
         asegurado_nombre=poliza.asegurado_nombre,
         rfc=poliza.rfc,
         fecha_inicio=poliza.fecha_inicio,
         fecha_fin=poliza.fecha_fin,
+        fecha_inicio_d=fecha_nativa(poliza.fecha_inicio),
+        fecha_fin_d=fecha_nativa(poliza.fecha_fin),
         prima_total=poliza.prima_total,
         prima_neta=poliza.prima_neta,
         iva=poliza.iva or 0,
@@ -2161,7 +2155,12 @@ def create_poliza(poliza: PolizaCreate, db: Session = Depends(get_db)):
         fuente="MANUAL",
         notas=poliza.notas,
     )
+    nueva.busqueda = busqueda_de("polizas", nueva)
     db.add(nueva)
+    db.flush()
+    refrescar_produccion(db, [nueva.anio_aplicacion])
+    refrescar_cobranza(db, poliza_ids=[nueva.id])
+    invalidar(db)
     db.commit()
     db.refresh(nueva)
     return {"success": True, "id": nueva.id}
@@ -2200,7 +2199,9 @@ def list_agentes(
 @router_agentes.post("", status_code=201)
 def create_agente(agente: AgenteCreate, db: Session = Depends(get_db)):
     nuevo = Agente(**agente.model_dump())
+    nuevo.busqueda = busqueda_de("agentes", nuevo)
     db.add(nuevo)
+    invalidar(db)
     db.commit()
     db.refresh(nuevo)
     return {"success": True, "id": nuevo.id}
@@ -2215,6 +2216,7 @@ router_conciliacion = APIRouter(prefix="/conciliacion", tags=["Conciliación"])
 @router_conciliacion.get("", response_model=ConciliacionResponse)
 def get_conciliacion(
     periodo: Optional[str] = Query(None),
+    recalcular: bool = Query(False, description="Forzar el recálculo aunque la conciliación persistida siga vigente"),
     db: Session = Depends(get_db)
 ):
     if not periodo:
@@ -2222,78 +2224,36 @@ def get_conciliacion(
         periodo = db.execute(text("SELECT MAX(periodo) FROM indicadores_axa")).scalar()
         if not periodo:
             periodo = "2025-12"  # Fallback
-    indicadores = db.execute(text("""
-        SELECT i.*, a.nombre_completo as agente_nombre
-        FROM indicadores_axa i
-        LEFT JOIN agentes a ON a.codigo_agente = i.agente_codigo
-        WHERE i.periodo = :periodo
-    """), {"periodo": periodo}).mappings().all()
 
-    conciliacion = []
-    for ind in indicadores:
-        poliza_int = db.execute(text("""
-            SELECT p.tipo_poliza, p.flag_nueva_formal, pr.ramo_codigo, pr.ramo_nombre
-            FROM polizas p
-            LEFT JOIN productos pr ON p.producto_id = pr.id
-            WHERE p.poliza_estandar = :pe OR p.poliza_original = :po
-        """), {"pe": ind["poliza"], "po": ind["poliza"]}).mappings().first()
+    # Cruce set-based persistido en `conciliaciones`; se reutiliza mientras los datos no cambien
+    asegurar_conciliacion(db, periodo, recalcular)
 
-        if poliza_int:
-            # Usar lógica consistente de nueva/subsecuente
-            int_es_nueva = _es_nueva(poliza_int)
-            axa_es_nueva = bool(ind["es_nueva_axa"])
-
-            coincide = (int_es_nueva == axa_es_nueva)
-            status = "COINCIDE" if coincide else "DIFERENCIA"
-            
-            tipo_pol_int = "NUEVA" if int_es_nueva else "SUBSECUENTE"
-            dif = None if coincide else f"Interno: {tipo_pol_int}, AXA: {'NUEVA' if axa_es_nueva else 'NO NUEVA'}"
+    conciliacion = []
+    for c in leer_conciliacion(db, periodo):
+        if c["indicador_axa_id"] is not None:
+            conciliacion.append(ItemConciliacion(
+                poliza=c["axa_poliza"],
+                agente_codigo=c["axa_agente_codigo"],
+                agente_nombre=c["axa_agente_nombre"],
+                ramo=c["axa_ramo"],
+                prima_primer_anio=c["prima_primer_anio"],
+                es_nueva_axa=bool(c["es_nueva_axa"]),
+                tipo_poliza_interna=c["clasificacion_interna"],
+                status=c["status"],
+                tipo_diferencia=c["tipo_diferencia"],
+            ))
         else:
-            status = "SOLO_AXA"
-            dif = "Póliza en AXA no encontrada en base interna"
-            tipo_pol_int = None
-
-        conciliacion.append(ItemConciliacion(
-            poliza=ind["poliza"],
-            agente_codigo=ind["agente_codigo"],
-            agente_nombre=ind["agente_nombre"],
-            ramo=ind["ramo"],
-            prima_primer_anio=ind["prima_primer_anio"],
-            es_nueva_axa=bool(ind["es_nueva_axa"]),
-            tipo_poliza_interna=tipo_pol_int,
-            status=status,
-            tipo_diferencia=dif,
-        ))
-
-    # ── Solo Interno (No en indicadores AXA) ──
-    # Extraemos pólizas ya procesadas (AXA) para filtrar las internas
-    procesadas_axa = [c.poliza for c in conciliacion]
-    
-    # Buscamos en base interna del mismo periodo que no estén en AXA
-    internal_only = db.execute(text("""
-        SELECT p.poliza_original, p.poliza_estandar, a.codigo_agente, a.nombre_completo as agente_nombre, 
-               pr.ramo_nombre as ramo, p.prima_neta, p.flag_nueva_formal, p.tipo_poliza, pr.ramo_codigo
-        FROM polizas p
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE p.periodo_aplicacion = :periodo
-          AND p.poliza_original NOT IN :paxa
-          AND p.poliza_estandar NOT IN :paxa
-    """), {"periodo": periodo, "paxa": tuple(procesadas_axa) if procesadas_axa else ('',)}).mappings().all()
-
-    for p in internal_only:
-        int_es_nueva = _es_nueva(p)
-        conciliacion.append(ItemConciliacion(
-            poliza=p["poliza_original"],
-            agente_codigo=p["codigo_agente"],
-            agente_nombre=p["agente_nombre"],
-            ramo=p["ramo"] or "VIDA/GMM",
-            prima_primer_anio=p["prima_neta"],
-            es_nueva_axa=None,
-            tipo_poliza_interna="NUEVA" if int_es_nueva else "SUBSECUENTE",
-            status="SOLO_INTERNO",
-            tipo_diferencia="Póliza interna no reportada en indicadores AXA",
-        ))
+            conciliacion.append(ItemConciliacion(
+                poliza=c["poliza_original"],
+                agente_codigo=c["codigo_agente"],
+                agente_nombre=c["agente_nombre"],
+                ramo=c["ramo_nombre"] or "VIDA/GMM",
+                prima_primer_anio=c["prima_neta"],
+                es_nueva_axa=None,
+                tipo_poliza_interna=c["clasificacion_interna"],
+                status=c["status"],
+                tipo_diferencia=c["tipo_diferencia"],
+            ))
 
     coincide_n = sum(1 for c in conciliacion if c.status == "COINCIDE")
     dif_n      = sum(1 for c in conciliacion if c.status == "DIFERENCIA")
@@ -2338,8 +2298,9 @@ async def importar_csv_polizas(
     Importa pólizas desde un archivo CSV con encabezados.
     1. Limpia la tabla pólizas completamente
     2. Lee el CSV (auto-detecta encoding utf-8/latin1)
-    3. Determina ramo (VIDA/GMM) por columna NOMRAMO
-    4. Aplica reglas de negocio automáticamente
+    3. Limpia columnas y determina ramo (VIDA/GMM) de forma vectorizada
+    4. Resuelve agentes/productos con mapas precargados
+    5. Aplica reglas de negocio e inserta en lotes (ver api/importar_polizas.py)
     """
     if not archivo.filename.endswith(".csv"):
         raise HTTPException(400, "Solo se aceptan archivos CSV (.csv)")
@@ -2352,209 +2313,23 @@ async def importar_csv_polizas(
         # ── Paso 0: Limpiar tabla pólizas ──
         count_antes = db.execute(text("SELECT COUNT(*) FROM polizas")).scalar() or 0
         db.execute(text("DELETE FROM polizas"))
+        db.execute(text("DELETE FROM produccion_mensual_agg"))
+        db.execute(text("DELETE FROM recibos_cobranza"))
+        db.execute(text("DELETE FROM deudores_prima"))
+        invalidar(db)
         db.commit()
         errores.append(f"INFO: Tabla polizas limpiada ({count_antes} registros anteriores eliminados)")
 
         # ── Paso 1: Leer CSV (auto-detectar encoding) ──
-        df = None
-        for enc in ["utf-8-sig", "utf-8", "latin1", "cp1252"]:
-            try:
-                df = pd.read_csv(io.BytesIO(contenido), dtype=str, encoding=enc, on_bad_lines="skip")
-                break
-            except (UnicodeDecodeError, Exception):
-                continue
-
+        df = leer_csv_polizas(contenido)
         if df is None:
             raise HTTPException(400, "No se pudo decodificar el archivo CSV.")
 
-        df.columns = [c.strip().upper() for c in df.columns]
-        df = df.where(pd.notna(df), None)
-
         errores.append(f"INFO: CSV leido: {len(df)} filas, {len(df.columns)} columnas")
         errores.append(f"INFO: Columnas encontradas: {', '.join(list(df.columns)[:15])}")
 
-        # ── Paso 2: Importar filas ──
-        for i, row in df.iterrows():
-            try:
-                pol_num = row.get("POLIZA")
-                if not pol_num:
-                    continue
-
-                agente_codigo = row.get("AGENTE")
-                agente_id = None
-                if agente_codigo:
-                    ag = db.execute(
-                        text("SELECT id FROM agentes WHERE codigo_agente = :c"),
-                        {"c": str(agente_codigo).strip()}
-                    ).scalar()
-                    agente_id = ag
-
-                # Helper: limpiar valores nan de string
-                def clean(v):
-                    if v is None: return None
-                    s = str(v).strip()
-                    return None if s.lower() == "nan" or s == "" else s
-
-                # Determinar ramo: usar columna RAMO (codigo) o NOMRAMO (texto)
-                ramo_col = clean(row.get("RAMO"))
-                ramo_raw = (clean(row.get("NOMRAMO")) or "").upper()
-                if ramo_col:
-                    try:
-                        ramo_codigo = int(float(ramo_col))
-                    except Exception:
-                        # Fallback por nombre
-                        if "VIDA" in ramo_raw:
-                            ramo_codigo = 11
-                        elif "AUTO" in ramo_raw:
-                            ramo_codigo = 90
-                        else:
-                            ramo_codigo = 34
-                else:
-                    if "VIDA" in ramo_raw:
-                        ramo_codigo = 11
-                    elif "AUTO" in ramo_raw:
-                        ramo_codigo = 90
-                    else:
-                        ramo_codigo = 34
-                gama = clean(row.get("GAMA"))
-
-                prod = db.execute(text(
-                    "SELECT id FROM productos WHERE ramo_codigo = :rc ORDER BY id LIMIT 1"
-                ), {"rc": ramo_codigo}).scalar()
-
-                # Auto-crear producto si no existe
-                if not prod:
-                    RAMO_NOMBRES = {
-                        11: "VIDA",
-                        34: "GASTOS MEDICOS MAYORES INDIVIDUAL",
-                        90: "Individual Automoviles",
-                    }
-                    ramo_nombre = RAMO_NOMBRES.get(ramo_codigo, ramo_raw or f"RAMO_{ramo_codigo}")
-                    db.execute(text(
-                        "INSERT INTO productos (ramo_codigo, ramo_nombre, plan) VALUES (:rc, :rn, :pl)"
-                    ), {"rc": ramo_codigo, "rn": ramo_nombre, "pl": ramo_nombre})
-                    db.flush()
-                    prod = db.execute(text(
-                        "SELECT id FROM productos WHERE ramo_codigo = :rc ORDER BY id LIMIT 1"
-                    ), {"rc": ramo_codigo}).scalar()
-
-                # Fechas (soporta dd-MMM-yy estilo Oracle y yyyy-mm-dd)
-                def parse_date(v):
-                    s = clean(v)
-                    if not s:
-                        return None
-                    if len(s) >= 10 and s[4] == "-":
-                        return s[:10]
-                    try:
-                        from datetime import datetime as dt
-                        return dt.strptime(s, "%d-%b-%y").strftime("%Y-%m-%d")
-                    except Exception:
-                        pass
-                    for fmt in ["%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y"]:
-                        try:
-                            from datetime import datetime as dt
-                            return dt.strptime(s, fmt).strftime("%Y-%m-%d")
-                        except Exception:
-                            continue
-                    return None
-
-                fecha_ini = parse_date(row.get("FECINI"))
-                fecha_fin = parse_date(row.get("FECFIN"))
-                anio = int(fecha_ini[:4]) if fecha_ini and len(fecha_ini) >= 4 else None
-
-                def to_float(v):
-                    s = clean(v)
-                    if not s:
-                        return None
-                    try:
-                        return float(s.replace(",", ""))
-                    except Exception:
-                        return None
-
-                prima_neta = to_float(row.get("PRIMANETA"))
-                prima_total = to_float(row.get("PRIMA_TOT"))
-                iva = to_float(row.get("IVA")) or 0
-                recargo = to_float(row.get("RECARGO")) or 0
-                suma = to_float(row.get("SUMA"))
-                deducible = to_float(row.get("DEDUCIBLE"))
-
-                status = clean(row.get("STATUS")) or "VIGENTE"
-                mystatus_csv = clean(row.get("MYSTATUS"))
-                mystatus = mystatus_csv if mystatus_csv else calcular_mystatus(status)
-                moneda = clean(row.get("MON")) or "MN"
-
-                poliza_dict = {
-                    "poliza_original": str(pol_num).strip(),
-                    "fecha_inicio": fecha_ini,
-                    "prima_neta": prima_neta,
-                    "moneda": moneda,
-                    "mystatus": mystatus,
-                    "status_recibo": status,
-                    "anio_aplicacion": anio,
-                    "es_nueva": clean(row.get("NUEVA")),
-                }
-                reglas = aplicar_reglas_poliza(poliza_dict, ramo_codigo=ramo_codigo)
-
-                db.execute(text("""
-                    INSERT INTO polizas (
-                        poliza_original, poliza_estandar, agente_id, producto_id,
-                        asegurado_nombre, fecha_inicio, fecha_fin, fecha_emision,
-                        prima_total, prima_neta, iva, recargo, suma_asegurada,
-                        deducible, num_asegurados, forma_pago, tipo_pago,
-                        status_recibo, gama, mystatus, periodo_aplicacion,
-                        anio_aplicacion, moneda, fuente,
-                        largo_poliza, raiz_poliza_6, terminacion, id_compuesto,
-                        es_reexpedicion, primer_anio, fecha_aplicacion,
-                        mes_aplicacion, pendientes_pago, trimestre,
-                        flag_pagada, flag_nueva_formal, prima_anual_pesos,
-                        equivalencias_emitidas, equivalencias_pagadas,
-                        flag_cancelada, prima_proporcional, condicional_prima,
-                        prima_acumulada_basica
-                    ) VALUES (
-                        :po, :pe, :ai, :pi,
-                        :an, :fi, :ff, :fe,
-                        :pt, :pn, :iv, :re, :su,
-                        :de, :na, :fp, :tp,
-                        :sr, :ga, :ms, :per,
-                        :anio, :mon, 'CSV_IMPORT',
-                        :largo, :raiz6, :term, :id_comp,
-                        :reexp, :primer, :fec_apli,
-                        :mes_apli, :pend, :trim,
-                        :fpag, :fnueva, :pap,
-                        :eqe, :eqp,
-                        :fcanc, :pprop, :cprim,
-                        :pacum
-                    )
-                """), {
-                    "po": str(pol_num).strip(),
-                    "pe": normalizar_poliza(str(pol_num).strip()),
-                    "ai": agente_id, "pi": prod,
-                    "an": clean(row.get("ASEGURADO")), "fi": fecha_ini,
-                    "ff": fecha_fin, "fe": parse_date(row.get("FECEMI")),
-                    "pt": prima_total, "pn": prima_neta, "iv": iva, "re": recargo,
-                    "su": suma, "de": deducible,
-                    "na": int(float(clean(row.get("ASEGS")) or "1")),
-                    "fp": clean(row.get("FP")), "tp": clean(row.get("TIPPAG")),
-                    "sr": status, "ga": gama, "ms": mystatus,
-                    "per": f"{anio}-{fecha_ini[5:7]}" if fecha_ini and anio else None,
-                    "anio": anio, "mon": moneda,
-                    "largo": reglas["largo_poliza"], "raiz6": reglas["raiz_poliza_6"],
-                    "term": reglas["terminacion"], "id_comp": reglas["id_compuesto"],
-                    "reexp": reglas["es_reexpedicion"], "primer": reglas["primer_anio"],
-                    "fec_apli": reglas["fecha_aplicacion"], "mes_apli": reglas["mes_aplicacion"],
-                    "pend": reglas["pendientes_pago"], "trim": reglas["trimestre"],
-                    "fpag": reglas["flag_pagada"], "fnueva": reglas["flag_nueva_formal"],
-                    "pap": reglas["prima_anual_pesos"], "eqe": reglas["equivalencias_emitidas"],
-                    "eqp": reglas["equivalencias_pagadas"], "fcanc": reglas["flag_cancelada"],
-                    "pprop": reglas["prima_proporcional"], "cprim": reglas["condicional_prima"],
-                    "pacum": reglas["prima_acumulada_basica"],
-                })
-                nuevos += 1
-
-            except Exception as e:
-                errores.append(f"Fila {i+2}: {str(e)}")
-                continue
-
+        # ── Paso 2: Limpieza vectorizada + inserción en lotes ──
+        nuevos = importar_polizas_df(db, df, errores)
         db.commit()
 
         real_errors = [e for e in errores if not e.startswith("INFO:")]
@@ -2608,70 +2383,33 @@ def aplicar_reglas_todas(
         conditions.append("pr.ramo_codigo = 34")
 
     where = " AND ".join(conditions)
-    rows = db.execute(text(f"""
-        SELECT p.*, pr.ramo_codigo, pr.ramo_nombre
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE {where}
-    """), params).mappings().all()
+    try:
+        # Keyset por bloques → staging → un solo UPDATE ... FROM staging
+        actualizados = recalcular_reglas(db, where, params)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        return ImportacionResult(
+            success=False, registros_procesados=0, registros_nuevos=0,
+            registros_actualizados=0, registros_error=1, errores=[str(e)],
+            mensaje=f"Error al recalcular reglas: {str(e)}"
+        )
 
-    polizas_dicts = [dict(r) for r in rows]
-    if not polizas_dicts:
+    if not actualizados:
         return ImportacionResult(
             success=True, registros_procesados=0, registros_nuevos=0,
             registros_actualizados=0, registros_error=0, errores=[],
             mensaje="No se encontraron pólizas para recalcular"
         )
 
-    resultados = aplicar_reglas_batch(polizas_dicts)
-    actualizados = 0
-    errores = []
-
-    for poliza_dict, reglas in zip(polizas_dicts, resultados):
-        try:
-            db.execute(text("""
-                UPDATE polizas SET
-                    largo_poliza = :largo, raiz_poliza_6 = :raiz6,
-                    terminacion = :term, num_reexpediciones = :nreexp,
-                    id_compuesto = :id_comp,
-                    es_reexpedicion = :reexp, primer_anio = :primer,
-                    fecha_aplicacion = :fec_apli, mes_aplicacion = :mes_apli,
-                    pendientes_pago = :pend, trimestre = :trim,
-                    flag_pagada = :fpag, flag_nueva_formal = :fnueva,
-                    prima_anual_pesos = :pap, equivalencias_emitidas = :eqe,
-                    equivalencias_pagadas = :eqp, flag_cancelada = :fcanc,
-                    prima_proporcional = :pprop, condicional_prima = :cprim,
-                    prima_acumulada_basica = :pacum,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = :id
-            """), {
-                "id": poliza_dict["id"],
-                "largo": reglas["largo_poliza"], "raiz6": reglas["raiz_poliza_6"],
-                "term": reglas["terminacion"], "nreexp": reglas["num_reexpediciones"],
-                "id_comp": reglas["id_compuesto"],
-                "reexp": reglas["es_reexpedicion"], "primer": reglas["primer_anio"],
-                "fec_apli": reglas["fecha_aplicacion"], "mes_apli": reglas["mes_aplicacion"],
-                "pend": reglas["pendientes_pago"], "trim": reglas["trimestre"],
-                "fpag": reglas["flag_pagada"], "fnueva": reglas["flag_nueva_formal"],
-                "pap": reglas["prima_anual_pesos"], "eqe": reglas["equivalencias_emitidas"],
-                "eqp": reglas["equivalencias_pagadas"], "fcanc": reglas["flag_cancelada"],
-                "pprop": reglas["prima_proporcional"], "cprim": reglas["condicional_prima"],
-                "pacum": reglas["prima_acumulada_basica"],
-            })
-            actualizados += 1
-        except Exception as e:
-            errores.append(f"Póliza {poliza_dict.get('poliza_original')}: {str(e)}")
-
-    db.commit()
-
     return ImportacionResult(
         success=True,
-        registros_procesados=len(polizas_dicts),
+        registros_procesados=actualizados,
         registros_nuevos=0,
         registros_actualizados=actualizados,
-        registros_error=len(errores),
-        errores=errores[:10],
-        mensaje=f"Reglas aplicadas: {actualizados} pólizas actualizadas de {len(polizas_dicts)} procesadas"
+        registros_error=0,
+        errores=[],
+        mensaje=f"Reglas aplicadas: {actualizados} pólizas actualizadas de {actualizados} procesadas"
     )
 
 
@@ -2705,21 +2443,22 @@ async def importar_indicadores_axa(
                     try: return float(str(v).replace(",","").strip()) if v else None
                     except: return None
 
-                # Buscar si la póliza existe en base interna
+                # Buscar si la póliza existe en base interna (índice de match_key)
+                clave = clave_cruce(poliza)
                 encontrada = db.execute(
-                    text("SELECT id FROM polizas WHERE poliza_estandar=:pe OR poliza_original=:po"),
-                    {"pe": normalizar_poliza(poliza), "po": poliza}
-                ).scalar()
+                    text("SELECT id FROM polizas WHERE match_key = :mk LIMIT 1"), {"mk": clave}
+                ).scalar() if clave else None
 
                 db.execute(text("""
                     INSERT INTO indicadores_axa (
-                        periodo, fecha_recepcion, poliza, agente_codigo, ramo,
+                        periodo, fecha_recepcion, poliza, match_key, agente_codigo, ramo,
                         num_asegurados, polizas_equivalentes, prima_primer_anio,
                         es_nueva_axa, reconocimiento_antiguedad, encontrada_en_base
-                    ) VALUES (:per, date('now'), :pol, :agc, :ram, :nas, :peq, :ppa, :ean, :rag, :enb)
+                    ) VALUES (:per, date('now'), :pol, :mk, :agc, :ram, :nas, :peq, :ppa, :ean, :rag, :enb)
                 """), {
                     "per": periodo,
                     "pol": poliza,
+                    "mk": clave,
                     "agc": (row.get("AGENTE") or row.get("CLAVE_AGENTE") or "").strip() or None,
                     "ram": (row.get("RAMO") or "").strip() or None,
                     "nas": int(float(row.get("NUM_ASEGURADOS") or 1)),
@@ -2734,6 +2473,7 @@ async def importar_indicadores_axa(
             except Exception as e:
                 errores.append(f"Fila {i+2}: {str(e)}")
 
+        invalidar(db)
         db.commit()
 
         log = Importacion(
@@ -2761,152 +2501,56 @@ async def importar_indicadores_axa(
 
 
 @router_importacion.post("/pagtotal", response_model=ImportacionResult)
-async def importar_pagtotal(
+def importar_pagtotal(
     archivo: UploadFile = File(...),
     limpiar: bool = Query(True, description="Limpiar tabla pagos antes de importar (false para chunks)"),
     actualizar_polizas: bool = Query(True, description="Actualizar prima_acumulada en pólizas después de importar"),
+    chunk_size: int = Query(20000, ge=1000, le=200000, description="Filas por bloque de lectura/inserción"),
     db: Session = Depends(get_db)
 ):
     """
-    Importa pagos desde archivo PAGTOTAL (Excel).
+    Importa pagos desde archivo PAGTOTAL (Excel o CSV) en streaming.
     1. Limpia tabla pagos
-    2. Importa todas las filas con campos mapeados
+    2. Vuelca el upload a disco y lo procesa por bloques de `chunk_size` filas
+       (parseo vectorizado + inserción por bloque; memoria acotada)
     3. Actualiza prima_acumulada_basica en pólizas
+
+    Con `limpiar=true` el DELETE y todos los bloques van en una sola
+    transacción: si el archivo falla a la mitad se revierte todo y `pagos`
+    conserva su contenido anterior. Con `limpiar=false` (modo append) cada
+    bloque se confirma al insertarse; ante un error los bloques previos quedan
+    cargados y el detalle del error indica cuántos pagos se confirmaron.
     """
     if not archivo.filename.endswith((".xlsx", ".xls", ".xlsb", ".csv")):
         raise HTTPException(400, "Solo se aceptan archivos Excel (.xlsx/.xls) o CSV")
 
-    contenido = await archivo.read()
     errores = []
     nuevos = 0
+    tmp_path = None
+    count_antes = db.execute(text("SELECT COUNT(*) FROM pagos")).scalar() or 0
+    cargado = False
 
     try:
         # ── Paso 0: Limpiar tabla pagos (opcional para chunks) ──
+        # Sin commit: el DELETE se confirma junto con el último bloque
         if limpiar:
-            count_antes = db.execute(text("SELECT COUNT(*) FROM pagos")).scalar() or 0
             db.execute(text("DELETE FROM pagos"))
-            db.commit()
             errores.append(f"INFO: Tabla pagos limpiada ({count_antes} registros anteriores)")
         else:
             errores.append("INFO: Modo append (sin limpiar tabla)")
 
-        # ── Paso 1: Leer archivo ──
-        if archivo.filename.endswith(".csv"):
-            for enc in ["utf-8", "latin-1", "cp1252"]:
-                try:
-                    df = pd.read_csv(io.BytesIO(contenido), encoding=enc, dtype=str)
-                    break
-                except:
-                    continue
-            else:
-                raise HTTPException(400, "No se pudo decodificar el CSV")
-        else:
-            xls = pd.ExcelFile(io.BytesIO(contenido))
-            hoja = xls.sheet_names[0]
-            df = pd.read_excel(xls, sheet_name=hoja, dtype=str)
-            errores.append(f"INFO: Leyendo hoja '{hoja}'")
-
-        df.columns = [c.strip().upper() for c in df.columns]
-        df = df.where(pd.notna(df), None)
-        errores.append(f"INFO: {len(df)} filas, {len(df.columns)} columnas")
-
-        # ── Paso 2: Importar filas ──
-        batch = []
-        for i, row in df.iterrows():
-            try:
-                poliza = (row.get("POLIZA") or "").strip()
-                if not poliza or poliza == "nan":
-                    continue
-
-                # Parse fecha
-                def parse_dt(v):
-                    if not v or str(v).strip() in ("", "nan", "None"):
-                        return None
-                    s = str(v).strip()[:10]
-                    for fmt_str in ("%Y-%m-%d", "%d-%b-%y", "%d/%m/%Y"):
-                        try:
-                            from datetime import datetime as _dt
-                            return _dt.strptime(s, fmt_str).strftime("%Y-%m-%d")
-                        except:
-                            continue
-                    return s[:10] if len(s) >= 10 else None
+        # ── Paso 1: Spool del upload a un temporal ──
+        tmp_path = spool_a_temporal(archivo.file, archivo.filename)
 
-                def to_float(v):
-                    try:
-                        return float(str(v).replace(",", "").strip()) if v and str(v).strip() not in ("", "nan") else 0
-                    except:
-                        return 0
-
-                fec_apli = parse_dt(row.get("FECAPLI"))
-                anio = int(fec_apli[:4]) if fec_apli and len(fec_apli) >= 4 else None
-                periodo = f"{fec_apli[:7]}" if fec_apli and len(fec_apli) >= 7 else None
-
-                batch.append({
-                    "poliza_numero": poliza,
-                    "endoso": (row.get("ENDOSO") or "").strip() or None,
-                    "agente_codigo": (row.get("AGENTE") or "").strip() or None,
-                    "contratante": (row.get("CONTRATANTE") or "").strip() or None,
-                    "ramo": (row.get("RAMO") or "").strip() or None,
-                    "moneda": (row.get("MON") or "MN").strip(),
-                    "fecha_inicio": parse_dt(row.get("PERINI")),
-                    "fecha_aplicacion": fec_apli,
-                    "comprobante": (row.get("COMPROBANTE") or "").strip() or None,
-                    "prima_neta": to_float(row.get("NETA")),
-                    "prima_total": to_float(row.get("PRITOT")),
-                    "comision": to_float(row.get("COMISION")),
-                    "comision_derecho": to_float(row.get("COMDERECHO")),
-                    "comision_recargo": to_float(row.get("COMRECARGO")),
-                    "comision_total": to_float(row.get("TOTCOMISION")),
-                    "promotor": (row.get("PROMOTOR") or "").strip() or None,
-                    "poliza_match": (row.get("POLIZA_MATCH") or poliza).strip(),
-                    "anio_aplicacion": anio,
-                    "periodo_aplicacion": periodo,
-                    "fuente": "PAGTOTAL",
-                })
-                nuevos += 1
-
-                # Batch insert every 5000 rows
-                if len(batch) >= 5000:
-                    db.execute(text("""
-                        INSERT INTO pagos (
-                            poliza_numero, endoso, agente_codigo, contratante, ramo, moneda,
-                            fecha_inicio, fecha_aplicacion, comprobante,
-                            prima_neta, prima_total, comision, comision_derecho, comision_recargo,
-                            comision_total, promotor, poliza_match,
-                            anio_aplicacion, periodo_aplicacion, fuente
-                        ) VALUES (
-                            :poliza_numero, :endoso, :agente_codigo, :contratante, :ramo, :moneda,
-                            :fecha_inicio, :fecha_aplicacion, :comprobante,
-                            :prima_neta, :prima_total, :comision, :comision_derecho, :comision_recargo,
-                            :comision_total, :promotor, :poliza_match,
-                            :anio_aplicacion, :periodo_aplicacion, :fuente
-                        )
-                    """), batch)
-                    db.flush()
-                    batch = []
-
-            except Exception as e:
-                errores.append(f"Fila {i+2}: {str(e)}")
-
-        # Insert remaining
-        if batch:
-            db.execute(text("""
-                INSERT INTO pagos (
-                    poliza_numero, endoso, agente_codigo, contratante, ramo, moneda,
-                    fecha_inicio, fecha_aplicacion, comprobante,
-                    prima_neta, prima_total, comision, comision_derecho, comision_recargo,
-                    comision_total, promotor, poliza_match,
-                    anio_aplicacion, periodo_aplicacion, fuente
-                ) VALUES (
-                    :poliza_numero, :endoso, :agente_codigo, :contratante, :ramo, :moneda,
-                    :fecha_inicio, :fecha_aplicacion, :comprobante,
-                    :prima_neta, :prima_total, :comision, :comision_derecho, :comision_recargo,
-                    :comision_total, :promotor, :poliza_match,
-                    :anio_aplicacion, :periodo_aplicacion, :fuente
-                )
-            """), batch)
-
-        db.commit()
+        # ── Paso 2: Leer, parsear e insertar bloque por bloque ──
+        # Con la tabla limpia el ledger de cobranza se recalcula completo al final
+        nuevos = importar_pagtotal_archivo(db, tmp_path, archivo.filename, errores, chunk_size,
+                                           refrescar=not limpiar, confirmar_bloques=not limpiar)
+        if limpiar:
+            refrescar_cobranza(db)
+            invalidar(db)
+            db.commit()
+        cargado = True
 
         # ── Paso 3: Actualizar prima_acumulada_basica en pólizas ──
         updated = 0
@@ -2914,12 +2558,14 @@ async def importar_pagtotal(
             updated = db.execute(text("""
                 UPDATE polizas SET prima_acumulada_basica = sub.total_pagado
                 FROM (
-                    SELECT poliza_match, SUM(prima_neta) as total_pagado
+                    SELECT match_key, SUM(prima_neta) as total_pagado
                     FROM pagos
-                    GROUP BY poliza_match
+                    WHERE match_key IS NOT NULL
+                    GROUP BY match_key
                 ) sub
-                WHERE polizas.poliza_original = sub.poliza_match
+                WHERE polizas.match_key = sub.match_key
             """)).rowcount
+            invalidar(db)
             db.commit()
             errores.append(f"INFO: prima_acumulada_basica actualizada en {updated} pólizas")
         else:
@@ -2949,9 +2595,21 @@ async def importar_pagtotal(
         )
 
     except HTTPException:
+        db.rollback()
         raise
     except Exception as e:
-        raise HTTPException(500, f"Error procesando PAGTOTAL: {str(e)}")
+        db.rollback()
+        if cargado:
+            estado = f"los {nuevos} pagos quedaron cargados; falló un paso posterior"
+        elif limpiar:
+            estado = "la tabla pagos no se modificó"
+        else:
+            confirmados = (db.execute(text("SELECT COUNT(*) FROM pagos")).scalar() or 0) - count_antes
+            estado = f"{confirmados} pagos de bloques previos quedaron confirmados"
+        raise HTTPException(500, f"Error procesando PAGTOTAL ({estado}): {str(e)}")
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -2968,146 +2626,55 @@ def exportar_polizas_excel(
     segmento: Optional[str] = None,
     gestion: Optional[str] = None,
     agente_codigo: Optional[str] = None,
+    formato: str = Query("xlsx", description="xlsx | csv | parquet"),
     db: Session = Depends(get_db)
 ):
-    """Exporta las pólizas filtradas como archivo Excel."""
-    from fastapi.responses import StreamingResponse
-
-    conditions = ["1=1"]
-    params: dict = {}
-    if anio:
-        conditions.append("p.anio_aplicacion = :anio")
-        params["anio"] = anio
-    if ramo == "vida":
-        conditions.append("pr.ramo_codigo = 11")
-    elif ramo == "gmm":
-        conditions.append("pr.ramo_codigo = 34")
-    elif ramo == "autos":
-        conditions.append("pr.ramo_codigo = 90")
-    
-    if tipo:
-        if tipo.upper() == "NUEVA":
-            conditions.append(SQL_ES_NUEVA)
-        elif tipo.upper() == "SUBSECUENTE":
-            conditions.append(SQL_ES_SUBSECUENTE)
-
-    if segmento:
-        conditions.append("a.segmento_agrupado = :seg")
-        params["seg"] = segmento.upper()
-    if gestion:
-        conditions.append("a.gestion_comercial LIKE :gest")
-        params["gest"] = f"%{gestion}%"
-    if agente_codigo:
-        conditions.append("a.codigo_agente = :agc")
-        params["agc"] = agente_codigo
-
-    where = " AND ".join(conditions)
-    rows = db.execute(text(f"""
-        SELECT p.poliza_original, p.asegurado_nombre, a.nombre_completo as agente,
-               a.codigo_agente, a.segmento_agrupado as segmento,
-               pr.ramo_nombre, p.gama, p.fecha_inicio, p.fecha_fin,
-               p.prima_neta, p.prima_total, p.iva, p.forma_pago, p.tipo_pago,
-               p.status_recibo, p.tipo_poliza, p.tipo_prima, p.pct_comision,
-               p.num_asegurados, p.suma_asegurada, p.mystatus, p.periodo_aplicacion
-        FROM polizas p
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        LEFT JOIN agentes a ON p.agente_id = a.id
-        WHERE {where}
-        ORDER BY p.fecha_inicio DESC
-    """), params).mappings().all()
+    """
+    Exporta las pólizas filtradas (xlsx por default, csv o parquet). Se lee y
+    escribe por lotes y se envía en streaming (ver api/exportacion.py).
+    """
+    from datetime import datetime
 
-    df = pd.DataFrame([dict(r) for r in rows])
-
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, sheet_name="Pólizas", index=False)
-        workbook = writer.book
-        worksheet = writer.sheets["Pólizas"]
-        header_fmt = workbook.add_format({"bold": True, "bg_color": "#1e3a5f", "font_color": "white", "border": 1})
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_fmt)
-        worksheet.set_column(0, len(df.columns) - 1, 18)
-
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
+    formato = validar_formato(formato)
+    sql, params = consulta_polizas(anio, ramo, tipo, segmento, gestion, agente_codigo)
+    nombre = f"polizas_{anio or 'todas'}_{datetime.now():%Y%m%d}"
+    return respuesta_exportacion(db, sql, params, COLUMNAS_POLIZAS, formato, nombre, hoja="Pólizas")
 
 
 @router_exportacion.get("/icp-2026-excel")
 def exportar_icp_2026_excel(anio: int = 2026, db: Session = Depends(get_db)):
     """Exporta el reporte consolidado de ICP 2026 (Resumen + Detalle Recluta) a Excel."""
-    from fastapi.responses import StreamingResponse
-    
-    # ── 1. Obtener Resumen General ──
-    # Reuso la lógica del endpoint (simplificado para el script)
-    # [Copia del bloque de consultas de get_icp_2026_status]
-    prima_total = db.execute(text("SELECT SUM(COALESCE(p.prima_neta, 0)) FROM polizas p WHERE p.anio_aplicacion = :anio"), {"anio": anio}).scalar() or 0.0
-    categoria = clasificar_tamano_cartera(prima_total)
-    
-    # KPIs Rápidos
-    recluta_count = db.execute(text("SELECT COUNT(DISTINCT a.id) FROM agentes a JOIN polizas p ON a.id = p.agente_id WHERE a.fecha_alta >= '2023-01-01' AND p.anio_aplicacion = :anio"), {"anio": anio}).scalar() or 0
-    puntos_vida = db.execute(text("SELECT SUM(CASE WHEN COALESCE(p.prima_anual_pesos, 0) >= 100000 THEN 3 WHEN COALESCE(p.prima_anual_pesos, 0) >= 50000 THEN 2 WHEN COALESCE(p.prima_anual_pesos, 0) >= 16000 THEN 1 ELSE 0 END) FROM polizas p LEFT JOIN productos pr ON p.producto_id = pr.id WHERE p.anio_aplicacion = :anio AND pr.ramo_codigo = 11 AND " + SQL_ES_NUEVA), {"anio": anio}).scalar() or 0
-    
-    data_actual = {
-        "recluta_productiva": recluta_count,
-        "polizas_vida_individual": puntos_vida,
-        "agentes_alfa_adicionales": 5, # Placeholder simplificado
-        "asegurados_gmmi": 100, # Placeholder simplificado
-        "crecimiento_cartera_pct": 0.15,
-        "agentes_ganadores_bono": 20
-    }
-    resumen_data = generar_resumen_icp_2026(data_actual, categoria)
-    
-    # ── 2. Obtener Detalle de Reclutas ──
-    agentes_raw = db.execute(text("""
-        SELECT a.id, a.nombre_completo, a.codigo_agente, a.fecha_alta,
-               COUNT(DISTINCT p.id) as polizas_total,
-               SUM(CASE WHEN pr.ramo_codigo = 11 AND """ + SQL_ES_NUEVA + """ THEN 1 ELSE 0 END) as polizas_vida,
-               SUM(CASE WHEN """ + SQL_ES_NUEVA + """ THEN COALESCE(p.prima_neta, 0) ELSE 0 END) as prima_total
-        FROM agentes a
-        LEFT JOIN polizas p ON a.id = p.agente_id AND p.anio_aplicacion = :anio
-        LEFT JOIN productos pr ON p.producto_id = pr.id
-        WHERE a.fecha_alta >= '2023-01-01' AND a.situacion = 'ACTIVO'
-        GROUP BY a.id, a.nombre_completo, a.codigo_agente, a.fecha_alta
-    """), {"anio": anio}).mappings().all()
-    detalle_reclutas = obtener_detalle_recluta_2026(agentes_raw)
-
-    # ── 3. Construir Excel ──
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        # Sheet 1: Resumen
-        df_resumen = pd.DataFrame([
-            {"ID": ind["id"], "Indicador": ind["nombre"], "Actual": ind["actual"], "Meta": ind["meta"], "Cumple": "SÍ" if ind["cumple"] else "NO"}
-            for ind in resumen_data["indicadores"]
-        ])
-        df_resumen.to_excel(writer, sheet_name="Resumen ICP 2026", index=False)
-        
-        # Sheet 2: Detalle Reclutas
-        df_detalle = pd.DataFrame(detalle_reclutas)
-        # Limpiar/renombrar columnas para el usuario final
-        if not df_detalle.empty:
-            df_detalle = df_detalle.rename(columns={
-                "nombre": "Agente", "codigo": "Código", "fecha_alta": "Alta", "anio_icp": "Año ICP",
-                "actual_vida": "Vida Actual", "meta_vida": "Meta Vida", "actual_prima": "Prima Actual", "meta_prima": "Meta Prima", "cumple": "Estatus Productivo"
-            })
-            df_detalle["Estatus Productivo"] = df_detalle["Estatus Productivo"].map({True: "PRODUCTIVO", False: "EN PROCESO"})
-        df_detalle.to_excel(writer, sheet_name="Detalle Reclutas", index=False)
-
-        # Formato
-        workbook = writer.book
-        header_fmt = workbook.add_format({"bold": True, "bg_color": "#1e3a5f", "font_color": "white", "border": 1})
-        for sheet in writer.sheets.values():
-            sheet.set_column(0, 10, 20)
-
-    output.seek(0)
-    filename = f"Reporte_ICP_2026_{categoria}.xlsx"
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
+    archivo = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX)
+    info = escribir_icp_2026(db, {"anio": anio}, "xlsx", archivo)
+    return respuesta_archivo(archivo, "xlsx", info["nombre"])
+
+
+@router_exportacion.post("/jobs", status_code=202, response_model=TrabajoExportacionOut)
+def crear_trabajo_exportacion(body: TrabajoExportacionCreate, db: Session = Depends(get_db)):
+    """
+    Encola una exportación en segundo plano (ver api/trabajos_exportacion.py).
+    Si ya existe el archivo para los mismos filtros y versión de datos se
+    responde ese trabajo con desde_cache=True; consultar GET /exportar/jobs/{id}.
+    """
+    trabajo, desde_cache = trabajos_exportacion.encolar(db, body.tipo, body.formato, body.filtros)
+    return trabajos_exportacion.estado(trabajo, desde_cache)
+
+
+@router_exportacion.get("/jobs/{trabajo_id}", response_model=TrabajoExportacionOut)
+def estado_trabajo_exportacion(trabajo_id: str, db: Session = Depends(get_db)):
+    """Estado y avance de una exportación en segundo plano."""
+    return trabajos_exportacion.estado(trabajos_exportacion.obtener(db, trabajo_id))
+
+
+@router_exportacion.get("/jobs/{trabajo_id}/descarga")
+def descargar_trabajo_exportacion(trabajo_id: str, db: Session = Depends(get_db)):
+    """Descarga el archivo de una exportación terminada (409 si sigue en curso, 410 si expiró)."""
+    trabajo = trabajos_exportacion.obtener(db, trabajo_id)
+    if trabajo.estado == "expirado" or (trabajo.estado == "listo" and not os.path.exists(trabajo.archivo or "")):
+        raise HTTPException(410, "El archivo de esta exportación ya no está disponible; solicítala de nuevo")
+    if trabajo.estado != "listo":
+        raise HTTPException(409, f"La exportación no está lista (estado: {trabajo.estado})")
+    return FileResponse(trabajo.archivo, media_type=FORMATOS[trabajo.formato][0], filename=trabajo.nombre_archivo)
 
 
 
@@ -3118,6 +2685,7 @@ router_finanzas = APIRouter(prefix="/finanzas", tags=["Finanzas"])
 
 
 @router_finanzas.get("", response_model=FinanzasResponse)
+@cacheado("finanzas")
 def get_finanzas(
     anio: int = Query(2025, description="Año de análisis"),
     ramo: Optional[str] = Query(None, description="Filtrar por ramo: vida, gmm"),
@@ -3419,47 +2987,54 @@ router_contratantes = APIRouter(prefix="/contratantes", tags=["Contratantes"])
 
 @router_contratantes.get("")
 def list_contratantes(
-    q: Optional[str] = Query(None, description="Búsqueda por nombre/RFC"),
+    q: Optional[str] = Query(None, description="Búsqueda por nombre/RFC/email (sin acentos ni mayúsculas)"),
     agente_id: Optional[int] = None,
     page: int = Query(1, ge=1),
     limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = Query(None, description="Cursor 'nombre,id' (next_cursor de la página anterior)"),
+    conteo: str = Query("exacto", description="Total: exacto | estimado | ninguno"),
     db: Session = Depends(get_db)
 ):
+    """Contratantes por nombre con num_polizas/prima_total del rollup (api/resumen_contratantes.py)."""
     conditions = ["1=1"]
     params: dict = {}
 
     if q:
-        conditions.append("(c.nombre ILIKE :q OR c.rfc ILIKE :q)")
-        params["q"] = f"%{q}%"
+        asegurar_busqueda(db)
+        conditions.append(filtro_busqueda(db, "contratantes", "c", q, params))
     if agente_id:
         conditions.append("c.agente_id = :agente_id")
         params["agente_id"] = agente_id
 
     where = " AND ".join(conditions)
 
-    # Total count
-    total = db.execute(text(f"""
-        SELECT COUNT(*) FROM contratantes c WHERE {where}
-    """), params).scalar() or 0
+    total, estimado = contar(db, f"FROM contratantes c WHERE {where}", params, conteo)
+    asegurar_resumen(db)
 
-    offset = (page - 1) * limit
-    params["limit"] = limit
-    params["offset"] = offset
+    cursor = leer_cursor(after)
+    if cursor:
+        where += " AND " + sql_keyset("c.nombre", "c.id", descendente=False)
+        params["cursor_valor"], params["cursor_id"] = cursor
+        paginado = "LIMIT :limit"
+    else:
+        paginado = "LIMIT :limit OFFSET :offset"
+        params["offset"] = (page - 1) * limit
+    params["limit"] = limit + 1     # Una fila extra indica si hay página siguiente
 
     rows = db.execute(text(f"""
         SELECT c.id, c.nombre, c.rfc, c.telefono, c.email, c.domicilio,
                c.notas, c.referido_por_id, c.agente_id, c.created_at,
-               COUNT(p.id) as num_polizas,
-               COALESCE(SUM(p.prima_neta), 0) as prima_total
+               COALESCE(r.num_polizas, 0) as num_polizas,
+               COALESCE(r.prima_total, 0) as prima_total
         FROM contratantes c
-        LEFT JOIN polizas p ON p.contratante_id = c.id
+        LEFT JOIN contratantes_resumen r ON r.contratante_id = c.id
         WHERE {where}
-        GROUP BY c.id, c.nombre, c.rfc, c.telefono, c.email, c.domicilio,
-                 c.notas, c.referido_por_id, c.agente_id, c.created_at
-        ORDER BY c.nombre
-        LIMIT :limit OFFSET :offset
+        ORDER BY c.nombre, c.id
+        {paginado}
     """), params).mappings().all()
 
+    hay_mas = len(rows) > limit
+    rows = rows[:limit]
     data = []
     for r in rows:
         data.append({
@@ -3474,13 +3049,20 @@ def list_contratantes(
             "created_at": r["created_at"],
         })
 
-    return {"data": data, "total": total, "page": page, "pages": max(1, -(-total // limit))}
+    return {
+        "data": data, "total": total, "page": page,
+        "pages": max(1, -(-total // limit)) if total is not None else None,
+        "total_estimado": estimado,
+        "next_cursor": crear_cursor(rows[-1]["nombre"], rows[-1]["id"]) if hay_mas else None,
+    }
 
 
 @router_contratantes.post("", response_model=ContratanteOut, status_code=201)
 def create_contratante(data: ContratanteCreate, db: Session = Depends(get_db)):
     c = Contratante(**data.model_dump())
+    c.busqueda = busqueda_de("contratantes", c)
     db.add(c)
+    invalidar(db)
     db.commit()
     db.refresh(c)
     return ContratanteOut(
@@ -3499,7 +3081,9 @@ def update_contratante(contratante_id: int, data: ContratanteCreate, db: Session
     for k, v in data.model_dump(exclude_unset=True).items():
         setattr(c, k, v)
     from datetime import datetime
+    c.busqueda = busqueda_de("contratantes", c)
     c.updated_at = datetime.now().isoformat()
+    invalidar(db)
     db.commit()
     db.refresh(c)
     pols = db.query(Poliza).filter(Poliza.contratante_id == c.id).all()
@@ -3513,6 +3097,33 @@ def update_contratante(contratante_id: int, data: ContratanteCreate, db: Session
     )
 
 
+# ═══════════════════════════════════════════════════════════════════
+# BÚSQUEDA UNIFICADA (typeahead)
+# ═══════════════════════════════════════════════════════════════════
+router_busqueda = APIRouter(prefix="/buscar", tags=["Búsqueda"])
+
+
+@router_busqueda.get("")
+def buscar_global(
+    q: str = Query(..., min_length=3, description="Texto a buscar (sin acentos ni mayúsculas)"),
+    tipos: Optional[str] = Query(None, description="polizas,contratantes,solicitudes,agentes (default: todos)"),
+    limite: int = Query(10, ge=1, le=50, description="Resultados por tipo"),
+    db: Session = Depends(get_db)
+):
+    """
+    Pólizas, asegurados, contratantes, solicitudes y agentes que contienen `q`,
+    ordenados por relevancia. Usa el índice de trigramas de api/busqueda.py.
+    """
+    tablas = [t.strip() for t in tipos.split(",") if t.strip()] if tipos else list(CAMPOS_BUSQUEDA)
+    invalidos = [t for t in tablas if t not in CAMPOS_BUSQUEDA]
+    if invalidos:
+        raise HTTPException(400, f"Tipos inválidos: {', '.join(invalidos)}. Use: {', '.join(CAMPOS_BUSQUEDA)}")
+
+    asegurar_busqueda(db)
+    hits = buscar(db, q, tablas, limite)
+    return {"q": q, "total": len(hits), "hits": hits}
+
+
 # ═══════════════════════════════════════════════════════════════════
 # SOLICITUDES — Entidad Raíz v2.0 (Pipeline de emisión)
 # ═══════════════════════════════════════════════════════════════════
@@ -3653,6 +3264,7 @@ def list_solicitudes(
 
 
 @router_solicitudes.get("/pipeline-stats")
+@cacheado("solicitudes/pipeline-stats")
 def get_pipeline_stats(
     anio: Optional[int] = None,
     db: Session = Depends(get_db),
@@ -3800,8 +3412,8 @@ def get_trazabilidad(nosol: str, db: Session = Depends(get_db)):
     pagos_data = []
     resumen_pagos = None
 
-    pol_num = sol_dict.get("poliza_numero")
-    if pol_num:
+    clave = sol_dict.get("match_key") or clave_cruce(sol_dict.get("poliza_numero"))
+    if clave:
         pol = db.execute(text("""
             SELECT p.id, p.poliza_original, p.poliza_estandar, p.asegurado_nombre,
                    p.contratante_nombre, p.fecha_inicio, p.fecha_fin,
@@ -3812,9 +3424,10 @@ def get_trazabilidad(nosol: str, db: Session = Depends(get_db)):
             FROM polizas p
             LEFT JOIN productos pr ON p.producto_id = pr.id
             LEFT JOIN agentes a ON p.agente_id = a.id
-            WHERE p.poliza_estandar = :pol OR p.poliza_original = :pol
+            WHERE p.match_key = :mk
+            ORDER BY p.id
             LIMIT 1
-        """), {"pol": pol_num}).mappings().first()
+        """), {"mk": clave}).mappings().first()
 
         if pol:
             poliza_data = dict(pol)
@@ -3823,10 +3436,10 @@ def get_trazabilidad(nosol: str, db: Session = Depends(get_db)):
                        prima_neta, comision, comision_total,
                        moneda, ramo, anio_aplicacion, periodo_aplicacion
                 FROM pagos
-                WHERE poliza_match = :pol OR poliza_numero = :pol_orig
+                WHERE match_key = :mk
                 ORDER BY fecha_aplicacion DESC
                 LIMIT 50
-            """), {"pol": pol["poliza_estandar"], "pol_orig": pol["poliza_original"]}).mappings().all()
+            """), {"mk": clave}).mappings().all()
             pagos_data = [dict(p) for p in pagos_raw]
 
             if pagos_data:
@@ -3891,8 +3504,10 @@ def create_solicitud(data: SolicitudCreate, db: Session = Depends(get_db)):
     from .rules_solicitudes import normalizar_ramo
     if data.ramo:
         s.ramo_normalizado = normalizar_ramo(data.ramo)
+    s.busqueda = busqueda_de("solicitudes", s)
 
     db.add(s)
+    invalidar(db)
     db.commit()
     db.refresh(s)
     return SolicitudOut(**_solicitud_to_out(s, db))
@@ -3908,6 +3523,7 @@ def update_solicitud(solicitud_id: int, data: SolicitudUpdate, db: Session = Dep
         if v is not None:
             setattr(s, k, v)
     s.updated_at = datetime.now().isoformat()
+    invalidar(db)
     db.commit()
     db.refresh(s)
     return SolicitudOut(**_solicitud_to_out(s, db))
@@ -3956,6 +3572,7 @@ def create_distribucion(data: DistribucionCreate, db: Session = Depends(get_db))
 
     d = DistribucionComision(**data.model_dump())
     db.add(d)
+    invalidar(db)
     db.commit()
     db.refresh(d)
     ag = db.query(Agente).get(d.agente_id) if d.agente_id else None
@@ -4023,7 +3640,10 @@ def update_configuracion(clave: str, data: ConfiguracionUpdate, db: Session = De
     from datetime import datetime
     c.valor = data.valor
     c.updated_at = datetime.now().isoformat()
+    invalidar(db)
     db.commit()
+    if clave == "doc_url_base":
+        olvidar_url_base()
     db.refresh(c)
     return ConfiguracionItem(
         clave=c.clave, valor=c.valor, tipo=c.tipo,
@@ -4036,91 +3656,33 @@ def update_configuracion(clave: str, data: ConfiguracionUpdate, db: Session = De
 # ═══════════════════════════════════════════════════════════════════
 router_documentos = APIRouter(prefix="/documentos", tags=["Documentos"])
 
-# URL base por defecto (se puede sobrescribir desde BD)
-DEFAULT_DOC_BASE = "http://54.184.22.19:7070/cartera-0.1/static/archivos"
-
-
-def _get_doc_base_url(db: Session) -> str:
-    """Lee la URL base de documentos desde configuración, con fallback."""
-    cfg = db.query(Configuracion).filter(Configuracion.clave == "doc_url_base").first()
-    return cfg.valor if cfg and cfg.valor else DEFAULT_DOC_BASE
-
 
 @router_documentos.get("/poliza/{num_poliza}")
-async def proxy_poliza_pdf(num_poliza: str, db: Session = Depends(get_db)):
+async def proxy_poliza_pdf(num_poliza: str, request: Request, db: Session = Depends(get_db)):
     """
     Proxy para PDFs de pólizas.
-    Descarga el PDF desde el servidor HTTP interno y lo sirve por HTTPS.
+    Retransmite el PDF del servidor HTTP interno por HTTPS (ver api/documentos.py).
     URL origen: {doc_url_base}/{num_poliza}.pdf
     """
     # Validar número de póliza (solo alfanuméricos)
     clean = re.sub(r'[^a-zA-Z0-9]', '', num_poliza)
     if not clean:
         raise HTTPException(400, "Número de póliza inválido")
-
-    base_url = _get_doc_base_url(db)
-    pdf_url = f"{base_url}/{clean}.pdf"
-
-    import httpx
-    try:
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            resp = await client.get(pdf_url)
-
-        if resp.status_code == 404:
-            raise HTTPException(404, f"Documento de póliza '{clean}' no encontrado")
-        if resp.status_code != 200:
-            raise HTTPException(502, f"Error al obtener documento: HTTP {resp.status_code}")
-
-        return StreamingResponse(
-            iter([resp.content]),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f'inline; filename="{clean}.pdf"',
-                "Cache-Control": "public, max-age=3600",
-            },
-        )
-    except httpx.TimeoutException:
-        raise HTTPException(504, "Timeout al conectar con servidor de documentos")
-    except httpx.ConnectError:
-        raise HTTPException(502, "No se pudo conectar con el servidor de documentos")
+    return await servir_pdf(request, db, f"{clean}.pdf", f"{clean}.pdf", f"Documento de póliza '{clean}'")
 
 
 @router_documentos.get("/solicitud/{num_solicitud}")
-async def proxy_solicitud_pdf(num_solicitud: str, db: Session = Depends(get_db)):
+async def proxy_solicitud_pdf(num_solicitud: str, request: Request, db: Session = Depends(get_db)):
     """
     Proxy para PDFs de solicitudes.
-    Descarga el PDF desde el servidor HTTP interno y lo sirve por HTTPS.
+    Retransmite el PDF del servidor HTTP interno por HTTPS (ver api/documentos.py).
     URL origen: {doc_url_base}/solicitudes/{num_solicitud}.pdf
     """
     clean = re.sub(r'[^a-zA-Z0-9]', '', num_solicitud)
     if not clean:
         raise HTTPException(400, "Número de solicitud inválido")
-
-    base_url = _get_doc_base_url(db)
-    pdf_url = f"{base_url}/solicitudes/{clean}.pdf"
-
-    import httpx
-    try:
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            resp = await client.get(pdf_url)
-
-        if resp.status_code == 404:
-            raise HTTPException(404, f"Documento de solicitud '{clean}' no encontrado")
-        if resp.status_code != 200:
-            raise HTTPException(502, f"Error al obtener documento: HTTP {resp.status_code}")
-
-        return StreamingResponse(
-            iter([resp.content]),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f'inline; filename="solicitud_{clean}.pdf"',
-                "Cache-Control": "public, max-age=3600",
-            },
-        )
-    except httpx.TimeoutException:
-        raise HTTPException(504, "Timeout al conectar con servidor de documentos")
-    except httpx.ConnectError:
-        raise HTTPException(502, "No se pudo conectar con el servidor de documentos")
+    return await servir_pdf(request, db, f"solicitudes/{clean}.pdf", f"solicitud_{clean}.pdf",
+                            f"Documento de solicitud '{clean}'")
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -4130,6 +3692,7 @@ router_indicadores_sol = APIRouter(prefix="/indicadores-solicitudes", tags=["Ind
 
 
 @router_indicadores_sol.get("")
+@cacheado("indicadores-solicitudes")
 def get_indicadores_solicitudes(
     anio: int = Query(2025, description="Año de análisis"),
     ramo: str = Query("", description="Filtro por ramo: SALUD, VIDA, o vacío=todos"),
@@ -4168,66 +3731,94 @@ def get_indicadores_solicitudes(
         base += " AND a.lider_codigo = :lider"
         params["lider"] = lider
 
-    # Seleccionar columnas específicas para evitar ambigüedad
-    base_select = base.replace("es.", "es.").replace("a.", "a.")
+    # ── Un solo recorrido: conteos por mes × ramo × etapa con las medidas de los KPIs ──
+    # KPIs, mensual, ramos, etapas y pivots se derivan de este resultado en Python.
+    grupos = db.execute(text(f"""
+        SELECT es.mes_recepcion, es.nomramo, es.etapa, COUNT(*) c,
+               SUM(CASE WHEN es.nuevo = 1 THEN 1 ELSE 0 END) nuevos,
+               COALESCE(SUM(es.numsolicitantes), 0) solicitantes,
+               SUM(CASE WHEN es.dias_tramite >= 0 THEN es.dias_tramite ELSE 0 END) dias_suma,
+               SUM(CASE WHEN es.dias_tramite >= 0 THEN 1 ELSE 0 END) dias_n
+        {base}
+        GROUP BY es.mes_recepcion, es.nomramo, es.etapa
+    """), params).fetchall()
+
+    RECHAZOS_TOP = ("RECHAZO_EMISION", "RECHAZO_EXPIRACION", "RECHAZO_SELECCION", "RECHAZO_AUT_INFO_AD")
+    k = defaultdict(int)
+    dias = {"suma": 0, "n": 0, "suma_emitidas": 0, "n_emitidas": 0}
+    meses_data = {}
+    ramos_data = {}
+    etapas_count = defaultdict(int)
+    pivot_ramo_dict = defaultdict(lambda: {m: 0 for m in range(1, 13)})
+    pivot_etapa_dict = defaultdict(lambda: {m: 0 for m in range(1, 13)})
+    for m, r, e, c, nuevos_g, solicitantes_g, dias_suma, dias_n in grupos:
+        k["total"] += c
+        k["nuevos"] += nuevos_g or 0
+        k["solicitantes"] += solicitantes_g or 0
+        dias["suma"] += dias_suma or 0
+        dias["n"] += dias_n or 0
+        if e == "POLIZA_ENVIADA":
+            k["emitidas"] += c
+            dias["suma_emitidas"] += dias_suma or 0
+            dias["n_emitidas"] += dias_n or 0
+        elif e in ("RECHAZO_EMISION", "RECHAZO_EXPIRACION", "RECHAZO_SELECCION", "CANCELADO"):
+            k[e] += c
+        if e and e.startswith("RECHAZO_AUT"):
+            k["RECHAZO_AUT"] += c
+        if e is None or (e not in RECHAZOS_TOP and e not in ("POLIZA_ENVIADA", "CANCELADO")):
+            k["en_tramite"] += c
+
+        if m is not None:
+            mes = meses_data.setdefault(m, {"mes": m, "total": 0, "emitidas": 0, "rechazadas": 0, "tramite": 0})
+            mes["total"] += c
+            if e == "POLIZA_ENVIADA":
+                mes["emitidas"] += c
+            elif e and "RECHAZO" in e:
+                mes["rechazadas"] += c
+            else:
+                mes["tramite"] += c
+        if r is not None:
+            ramo_d = ramos_data.setdefault(r, {"ramo": r, "total": 0, "emitidas": 0, "rechazadas": 0})
+            ramo_d["total"] += c
+            if e == "POLIZA_ENVIADA":
+                ramo_d["emitidas"] += c
+            elif e and e.startswith("RECHAZO"):
+                ramo_d["rechazadas"] += c
+            if m is not None:
+                pivot_ramo_dict[r][m] += c
+        if e is not None:
+            etapas_count[e] += c
+            if m is not None:
+                pivot_etapa_dict[e][m] += c
 
     # KPIs principales
-    total = db.execute(text(f"SELECT COUNT(*) {base}"), params).scalar() or 0
-    emitidas = db.execute(text(f"SELECT COUNT(*) {base} AND es.etapa = 'POLIZA_ENVIADA'"), params).scalar() or 0
-    rechazos_emision = db.execute(text(f"SELECT COUNT(*) {base} AND es.etapa = 'RECHAZO_EMISION'"), params).scalar() or 0
-    rechazos_exp = db.execute(text(f"SELECT COUNT(*) {base} AND es.etapa = 'RECHAZO_EXPIRACION'"), params).scalar() or 0
-    rechazos_sel = db.execute(text(f"SELECT COUNT(*) {base} AND es.etapa = 'RECHAZO_SELECCION'"), params).scalar() or 0
-    rechazos_aut = db.execute(text(f"SELECT COUNT(*) {base} AND es.etapa LIKE 'RECHAZO_AUT%'"), params).scalar() or 0
-    canceladas = db.execute(text(f"SELECT COUNT(*) {base} AND es.etapa = 'CANCELADO'"), params).scalar() or 0
-    en_tramite = db.execute(text(f"SELECT COUNT(*) {base} AND (es.etapa IS NULL OR es.etapa NOT IN ('POLIZA_ENVIADA','RECHAZO_EMISION','RECHAZO_EXPIRACION','RECHAZO_SELECCION','RECHAZO_AUT_INFO_AD','CANCELADO'))"), params).scalar() or 0
+    total = k["total"]
+    emitidas = k["emitidas"]
+    rechazos_emision = k["RECHAZO_EMISION"]
+    rechazos_exp = k["RECHAZO_EXPIRACION"]
+    rechazos_sel = k["RECHAZO_SELECCION"]
+    rechazos_aut = k["RECHAZO_AUT"]
+    canceladas = k["CANCELADO"]
+    en_tramite = k["en_tramite"]
 
     total_rechazos = rechazos_emision + rechazos_exp + rechazos_sel + rechazos_aut
     tasa_emision = round((emitidas / total * 100), 1) if total > 0 else 0
     tasa_rechazo = round((total_rechazos / total * 100), 1) if total > 0 else 0
 
-    avg_dias = db.execute(text(f"SELECT AVG(es.dias_tramite) {base} AND es.dias_tramite IS NOT NULL AND es.dias_tramite >= 0"), params).scalar()
-    avg_dias = round(avg_dias, 1) if avg_dias else 0
-
-    avg_emitidas = db.execute(text(f"SELECT AVG(es.dias_tramite) {base} AND es.etapa = 'POLIZA_ENVIADA' AND es.dias_tramite IS NOT NULL AND es.dias_tramite >= 0"), params).scalar()
-    avg_emitidas = round(avg_emitidas, 1) if avg_emitidas else 0
+    avg_dias = round(dias["suma"] / dias["n"], 1) if dias["suma"] else 0
+    avg_emitidas = round(dias["suma_emitidas"] / dias["n_emitidas"], 1) if dias["suma_emitidas"] else 0
 
-    nuevos = db.execute(text(f"SELECT COUNT(*) {base} AND es.nuevo = 1"), params).scalar() or 0
+    nuevos = k["nuevos"]
     reingresos = total - nuevos
-
-    # Solicitantes totales
-    total_solicitantes = db.execute(text(f"SELECT COALESCE(SUM(es.numsolicitantes), 0) {base}"), params).scalar() or 0
+    total_solicitantes = k["solicitantes"]
 
     # Por mes (para gráfica)
-    mensual = db.execute(text(f"""
-        SELECT es.mes_recepcion, es.etapa, COUNT(*) c
-        {base} AND es.mes_recepcion IS NOT NULL
-        GROUP BY es.mes_recepcion, es.etapa
-        ORDER BY es.mes_recepcion
-    """), params).fetchall()
-
-    meses_data = {}
-    for m, e, c in mensual:
-        if m not in meses_data:
-            meses_data[m] = {"mes": m, "total": 0, "emitidas": 0, "rechazadas": 0, "tramite": 0}
-        meses_data[m]["total"] += c
-        if e == "POLIZA_ENVIADA":
-            meses_data[m]["emitidas"] += c
-        elif e and "RECHAZO" in e:
-            meses_data[m]["rechazadas"] += c
-        else:
-            meses_data[m]["tramite"] += c
-    por_mes = list(meses_data.values())
+    por_mes = [meses_data[m] for m in sorted(meses_data)]
 
     # Por ramo
-    ramos = db.execute(text(f"""
-        SELECT es.nomramo, COUNT(*) total,
-               SUM(CASE WHEN es.etapa = 'POLIZA_ENVIADA' THEN 1 ELSE 0 END) emitidas,
-               SUM(CASE WHEN es.etapa LIKE 'RECHAZO%' THEN 1 ELSE 0 END) rechazadas
-        {base} AND es.nomramo IS NOT NULL
-        GROUP BY es.nomramo ORDER BY total DESC
-    """), params).fetchall()
-    por_ramo = [{"ramo": r[0], "total": r[1], "emitidas": r[2], "rechazadas": r[3],
-                 "tasa_emision": round(r[2] / r[1] * 100, 1) if r[1] > 0 else 0} for r in ramos]
+    ramos = sorted(ramos_data.values(), key=lambda x: (-x["total"], x["ramo"]))
+    por_ramo = [{**r, "tasa_emision": round(r["emitidas"] / r["total"] * 100, 1) if r["total"] > 0 else 0}
+                for r in ramos]
 
     # Top agentes por solicitudes
     top_agentes = db.execute(text(f"""
@@ -4244,36 +3835,16 @@ def get_indicadores_solicitudes(
     } for a in top_agentes]
 
     # Distribución de etapas
-    dist_etapas = db.execute(text(f"""
-        SELECT es.etapa, COUNT(*) c
-        {base} AND es.etapa IS NOT NULL
-        GROUP BY es.etapa ORDER BY c DESC
-    """), params).fetchall()
+    dist_etapas = sorted(etapas_count.items(), key=lambda x: (-x[1], x[0]))
     etapas_data = [{"etapa": e[0], "count": e[1],
                     "porcentaje": round(e[1] / total * 100, 1) if total > 0 else 0} for e in dist_etapas]
 
     # ── Datos Pivot Heatmap (Looker Style) ──
-    res_pivot_ramo = db.execute(text(f"""
-        SELECT es.nomramo, es.mes_recepcion, COUNT(*) as c
-        {base} AND es.nomramo IS NOT NULL AND es.mes_recepcion IS NOT NULL
-        GROUP BY es.nomramo, es.mes_recepcion
-    """), params).fetchall()
-    pivot_ramo_dict = defaultdict(lambda: {m: 0 for m in range(1, 13)})
-    for r, m, c in res_pivot_ramo:
-        pivot_ramo_dict[r][m] = c
     pivot_ramo = [{"nombre": r, "meses": m, "total": sum(m.values())} for r, m in pivot_ramo_dict.items()]
-    pivot_ramo.sort(key=lambda x: x["total"], reverse=True)
+    pivot_ramo.sort(key=lambda x: (-x["total"], x["nombre"]))
 
-    res_pivot_etapa = db.execute(text(f"""
-        SELECT es.etapa, es.mes_recepcion, COUNT(*) as c
-        {base} AND es.etapa IS NOT NULL AND es.mes_recepcion IS NOT NULL
-        GROUP BY es.etapa, es.mes_recepcion
-    """), params).fetchall()
-    pivot_etapa_dict = defaultdict(lambda: {m: 0 for m in range(1, 13)})
-    for e, m, c in res_pivot_etapa:
-        pivot_etapa_dict[e][m] = c
     pivot_etapa = [{"nombre": e, "meses": m, "total": sum(m.values())} for e, m in pivot_etapa_dict.items()]
-    pivot_etapa.sort(key=lambda x: x["total"], reverse=True)
+    pivot_etapa.sort(key=lambda x: (-x["total"], x["nombre"]))
 
     # Rechazos recientes con observaciones
     rechazos_recientes = db.execute(text(f"""
@@ -4287,11 +3858,19 @@ def get_indicadores_solicitudes(
         "fecha_recepcion": r[5], "fecha_etapa": r[6], "agente": r[7], "dias": r[8]
     } for r in rechazos_recientes]
 
-    # Filtros disponibles
-    anios_disp = db.execute(text("SELECT DISTINCT ano_recepcion FROM etapas_solicitudes WHERE ano_recepcion IS NOT NULL ORDER BY ano_recepcion")).scalars().all()
-    segmentos_disp = db.execute(text("SELECT DISTINCT segmento_agrupado FROM agentes WHERE segmento_agrupado IS NOT NULL ORDER BY 1")).scalars().all()
-    gestiones_disp = db.execute(text("SELECT DISTINCT gestion_comercial FROM agentes WHERE gestion_comercial IS NOT NULL ORDER BY 1")).scalars().all()
-    lideres_disp = db.execute(text("SELECT DISTINCT lider_codigo FROM agentes WHERE lider_codigo IS NOT NULL ORDER BY 1")).scalars().all()
+    # Filtros disponibles (una consulta)
+    disponibles = defaultdict(list)
+    for campo, valor in db.execute(text("""
+        SELECT DISTINCT 'anio', CAST(ano_recepcion AS VARCHAR(10)) FROM etapas_solicitudes WHERE ano_recepcion IS NOT NULL
+        UNION ALL SELECT DISTINCT 'segmento', segmento_agrupado FROM agentes WHERE segmento_agrupado IS NOT NULL
+        UNION ALL SELECT DISTINCT 'gestion', gestion_comercial FROM agentes WHERE gestion_comercial IS NOT NULL
+        UNION ALL SELECT DISTINCT 'lider', lider_codigo FROM agentes WHERE lider_codigo IS NOT NULL
+    """)).fetchall():
+        disponibles[campo].append(valor)
+    anios_disp = sorted(int(a) for a in disponibles["anio"])
+    segmentos_disp = sorted(disponibles["segmento"])
+    gestiones_disp = sorted(disponibles["gestion"])
+    lideres_disp = sorted(disponibles["lider"])
 
     return {
         "kpis": {
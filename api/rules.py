@@ -6,6 +6,9 @@ from datetime import date, datetime
 import re
 import os
 
+import numpy as np
+import pandas as pd
+
 # ── Configuración ──────────────────────────────────────────────────
 UMBRAL_COMISION_BASICA = 0.021   # 2.1% — configurable
 CURRENT_YEAR = date.today().year
@@ -280,6 +283,18 @@ def normalizar_poliza(num: str) -> str:
     return normalizado
 
 
+def clave_cruce(num):
+    """
+    Clave canónica de cruce póliza↔pago↔indicador (columna match_key).
+    Es normalizar_poliza sin comillas; vacío → None para que no cruce con nada.
+    Ej: ' "0076384A" ' → '76384A'
+    """
+    if num is None:
+        return None
+    clave = normalizar_poliza(str(num).replace('"', '').strip())
+    return clave or None
+
+
 # ── Segmento agrupado ────────────────────────────────────────────
 def agrupar_segmento(segmento: str) -> str:
     """Retorna el grupo del segmento (ALFA, BETA, OMEGA)."""
@@ -440,6 +455,13 @@ ESTATUS_CANCELADA = {
 }
 
 
+# MYSTATUS que indican pago (para inferir la fecha de aplicación desde fecha_inicio)
+MYSTATUS_PAGADOS = (
+    "PAGADA TOTAL", "PAGADA S/FP", "PAGADA", "TERMINADA",
+    "TERMINADA PAGADA", "ANTICIPADA", "AL CORRIENTE",
+)
+
+
 # ── BG: LARGO ────────────────────────────────────────────────────
 def largo_poliza(num_poliza: str) -> int:
     """Largo del número de póliza. Excel: =LEN(AD2)"""
@@ -824,13 +846,9 @@ def aplicar_reglas_poliza(poliza: dict, ramo_codigo: int = None) -> dict:
     
     if not fecha_apli or fecha_apli == "-" or fecha_apli == "":
         # Si tiene status PAGADA o mystatus que indica pago, inferir de fecha_inicio
-        pagada_mystatus = (
-            "PAGADA TOTAL", "PAGADA S/FP", "PAGADA", "TERMINADA",
-            "TERMINADA PAGADA", "ANTICIPADA", "AL CORRIENTE"
-        )
         ms_upper = ms.strip().upper() if ms else ""
         status_upper = status.strip().upper() if status else ""
-        if status_upper in STATUS_PAGADOS or ms_upper in pagada_mystatus:
+        if status_upper in STATUS_PAGADOS or ms_upper in MYSTATUS_PAGADOS:
             fecha_apli = fecha_ini
     
     _periodo_apli = fecha_apli[:7] if fecha_apli and len(fecha_apli) >= 7 else poliza.get("periodo_aplicacion")
@@ -987,3 +1005,339 @@ def aplicar_reglas_batch(polizas: list, ramo_codigo: int = None) -> list:
         r["num_reexpediciones"] = raices.get(raiz, 0) if raiz else 0
 
     return resultados
+
+
+
+
+# ══════════════════════════════════════════════════════════════════
+# VERSIÓN COLUMNAR: las mismas reglas sobre un DataFrame completo
+# ══════════════════════════════════════════════════════════════════
+# Cada regla escalar de arriba tiene aquí su expresión vectorizada
+# (pandas/NumPy). El resultado debe ser idéntico al de aplicar_reglas_batch;
+# tests/test_rules.py::TestAplicarReglasDataframe lo verifica.
+#
+# Las columnas de texto (fechas, estatus, moneda, número de póliza) se
+# factorizan: las operaciones de texto corren una vez por valor distinto y
+# por fila solo quedan operaciones NumPy sobre los códigos. En la cartera
+# real fechas y estatus se repiten miles de veces.
+
+_ENTERO_RE = r"\s*[+-]?\d+\s*"      # Lo que int() acepta de un texto
+
+_TEXTO_PENDIENTE_2026 = "PRIMER AÑO 2026, PENDIENTE DE PAGO"
+_PENDIENTES = np.array(["", "PRIMER AÑO 2026 PENDIENTE PAGO", "-"], dtype=object)
+_CONDICIONAL = np.array(["OK", "Cancelada"], dtype=object)
+_TIPOS = np.array(["NO_APLICA", "NUEVA", "SUBSECUENTE"], dtype=object)
+# Derivados de fecha que se toman de la fuente elegida como fecha de aplicación
+_COLUMNAS_APLI = ("valor", "vacia", "largo", "prefijo7", "anio_apli", "mes_nombre", "trimestre")
+
+
+def _factorizar(df: pd.DataFrame, nombre: str) -> tuple:
+    """
+    (códigos por fila, valores distintos como texto).
+    Faltante/None/NaN → '' (equivale a `poliza.get(x) or ''`).
+    """
+    if nombre not in df.columns:
+        return np.zeros(len(df), dtype=np.intp), pd.Series([""], dtype=object)
+    codigos, unicos = pd.factorize(df[nombre])
+    unicos = pd.Series(np.append(np.asarray(unicos, dtype=object), ""), dtype=object)
+    if not pd.api.types.is_string_dtype(unicos):
+        unicos = unicos.astype(str)
+    codigos = np.where(codigos < 0, len(unicos) - 1, codigos)
+    return codigos, unicos.astype(object)
+
+
+def _por_valor(df: pd.DataFrame, nombre: str, derivar, columnas: tuple = None) -> dict:
+    """
+    Evalúa `derivar` sobre los valores distintos de la columna y expande a todas
+    las filas las `columnas` pedidas (todas si es None; "valor" es el texto original).
+    """
+    codigos, unicos = _factorizar(df, nombre)
+    derivadas = derivar(unicos)
+    derivadas["valor"] = unicos
+    return {c: derivadas[c].to_numpy()[codigos] for c in (columnas or derivadas.columns)}
+
+
+def _numero(df: pd.DataFrame, nombre: str) -> np.ndarray:
+    """Columna numérica; faltante/None/NaN → 0.0 (equivale a `poliza.get(x) or 0`)."""
+    if nombre not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[nombre], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+
+
+def _a_entero(s: pd.Series) -> pd.Series:
+    """int(texto) por elemento; NaN donde int() lanzaría ValueError."""
+    valido = s.str.fullmatch(_ENTERO_RE).fillna(False).astype(bool)
+    return pd.to_numeric(s.where(valido), errors="coerce")
+
+
+def _redondear(valores: np.ndarray, decimales: int = 2) -> np.ndarray:
+    """
+    round() de Python en vectorizado. np.round escala por 10**n y en los
+    empates binarios (p.ej. 2.675) puede diferir; esos casos se resuelven con round().
+    """
+    r = np.round(valores, decimales)
+    escalado = valores * 10 ** decimales
+    distancia = np.abs(escalado - np.floor(escalado) - 0.5)
+    dudosos = distancia <= 1e-6 + 8 * np.spacing(np.abs(escalado))
+    if dudosos.any():
+        r[dudosos] = [round(float(v), decimales) for v in valores[dudosos]]
+    return r
+
+
+# ── Derivados por valor distinto ─────────────────────────────────
+def _derivados_poliza(pol: pd.Series) -> pd.DataFrame:
+    """BG, BH, BI y reexpedición a partir del número de póliza."""
+    num = pol.str.strip()
+    largo = num.str.len()
+    terminacion = num.str[-2:]
+    # re.search(r'(\d{2})$') y int(...) > 0, evaluado por terminación distinta
+    finales = pd.Series(terminacion.unique(), dtype=object)
+    dos_digitos = (finales.str.len() == 2) & finales.str.isdecimal()
+    reexp = pd.to_numeric(finales.where(dos_digitos), errors="coerce").fillna(0) > 0
+    return pd.DataFrame({
+        "num": num,
+        "largo": largo,
+        "raiz6": num.str[:6],
+        "terminacion": terminacion,
+        "reexp": terminacion.map(pd.Series(reexp.to_numpy(), index=finales)).astype(bool),
+    })
+
+
+def _derivados_fecha(fecha: pd.Series) -> pd.DataFrame:
+    """BL, CA y el año de un texto 'YYYY-MM-DD' (o nombre de mes); días a hoy y a TODAY()-28."""
+    largo = fecha.str.len()
+    vacia = (fecha == "") | (fecha == "-")
+    mes = _a_entero(fecha.str[5:7])
+    es_iso = (largo >= 7) & (fecha.str[4] == "-")
+    mes_trim = mes.where(es_iso, fecha.str.strip().str.upper().map({v: k for k, v in MESES_ES.items()}).fillna(0))
+    trimestre = ("Q" + ((mes_trim.fillna(1) - 1) // 3 + 1).astype("int64").astype(str)).astype(object)
+    anio = _a_entero(fecha.str[:4])
+    dt = pd.to_datetime(fecha.str[:10], format="%Y-%m-%d", errors="coerce")
+    hoy = datetime.now()
+    return pd.DataFrame({
+        "vacia": vacia,
+        "largo": largo,
+        "prefijo7": fecha.str[:7],
+        "sin_espacios": fecha.str.strip(),
+        "anio": anio,
+        "anio_apli": anio.where(~vacia & (largo >= 4)),
+        "mes_nombre": mes.map(MESES_ES).fillna("").astype(object),
+        "trimestre": trimestre.where(~vacia & mes_trim.between(1, 12), "-"),
+        "es_fecha": dt.notna(),
+        "anio_fecha": dt.dt.year,
+        "dias_hoy": (pd.Timestamp(hoy) - dt).dt.days,
+        "dias_ref": (pd.Timestamp(hoy.date()) - pd.Timedelta(days=28) - dt).dt.days,
+    })
+
+
+def _derivados_estatus(estatus: pd.Series) -> pd.DataFrame:
+    normalizado = estatus.str.strip().str.upper()
+    return pd.DataFrame({
+        "pagado": normalizado.isin(STATUS_PAGADOS),
+        "pagado_crudo": estatus.isin(STATUS_PAGADOS),
+        "ms_pagada": normalizado.isin(MYSTATUS_PAGADOS),
+        "vacio": normalizado == "",
+        "cancelado": normalizado.isin(ESTATUS_CANCELADA),
+        "cancelado_vida": normalizado.isin(["CANC/X F.PAGO", "CANC/X SUSTITUCION"]),
+    })
+
+
+def _derivados_moneda(moneda: pd.Series) -> pd.DataFrame:
+    mon = moneda.replace("", "MN").str.strip().str.upper()
+    return pd.DataFrame({"tc": np.select(
+        [mon.isin(["UDIS", "UDI"]), mon.isin(["USD", "DLS"])],
+        [TC_UDIS, TC_USD], default=1.0,
+    )})
+
+
+def _derivados_tipo(tipo: pd.Series) -> pd.DataFrame:
+    return pd.DataFrame({
+        "definido": tipo.isin(["NUEVA", "SUBSECUENTE"]),
+        "o_no_aplica": tipo.replace("", "NO_APLICA"),
+    })
+
+
+def _derivados_ramo(nombre: pd.Series) -> pd.DataFrame:
+    n = nombre.str.upper()
+    return pd.DataFrame({"rc": np.select(
+        [n.str.contains("VIDA", regex=False),
+         n.str.contains("GASTO", regex=False) | n.str.contains("GMM", regex=False)],
+        [11.0, 34.0], default=np.nan,
+    )})
+
+
+def _ramo_por_fila(df: pd.DataFrame, ramo_codigo: int = None) -> np.ndarray:
+    """Mismo criterio que aplicar_reglas_batch: parámetro, columna ramo_codigo o nombre del ramo."""
+    if ramo_codigo:
+        return np.full(len(df), float(ramo_codigo))
+    if "ramo_codigo" in df.columns:
+        rc = pd.to_numeric(df["ramo_codigo"], errors="coerce").to_numpy(dtype=float)
+    else:
+        rc = np.full(len(df), np.nan)
+    sin_ramo = np.isnan(rc)
+    if sin_ramo.any():
+        crudo = _por_valor(df, "ramo_nombre_raw", _derivados_ramo)
+        nombre = _por_valor(df, "ramo_nombre", _derivados_ramo)
+        inferido = np.where(crudo["valor"] != "", crudo["rc"], nombre["rc"])
+        rc = np.where(sin_ramo, inferido, rc)
+    return rc
+
+
+def aplicar_reglas_dataframe(df: pd.DataFrame, ramo_codigo: int = None) -> pd.DataFrame:
+    """
+    Versión columnar de aplicar_reglas_batch: calcula todas las columnas
+    derivadas (BG–CV) con expresiones vectorizadas sobre el DataFrame completo.
+
+    Args:
+        df: una fila por póliza con los mismos campos raw que aplicar_reglas_poliza
+            (poliza_original, fecha_inicio, prima_neta, moneda, mystatus, ...).
+            Las columnas que falten se tratan como vacías.
+        ramo_codigo: 11 (Vida) o 34 (GMM), None si mixto
+
+    Returns:
+        DataFrame con el mismo índice que `df` y las mismas llaves que
+        aplicar_reglas_batch (incluye num_reexpediciones).
+    """
+    idx = df.index
+    pol = _por_valor(df, "poliza_original", _derivados_poliza)
+    ini = _por_valor(df, "fecha_inicio", _derivados_fecha)
+    explicita = _por_valor(df, "fecha_aplicacion", _derivados_fecha, _COLUMNAS_APLI)
+    primer_pago = _por_valor(df, "fecha_primer_pago", _derivados_fecha, _COLUMNAS_APLI + ("anio",))
+    ms = _por_valor(df, "mystatus", _derivados_estatus)
+    status = _por_valor(df, "status_recibo", _derivados_estatus)
+    tipo = _por_valor(df, "tipo_poliza", _derivados_tipo)
+    tipo_cambio = _por_valor(df, "moneda", _derivados_moneda)["tc"]
+    prima_neta = _numero(df, "prima_neta")
+    anio = _numero(df, "anio_aplicacion")
+    anio = np.where(anio == 0, datetime.now().year, anio)
+    rc = _ramo_por_fila(df, ramo_codigo)
+
+    # Fecha de aplicación: explícita → primer pago → fecha_inicio si está pagada
+    pagada = status["pagado"] | ms["ms_pagada"]
+    origen = np.where(~explicita["vacia"], 0,
+                      np.where(~primer_pago["vacia"] | ~pagada, 1, 2))
+    apli = {c: np.choose(origen, [explicita[c], primer_pago[c], ini[c]]) for c in _COLUMNAS_APLI}
+    tiene_apli = ~apli["vacia"].astype(bool)
+    anio_apli = apli["anio_apli"].astype(float)
+
+    if "periodo_aplicacion" in df.columns:
+        periodo_crudo = df["periodo_aplicacion"].astype(object).where(df["periodo_aplicacion"].notna(), None)
+    else:
+        periodo_crudo = np.full(len(df), None, dtype=object)
+    periodo_apli = np.where(apli["largo"] >= 7, apli["prefijo7"], periodo_crudo)
+
+    # BJ: primer año (-1 = "-", -2 = 2026 pendiente; el texto se arma por año distinto)
+    anio_ini = ini["anio"].astype(float)
+    anio_ref = np.where(np.nan_to_num(anio_apli) != 0, anio_apli, anio)
+    anio_primer = np.select(
+        [pol["num"] == "",
+         np.isin(anio_apli, [2023, 2024, 2025, 2026]),
+         anio_ref == 2026,
+         anio_ref >= 2023,
+         anio_ini == 2026,
+         anio_ini >= 2023],
+        [-1, anio_apli, -2, anio_ref, -2, anio_ini],
+        default=-1,
+    ).astype("int64")
+    anios, posicion = np.unique(anio_primer, return_inverse=True)
+    textos = {-1: "-", -2: _TEXTO_PENDIENTE_2026}
+    primer_anio = np.array([textos.get(a, f"PRIMER AÑO {a}") for a in anios.tolist()],
+                           dtype=object)[posicion]
+
+    # BV: pendientes de pago
+    pendientes = _PENDIENTES[np.select(
+        [~ini["es_fecha"].astype(bool),
+         ini["dias_hoy"] > 30,
+         (primer_anio == "-") & (ini["anio_fecha"] == 2026) & ~tiene_apli],
+        [0, 0, 1], default=2,
+    )]
+
+    # CI: pagada
+    flag_pag = tiene_apli.astype("int64")
+
+    # CM: prima anual en pesos
+    prima_pesos = np.where(prima_neta != 0, _redondear(prima_neta * tipo_cambio), 0.0)
+
+    # CF: prima acumulada (existente, o la prima en pesos si está pagada)
+    prima_acum = _numero(df, "prima_acumulada_basica")
+    prima_acum = np.where(prima_acum != 0, prima_acum, _numero(df, "neta_acumulada"))
+    prima_acum = np.where((flag_pag == 1) & (prima_acum == 0), prima_pesos, prima_acum)
+
+    # CP: cancelada (0) / vigente (1)
+    flag_canc = np.select(
+        [ms["cancelado"].astype(bool), ms["vacio"].astype(bool)],
+        [0, (prima_acum > 0).astype("int64")], default=1,
+    )
+
+    # Clasificación NUEVA / SUBSECUENTE (status_recibo sin normalizar, igual que clasificar_poliza)
+    con_ramo = np.isin(rc, [11, 34]) & (ini["valor"] != "")
+    propuesto = np.select(
+        [con_ramo & (anio_ini == anio) & status["pagado_crudo"].astype(bool),
+         con_ramo & (anio_ini < anio)],
+        [1, 2], default=0,
+    )
+    tipo_final = np.where(
+        (rc == 11) & tipo["definido"].astype(bool), tipo["valor"],
+        np.where(propuesto != 0, _TIPOS[propuesto], tipo["o_no_aplica"]),
+    )
+
+    # CJ: nueva formal
+    anio_pago = np.where(primer_pago["largo"] >= 4, primer_pago["anio"].astype(float), np.nan)
+    anio_poliza = np.where(ini["largo"] >= 4, np.nan_to_num(anio_ini), 0)
+    flag_nueva = np.select(
+        [anio_pago == anio,
+         anio_pago < anio,
+         tipo_final == "SUBSECUENTE",
+         (anio_poliza != 0) & (anio_poliza < anio),
+         rc == 34],
+        [1, 0, 0, 0, flag_canc],
+        default=(~ms["cancelado_vida"].astype(bool)).astype("int64"),
+    )
+
+    # CN / CO: equivalencias emitidas y pagadas
+    umbral_bajo = np.where(anio == 2024, 15000, 16000)
+    equiv = np.select(
+        [prima_pesos == 0, prima_pesos < umbral_bajo, prima_pesos < 50000],
+        [0.0, 0.5, 1.0], default=2.0,
+    )
+    equiv_pag = np.where((flag_canc != 0) & tiene_apli & (prima_acum != 0), equiv, 0.0)
+
+    # CU / CV: prima proporcional a TODAY()-28 y condicional
+    dias = ini["dias_ref"].astype(float)
+    aplica_prop = ini["es_fecha"].astype(bool) & (prima_pesos != 0) & (dias > 0)
+    prima_prop = np.where(aplica_prop, _redondear((np.nan_to_num(dias) / 365.0) * prima_pesos), 0.0)
+    cond_prima = _CONDICIONAL[(prima_acum < prima_prop).astype("int64")]
+
+    # BF: COUNTIF sobre la raíz de 6 caracteres
+    raiz6 = pd.Series(pol["raiz6"], index=idx, dtype=object)
+    num_reexp = raiz6.map(raiz6[raiz6 != ""].value_counts()).fillna(0).astype("int64")
+
+    def _objeto(valores) -> pd.Series:
+        return pd.Series(valores, index=idx, dtype=object)
+
+    return pd.DataFrame({
+        "largo_poliza": pol["largo"].astype("int64"),
+        "raiz_poliza_6": raiz6,
+        "terminacion": _objeto(pol["terminacion"]),
+        "id_compuesto": _objeto(pol["num"] + ini["sin_espacios"]),
+        "es_reexpedicion": pol["reexp"].astype(bool),
+        "primer_anio": _objeto(primer_anio),
+        "fecha_aplicacion": _objeto(np.where(tiene_apli, apli["valor"], None)),
+        "mes_aplicacion": _objeto(apli["mes_nombre"]),
+        "pendientes_pago": _objeto(pendientes),
+        "trimestre": _objeto(apli["trimestre"]),
+        "flag_pagada": flag_pag,
+        "flag_nueva_formal": flag_nueva.astype("int64"),
+        "tipo_poliza_nuevo": _objeto(tipo_final),
+        "prima_anual_pesos": prima_pesos,
+        "prima_acumulada_basica": _objeto(np.where(prima_acum != 0, prima_acum.astype(object), None)),
+        "equivalencias_emitidas": equiv,
+        "equivalencias_pagadas": equiv_pag,
+        "flag_cancelada": flag_canc.astype("int64"),
+        "prima_proporcional": prima_prop,
+        "condicional_prima": _objeto(cond_prima),
+        "periodo_aplicacion": _objeto(periodo_apli),
+        "anio_aplicacion": _objeto(np.where(np.isnan(anio_apli), None,
+                                            np.nan_to_num(anio_apli).astype("int64").astype(object))),
+        "num_reexpediciones": num_reexp,
+    }, index=idx)
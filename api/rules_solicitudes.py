@@ -139,15 +139,17 @@ def puede_vincular_poliza(poliza_numero: str) -> bool:
 def normalizar_poliza_para_cruce(poliza_numero: str) -> str:
     """
     Normaliza el número de póliza de la solicitud para cruzar con la tabla polizas.
-    Reutiliza la lógica de api/rules.py pero adaptada.
+    Es la misma clave que la columna match_key (api.rules.clave_cruce); "" si no hay póliza.
     """
-    import re
-    if not poliza_numero:
-        return ""
-    pol = str(poliza_numero).strip()
-    # Quitar ceros iniciales
-    normalizado = re.sub(r'^0+(\d)', r'\1', pol)
-    return normalizado
+    from .rules import clave_cruce
+    return clave_cruce(poliza_numero) or ""
+
+
+def match_key_solicitud(poliza_numero: str):
+    """match_key de la solicitud: clave de cruce si la póliza es vinculable (S3), si no None."""
+    if not puede_vincular_poliza(poliza_numero):
+        return None
+    return normalizar_poliza_para_cruce(poliza_numero) or None
 
 
 # ══════════════════════════════════════════════════════════════════
@@ -296,6 +298,7 @@ def aplicar_reglas_solicitud(solicitud: dict) -> dict:
         "alerta_atorada": alerta,
         "sla_cumplido": sla,
         "poliza_numero_normalizada": poliza_normalizada,
+        "match_key": poliza_normalizada or None,
         "puede_vincular": vinculable,
     }
 
@@ -100,10 +100,12 @@ class PolizaOut(PolizaBase):
 
 class PolizaListResponse(BaseModel):
     data: List[PolizaOut]
-    total: int
+    total: Optional[int] = None           # None con conteo=ninguno
     page: int
     limit: int
-    pages: int
+    pages: Optional[int] = None
+    total_estimado: bool = False          # total del planner (conteo=estimado en PostgreSQL)
+    next_cursor: Optional[str] = None     # 'fecha_inicio,id' para ?after= (None en la última página)
 
 
 # ── Dashboard ─────────────────────────────────────────────────────
@@ -486,6 +488,38 @@ class CobranzaResponse(BaseModel):
     filtros_disponibles: dict = {}
 
 
+class CobranzaResumenResponse(BaseModel):
+    """GET /cobranza/resumen: KPIs, alertas y seguimiento sin las listas."""
+    resumen: CobranzaResumen
+    alertas: List[AlertaCobranza]
+    seguimiento_mensual: List[SeguimientoMensual]
+    filtros_disponibles: dict = {}
+
+
+class DeudoresPagina(BaseModel):
+    data: List[DeudorPrima]
+    total: Optional[int] = None           # None con conteo=ninguno
+    limit: int
+    total_estimado: bool = False
+    next_cursor: Optional[str] = None     # Para ?after= (None en la última página)
+
+
+class RenovacionesPagina(BaseModel):
+    data: List[RenovacionPendiente]
+    total: Optional[int] = None
+    limit: int
+    total_estimado: bool = False
+    next_cursor: Optional[str] = None
+
+
+class CanceladasPagina(BaseModel):
+    data: List[PolizaCancelada]
+    total: Optional[int] = None
+    limit: int
+    total_estimado: bool = False
+    next_cursor: Optional[str] = None
+
+
 # ── Conciliación ──────────────────────────────────────────────────
 class ResumenConciliacion(BaseModel):
     total: int = 0
@@ -525,6 +559,31 @@ class ImportacionResult(BaseModel):
     mensaje: str = ""
 
 
+# ── Exportación asíncrona ─────────────────────────────────────────
+class TrabajoExportacionCreate(BaseModel):
+    tipo: str = Field(..., description="polizas | icp-2026")
+    formato: str = "xlsx"
+    filtros: dict = {}
+
+
+class TrabajoExportacionOut(BaseModel):
+    id: str
+    tipo: str
+    formato: str
+    filtros: dict = {}
+    estado: str                          # pendiente, en_proceso, listo, error, expirado
+    progreso: float = 0.0                # % de filas escritas
+    filas_total: Optional[int] = None
+    filas_procesadas: int = 0
+    desde_cache: bool = False            # True si se reutilizó un archivo ya generado
+    nombre_archivo: Optional[str] = None
+    bytes: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[str] = None
+    terminado_at: Optional[str] = None
+    url_descarga: Optional[str] = None
+
+
 # ── Finanzas — Ingresos vs Egresos (Fase 4) ──────────────────────
 
 class IngresoEgresoMensual(BaseModel):
@@ -8,6 +8,12 @@ from .database import (
     Segmento, Recibo, GestionComercial, Presupuesto,
     Contratante, Solicitud, Configuracion,
 )
+from .produccion_agg import refrescar_produccion
+from .deudor_prima import refrescar_cobranza
+from .cache_respuestas import invalidar
+from .rules import clave_cruce
+from .fechas_nativas import con_fechas_nativas
+from .busqueda import con_busqueda, texto_busqueda
 from datetime import datetime
 
 AGENTES_DEMO = [
@@ -108,6 +114,7 @@ def _fake_polizas(agente_ids: list[int], prod_ids_vida: list[int], prod_ids_gmm_
                 polizas.append({
                     "poliza_original": f"1{pid:04d}U00",
                     "poliza_estandar": f"1{pid:04d}U00",
+                    "match_key": f"1{pid:04d}U00",
                     "agente_id": agente_id,
                     "producto_id": prod_gmm,
                     "asegurado_nombre": nombres[pid % len(nombres)],
@@ -149,6 +156,7 @@ def _fake_polizas(agente_ids: list[int], prod_ids_vida: list[int], prod_ids_gmm_
             polizas.append({
                 "poliza_original": f"00764{pid:02d}A",
                 "poliza_estandar": f"764{pid:02d}A",
+                "match_key": f"764{pid:02d}A",
                 "agente_id": agente_id,
                 "producto_id": prod,
                 "asegurado_nombre": nombres[(pid * 3) % len(nombres)],
@@ -211,6 +219,7 @@ def seed_demo(db: Session) -> bool:
         ag = Agente(
             **{k: v for k, v in a.items() if v is not None},
             promotor="MAG Principal", nombre_promotoria="MAG",
+            busqueda=texto_busqueda(a["codigo_agente"], a["nombre_completo"]),
             segmento_nombre=seg_nombre,
             segmento_agrupado=extra.get("segmento_agrupado"),
             gestion_comercial=gestion_nombre,
@@ -242,7 +251,7 @@ def seed_demo(db: Session) -> bool:
     # Pólizas
     polizas_data = _fake_polizas(agente_ids, prod_vida, prod_gmm_map)
     for pd_data in polizas_data:
-        db.add(Poliza(**pd_data))
+        db.add(Poliza(**con_busqueda("polizas", con_fechas_nativas("polizas", pd_data))))
 
     # Indicadores AXA ejemplo
     for codigo, pol, ramo, prima in [
@@ -254,6 +263,7 @@ def seed_demo(db: Session) -> bool:
         db.add(IndicadorAxa(
             periodo="2025-07",
             poliza=pol,
+            match_key=clave_cruce(pol),
             agente_codigo=codigo,
             ramo=ramo,
             prima_primer_anio=prima,
@@ -297,7 +307,7 @@ def seed_demo(db: Session) -> bool:
     ]
     contratantes = []
     for cd in contratantes_demo:
-        c = Contratante(**cd)
+        c = Contratante(**con_busqueda("contratantes", cd))
         if len(contratantes) > 0:
             c.agente_id = agentes[len(contratantes) % len(agentes)].id
         db.add(c)
@@ -321,7 +331,7 @@ def seed_demo(db: Session) -> bool:
         {"folio": "SOL-202502-0006", "agente_id": agentes[2].id, "contratante_id": contratantes[1].id, "ramo": "GMM", "plan": "Estándar", "prima_estimada": 12000, "estado": "CANCELADA", "fecha_solicitud": "2025-02-08", "notas": "Cliente desistió"},
     ]
     for sd in solicitudes_demo:
-        db.add(Solicitud(**sd))
+        db.add(Solicitud(**con_busqueda("solicitudes", sd)))
 
     # ── Configuraciones default (Fase 5.5) ──
     configs_default = [
@@ -338,6 +348,10 @@ def seed_demo(db: Session) -> bool:
     for cfg in configs_default:
         db.add(Configuracion(**cfg))
 
+    db.flush()
+    refrescar_produccion(db)
+    refrescar_cobranza(db)
+    invalidar(db)
     db.commit()
     print(f"[SEED] {len(polizas_data)} polizas, {len(agentes)} agentes, {len(SEGMENTOS_DEMO)} segmentos, {len(GESTIONES_DEMO)} gestiones insertados.")
     return True
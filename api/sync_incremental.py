@@ -0,0 +1,341 @@
+"""
+Sincronización incremental Oracle → BD local
+============================================
+Reemplaza el DELETE + reinserción completa por un upsert set-based:
+  1. Marca de agua (high-watermark) por fuente en `sync_watermarks`
+  2. Oracle solo entrega filas con columna_marca >= marca - VENTANA_DIAS
+  3. El delta se carga a una tabla staging temporal (COPY en PostgreSQL)
+  4. MERGE: UPDATE ... FROM staging (solo filas que cambiaron)
+            + INSERT ... SELECT de las llaves que no existen
+
+Llaves naturales:
+  polizas      → poliza_original + fecha_inicio (fecha_inicio puede venir vacía)
+  solicitudes  → nosol
+  pagos        → comprobante; sin comprobante, poliza_numero + fecha_aplicacion
+                 + endoso (llave alterna, solo contra pagos locales sin comprobante;
+                 los pagos que la comparten se suman en una fila)
+
+La ventana de re-lectura cubre cambios tardíos en Oracle; como el MERGE es
+idempotente, releer filas sin cambios no reescribe nada.
+
+Pólizas se extrae COMPLETA en cada corrida (`siempre_completo`): la vista
+POLIZAS_01 no tiene columna de última modificación y FECEMI (emisión) no cambia
+cuando una póliza vieja se cancela o cambia de estatus o prima. El MERGE sigue
+reescribiendo solo las filas que cambiaron, y al tener la vista entera se
+borran las pólizas de Oracle que ya no existen en la vista (`ausentes`), igual
+que el DELETE + recarga de antes. Si la vista expone una columna de
+modificación, basta apuntar "marca" a ella y quitar `siempre_completo`.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .bulk_loader import bulk_insert, defaults_python
+from .database import Base, SyncWatermark
+from .cache_respuestas import invalidar
+
+logger = logging.getLogger(__name__)
+
+VENTANA_DIAS = 7
+
+# Fuente → tabla local, llave natural, vista Oracle y columna de marca de agua
+ENTIDADES = {
+    "polizas": {
+        "tabla": "polizas",
+        "llave": ("poliza_original", "fecha_inicio"),
+        "opcionales": ("fecha_inicio",),        # Columnas de la llave que pueden venir vacías
+        "vista": "UCARTERA.POLIZAS_01",
+        "marca": "FECEMI",                      # Solo informativa: ver siempre_completo
+        "siempre_completo": True,
+        # Con la vista completa: filas locales de esta fuente que ya no vienen se
+        # borran; sus referencias se anulan ("nulo") o se borran ("borrar")
+        "ausentes": {
+            "filtro": "fuente = 'ORACLE_MAESTRO'",
+            "referencias": (
+                ("polizas", "poliza_padre_id", "nulo"),
+                ("conciliaciones", "poliza_id", "nulo"),
+                ("recibos", "poliza_id", "borrar"),
+                ("recibos_cobranza", "poliza_id", "borrar"),
+                ("deudores_prima", "poliza_id", "borrar"),
+            ),
+        },
+    },
+    "pagos": {
+        "tabla": "pagos",
+        "llave": ("comprobante",),
+        # Pagos sin comprobante: se reconcilian por póliza + fecha + endoso; si
+        # varios comparten esa llave se guardan como una fila con los montos sumados
+        "alterna": {
+            "llave": ("poliza_numero", "fecha_aplicacion", "endoso"),
+            "opcionales": ("endoso",),
+            "sumar": ("prima_neta", "prima_total", "comision", "comision_derecho",
+                      "comision_recargo", "comision_total"),
+        },
+        "vista": "PAGTOTAL",
+        "marca": "FECAPLI",
+        "inicial": "FECAPLI >= SYSDATE - 5",     # Primera corrida sin marca
+    },
+    "solicitudes": {
+        "tabla": "solicitudes",
+        "llave": ("nosol",),
+        "vista": "UCARTERA.VW_CONCENTRADO_ULT_ETAPAS",
+        "marca": "FECETAPA",
+    },
+}
+
+# Columnas que no cuentan como "cambio" al comparar contra staging
+_NO_COMPARABLES = {"created_at", "updated_at"}
+
+
+# ══════════════════════════════════════════════════════════════════
+# MARCAS DE AGUA
+# ══════════════════════════════════════════════════════════════════
+
+def leer_marca(db: Session, fuente: str) -> Optional[str]:
+    wm = db.query(SyncWatermark).filter_by(fuente=fuente).first()
+    return wm.marca if wm else None
+
+
+def guardar_marca(db: Session, fuente: str, marca: Optional[str], stats: dict) -> None:
+    """Actualiza la marca de la fuente (no hace commit; va en la misma transacción del MERGE)."""
+    wm = db.query(SyncWatermark).filter_by(fuente=fuente).first()
+    if wm is None:
+        wm = SyncWatermark(fuente=fuente)
+        db.add(wm)
+    if marca is not None:
+        wm.marca = marca
+    wm.filas_leidas = stats["leidas"]
+    wm.filas_insertadas = stats["insertadas"]
+    wm.filas_actualizadas = stats["actualizadas"]
+    wm.updated_at = datetime.now().isoformat()
+    db.flush()
+
+
+def _valor_marca(v) -> Optional[str]:
+    if v is None or v == "":
+        return None
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return str(v)
+
+
+def consulta_incremental(db: Session, fuente: str, columnas: str = "*",
+                         completo: bool = False, filtro: str = None):
+    """
+    SQL de Oracle para la fuente, limitado al delta desde la última marca.
+    Sin marca previa se usa el filtro "inicial" de la fuente (si tiene);
+    con completo=True (o si la fuente es `siempre_completo`) se extrae la vista entera.
+    Retorna (sql, params).
+    """
+    ent = ENTIDADES[fuente]
+    completo = completo or ent.get("siempre_completo", False)
+    condiciones = [filtro] if filtro else []
+    params = {}
+    marca = None if completo else leer_marca(db, fuente)
+    if marca:
+        try:
+            desde = datetime.fromisoformat(marca) - timedelta(days=VENTANA_DIAS)
+        except ValueError:
+            desde = marca
+        condiciones.append(f"{ent['marca']} >= :desde")
+        params["desde"] = desde
+    elif not completo and ent.get("inicial"):
+        condiciones.append(ent["inicial"])
+
+    sql = f"SELECT {columnas} FROM {ent['vista']}"
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    return sql, params
+
+
+# ══════════════════════════════════════════════════════════════════
+# MERGE VÍA STAGING
+# ══════════════════════════════════════════════════════════════════
+
+def _distinto(dialecto: str, tabla: str, columnas: list) -> str:
+    """Condición null-safe 'la fila destino difiere de staging en alguna columna'."""
+    op = "IS DISTINCT FROM" if dialecto == "postgresql" else "IS NOT"
+    return " OR ".join(f"{tabla}.{c} {op} s.{c}" for c in columnas)
+
+
+def _cruce(dialecto: str, tabla: str, llave: tuple, opcionales: tuple = (), nulas: tuple = ()) -> str:
+    """
+    Condición de cruce destino ↔ staging por llave natural. Las columnas
+    `opcionales` se comparan null-safe; las `nulas` deben ser NULL en el destino.
+    """
+    igual = "IS NOT DISTINCT FROM" if dialecto == "postgresql" else "IS"
+    partes = [f"{tabla}.{k} {igual if k in opcionales else '='} s.{k}" for k in llave]
+    partes += [f"{tabla}.{c} IS NULL" for c in nulas]
+    return " AND ".join(partes)
+
+
+def _clave(fila: dict, llave: tuple, opcionales: tuple = ()) -> Optional[tuple]:
+    """Llave natural de la fila; None si falta alguna columna no opcional."""
+    clave = tuple(fila.get(k) for k in llave)
+    if any((v is None or v == "") and k not in opcionales for k, v in zip(llave, clave)):
+        return None
+    return clave
+
+
+def _borrar_ausentes(db: Session, tabla: str, stg: str, cruce: str, ausentes: dict) -> int:
+    """Borra las filas de `tabla` (según el filtro) que no vienen en staging; primero sus referencias."""
+    aus = f"aus_{tabla}"
+    db.execute(text(f"DROP TABLE IF EXISTS {aus}"))
+    db.execute(text(f"""
+        CREATE TEMP TABLE {aus} AS
+        SELECT id FROM {tabla}
+        WHERE {ausentes["filtro"]} AND NOT EXISTS (SELECT 1 FROM {stg} AS s WHERE {cruce})
+    """))
+    for ref_tabla, columna, accion in ausentes.get("referencias", ()):
+        if accion == "nulo":
+            db.execute(text(f"UPDATE {ref_tabla} SET {columna} = NULL WHERE {columna} IN (SELECT id FROM {aus})"))
+        else:
+            db.execute(text(f"DELETE FROM {ref_tabla} WHERE {columna} IN (SELECT id FROM {aus})"))
+    eliminadas = db.execute(text(f"DELETE FROM {tabla} WHERE id IN (SELECT id FROM {aus})")).rowcount
+    db.execute(text(f"DROP TABLE {aus}"))
+    return eliminadas
+
+
+def merge_staging(db: Session, tabla: str, llave: tuple, filas: list, ausentes: dict = None,
+                  opcionales: tuple = (), nulas: tuple = ()) -> dict:
+    """
+    Upsert de `filas` (dicts con columnas de `tabla`, llaves únicas) en `tabla`.
+    Solo reescribe las filas que cambiaron. Con `ausentes` (extracción completa)
+    además borra las filas locales que ya no vienen. Las columnas `opcionales`
+    de la llave se cruzan null-safe; con `nulas` solo se cruza contra filas
+    locales que tienen esas columnas en NULL. No hace commit.
+    Retorna {"insertadas", "actualizadas", "eliminadas"}.
+    """
+    if not filas:
+        return {"insertadas": 0, "actualizadas": 0, "eliminadas": 0}
+
+    modelo = Base.metadata.tables[tabla]
+    columnas = [c for c in filas[0] if c in modelo.columns]
+    defaults = defaults_python(modelo, columnas)
+    todas = columnas + list(defaults)
+    actualizables = [c for c in columnas if c not in llave and c not in nulas and c != "created_at"]
+    comparables = [c for c in actualizables if c not in _NO_COMPARABLES]
+
+    stg = f"stg_{tabla}"
+    lista = ", ".join(todas)
+    db.execute(text(f"DROP TABLE IF EXISTS {stg}"))
+    db.execute(text(f"CREATE TEMP TABLE {stg} AS SELECT {lista} FROM {tabla} WHERE 1=0"))
+    bulk_insert(db, stg, filas, columnas=todas)
+
+    dialecto = db.get_bind().dialect.name
+    cruce = _cruce(dialecto, tabla, llave, opcionales, nulas)
+
+    actualizadas = 0
+    if comparables:
+        asignaciones = ", ".join(f"{c} = s.{c}" for c in actualizables)
+        actualizadas = db.execute(text(f"""
+            UPDATE {tabla} SET {asignaciones}
+            FROM {stg} AS s
+            WHERE {cruce} AND ({_distinto(dialecto, tabla, comparables)})
+        """)).rowcount
+
+    cruce_nuevas = _cruce(dialecto, "t", llave, opcionales, nulas)
+    insertadas = db.execute(text(f"""
+        INSERT INTO {tabla} ({lista})
+        SELECT {", ".join("s." + c for c in todas)} FROM {stg} AS s
+        WHERE NOT EXISTS (SELECT 1 FROM {tabla} t WHERE {cruce_nuevas})
+    """)).rowcount
+
+    eliminadas = 0
+    if ausentes:
+        eliminadas = _borrar_ausentes(db, tabla, stg, cruce, ausentes)
+
+    db.execute(text(f"DROP TABLE {stg}"))
+    return {"insertadas": insertadas, "actualizadas": actualizadas, "eliminadas": eliminadas}
+
+
+def sincronizar(db: Session, fuente: str, registros: Iterable[dict],
+                mapear: Callable[[dict], Optional[dict]], completo: bool = False) -> dict:
+    """
+    Sincroniza una fuente Oracle de forma incremental.
+
+    Args:
+        registros: filas crudas de Oracle como dicts (columnas en mayúsculas).
+        mapear: convierte una fila cruda en la fila local; None para descartarla.
+        completo: `registros` es la vista entera; si la fuente define `ausentes`
+            se borran las filas locales que ya no vienen (ver consulta_incremental).
+
+    Las filas sin llave natural completa se reconcilian por la llave `alterna`
+    de la fuente si la tiene (con la llave principal en NULL). Las que `mapear`
+    descarta y las que no traen ninguna llave no se pueden reconciliar: se
+    cuentan (descartadas, sin_llave) y se registran en el log. Si la llave
+    principal se repite en el delta gana la última; si se repite la alterna,
+    las columnas `sumar` se acumulan en una sola fila (colisiones). Guarda la
+    nueva marca de agua. No hace commit: el MERGE y la marca se confirman juntos.
+
+    Returns:
+        Estadísticas: leidas, insertadas, actualizadas, eliminadas, sin_cambios,
+        descartadas, llave_alterna, colisiones, sin_llave, marca.
+    """
+    ent = ENTIDADES[fuente]
+    llave = ent["llave"]
+    opcionales = ent.get("opcionales", ())
+    alterna = ent.get("alterna")
+    completo = completo or ent.get("siempre_completo", False)
+    delta, delta_alterna = {}, {}
+    leidas = descartadas = sin_llave = colisiones = 0
+    marca = leer_marca(db, fuente)
+
+    for data in registros:
+        leidas += 1
+        valor = _valor_marca(data.get(ent["marca"]))
+        if valor is not None and (marca is None or valor > marca):
+            marca = valor
+        fila = mapear(data)
+        if fila is None:
+            descartadas += 1
+            continue
+        clave = _clave(fila, llave, opcionales)
+        if clave is not None:
+            delta[clave] = fila
+            continue
+        clave = _clave(fila, alterna["llave"], alterna.get("opcionales", ())) if alterna else None
+        if clave is None:
+            sin_llave += 1
+            continue
+        fila.update({k: None for k in llave})
+        previa = delta_alterna.get(clave)
+        if previa is not None:
+            colisiones += 1
+            for c in alterna.get("sumar", ()):
+                if c in fila:
+                    fila[c] = (previa.get(c) or 0) + (fila[c] or 0)
+        delta_alterna[clave] = fila
+
+    if descartadas or sin_llave:
+        logger.warning(f"[SYNC] {fuente}: {descartadas:,} filas descartadas por el mapeo y "
+                       f"{sin_llave:,} sin llave natural ({'/'.join(llave)}) de {leidas:,} leídas")
+    if colisiones:
+        logger.warning(f"[SYNC] {fuente}: {colisiones:,} filas sin llave natural comparten la llave "
+                       f"alterna ({'/'.join(alterna['llave'])}); sus montos se sumaron en una sola fila")
+
+    # Una extracción completa vacía es un error de origen, no "borrar todo"
+    ausentes = ent.get("ausentes") if completo and delta else None
+    stats = merge_staging(db, ent["tabla"], llave, list(delta.values()), ausentes=ausentes,
+                          opcionales=opcionales)
+    if delta_alterna:
+        extra = merge_staging(db, ent["tabla"], alterna["llave"], list(delta_alterna.values()),
+                              opcionales=alterna.get("opcionales", ()), nulas=llave)
+        stats["insertadas"] += extra["insertadas"]
+        stats["actualizadas"] += extra["actualizadas"]
+    stats.update({
+        "leidas": leidas,
+        "sin_cambios": len(delta) + len(delta_alterna) - stats["insertadas"] - stats["actualizadas"],
+        "descartadas": descartadas,
+        "llave_alterna": len(delta_alterna),
+        "colisiones": colisiones,
+        "sin_llave": sin_llave,
+        "marca": marca,
+    })
+    guardar_marca(db, fuente, marca, stats)
+    if stats["insertadas"] or stats["actualizadas"] or stats["eliminadas"]:
+        invalidar(db)
+    return stats
@@ -0,0 +1,267 @@
+"""
+Trabajos de exportación asíncronos
+==================================
+Las exportaciones grandes ya no corren dentro del request (ocupaban un
+worker y chocaban con el timeout de Cloud Run):
+
+  POST /exportar/jobs                  encola {tipo, formato, filtros} → 202 + id
+  GET  /exportar/jobs/{id}             estado y avance (filas escritas / total)
+  GET  /exportar/jobs/{id}/descarga    el archivo, cuando el estado es 'listo'
+
+Un pool de hilos (MAG_EXPORT_WORKERS) escribe el archivo con los escritores
+por lotes de api/exportacion.py en MAG_EXPORT_DIR. El estado vive en la tabla
+trabajos_exportacion, así que cualquier instancia lo consulta; para que
+cualquiera sirva la descarga, MAG_EXPORT_DIR debe ser un volumen compartido
+(igual que MAG_CACHE_DIR).
+
+Latido: cada MAG_EXPORT_LATIDO_LOTES lotes el worker escribe filas_procesadas
+y updated_at en la fila del trabajo (con su propia sesión, sin tocar el cursor
+de la exportación). Así otra instancia ve el avance y solo da por abandonado
+un trabajo cuyo latido lleva MAG_EXPORT_TIMEOUT_MIN sin llegar. En SQLite no
+hay latido: el cursor abierto de la exportación bloquea cualquier escritura
+desde otra conexión, y una BD local la usa una sola instancia.
+
+Artefactos: la clave es sha256(tipo, formato, filtros normalizados, versión
+de los datos). Si ya hay un trabajo listo con la misma clave se responde ese
+(desde_cache=True) sin recalcular; si hay uno en curso, se reutiliza. Al subir
+la versión de los datos la clave cambia y la siguiente petición genera otro
+archivo. Los artefactos se borran a las MAG_EXPORT_TTL_HORAS.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session, sessionmaker
+
+from .cache_respuestas import version_datos
+from .database import TrabajoExportacion
+from .exportacion import EXPORTACIONES, FORMATOS, normalizar_filtros, validar_formato
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("MAG_EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "mag_exportaciones")
+EXPORT_WORKERS = int(os.getenv("MAG_EXPORT_WORKERS", "2"))
+EXPORT_TTL_HORAS = int(os.getenv("MAG_EXPORT_TTL_HORAS", "24"))
+# Un trabajo en curso que no está en esta instancia y no avanza en este tiempo
+# se da por perdido (la instancia que lo corría se reinició)
+EXPORT_TIMEOUT_MIN = int(os.getenv("MAG_EXPORT_TIMEOUT_MIN", "30"))
+EXPORT_LATIDO_LOTES = int(os.getenv("MAG_EXPORT_LATIDO_LOTES", "10"))   # Lotes entre escrituras del avance
+SIN_LATIDO = ("sqlite",)    # Dialectos donde el worker no escribe el avance en la BD
+
+EN_CURSO = ("pendiente", "en_proceso")
+
+_pool: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+_progreso = {}          # id → filas escritas (trabajos de esta instancia)
+
+
+def _pool_trabajos() -> ThreadPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="exportacion")
+        return _pool
+
+
+def _ahora() -> str:
+    return datetime.now().isoformat()
+
+
+def clave_artefacto(tipo: str, formato: str, filtros: dict, version: int) -> str:
+    datos = json.dumps([tipo, formato, filtros, version], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(datos.encode()).hexdigest()
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. ENCOLAR
+# ══════════════════════════════════════════════════════════════════
+
+def _abandonado(trabajo: TrabajoExportacion) -> bool:
+    """En curso en otra instancia (o en cola aquí) y sin latido en EXPORT_TIMEOUT_MIN."""
+    if trabajo.id in _progreso:
+        return False
+    limite = datetime.now() - timedelta(minutes=EXPORT_TIMEOUT_MIN)
+    return datetime.fromisoformat(trabajo.updated_at) < limite
+
+
+def limpiar_vencidos(db: Session) -> int:
+    """Borra los artefactos de más de EXPORT_TTL_HORAS y marca sus trabajos como 'expirado'. No hace commit."""
+    limite = (datetime.now() - timedelta(hours=EXPORT_TTL_HORAS)).isoformat()
+    vencidos = db.query(TrabajoExportacion).filter(
+        TrabajoExportacion.estado == "listo", TrabajoExportacion.terminado_at < limite).all()
+    for t in vencidos:
+        if t.archivo and os.path.exists(t.archivo):
+            os.unlink(t.archivo)
+        t.estado = "expirado"
+        t.updated_at = _ahora()
+    return len(vencidos)
+
+
+def encolar(db: Session, tipo: str, formato: str, filtros: dict) -> tuple:
+    """
+    Trabajo para (tipo, formato, filtros): uno listo o en curso con la misma
+    clave, o uno nuevo enviado al pool. Retorna (trabajo, desde_cache).
+    """
+    if tipo not in EXPORTACIONES:
+        raise HTTPException(400, f"tipo debe ser uno de: {', '.join(EXPORTACIONES)}")
+    definicion = EXPORTACIONES[tipo]
+    formato = validar_formato(formato)
+    if formato not in definicion["formatos"]:
+        raise HTTPException(400, f"{tipo} se exporta en: {', '.join(definicion['formatos'])}")
+    filtros = normalizar_filtros(tipo, filtros or {})
+    version = version_datos(db)
+    clave = clave_artefacto(tipo, formato, filtros, version)
+
+    limpiar_vencidos(db)
+    for previo in (db.query(TrabajoExportacion)
+                   .filter(TrabajoExportacion.clave == clave,
+                           TrabajoExportacion.estado.in_(("listo",) + EN_CURSO))
+                   .order_by(TrabajoExportacion.created_at.desc())):
+        if previo.estado == "listo" and previo.archivo and os.path.exists(previo.archivo):
+            db.commit()
+            return previo, True
+        if previo.estado in EN_CURSO:
+            if not _abandonado(previo):
+                db.commit()
+                return previo, False
+            previo.estado = "error"
+            previo.error = "Trabajo abandonado: la instancia que lo procesaba ya no responde"
+            previo.updated_at = _ahora()
+
+    trabajo = TrabajoExportacion(
+        id=uuid.uuid4().hex, tipo=tipo, formato=formato,
+        filtros=json.dumps(filtros, ensure_ascii=False), clave=clave, version=version,
+        estado="pendiente", filas_procesadas=0,
+    )
+    db.add(trabajo)
+    db.commit()
+    _progreso[trabajo.id] = 0
+    # El hilo abre sus propias sesiones sobre el mismo engine que el request
+    _pool_trabajos().submit(ejecutar, sessionmaker(bind=db.get_bind()), trabajo.id)
+    return trabajo, False
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. WORKER
+# ══════════════════════════════════════════════════════════════════
+
+def _latido(session_factory, trabajo_id: str, filas: int) -> None:
+    """Avance y updated_at en la BD, en una sesión aparte. Un fallo solo se registra."""
+    db = session_factory()
+    try:
+        db.query(TrabajoExportacion).filter(
+            TrabajoExportacion.id == trabajo_id, TrabajoExportacion.estado == "en_proceso",
+        ).update({"filas_procesadas": filas, "updated_at": _ahora()}, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.warning(f"[EXPORTACIÓN] No se pudo registrar el avance de {trabajo_id}", exc_info=True)
+    finally:
+        db.close()
+
+
+def ejecutar(session_factory, trabajo_id: str) -> None:
+    """Escribe el artefacto del trabajo (en un hilo del pool) y deja el estado final en la BD."""
+    db = session_factory()
+    tmp = None
+    try:
+        trabajo = db.get(TrabajoExportacion, trabajo_id)
+        definicion = EXPORTACIONES[trabajo.tipo]
+        filtros = json.loads(trabajo.filtros or "{}")
+        trabajo.estado = "en_proceso"
+        trabajo.updated_at = _ahora()
+        if definicion["contar"]:
+            trabajo.filas_total = definicion["contar"](db, filtros)
+        db.commit()
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        ruta = os.path.join(EXPORT_DIR, f"{trabajo.clave}.{FORMATOS[trabajo.formato][1]}")
+        tmp = f"{ruta}.{trabajo_id}.parcial"
+
+        lotes = 0
+        latir = db.get_bind().dialect.name not in SIN_LATIDO
+
+        def avance(n: int) -> None:
+            nonlocal lotes
+            _progreso[trabajo_id] = _progreso.get(trabajo_id, 0) + n
+            lotes += 1
+            if latir and lotes % EXPORT_LATIDO_LOTES == 0:
+                _latido(session_factory, trabajo_id, _progreso[trabajo_id])
+
+        with open(tmp, "wb") as destino:
+            info = definicion["escribir"](db, filtros, trabajo.formato, destino, avance)
+        os.replace(tmp, ruta)
+        tmp = None
+
+        trabajo = db.get(TrabajoExportacion, trabajo_id)
+        trabajo.estado = "listo"
+        trabajo.archivo = ruta
+        trabajo.nombre_archivo = info["nombre"]
+        trabajo.filas_procesadas = info["filas"]
+        trabajo.filas_total = info["filas"]
+        trabajo.bytes = os.path.getsize(ruta)
+        trabajo.updated_at = trabajo.terminado_at = _ahora()
+        db.commit()
+        logger.info(f"[EXPORTACIÓN] {trabajo.tipo}/{trabajo.formato}: {info['filas']:,} filas, {trabajo.bytes:,} bytes")
+
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"[EXPORTACIÓN] Error en el trabajo {trabajo_id}")
+        trabajo = db.get(TrabajoExportacion, trabajo_id)
+        if trabajo is not None:
+            trabajo.estado = "error"
+            trabajo.error = str(e)
+            trabajo.updated_at = trabajo.terminado_at = _ahora()
+            db.commit()
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+    finally:
+        _progreso.pop(trabajo_id, None)
+        db.close()
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. ESTADO
+# ══════════════════════════════════════════════════════════════════
+
+def obtener(db: Session, trabajo_id: str) -> TrabajoExportacion:
+    trabajo = db.get(TrabajoExportacion, trabajo_id)
+    if trabajo is None:
+        raise HTTPException(404, "Trabajo de exportación no encontrado")
+    return trabajo
+
+
+def estado(trabajo: TrabajoExportacion, desde_cache: bool = False) -> dict:
+    """Respuesta de GET /exportar/jobs/{id}; el avance se lee de esta instancia si lo corre, si no del último latido."""
+    procesadas = _progreso.get(trabajo.id, trabajo.filas_procesadas or 0)
+    if trabajo.estado == "listo":
+        progreso = 100.0
+    elif trabajo.filas_total:
+        progreso = round(min(procesadas / trabajo.filas_total * 100, 99.9), 1)
+    else:
+        progreso = 0.0
+    return {
+        "id": trabajo.id,
+        "tipo": trabajo.tipo,
+        "formato": trabajo.formato,
+        "filtros": json.loads(trabajo.filtros or "{}"),
+        "estado": trabajo.estado,
+        "progreso": progreso,
+        "filas_total": trabajo.filas_total,
+        "filas_procesadas": procesadas,
+        "desde_cache": desde_cache,
+        "nombre_archivo": trabajo.nombre_archivo,
+        "bytes": trabajo.bytes,
+        "error": trabajo.error,
+        "created_at": trabajo.created_at,
+        "terminado_at": trabajo.terminado_at,
+        "url_descarga": f"/exportar/jobs/{trabajo.id}/descarga" if trabajo.estado == "listo" else None,
+    }
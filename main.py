@@ -9,6 +9,10 @@ from contextlib import asynccontextmanager
 
 from api.database import init_db, SessionLocal
 from api.seed import seed_demo
+from api.produccion_agg import inicializar_produccion
+from api.oracle_client import cerrar_pool
+from api.documentos import cerrar_cliente as cerrar_cliente_documentos
+from api.cache_respuestas import estadisticas as estadisticas_cache
 from api.tenant import get_tenant_config, get_tenant_branding, validate_tenant, TENANT_ID, TENANT_DISPLAY_NAME
 from api.routers import (
     router_dashboard,
@@ -20,6 +24,7 @@ from api.routers import (
     router_cobranza,
     router_finanzas,
     router_contratantes,
+    router_busqueda,
     router_solicitudes,
     router_comisiones,
     router_configuracion,
@@ -50,10 +55,14 @@ async def lifespan(app: FastAPI):
         seeded = seed_demo(db)
         if seeded:
             print("[MAG] Datos de demo insertados.")
+        if inicializar_produccion(db):
+            print("[MAG] Producción pre-agregada construida.")
     finally:
         db.close()
     print("[MAG] API lista.")
     yield
+    cerrar_pool()
+    await cerrar_cliente_documentos()
     print("[MAG] API detenida.")
 
 
@@ -79,6 +88,7 @@ app.include_router(router_conciliacion)
 app.include_router(router_cobranza)
 app.include_router(router_finanzas)
 app.include_router(router_contratantes)
+app.include_router(router_busqueda)
 app.include_router(router_solicitudes)
 app.include_router(router_comisiones)
 app.include_router(router_configuracion)
@@ -114,4 +124,4 @@ def tenant_info():
 
 @app.get("/health", tags=["Sistema"])
 def health():
-    return {"status": "ok", "tenant": TENANT_ID}
+    return {"status": "ok", "tenant": TENANT_ID, "cache": estadisticas_cache()}
@@ -20,6 +20,7 @@ from datetime import datetime
 from collections import Counter, defaultdict
 from sqlalchemy import text
 from api.database import SessionLocal, engine
+from api.cache_respuestas import invalidar
 from api.rules_solicitudes import (
     normalizar_ramo, derivar_estado_de_etapa, detectar_solicitud_atorada,
     calcular_dias_tramite, evaluar_sla, calcular_tasa_conversion, puede_vincular_poliza,
@@ -197,6 +198,7 @@ def main():
             """), {"tasa": tasa, "idagente": a["idagente"]})
             updated_agentes += 1
 
+        invalidar(db)
         db.commit()
         print(f"  ✅ {updated_agentes:,} agentes con tasa actualizada")
 
@@ -215,11 +217,8 @@ def main():
         # Verificar cuántas polizas de solicitudes se encuentran en tabla polizas
         matches = db.execute(text("""
             SELECT COUNT(DISTINCT s.id) FROM solicitudes s
-            INNER JOIN polizas p ON (
-                p.poliza_estandar = s.poliza_numero OR
-                p.poliza_original = s.poliza_numero
-            )
-            WHERE s.poliza_numero IS NOT NULL AND s.poliza_numero != ''
+            INNER JOIN polizas p ON p.match_key = s.match_key
+            WHERE s.match_key IS NOT NULL
         """)).scalar()
 
         print(f"  Solicitudes con póliza asignada:   {sol_con_poliza:,} ({sol_con_poliza/total_sol*100:.1f}%)")
@@ -236,19 +235,13 @@ def main():
         pol_con_pagos = db.execute(text("""
             SELECT COUNT(DISTINCT p.id)
             FROM polizas p
-            INNER JOIN pagos pg ON (
-                pg.poliza_match = p.poliza_estandar OR
-                pg.poliza_numero = p.poliza_original
-            )
+            INNER JOIN pagos pg ON pg.match_key = p.match_key
         """)).scalar()
 
         pagos_huerfanos = db.execute(text("""
             SELECT COUNT(pg.id)
             FROM pagos pg
-            LEFT JOIN polizas p ON (
-                pg.poliza_match = p.poliza_estandar OR
-                pg.poliza_numero = p.poliza_original
-            )
+            LEFT JOIN polizas p ON p.match_key = pg.match_key
             WHERE p.id IS NULL
         """)).scalar()
 
@@ -263,15 +256,9 @@ def main():
         cadena_completa = db.execute(text("""
             SELECT COUNT(DISTINCT s.id)
             FROM solicitudes s
-            INNER JOIN polizas p ON (
-                p.poliza_estandar = s.poliza_numero OR
-                p.poliza_original = s.poliza_numero
-            )
-            INNER JOIN pagos pg ON (
-                pg.poliza_match = p.poliza_estandar OR
-                pg.poliza_numero = p.poliza_original
-            )
-            WHERE s.poliza_numero IS NOT NULL AND s.poliza_numero != ''
+            INNER JOIN polizas p ON p.match_key = s.match_key
+            INNER JOIN pagos pg ON pg.match_key = p.match_key
+            WHERE s.match_key IS NOT NULL
         """)).scalar()
 
         print(f"  Solicitudes con cadena completa:    {cadena_completa:,}")
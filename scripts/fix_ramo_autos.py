@@ -19,6 +19,7 @@ sys.path.insert(0, ROOT)
 
 from sqlalchemy import text, create_engine
 from sqlalchemy.orm import sessionmaker
+from api.cache_respuestas import invalidar
 
 # Usar la URL de Cloud SQL desde variable de entorno
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -82,6 +83,7 @@ try:
                OR LOWER(ramo_nombre) LIKE '%automóvil%')
           AND ramo_codigo != 90
     """)).rowcount
+    invalidar(db)
     db.commit()
     print(f"  ✅ {updated} productos actualizados a ramo_codigo=90")
 
@@ -25,6 +25,11 @@ except ImportError:
 
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
+
+# api/ se copia junto a scripts/ en la imagen (ver Dockerfile)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.bulk_loader import bulk_insert
+from api.cache_respuestas import invalidar
 from datetime import datetime
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
@@ -125,26 +130,6 @@ def main():
             reader.fieldnames = [h.strip().replace('"', '') for h in reader.fieldnames]
             print(f"  Columnas: {', '.join(reader.fieldnames[:8])}...", flush=True)
 
-        INSERT_SQL = text("""
-            INSERT INTO etapas_solicitudes (
-                nosol, nomramo, fecrecepcion, contratante,
-                dia_recepcion, mes_recepcion, ano_recepcion,
-                etapa, subetapa, fecetapa,
-                dia_etapa, mes_etapa, ano_etapa,
-                observaciones, idagente, nuevo, antaxa, reingreso,
-                contasol, poliza, numsolicitantes, fecha_sistema,
-                dias_tramite, fuente
-            ) VALUES (
-                :nosol, :nomramo, :fecrecepcion, :contratante,
-                :dia_recepcion, :mes_recepcion, :ano_recepcion,
-                :etapa, :subetapa, :fecetapa,
-                :dia_etapa, :mes_etapa, :ano_etapa,
-                :observaciones, :idagente, :nuevo, :antaxa, :reingreso,
-                :contasol, :poliza, :numsolicitantes, :fecha_sistema,
-                :dias_tramite, :fuente
-            )
-        """)
-
         batch = []
         total = 0
         errores = 0
@@ -229,8 +214,9 @@ def main():
                 if errores <= 5:
                     print(f"  Error fila {i+2}: {str(e)[:80]}", flush=True)
 
-        if batch:
-            db.execute(INSERT_SQL, batch)
+        # COPY FROM STDIN en Cloud SQL (psycopg2)
+        bulk_insert(db, "etapas_solicitudes", batch)
+        invalidar(db)
         db.commit()
 
         os.unlink(tmp.name)
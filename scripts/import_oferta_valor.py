@@ -13,6 +13,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from pyxlsb import open_workbook
 from sqlalchemy import text
 from api.database import SessionLocal, IndicadorAxa, Importacion
+from api.rules import clave_cruce
+from api.cache_respuestas import invalidar
 
 # ─── Mapa correcto: columnas 0-121 (fila 1 = headers cortos) ────
 # Row 1: agente(0), agts(1), nombre_com(2), rol(3), situacion(4),
@@ -172,13 +174,14 @@ def import_sabana(filepath: str, periodo: str, db):
                     if pol_vida > 0 or prima_vida > 0 or equiv > 0:
                         db.execute(text("""
                             INSERT INTO indicadores_axa (
-                                periodo, poliza, agente_codigo, ramo,
+                                periodo, poliza, match_key, agente_codigo, ramo,
                                 num_asegurados, polizas_equivalentes, prima_primer_anio,
                                 es_nueva_axa, encontrada_en_base, diferencia_clasificacion
-                            ) VALUES (:per, :pol, :agc, 'VIDA', 1, :peq, :ppa, true, true, :dif)
+                            ) VALUES (:per, :pol, :mk, :agc, 'VIDA', 1, :peq, :ppa, true, true, :dif)
                         """), {
                             "per": periodo,
                             "pol": f"OV-VIDA-{codigo}",
+                            "mk": clave_cruce(f"OV-VIDA-{codigo}"),
                             "agc": codigo,
                             "peq": equiv,
                             "ppa": prima_vida,
@@ -189,13 +192,14 @@ def import_sabana(filepath: str, periodo: str, db):
                     if pol_gmm > 0 or prima_gmm > 0 or aseg > 0:
                         db.execute(text("""
                             INSERT INTO indicadores_axa (
-                                periodo, poliza, agente_codigo, ramo,
+                                periodo, poliza, match_key, agente_codigo, ramo,
                                 num_asegurados, polizas_equivalentes, prima_primer_anio,
                                 es_nueva_axa, encontrada_en_base, diferencia_clasificacion
-                            ) VALUES (:per, :pol, :agc, 'GMM', :nas, :peq, :ppa, true, true, :dif)
+                            ) VALUES (:per, :pol, :mk, :agc, 'GMM', :nas, :peq, :ppa, true, true, :dif)
                         """), {
                             "per": periodo,
                             "pol": f"OV-GMM-{codigo}",
+                            "mk": clave_cruce(f"OV-GMM-{codigo}"),
                             "agc": codigo,
                             "nas": aseg,
                             "peq": pol_gmm,
@@ -207,13 +211,14 @@ def import_sabana(filepath: str, periodo: str, db):
                     if prima_autos > 0:
                         db.execute(text("""
                             INSERT INTO indicadores_axa (
-                                periodo, poliza, agente_codigo, ramo,
+                                periodo, poliza, match_key, agente_codigo, ramo,
                                 num_asegurados, polizas_equivalentes, prima_primer_anio,
                                 es_nueva_axa, encontrada_en_base, diferencia_clasificacion
-                            ) VALUES (:per, :pol, :agc, 'AUTOS', 1, 0, :ppa, true, true, :dif)
+                            ) VALUES (:per, :pol, :mk, :agc, 'AUTOS', 1, 0, :ppa, true, true, :dif)
                         """), {
                             "per": periodo,
                             "pol": f"OV-AUTOS-{codigo}",
+                            "mk": clave_cruce(f"OV-AUTOS-{codigo}"),
                             "agc": codigo,
                             "ppa": prima_autos,
                             "dif": extras,
@@ -259,12 +264,11 @@ def import_detalle_pol(filepath: str, periodo: str, db):
                     cnt = safe_int(values[10])
                     vigente = safe_str(values[11]) if len(values) > 11 else None
                     
-                    # Verificar en base interna
-                    from api.rules import normalizar_poliza
-                    pol_norm = normalizar_poliza(poliza)
+                    # Verificar en base interna (índice de match_key)
+                    clave = clave_cruce(poliza)
                     encontrada = db.execute(
-                        text("SELECT id FROM polizas WHERE poliza_estandar=:pe OR poliza_original=:po"),
-                        {"pe": pol_norm, "po": poliza}
+                        text("SELECT id FROM polizas WHERE match_key = :mk LIMIT 1"),
+                        {"mk": clave}
                     ).scalar()
                     
                     if not encontrada:
@@ -272,13 +276,14 @@ def import_detalle_pol(filepath: str, periodo: str, db):
                     
                     db.execute(text("""
                         INSERT INTO indicadores_axa (
-                            periodo, poliza, agente_codigo, ramo,
+                            periodo, poliza, match_key, agente_codigo, ramo,
                             num_asegurados, es_nueva_axa, encontrada_en_base,
                             diferencia_clasificacion
-                        ) VALUES (:per, :pol, :agc, :ram, :nas, true, :enb, :dif)
+                        ) VALUES (:per, :pol, :mk, :agc, :ram, :nas, true, :enb, :dif)
                     """), {
                         "per": periodo,
                         "pol": poliza,
+                        "mk": clave,
                         "agc": agente,
                         "ram": ramo,
                         "nas": cnt,
@@ -374,6 +379,7 @@ def main():
             total += n
             all_errors.extend(errs)
         
+        invalidar(db)
         db.commit()
         
         # Log
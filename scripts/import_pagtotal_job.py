@@ -28,6 +28,14 @@ except ImportError:
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
+# api/ se copia junto a scripts/ en la imagen (ver Dockerfile)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.bulk_loader import bulk_insert
+from api.rules import clave_cruce
+from api.fechas_nativas import fecha_nativa
+from api.cache_respuestas import invalidar
+from api.deudor_prima import refrescar_cobranza
+
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
 GCS_BUCKET = os.environ.get("GCS_BUCKET", "mag-sistema-imports-922967")
 GCS_BLOB = os.environ.get("GCS_BLOB", "PAGTOTAL_202603101502.csv")
@@ -101,33 +109,12 @@ def main():
                 continue
         print(f"  Encoding: {detected_enc}")
 
-        INSERT_SQL = text("""
-            INSERT INTO pagos (
-                poliza_numero, endoso, agente_codigo, contratante, ramo, moneda,
-                fecha_inicio, fecha_aplicacion, comprobante,
-                prima_neta, prima_total, comision, comision_derecho, comision_recargo,
-                comision_total, promotor, poliza_match,
-                anio_aplicacion, periodo_aplicacion, fuente
-            ) VALUES (
-                :poliza_numero, :endoso, :agente_codigo, :contratante, :ramo, :moneda,
-                :fecha_inicio, :fecha_aplicacion, :comprobante,
-                :prima_neta, :prima_total, :comision, :comision_derecho, :comision_recargo,
-                :comision_total, :promotor, :poliza_match,
-                :anio_aplicacion, :periodo_aplicacion, :fuente
-            )
-        """)
-
-        batch = []
-        total = 0
         errores = 0
-        BATCH_SIZE = 2000
-
-        with open(tmp.name, "r", encoding=detected_enc) as f:
-            reader = csv.DictReader(f)
-            if reader.fieldnames:
-                reader.fieldnames = [h.strip().upper().replace('"', '') for h in reader.fieldnames]
-                print(f"  Columnas: {', '.join(reader.fieldnames[:5])}...")
+        BATCH_SIZE = 50000
 
+        def filas_pagtotal(reader):
+            """Genera las filas de pagos; COPY las consume sin acumular el archivo."""
+            nonlocal errores
             for i, row in enumerate(reader):
                 try:
                     poliza = (row.get("POLIZA") or "").strip().replace('"', '')
@@ -138,7 +125,7 @@ def main():
                     anio = int(fec_apli[:4]) if fec_apli and len(fec_apli) >= 4 else None
                     periodo = fec_apli[:7] if fec_apli and len(fec_apli) >= 7 else None
 
-                    batch.append({
+                    yield {
                         "poliza_numero": poliza,
                         "endoso": (row.get("ENDOSO") or "").strip().replace('"', '') or None,
                         "agente_codigo": (row.get("AGENTE") or "").strip().replace('"', '') or None,
@@ -147,6 +134,7 @@ def main():
                         "moneda": (row.get("MON") or "MN").strip().replace('"', ''),
                         "fecha_inicio": parse_dt(row.get("PERINI")),
                         "fecha_aplicacion": fec_apli,
+                        "fecha_aplicacion_d": fecha_nativa(fec_apli),
                         "comprobante": (row.get("COMPROBANTE") or "").strip().replace('"', '') or None,
                         "prima_neta": to_float(row.get("NETA")),
                         "prima_total": to_float(row.get("PRITOT")),
@@ -156,28 +144,31 @@ def main():
                         "comision_total": to_float(row.get("TOTCOMISION")),
                         "promotor": (row.get("PROMOTOR") or "").strip().replace('"', '') or None,
                         "poliza_match": (row.get("POLIZA_MATCH") or poliza).strip().replace('"', ''),
+                        "match_key": clave_cruce(row.get("POLIZA_MATCH") or poliza),
                         "anio_aplicacion": anio,
                         "periodo_aplicacion": periodo,
                         "fuente": "PAGTOTAL",
-                    })
-                    total += 1
-
-                    if len(batch) >= BATCH_SIZE:
-                        db.execute(INSERT_SQL, batch)
-                        db.commit()
-                        elapsed = time.time() - start
-                        rate = total / elapsed if elapsed > 0 else 0
-                        print(f"  {total:>8,} registros ({rate:.0f}/s)...", flush=True)
-                        batch = []
-
+                    }
                 except Exception as e:
                     errores += 1
                     if errores <= 5:
                         print(f"  ⚠️ Error fila {i+2}: {str(e)[:80]}")
 
-        if batch:
-            db.execute(INSERT_SQL, batch)
-            db.commit()
+        def progreso(n):
+            elapsed = time.time() - start
+            rate = n / elapsed if elapsed > 0 else 0
+            print(f"  {n:>8,} registros ({rate:.0f}/s)...", flush=True)
+
+        # COPY FROM STDIN en Cloud SQL (psycopg2); una sola transacción
+        with open(tmp.name, "r", encoding=detected_enc) as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames:
+                reader.fieldnames = [h.strip().upper().replace('"', '') for h in reader.fieldnames]
+                print(f"  Columnas: {', '.join(reader.fieldnames[:5])}...")
+
+            total = bulk_insert(db, "pagos", filas_pagtotal(reader),
+                                batch_size=BATCH_SIZE, progreso=progreso)
+        db.commit()
 
         t1 = time.time() - start
         print(f"  ✅ {total:,} pagos importados en {t1:.1f}s ({errores} errores)")
@@ -192,13 +183,18 @@ def main():
         updated = db.execute(text("""
             UPDATE polizas SET prima_acumulada_basica = sub.total_pagado
             FROM (
-                SELECT poliza_match, SUM(prima_neta) as total_pagado
-                FROM pagos GROUP BY poliza_match
+                SELECT match_key, SUM(prima_neta) as total_pagado
+                FROM pagos WHERE match_key IS NOT NULL GROUP BY match_key
             ) sub
-            WHERE polizas.poliza_original = sub.poliza_match
+            WHERE polizas.match_key = sub.match_key
         """)).rowcount
+        # Ledger de cobranza (pagado, saldo y semáforo) con los pagos recién cargados
+        cobranza = refrescar_cobranza(db)
+        # Las respuestas en caché (cobranza, dashboard, finanzas) dejan de servirse
+        invalidar(db)
         db.commit()
         print(f"  ✅ {updated:,} pólizas actualizadas con prima acumulada")
+        print(f"  ✅ {cobranza:,} pólizas con cobranza recalculada")
 
         # Contratantes
         contratantes_nuevos = db.execute(text("""
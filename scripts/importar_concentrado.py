@@ -16,6 +16,7 @@ sys.path.insert(0, BASE_DIR)
 
 from sqlalchemy import text
 from api.database import SessionLocal, engine, Base
+from api.cache_respuestas import invalidar
 
 
 def parse_dt(v):
@@ -195,6 +196,7 @@ def main():
                 )
             """), batch)
 
+        invalidar(db)
         db.commit()
         t1 = time.time() - start
         print(f"\n   ✅ {total:,} etapas importadas en {t1:.1f}s ({errores} errores)")
@@ -17,6 +17,10 @@ sys.path.insert(0, BASE_DIR)
 
 from sqlalchemy import text
 from api.database import SessionLocal, engine, Base, Pago
+from api.rules import clave_cruce
+from api.fechas_nativas import fecha_nativa
+from api.cache_respuestas import invalidar
+from api.deudor_prima import refrescar_cobranza
 
 
 def parse_dt(v):
@@ -124,6 +128,7 @@ def main():
                         "moneda": (row.get("MON") or "MN").strip().replace('"', ''),
                         "fecha_inicio": parse_dt(row.get("PERINI")),
                         "fecha_aplicacion": fec_apli,
+                        "fecha_aplicacion_d": fecha_nativa(fec_apli),
                         "comprobante": (row.get("COMPROBANTE") or "").strip().replace('"', '') or None,
                         "prima_neta": to_float(row.get("NETA")),
                         "prima_total": to_float(row.get("PRITOT")),
@@ -133,6 +138,7 @@ def main():
                         "comision_total": to_float(row.get("TOTCOMISION")),
                         "promotor": (row.get("PROMOTOR") or "").strip().replace('"', '') or None,
                         "poliza_match": (row.get("POLIZA_MATCH") or poliza).strip().replace('"', ''),
+                        "match_key": clave_cruce(row.get("POLIZA_MATCH") or poliza),
                         "anio_aplicacion": anio,
                         "periodo_aplicacion": periodo,
                         "fuente": "PAGTOTAL",
@@ -144,15 +150,15 @@ def main():
                         db.execute(text("""
                             INSERT INTO pagos (
                                 poliza_numero, endoso, agente_codigo, contratante, ramo, moneda,
-                                fecha_inicio, fecha_aplicacion, comprobante,
+                                fecha_inicio, fecha_aplicacion, fecha_aplicacion_d, comprobante,
                                 prima_neta, prima_total, comision, comision_derecho, comision_recargo,
-                                comision_total, promotor, poliza_match,
+                                comision_total, promotor, poliza_match, match_key,
                                 anio_aplicacion, periodo_aplicacion, fuente
                             ) VALUES (
                                 :poliza_numero, :endoso, :agente_codigo, :contratante, :ramo, :moneda,
-                                :fecha_inicio, :fecha_aplicacion, :comprobante,
+                                :fecha_inicio, :fecha_aplicacion, :fecha_aplicacion_d, :comprobante,
                                 :prima_neta, :prima_total, :comision, :comision_derecho, :comision_recargo,
-                                :comision_total, :promotor, :poliza_match,
+                                :comision_total, :promotor, :poliza_match, :match_key,
                                 :anio_aplicacion, :periodo_aplicacion, :fuente
                             )
                         """), batch)
@@ -172,15 +178,15 @@ def main():
             db.execute(text("""
                 INSERT INTO pagos (
                     poliza_numero, endoso, agente_codigo, contratante, ramo, moneda,
-                    fecha_inicio, fecha_aplicacion, comprobante,
+                    fecha_inicio, fecha_aplicacion, fecha_aplicacion_d, comprobante,
                     prima_neta, prima_total, comision, comision_derecho, comision_recargo,
-                    comision_total, promotor, poliza_match,
+                    comision_total, promotor, poliza_match, match_key,
                     anio_aplicacion, periodo_aplicacion, fuente
                 ) VALUES (
                     :poliza_numero, :endoso, :agente_codigo, :contratante, :ramo, :moneda,
-                    :fecha_inicio, :fecha_aplicacion, :comprobante,
+                    :fecha_inicio, :fecha_aplicacion, :fecha_aplicacion_d, :comprobante,
                     :prima_neta, :prima_total, :comision, :comision_derecho, :comision_recargo,
-                    :comision_total, :promotor, :poliza_match,
+                    :comision_total, :promotor, :poliza_match, :match_key,
                     :anio_aplicacion, :periodo_aplicacion, :fuente
                 )
             """), batch)
@@ -201,25 +207,31 @@ def main():
                     prima_acumulada_basica = (
                         SELECT SUM(p.prima_neta) 
                         FROM pagos p 
-                        WHERE p.poliza_match = polizas.poliza_original
+                        WHERE p.match_key = polizas.match_key
                     ),
                     updated_at = datetime('now')
-                WHERE poliza_original IN (SELECT DISTINCT poliza_match FROM pagos)
+                WHERE match_key IN (SELECT DISTINCT match_key FROM pagos)
             """)).rowcount
         else:
             # PostgreSQL soporta UPDATE FROM
             updated = db.execute(text("""
                 UPDATE polizas SET prima_acumulada_basica = sub.total_pagado
                 FROM (
-                    SELECT poliza_match, SUM(prima_neta) as total_pagado
+                    SELECT match_key, SUM(prima_neta) as total_pagado
                     FROM pagos
-                    GROUP BY poliza_match
+                    WHERE match_key IS NOT NULL
+                    GROUP BY match_key
                 ) sub
-                WHERE polizas.poliza_original = sub.poliza_match
+                WHERE polizas.match_key = sub.match_key
             """)).rowcount
 
+        # Ledger de cobranza (pagado, saldo y semáforo) con los pagos recién cargados
+        cobranza = refrescar_cobranza(db)
+        # Las respuestas en caché (cobranza, dashboard, finanzas) dejan de servirse
+        invalidar(db)
         db.commit()
         print(f"   ✅ {updated:,} pólizas actualizadas con prima acumulada")
+        print(f"   ✅ {cobranza:,} pólizas con cobranza recalculada")
 
         # ── Paso 4: Estadísticas finales ──
         total_final = db.execute(text("SELECT COUNT(*) FROM pagos")).scalar() or 0
@@ -1,49 +1,40 @@
 import os
 import sys
-import subprocess
+import time
 
 # Agregar el directorio raíz al path
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from api.pipeline_oracle import ejecutar_pipeline
 
-def run_script(script_name):
-    path = os.path.join(BASE_DIR, "scripts", script_name)
-    print(f"\n{'='*60}")
-    print(f"▶️ Ejecutando: {script_name}")
-    print(f"{'='*60}")
-    
-    try:
-        # Usar el mismo intérprete de python que está corriendo este script
-        subprocess.run([sys.executable, path], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error al ejecutar {script_name}: {e}")
-        return False
-    return True
 
 def main():
     print("🌟 Iniciando Pipeline de Importación Oracle (MAG Sistema) 🌟")
-    
-    scripts = [
-        "importar_maestro_polizas.py",
-        "importar_pagtotal_oracle.py",
-        "importar_solicitudes_oracle.py",
-        "reprocesar_reglas_mag.py"
-    ]
-    
-    success = True
-    for s in scripts:
-        if not run_script(s):
-            success = False
-            print(f"⚠️ El pipeline se detuvo o tuvo errores en {s}")
-            # Decidir si continuar o no. Por ahora seguimos.
-    
-    if success:
-        print(f"\n{'='*60}")
-        print("✅ PIPELINE FINALIZADO EXITOSAMENTE")
-        print(f"{'='*60}")
+    # Por defecto cada etapa sincroniza solo el delta; --completo re-extrae todo
+    completo = "--completo" in sys.argv
+    inicio = time.time()
+
+    # Etapas en proceso: polizas ∥ pagtotal → solicitudes → reglas
+    estado = ejecutar_pipeline(completo=completo)
+
+    for nombre, m in estado["etapas"].items():
+        if m["estado"] == "ok":
+            print(f"  ✅ {nombre:<12} {m['filas']:>10,} filas  {m['duracion_segundos']:>8.1f}s  "
+                  f"({m['filas_por_segundo'] or 0:,.0f}/s, pico {m['memoria_pico_mb']} MB)")
+        elif m["estado"] == "error":
+            print(f"  ❌ {nombre:<12} {m.get('error')}")
+        else:
+            print(f"  ⚠️ {nombre:<12} {m['estado']}")
+
+    print(f"\n{'='*60}")
+    if estado["exito"]:
+        print(f"✅ PIPELINE FINALIZADO EXITOSAMENTE ({time.time() - inicio:.1f}s)")
     else:
-        print(f"\n{'='*60}")
         print("❌ PIPELINE FINALIZADO CON ERRORES")
-        print(f"{'='*60}")
+    print(f"{'='*60}")
+    if not estado["exito"]:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
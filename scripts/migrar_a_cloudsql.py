@@ -58,17 +58,20 @@ def migrate_table(table_name, sqlite_sess, pg_sess):
         print(f"   ⏭️  {table_name}: vacía, skip")
         return 0
 
-    # Detectar columnas Boolean del modelo
+    # Detectar columnas Boolean y generadas (no se insertan) del modelo
     bool_cols = set()
+    generadas = set()
     if table_name in Base.metadata.tables:
         table_obj = Base.metadata.tables[table_name]
         for col in table_obj.columns:
             if isinstance(col.type, Boolean):
                 bool_cols.add(col.name)
+            if col.computed is not None:
+                generadas.add(col.name)
 
-    rows = sqlite_sess.execute(text(f"SELECT * FROM {table_name}")).fetchall()
     cols = sqlite_sess.execute(text(f"SELECT * FROM {table_name} LIMIT 1")).keys()
-    col_names = list(cols)
+    col_names = [c for c in cols if c not in generadas]
+    rows = sqlite_sess.execute(text(f"SELECT {', '.join(col_names)} FROM {table_name}")).fetchall()
 
     # Insert batch
     placeholders = ", ".join([f":{c}" for c in col_names])
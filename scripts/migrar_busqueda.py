@@ -0,0 +1,85 @@
+"""
+Migración de BD — Índice de búsqueda (trigramas)
+================================================
+Agrega la columna `busqueda` (campos de texto normalizados, ver
+api/busqueda.py) a polizas, contratantes, solicitudes y agentes, la rellena
+para las filas existentes y crea el índice de trigramas de cada tabla:
+
+  PostgreSQL  extensión pg_trgm + índice GIN ix_<tabla>_busqueda_trgm
+  SQLite      tabla FTS5 <tabla>_fts (trigram) + triggers, reconstruida al final
+
+Idempotente: solo rellena filas con busqueda NULL y el DDL usa IF NOT EXISTS.
+
+Uso:
+    python scripts/migrar_busqueda.py
+"""
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from sqlalchemy import text, inspect
+from api.database import SessionLocal, engine, TABLAS_BUSQUEDA, ddl_busqueda
+from api.busqueda import completar_busqueda
+
+
+def column_exists(inspector, table_name: str, column_name: str) -> bool:
+    """Verifica si una columna ya existe en la tabla."""
+    try:
+        columns = [c["name"] for c in inspector.get_columns(table_name)]
+        return column_name in columns
+    except Exception:
+        return False
+
+
+def main():
+    print("=" * 60)
+    print("🔧 MIGRACIÓN — busqueda (índice de trigramas)")
+    print("=" * 60)
+    start = time.time()
+
+    db = SessionLocal()
+    inspector = inspect(engine)
+    dialecto = engine.dialect.name
+
+    try:
+        for tabla in TABLAS_BUSQUEDA:
+            if tabla not in inspector.get_table_names():
+                print(f"   ⏭️  Tabla {tabla} no existe aún (se creará con create_all)")
+                continue
+
+            if not column_exists(inspector, tabla, "busqueda"):
+                db.execute(text(f"ALTER TABLE {tabla} ADD COLUMN busqueda TEXT"))
+                db.commit()
+                print(f"   ✅ {tabla}.busqueda agregada")
+
+            # Primero el relleno y después el índice: el FTS se reconstruye una sola vez
+            n = completar_busqueda(db, [tabla])
+            db.commit()
+
+            ddl = ddl_busqueda(tabla, dialecto)
+            for sql in ddl:
+                db.execute(text(sql))
+            if dialecto == "sqlite" and ddl:
+                db.execute(text(f"INSERT INTO {tabla}_fts({tabla}_fts) VALUES ('rebuild')"))
+            db.commit()
+            indice = "sin índice de trigramas (motor no soportado)" if not ddl else "índice verificado"
+            print(f"   ✅ {tabla}: {n:,} filas completadas, {indice}")
+
+        elapsed = time.time() - start
+        print(f"\n✅ Migración completada en {elapsed:.1f}s")
+
+    except Exception as e:
+        db.rollback()
+        print(f"\n❌ Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
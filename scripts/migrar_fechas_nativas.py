@@ -0,0 +1,148 @@
+"""
+Migración de BD — Fechas nativas (Date) y columnas generadas
+============================================================
+Fase "expand" de la migración de fechas texto a tipos nativos:
+
+  1. Agrega las columnas Date gemelas (api/fechas_nativas.COLUMNAS_FECHA)
+     y la columna generada polizas.mes_periodo
+  2. Rellena las columnas Date desde el texto ISO, en lotes por id
+  3. Crea los índices ix_<tabla>_<columna>
+  4. Reporta las fechas texto que no se pudieron convertir: con 0 pendientes
+     se puede pasar a MAG_LECTURA_FECHAS=nativa
+
+Idempotente: solo rellena filas con la columna Date en NULL.
+
+Uso:
+    python scripts/migrar_fechas_nativas.py
+"""
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from sqlalchemy import text, inspect
+from api.database import SessionLocal, engine, SQL_MES_PERIODO
+from api.fechas_nativas import COLUMNAS_FECHA, fecha_nativa
+
+BATCH_SIZE = 5000
+
+
+def column_exists(inspector, table_name: str, column_name: str) -> bool:
+    """Verifica si una columna ya existe en la tabla."""
+    try:
+        columns = [c["name"] for c in inspector.get_columns(table_name)]
+        return column_name in columns
+    except Exception:
+        return False
+
+
+def rellenar(db, tabla: str, nativa: str, texto: str) -> int:
+    """Convierte `texto` → `nativa` en lotes por id para las filas que aún no la tienen."""
+    total = 0
+    ultimo_id = 0
+    while True:
+        filas = db.execute(text(f"""
+            SELECT id, {texto} FROM {tabla}
+            WHERE {nativa} IS NULL AND {texto} IS NOT NULL AND {texto} != '' AND id > :ultimo
+            ORDER BY id LIMIT :lote
+        """), {"ultimo": ultimo_id, "lote": BATCH_SIZE}).fetchall()
+        if not filas:
+            break
+        ultimo_id = filas[-1][0]
+        params = [{"id": i, "f": fecha_nativa(v)} for i, v in filas]
+        params = [p for p in params if p["f"] is not None]
+        if params:
+            db.execute(text(f"UPDATE {tabla} SET {nativa} = :f WHERE id = :id"), params)
+        db.commit()
+        total += len(params)
+    return total
+
+
+def main():
+    print("=" * 60)
+    print("🔧 MIGRACIÓN — Fechas nativas (Date)")
+    print("=" * 60)
+    start = time.time()
+
+    db = SessionLocal()
+    inspector = inspect(engine)
+    dialecto = engine.dialect.name
+
+    try:
+        # ══════════════════════════════════════════════════════════
+        # 1. Columnas Date + generada
+        # ══════════════════════════════════════════════════════════
+        print("\n📋 Paso 1: Agregar columnas...")
+        for tabla, columnas in COLUMNAS_FECHA.items():
+            for nativa in columnas:
+                if not column_exists(inspector, tabla, nativa):
+                    db.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {nativa} DATE"))
+                    print(f"   ✅ {tabla}.{nativa} (DATE) agregada")
+                else:
+                    print(f"   ⏭️  {tabla}.{nativa} ya existe")
+
+        if not column_exists(inspector, "polizas", "mes_periodo"):
+            # SQLite solo admite columnas generadas VIRTUAL en ALTER TABLE
+            almacenada = "STORED" if dialecto == "postgresql" else "VIRTUAL"
+            db.execute(text(
+                f"ALTER TABLE polizas ADD COLUMN mes_periodo INTEGER "
+                f"GENERATED ALWAYS AS ({SQL_MES_PERIODO}) {almacenada}"
+            ))
+            print(f"   ✅ polizas.mes_periodo (generada {almacenada}) agregada")
+        db.commit()
+
+        # ══════════════════════════════════════════════════════════
+        # 2. Backfill
+        # ══════════════════════════════════════════════════════════
+        print("\n📋 Paso 2: Rellenar fechas nativas...")
+        for tabla, columnas in COLUMNAS_FECHA.items():
+            for nativa, texto in columnas.items():
+                n = rellenar(db, tabla, nativa, texto)
+                print(f"   ✅ {tabla}.{nativa}: {n:,} filas convertidas")
+
+        # ══════════════════════════════════════════════════════════
+        # 3. Índices
+        # ══════════════════════════════════════════════════════════
+        print("\n📋 Paso 3: Crear índices...")
+        for tabla, columnas in COLUMNAS_FECHA.items():
+            for nativa in columnas:
+                db.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{tabla}_{nativa} ON {tabla}({nativa})"))
+        db.commit()
+        print("   ✅ Índices verificados")
+
+        # ══════════════════════════════════════════════════════════
+        # 4. Pendientes (texto no convertible)
+        # ══════════════════════════════════════════════════════════
+        print("\n📋 Paso 4: Fechas texto sin convertir...")
+        pendientes = 0
+        for tabla, columnas in COLUMNAS_FECHA.items():
+            for nativa, texto in columnas.items():
+                n = db.execute(text(f"""
+                    SELECT COUNT(*) FROM {tabla}
+                    WHERE {nativa} IS NULL AND {texto} IS NOT NULL AND {texto} != ''
+                """)).scalar() or 0
+                pendientes += n
+                if n:
+                    print(f"   ⚠️  {tabla}.{texto}: {n:,} valores no son fecha ISO")
+        if pendientes:
+            print("   Mantener MAG_LECTURA_FECHAS=dual hasta corregirlos")
+        else:
+            print("   ✅ Sin pendientes: se puede usar MAG_LECTURA_FECHAS=nativa")
+
+        elapsed = time.time() - start
+        print(f"\n✅ Migración completada en {elapsed:.1f}s")
+
+    except Exception as e:
+        db.rollback()
+        print(f"\n❌ Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Migración de BD — Índices de consulta
+=====================================
+Crea en una BD existente los índices declarados en api/database.py
+(index=True y __table_args__). create_all solo los crea junto con tablas
+nuevas; las tablas existentes necesitan esta migración.
+
+El juego de índices sale de los predicados de api/routers.py:
+  - polizas: anio_aplicacion (+ producto_id / flag_nueva_formal / fecha_inicio), agente_id +
+    anio_aplicacion, periodo_aplicacion, poliza_original + fecha_inicio,
+    poliza_estandar, fecha_fin, contratante_id
+  - etapas_solicitudes: ano_recepcion + idagente
+  - pagos: comprobante
+  - indicadores_axa: periodo; conciliaciones: periodo + fecha_conciliacion
+  - deudores_prima: fecha_corte; contratantes_resumen: version (chequeos de vigencia)
+
+Al terminar ejecuta ANALYZE para que el planner tenga estadísticas.
+Idempotente: los índices existentes se omiten. Un índice cuyas columnas aún no
+existen (migraciones previas pendientes) se reporta y se omite.
+
+Uso:
+    python scripts/migrar_indices.py
+"""
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from sqlalchemy import text, inspect
+from api.database import Base, engine
+
+
+def main():
+    print("=" * 60)
+    print("🔧 MIGRACIÓN — Índices de consulta")
+    print("=" * 60)
+    start = time.time()
+
+    inspector = inspect(engine)
+    tablas = set(inspector.get_table_names())
+    creados = omitidos = 0
+
+    try:
+        for tabla in Base.metadata.sorted_tables:
+            if tabla.name not in tablas:
+                continue
+            existentes = {i["name"] for i in inspector.get_indexes(tabla.name)}
+            columnas = {c["name"] for c in inspector.get_columns(tabla.name)}
+
+            for indice in sorted(tabla.indexes, key=lambda i: i.name):
+                if indice.name in existentes:
+                    continue
+                faltan = [c.name for c in indice.columns if c.name not in columnas]
+                if faltan:
+                    print(f"   ⚠️  {indice.name}: faltan columnas {', '.join(faltan)} (migración pendiente)")
+                    omitidos += 1
+                    continue
+                t0 = time.time()
+                indice.create(bind=engine, checkfirst=True)
+                creados += 1
+                cols = ", ".join(c.name for c in indice.columns)
+                print(f"   ✅ {indice.name} ON {tabla.name}({cols}) — {time.time() - t0:.1f}s")
+
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        print("\n   📊 ANALYZE ejecutado")
+
+        elapsed = time.time() - start
+        print(f"\n✅ Migración completada en {elapsed:.1f}s: {creados} índice(s) creados, {omitidos} omitidos")
+
+    except Exception as e:
+        print(f"\n❌ Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Migración de BD — Clave de cruce match_key
+==========================================
+Agrega la columna `match_key` (clave_cruce del número de póliza) a polizas,
+pagos, indicadores_axa y solicitudes, la rellena para las filas existentes y
+crea el índice B-tree de cada tabla. Todos los cruces póliza↔pago↔indicador↔
+solicitud son igualdades sobre esta columna.
+
+Idempotente: solo rellena filas con match_key NULL.
+
+Uso:
+    python scripts/migrar_match_key.py
+"""
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from sqlalchemy import text, inspect
+from api.database import SessionLocal, engine
+from api.rules import clave_cruce
+from api.cache_respuestas import invalidar
+from api.rules_solicitudes import match_key_solicitud
+
+BATCH_SIZE = 5000
+
+# tabla → (expresión fuente del número de póliza, función de clave)
+TABLAS = {
+    "polizas": ("poliza_original", clave_cruce),
+    "pagos": ("COALESCE(poliza_match, poliza_numero)", clave_cruce),
+    "indicadores_axa": ("poliza", clave_cruce),
+    "solicitudes": ("poliza_numero", match_key_solicitud),
+}
+
+
+def column_exists(inspector, table_name: str, column_name: str) -> bool:
+    """Verifica si una columna ya existe en la tabla."""
+    try:
+        columns = [c["name"] for c in inspector.get_columns(table_name)]
+        return column_name in columns
+    except Exception:
+        return False
+
+
+def rellenar(db, tabla: str, fuente: str, clave) -> int:
+    """Calcula match_key en lotes por id para las filas que aún no lo tienen."""
+    total = 0
+    ultimo_id = 0
+    while True:
+        filas = db.execute(text(f"""
+            SELECT id, {fuente} FROM {tabla}
+            WHERE match_key IS NULL AND id > :ultimo
+            ORDER BY id LIMIT :lote
+        """), {"ultimo": ultimo_id, "lote": BATCH_SIZE}).fetchall()
+        if not filas:
+            break
+        ultimo_id = filas[-1][0]
+        params = [{"id": i, "mk": clave(pol)} for i, pol in filas]
+        params = [p for p in params if p["mk"]]
+        if params:
+            db.execute(text(f"UPDATE {tabla} SET match_key = :mk WHERE id = :id"), params)
+        db.commit()
+        total += len(params)
+    return total
+
+
+def main():
+    print("=" * 60)
+    print("🔧 MIGRACIÓN — match_key (clave de cruce de póliza)")
+    print("=" * 60)
+    start = time.time()
+
+    db = SessionLocal()
+    inspector = inspect(engine)
+
+    try:
+        for tabla, (fuente, clave) in TABLAS.items():
+            if tabla not in inspector.get_table_names():
+                print(f"   ⏭️  Tabla {tabla} no existe aún (se creará con create_all)")
+                continue
+
+            if not column_exists(inspector, tabla, "match_key"):
+                db.execute(text(f"ALTER TABLE {tabla} ADD COLUMN match_key VARCHAR(30)"))
+                db.commit()
+                print(f"   ✅ {tabla}.match_key agregada")
+
+            n = rellenar(db, tabla, fuente, clave)
+            db.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{tabla}_match_key ON {tabla}(match_key)"))
+            db.commit()
+            print(f"   ✅ {tabla}: {n:,} claves calculadas, índice ix_{tabla}_match_key verificado")
+
+        # Los cruces por match_key cambian: invalida las respuestas en caché
+        invalidar(db)
+        db.commit()
+
+        elapsed = time.time() - start
+        print(f"\n✅ Migración completada en {elapsed:.1f}s")
+
+    except Exception as e:
+        db.rollback()
+        print(f"\n❌ Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -26,10 +26,13 @@ from api.database import (
     GestionComercial, Presupuesto, Configuracion, Importacion,
 )
 from api.rules import (
-    normalizar_poliza, calcular_mystatus, es_reexpedicion,
+    normalizar_poliza, clave_cruce, calcular_mystatus, es_reexpedicion,
     aplicar_reglas_poliza, aplicar_reglas_batch,
     agrupar_segmento,
 )
+from api.cache_respuestas import invalidar
+from api.fechas_nativas import fecha_nativa
+from api.busqueda import busqueda_de
 
 # ══════════════════════════════════════════════════════════════════
 # CONFIGURACIÓN
@@ -341,6 +344,7 @@ def main():
                 poliza = Poliza(
                     poliza_original=pol_num,
                     poliza_estandar=normalizar_poliza(pol_num),
+                    match_key=clave_cruce(pol_num),
                     version=version,
                     solicitud=solicitud,
 
@@ -358,6 +362,8 @@ def main():
                     fecha_emision=fecha_emi,
                     fecha_inicio=fecha_ini or "2026-01-01",  # fallback
                     fecha_fin=fecha_fin,
+                    fecha_inicio_d=fecha_nativa(fecha_ini or "2026-01-01"),
+                    fecha_fin_d=fecha_nativa(fecha_fin),
 
                     moneda=moneda,
                     prima_total=prima_total,
@@ -389,6 +395,7 @@ def main():
                     fuente="EXCEL_IMPORT",
                     notas=notas,
                 )
+                poliza.busqueda = busqueda_de("polizas", poliza)
 
                 db.add(poliza)
                 polizas_insertadas += 1
@@ -491,6 +498,7 @@ def main():
                 if len(errores_reglas) <= 3:
                     print(f"  ⚠️  Error regla: {str(e)}")
 
+        invalidar(db)
         db.commit()
         print(f"  ✅ {actualizados} pólizas con reglas aplicadas")
 
@@ -19,8 +19,10 @@ from sqlalchemy import text
 from api.database import SessionLocal, engine, Base
 from api.rules_solicitudes import (
     normalizar_ramo, derivar_estado_de_etapa, detectar_solicitud_atorada,
-    calcular_dias_tramite, evaluar_sla, calcular_tasa_conversion,
+    calcular_dias_tramite, evaluar_sla, calcular_tasa_conversion, match_key_solicitud,
 )
+from api.fechas_nativas import fecha_nativa
+from api.cache_respuestas import invalidar
 
 EXCEL_PATH = os.path.join(
     os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
@@ -239,27 +241,27 @@ def main():
 
         db.execute(text("""
             INSERT INTO solicitudes (
-                nosol, nomramo, fecrecepcion, contratante_nombre,
+                nosol, nomramo, fecrecepcion, fecrecepcion_d, contratante_nombre,
                 dia_recepcion, mes_recepcion, ano_recepcion,
                 idagente, nuevo, antaxa, reingreso, contasol,
-                poliza_numero, numsolicitantes, fecha_sistema,
+                poliza_numero, match_key, numsolicitantes, fecha_sistema,
                 agente_nombre, promotor_nombre, segmento, segmento_agrupado,
                 gestion_comercial, poliza_6_digitos, primer_ano,
                 dias_devengados, estatus_pago, sub_etapa,
-                ultima_etapa, ultima_subetapa, fecha_ultima_etapa,
+                ultima_etapa, ultima_subetapa, fecha_ultima_etapa, fecha_ultima_etapa_d,
                 observaciones_etapa,
                 ramo_normalizado, estado, tipo_rechazo,
                 dias_tramite, alerta_atorada, sla_cumplido,
                 fuente, created_at, updated_at
             ) VALUES (
-                :nosol, :nomramo, :fecrecepcion, :contratante,
+                :nosol, :nomramo, :fecrecepcion, :fecrecepcion_d, :contratante,
                 :dia_rec, :mes_rec, :ano_rec,
                 :idagente, :nuevo, :antaxa, :reingreso, :contasol,
-                :poliza, :numsolicitantes, :fecha_sistema,
+                :poliza, :match_key, :numsolicitantes, :fecha_sistema,
                 :agente_nombre, :promotor, :segmento, :segmento_agrupado,
                 :gestion, :poliza_6, :primer_ano,
                 :dias_devengados, :estatus_pago, :sub_etapa,
-                :ultima_etapa, :ultima_subetapa, :fecha_ultima_etapa,
+                :ultima_etapa, :ultima_subetapa, :fecha_ultima_etapa, :fecha_ultima_etapa_d,
                 :observaciones,
                 :ramo_norm, :estado, :tipo_rechazo,
                 :dias_tramite, :alerta, :sla,
@@ -269,6 +271,7 @@ def main():
             "nosol": nosol,
             "nomramo": nomramo,
             "fecrecepcion": fecrecepcion,
+            "fecrecepcion_d": fecha_nativa(fecrecepcion),
             "contratante": safe_str(row[3], 300),
             "dia_rec": safe_int(row[4]),
             "mes_rec": safe_int(row[5]),
@@ -279,6 +282,7 @@ def main():
             "reingreso": safe_int(row[16]),
             "contasol": safe_int(row[17]),
             "poliza": safe_str(row[18], 30),
+            "match_key": match_key_solicitud(safe_str(row[18], 30)),
             "numsolicitantes": safe_int(row[19]),
             "fecha_sistema": safe_date(row[20]),
             "agente_nombre": safe_str(row[22], 200),
@@ -294,6 +298,7 @@ def main():
             "ultima_etapa": safe_str(row[7], 50),
             "ultima_subetapa": safe_str(row[57], 50),
             "fecha_ultima_etapa": fecetapa,
+            "fecha_ultima_etapa_d": fecha_nativa(fecetapa),
             "observaciones": safe_str(row[12]),
             "ramo_norm": ramo_norm,
             "estado": estado_result["estado"],
@@ -406,6 +411,7 @@ def main():
         db.execute(text(
             "UPDATE solicitudes SET tasa_conversion_agente = :tasa WHERE idagente = :id"
         ), {"tasa": tasa, "id": a["idagente"]})
+    invalidar(db)
     db.commit()
     print(f"  ✅ {len(agentes_stats):,} agentes con tasa calculada", flush=True)
 
@@ -20,11 +20,13 @@ sys.path.insert(0, BASE_DIR)
 
 from sqlalchemy import text
 from api.database import SessionLocal, engine, Base
+from api.fechas_nativas import con_fechas_nativas
+from api.cache_respuestas import invalidar
 from api.rules_solicitudes import (
     normalizar_ramo,
     derivar_estado_de_etapa,
     puede_vincular_poliza,
-    normalizar_poliza_para_cruce,
+    match_key_solicitud,
     detectar_solicitud_atorada,
     calcular_dias_tramite,
     evaluar_sla,
@@ -150,8 +152,10 @@ def main():
                 "observaciones_etapa": safe_str(ultima[10]),
                 # Póliza
                 "poliza_numero": poliza_num if puede_vincular_poliza(poliza_num) else None,
+                "match_key": match_key_solicitud(poliza_num),
                 "fuente": "VW_CONCENTRADO",
             }
+            con_fechas_nativas("solicitudes", record)
 
             if nosol in existing_nosol:
                 # UPDATE existente
@@ -204,9 +208,8 @@ def main():
 
         # Obtener solicitudes con póliza_numero válido
         sols_con_poliza = db.execute(text("""
-            SELECT id, poliza_numero FROM solicitudes
-            WHERE poliza_numero IS NOT NULL
-            AND poliza_numero != ''
+            SELECT id, poliza_numero, match_key FROM solicitudes
+            WHERE match_key IS NOT NULL
             AND poliza_numero != 'PENDIENTE'
         """)).fetchall()
 
@@ -215,19 +218,14 @@ def main():
         vinculadas_s2p = 0
         vinculadas_p2s = 0
 
-        for sol_id, pol_num in sols_con_poliza:
-            if not pol_num:
-                continue
-
-            pol_norm = normalizar_poliza_para_cruce(pol_num)
-
-            # Buscar póliza por poliza_estandar o poliza_original
+        for sol_id, pol_num, clave in sols_con_poliza:
+            # Buscar póliza por clave de cruce (índice ix_polizas_match_key)
             poliza_row = db.execute(text("""
                 SELECT id FROM polizas
-                WHERE poliza_estandar = :pol_norm
-                   OR poliza_original = :pol_num
+                WHERE match_key = :mk
+                ORDER BY id
                 LIMIT 1
-            """), {"pol_norm": pol_norm, "pol_num": pol_num}).fetchone()
+            """), {"mk": clave}).fetchone()
 
             if poliza_row:
                 poliza_id = poliza_row[0]
@@ -294,6 +292,7 @@ def main():
                 "UPDATE solicitudes SET tasa_conversion_agente = :tasa WHERE idagente = :ag"
             ), {"tasa": tasa, "ag": ag_code})
 
+        invalidar(db)
         db.commit()
         print(f"   ✅ Tasa de conversión calculada para {len(agente_stats):,} agentes")
 
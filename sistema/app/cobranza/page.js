@@ -27,6 +27,56 @@ function fmtF(n) {
     return `$${n.toLocaleString('es-MX', { minimumFractionDigits: 0, maximumFractionDigits: 0 })}`;
 }
 
+// Lista paginada por cursor (/cobranza/deudores, /renovaciones, /canceladas):
+// la primera página al cambiar los filtros y las siguientes con cargarMas().
+function useListaPaginada(ruta, filtros, activa) {
+    const [filas, setFilas] = useState([]);
+    const [total, setTotal] = useState(null);
+    const [cursor, setCursor] = useState(null);
+    const [cargando, setCargando] = useState(false);
+    const clave = new URLSearchParams(filtros).toString();
+
+    useEffect(() => {
+        if (!activa) return;
+        let vigente = true;
+        setCargando(true);
+        apiFetch(`${ruta}?${clave}`)
+            .then(d => { if (vigente) { setFilas(d.data); setTotal(d.total); setCursor(d.next_cursor); } })
+            .catch(() => { if (vigente) { setFilas([]); setTotal(0); setCursor(null); } })
+            .finally(() => { if (vigente) setCargando(false); });
+        return () => { vigente = false; };
+    }, [ruta, clave, activa]);
+
+    const cargarMas = () => {
+        if (!cursor || cargando) return;
+        setCargando(true);
+        const p = new URLSearchParams(filtros);
+        p.set('after', cursor);
+        p.set('conteo', 'ninguno');
+        apiFetch(`${ruta}?${p}`)
+            .then(d => { setFilas(f => [...f, ...d.data]); setCursor(d.next_cursor); })
+            .finally(() => setCargando(false));
+    };
+
+    return { filas, total, hayMas: !!cursor, cargando, cargarMas };
+}
+
+function alScrollFinal(e, lista) {
+    const el = e.currentTarget;
+    if (el.scrollHeight - el.scrollTop - el.clientHeight < 200) lista.cargarMas();
+}
+
+function CargarMas({ lista }) {
+    if (!lista.hayMas) return null;
+    return (
+        <div style={{ textAlign: 'center', padding: 12 }}>
+            <button className="btn btn-ghost" onClick={lista.cargarMas} disabled={lista.cargando}>
+                {lista.cargando ? 'Cargando…' : `Cargar más (${lista.filas.length} de ${lista.total ?? '…'})`}
+            </button>
+        </div>
+    );
+}
+
 export default function Cobranza() {
     const [data, setData] = useState(null);
     const [anio, setAnio] = useState(2025);
@@ -35,6 +85,7 @@ export default function Cobranza() {
     const [loading, setLoading] = useState(true);
     const [tab, setTab] = useState('deudores');
     const [busqueda, setBusqueda] = useState('');
+    const [q, setQ] = useState('');
     // Modal de Historial de Pagos
     const [pagosModal, setPagosModal] = useState(null);
     const [pagosData, setPagosData] = useState([]);
@@ -58,27 +109,39 @@ export default function Cobranza() {
         const p = new URLSearchParams({ anio });
         if (ramo) p.set('ramo', ramo);
         if (prioFiltro) p.set('prioridad', prioFiltro);
-        apiFetch(`/cobranza?${p}`)
+        apiFetch(`/cobranza/resumen?${p}`)
             .then(d => { setData(d); setLoading(false); })
             .catch(() => setLoading(false));
     }, [anio, ramo, prioFiltro]);
 
-    const res = data?.resumen || {};
-    const deudores = useMemo(() => {
-        if (!data?.deudores) return [];
-        if (!busqueda) return data.deudores;
-        const q = busqueda.toLowerCase();
-        return data.deudores.filter(d =>
-            (d.poliza || '').toLowerCase().includes(q) ||
-            (d.contratante || '').toLowerCase().includes(q) ||
-            (d.agente_nombre || '').toLowerCase().includes(q) ||
-            (d.agente_clave || '').toLowerCase().includes(q)
-        );
-    }, [data, busqueda]);
+    // La búsqueda se resuelve en el servidor: se envía al dejar de escribir
+    useEffect(() => {
+        const t = setTimeout(() => setQ(busqueda.trim().length >= 3 ? busqueda.trim() : ''), 300);
+        return () => clearTimeout(t);
+    }, [busqueda]);
+
+    const filtros = useMemo(() => {
+        const f = { anio, limit: 100 };
+        if (ramo) f.ramo = ramo;
+        return f;
+    }, [anio, ramo]);
+    const filtrosDeudores = useMemo(() => {
+        const f = { ...filtros };
+        if (prioFiltro) f.prioridad = prioFiltro;
+        if (q) f.q = q;
+        return f;
+    }, [filtros, prioFiltro, q]);
 
-    const renovaciones = data?.renovaciones || [];
-    const canceladas = data?.canceladas || [];
+    const listaDeudores = useListaPaginada('/cobranza/deudores', filtrosDeudores, tab === 'deudores');
+    const listaRenovaciones = useListaPaginada('/cobranza/renovaciones', filtros, tab === 'renovaciones');
+    const listaCanceladas = useListaPaginada('/cobranza/canceladas', filtros, tab === 'canceladas');
+
+    const res = data?.resumen || {};
+    const deudores = listaDeudores.filas;
+    const renovaciones = listaRenovaciones.filas;
+    const canceladas = listaCanceladas.filas;
     const alertas = data?.alertas || [];
+    const primaPerdida = alertas.find(a => a.tipo === 'cancelada')?.monto || 0;
     const seguimiento = data?.seguimiento_mensual || [];
     const donutData = Object.entries(PRIO_CONFIG)
         .map(([k, v]) => ({ name: v.label, value: res[k === 'al_dia' ? 'al_dia' : k === 'atencion' ? 'atencion' : k === 'urgente' ? 'urgentes' : k === 'critico' ? 'criticas' : 'pagadas'] || 0, fill: v.color }))
@@ -182,17 +245,18 @@ export default function Cobranza() {
                                     <div className="filters-bar" style={{ marginBottom: 16 }}>
                                         <div className="filter-group">
                                             <span className="filter-label">🔎</span>
-                                            <input type="search" placeholder="Póliza, contratante o agente..."
+                                            <input type="search" placeholder="Póliza, contratante, RFC o clave de agente..."
                                                 value={busqueda} onChange={e => setBusqueda(e.target.value)}
                                                 style={{ width: 280 }} />
                                         </div>
                                         <div style={{ marginLeft: 'auto', fontSize: 12, color: 'var(--text-muted)' }}>
-                                            {deudores.length} pólizas · Prima pendiente: {fmtF(deudores.reduce((s, d) => s + d.prima_pendiente, 0))}
+                                            {listaDeudores.total ?? deudores.length} pólizas · Prima pendiente: {fmtF(res.prima_por_cobrar)}
                                         </div>
                                     </div>
 
                                     <div className="card" style={{ overflow: 'hidden' }}>
-                                        <div className="table-container" style={{ maxHeight: 'calc(100vh - 380px)', overflow: 'auto' }}>
+                                        <div className="table-container" style={{ maxHeight: 'calc(100vh - 380px)', overflow: 'auto' }}
+                                            onScroll={e => alScrollFinal(e, listaDeudores)}>
                                             <table style={{ fontSize: 12 }}>
                                                 <thead>
                                                     <tr>
@@ -255,6 +319,7 @@ export default function Cobranza() {
                                                     })}
                                                 </tbody>
                                             </table>
+                                            <CargarMas lista={listaDeudores} />
                                         </div>
                                     </div>
                                 </>
@@ -264,7 +329,7 @@ export default function Cobranza() {
                                 <div className="card">
                                     <div style={{ marginBottom: 16 }}>
                                         <div style={{ fontSize: 15, fontWeight: 700, color: 'var(--text-primary)' }}>Renovaciones Pendientes</div>
-                                        <div style={{ fontSize: 12, color: 'var(--text-muted)' }}>{renovaciones.length} pólizas en ventana de renovación (±90 días)</div>
+                                        <div style={{ fontSize: 12, color: 'var(--text-muted)' }}>{listaRenovaciones.total ?? renovaciones.length} pólizas en ventana de renovación (-60 / +90 días)</div>
                                     </div>
                                     {renovaciones.length === 0 ? (
                                         <div className="empty-state">
@@ -312,6 +377,7 @@ export default function Cobranza() {
                                                     ))}
                                                 </tbody>
                                             </table>
+                                            <CargarMas lista={listaRenovaciones} />
                                         </div>
                                     )}
                                 </div>
@@ -322,7 +388,7 @@ export default function Cobranza() {
                                     <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: 16 }}>
                                         <div>
                                             <div style={{ fontSize: 15, fontWeight: 700, color: 'var(--text-primary)' }}>Pólizas Canceladas — {anio}</div>
-                                            <div style={{ fontSize: 12, color: 'var(--text-muted)' }}>{canceladas.length} pólizas · Prima perdida: {fmtF(canceladas.reduce((s, c) => s + c.prima_perdida, 0))}</div>
+                                            <div style={{ fontSize: 12, color: 'var(--text-muted)' }}>{listaCanceladas.total ?? canceladas.length} pólizas · Prima perdida: {fmtF(primaPerdida)}</div>
                                         </div>
                                     </div>
                                     {canceladas.length === 0 ? (
@@ -362,6 +428,7 @@ export default function Cobranza() {
                                                     ))}
                                                 </tbody>
                                             </table>
+                                            <CargarMas lista={listaCanceladas} />
                                         </div>
                                     )}
                                 </div>
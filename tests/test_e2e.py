@@ -6,17 +6,30 @@ BD SQLite temporal aislada para cada sesión de tests.
 
 Ejecutar: python -m pytest tests/test_e2e.py -v
 """
-import sys, os
+import sys, os, io, re
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import pytest
 import tempfile
+from contextlib import contextmanager
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+import pandas as pd
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
-from api.database import Base, get_db
+from api.database import Base, get_db, EtapaSolicitud, Pago, Solicitud
+from api.cache_respuestas import invalidar
 from api.seed import seed_demo
+from api.bulk_loader import bulk_insert
+from api.fechas_nativas import fecha_nativa
+from api.produccion_agg import refrescar_produccion
+from api.sync_incremental import merge_staging
+from api.conciliacion import conciliar_periodo
+from api.deudor_prima import DIAS_GRACIA, calcular_cobranza, refrescar_cobranza, actualizar_corte
 
 
 # ── Isolated file-based test DB ─────────────────────────────────────
@@ -101,6 +114,30 @@ class TestDashboard:
     def test_distribucion_gama(self, client):
         assert "distribucion_gama" in client.get("/dashboard?anio=2025").json()
 
+    def test_kpis_cuadran_con_mensual(self, client):
+        d = client.get("/dashboard?anio=2025").json()
+        kpis, pm = d["kpis"], d["produccion_mensual"]
+        assert kpis["polizas_nuevas_vida"] == sum(m["polizas_vida"] for m in pm)
+        assert kpis["polizas_nuevas_gmm"] == sum(m["polizas_gmm"] for m in pm)
+        assert kpis["prima_nueva_gmm"] == pytest.approx(sum(m["prima_gmm"] for m in pm), abs=1)
+
+    def test_anio_sin_produccion(self, client):
+        kpis = client.get("/dashboard?anio=2031").json()["kpis"]
+        assert kpis["total_polizas"] == 0
+        assert kpis["polizas_vida_ant"] == 0
+
+    def test_respuesta_cacheada(self, client):
+        primera = client.get("/dashboard/ejecutivo?anio=2025").json()
+        aciertos = client.get("/health").json()["cache"]["aciertos"]
+        assert client.get("/dashboard/ejecutivo?anio=2025").json() == primera
+        assert client.get("/health").json()["cache"]["aciertos"] == aciertos + 1
+
+    def test_escritura_invalida_cache(self, client):
+        assert client.get("/dashboard?anio=2032").json()["kpis"]["total_polizas"] == 0
+        r = client.post("/polizas", json={"poliza_original": "E2E-CACHE-1", "fecha_inicio": "2032-05-01"})
+        assert r.status_code == 201
+        assert client.get("/dashboard?anio=2032").json()["kpis"]["total_polizas"] == 1
+
 
 # ═══════════════════════════════════════════════════════════════════
 # 3. POLIZAS (response: {data, total, page, limit, pages})
@@ -127,6 +164,37 @@ class TestPolizas:
         d = client.get("/polizas?ramo=vida").json()
         assert d["total"] >= 0  # May or may not have vida polizas
 
+    def test_keyset_igual_a_offset(self, client):
+        esperado = [p["id"] for p in client.get("/polizas?limit=500").json()["data"]]
+        vistos, after = [], None
+        while True:
+            url = "/polizas?limit=7&conteo=ninguno" + (f"&after={after}" if after else "")
+            d = client.get(url).json()
+            vistos += [p["id"] for p in d["data"]]
+            after = d["next_cursor"]
+            if not after:
+                break
+        assert vistos == esperado
+
+    def test_conteo_ninguno_y_estimado(self, client):
+        d = client.get("/polizas?limit=5&conteo=ninguno").json()
+        assert d["total"] is None and d["pages"] is None
+        assert d["next_cursor"]
+        exacto = client.get("/polizas?anio=2025").json()["total"]
+        assert client.get("/polizas?anio=2025&conteo=estimado").json()["total"] == exacto  # SQLite: exacto
+
+    def test_cursor_invalido(self, client):
+        assert client.get("/polizas?after=sin-id").status_code == 400
+        assert client.get("/polizas?conteo=aprox").status_code == 400
+
+    def test_busqueda_sin_acentos(self, client):
+        d = client.get("/polizas?q=gomez perez&limit=500").json()
+        assert d["total"] > 0 and d["total"] == len(d["data"])
+        assert all(p["asegurado_nombre"] == "GÓMEZ PÉREZ, CARLOS" for p in d["data"])
+        assert client.get("/polizas?q=GÓMEZ, Pérez&limit=500").json()["total"] == d["total"]
+        codigo = client.get("/agentes").json()["data"][0]["codigo_agente"]
+        assert client.get(f"/polizas?q={codigo}").json()["total"] > 0
+
 
 # ═══════════════════════════════════════════════════════════════════
 # 4. AGENTES (response: {data: [...]})
@@ -165,6 +233,120 @@ class TestCobranza:
         res = client.get("/cobranza?anio=2025").json()["resumen"]
         assert "total_pendiente" in res or "polizas_pendientes" in res or isinstance(res, dict)
 
+    def test_ledger_recibos(self):
+        polizas = pd.DataFrame([
+            {"poliza_id": 1, "anio_aplicacion": 2025, "match_key": "1T", "mystatus": "ATRASADA",
+             "forma_pago": "TRIMESTRAL", "fecha_inicio": "2025-01-31", "fecha_inicio_d": None,
+             "prima_neta": 1200.0, "prima_total": None, "prima_acumulada_basica": 500.0,
+             "neta_acumulada": None, "pagos_total": 300.0},
+            {"poliza_id": 2, "anio_aplicacion": 2025, "match_key": "2A", "mystatus": "PAGADA",
+             "forma_pago": None, "fecha_inicio": None, "fecha_inicio_d": None,
+             "prima_neta": 800.0, "prima_total": 900.0, "prima_acumulada_basica": None,
+             "neta_acumulada": None, "pagos_total": None},
+        ])
+        recibos, deudores = calcular_cobranza(polizas, date(2025, 6, 15))
+        assert [str(f) for f in recibos["fecha_vencimiento"]] == [
+            "2025-01-31", "2025-04-30", "2025-07-31", "2025-10-31"]
+        assert recibos["prima_pagada"].tolist() == [300.0, 200.0, 0.0, 0.0]
+        trimestral, sin_fecha = deudores.to_dict("records")
+        assert trimestral["recibo_actual"] == "2/4" and trimestral["dias_vencimiento"] == 46
+        assert str(trimestral["fecha_proximo_recibo"]) == "2025-04-30"
+        assert trimestral["prioridad"] == "critico" and trimestral["prima_pendiente"] == 700.0
+        assert sin_fecha["recibo_actual"] == "-" and sin_fecha["prioridad"] == "pagado"
+
+    def test_gracia_sin_pagos(self):
+        base = {"anio_aplicacion": 2025, "mystatus": "ATRASADA", "forma_pago": "ANUAL", "fecha_inicio_d": None,
+                "prima_neta": 1000.0, "prima_total": None, "prima_acumulada_basica": None,
+                "neta_acumulada": None, "pagos_total": None}
+        polizas = pd.DataFrame([
+            {**base, "poliza_id": 1, "match_key": "1A", "fecha_inicio": "2025-05-01"},
+            {**base, "poliza_id": 2, "match_key": "2A", "fecha_inicio": "2025-06-01"},
+            {**base, "poliza_id": 3, "match_key": "3A", "fecha_inicio": "2025-05-01", "pagos_total": 100.0},
+        ])
+        _, deudores = calcular_cobranza(polizas, date(2025, 6, 15))
+        sin_pago, en_gracia, parcial = deudores.to_dict("records")
+        # Sin ningún pago: hoy - fecha_inicio - DIAS_GRACIA
+        assert sin_pago["dias_vencimiento"] == 45 - DIAS_GRACIA and sin_pago["prioridad"] == "atencion"
+        assert en_gracia["dias_vencimiento"] == 0 and en_gracia["prioridad"] == "al_dia"
+        # Con un pago parcial el recibo cuenta desde su vencimiento
+        assert parcial["dias_vencimiento"] == 45 and parcial["prioridad"] == "critico"
+
+    def test_pago_y_cambio_de_dia(self, client):
+        critica = next(d for d in client.get("/cobranza?anio=2025").json()["deudores"]
+                       if d["prioridad"] == "critico" and d["prima_pendiente"] > 0)
+        db = _Session()
+        pid, mk, corte = db.execute(text("""
+            SELECT d.poliza_id, d.match_key, d.fecha_corte FROM deudores_prima d
+            JOIN polizas p ON p.id = d.poliza_id WHERE p.poliza_original = :p
+        """), {"p": critica["poliza"]}).first()
+        # El pago llega: solo se recalcula la póliza de su match_key
+        bulk_insert(db, "pagos", [{"poliza_numero": critica["poliza"], "match_key": mk,
+                                   "prima_neta": critica["prima_pendiente"]}])
+        assert refrescar_cobranza(db, match_keys=[mk]) >= 1
+        invalidar(db)
+        db.commit()
+        fila = next(d for d in client.get("/cobranza?anio=2025").json()["deudores"]
+                    if d["poliza"] == critica["poliza"])
+        assert fila["prima_pendiente"] == 0 and fila["fecha_proximo_recibo"] is None
+
+        # Cambio de día: los días de vencimiento avanzan sin reconstruir el ledger
+        antes = db.execute(text("SELECT poliza_id, dias_vencimiento FROM deudores_prima "
+                                "WHERE dias_vencimiento > 0 AND poliza_id != :p"), {"p": pid}).fetchall()
+        manana = fecha_nativa(corte) + timedelta(days=1)
+        assert actualizar_corte(db, manana) >= len(antes) > 0
+        invalidar(db)
+        db.commit()
+        despues = dict(db.execute(text("SELECT poliza_id, dias_vencimiento FROM deudores_prima")).fetchall())
+        assert all(despues[i] == dias + 1 for i, dias in antes)
+        assert db.execute(text("SELECT MIN(fecha_corte) FROM deudores_prima")).scalar() == manana.isoformat()
+        db.close()
+
+    def _recorrer(self, client, ruta):
+        """Todas las filas de una lista paginada siguiendo next_cursor."""
+        d = client.get(ruta).json()
+        filas, total = d["data"], d["total"]
+        while d["next_cursor"]:
+            d = client.get(ruta + "&" + urlencode({"after": d["next_cursor"], "conteo": "ninguno"})).json()
+            assert d["total"] is None
+            filas += d["data"]
+        assert len(filas) == total
+        return filas
+
+    def test_resumen_y_listas_paginadas(self, client):
+        completo = client.get("/cobranza?anio=2025").json()
+        resumen = client.get("/cobranza/resumen?anio=2025").json()
+        for k in ["resumen", "alertas", "seguimiento_mensual"]:
+            assert resumen[k] == completo[k]
+        assert "deudores" not in resumen
+        # Recorrer las páginas da la misma lista, en el mismo orden, que la vista completa
+        assert self._recorrer(client, "/cobranza/deudores?anio=2025&limit=7") == completo["deudores"]
+        assert self._recorrer(client, "/cobranza/renovaciones?limit=3") == completo["renovaciones"]
+        assert self._recorrer(client, "/cobranza/canceladas?anio=2025&limit=2") == completo["canceladas"]
+
+    def test_orden_y_filtros_en_sql(self, client):
+        dias = [d["dias_vencimiento"] for d in self._recorrer(client, "/cobranza/deudores?anio=2025&orden=dias&limit=5")]
+        assert dias == sorted(dias, reverse=True)
+        pendiente = [d["prima_pendiente"] for d in
+                     self._recorrer(client, "/cobranza/deudores?anio=2025&orden=prima_pendiente&limit=5")]
+        assert pendiente == sorted(pendiente, reverse=True)
+
+        criticos = self._recorrer(client, "/cobranza/deudores?anio=2025&prioridad=critico&limit=2")
+        assert {d["prioridad"] for d in criticos} <= {"critico"}
+        assert len(criticos) == client.get("/cobranza/resumen?anio=2025").json()["resumen"]["criticas"]
+        poliza = criticos[0]["poliza"] if criticos else None
+        if poliza:
+            encontrados = client.get("/cobranza/deudores", params={"anio": 2025, "q": poliza}).json()["data"]
+            assert poliza in [d["poliza"] for d in encontrados]
+
+        for estado in ["por_vencer", "vencida", "renovada"]:
+            filas = client.get(f"/cobranza/renovaciones?estado={estado}&limit=500").json()["data"]
+            assert {r["estado_renovacion"] for r in filas} <= {estado}
+
+        assert client.get("/cobranza/deudores?prioridad=rojo").status_code == 400
+        assert client.get("/cobranza/deudores?orden=nombre").status_code == 400
+        assert client.get("/cobranza/renovaciones?estado=x").status_code == 400
+        assert client.get("/cobranza/deudores?after=1,abc,3").status_code == 400
+
 
 # ═══════════════════════════════════════════════════════════════════
 # 6. FINANZAS
@@ -228,6 +410,19 @@ class TestContratantes:
         for k in ["id", "nombre", "num_polizas", "prima_total"]:
             assert k in c
 
+    def test_recalculo_concurrente_no_duplica(self, client):
+        from concurrent.futures import ThreadPoolExecutor
+        db = _Session()
+        invalidar(db)
+        db.commit()
+        with ThreadPoolExecutor(4) as pool:
+            respuestas = list(pool.map(lambda _: client.get("/contratantes"), range(4)))
+        assert all(r.status_code == 200 for r in respuestas)
+        filas = db.execute(text("SELECT COUNT(*) FROM contratantes_resumen")).scalar()
+        total = db.execute(text("SELECT COUNT(*) FROM contratantes")).scalar()
+        db.close()
+        assert filas == total
+
     def test_search_name(self, client):
         d = client.get("/contratantes?q=MARTINEZ").json()
         assert len(d) >= 1
@@ -258,6 +453,28 @@ class TestContratantes:
     def test_update_404(self, client):
         assert client.put("/contratantes/999999", json={"nombre": "X"}).status_code == 404
 
+    def test_rollup_y_keyset(self, client):
+        r = client.post("/contratantes", json={"nombre": "E2E, ROLLUP"})
+        cid = r.json()["id"]
+        db = _Session()
+        pid, prima = db.execute(text("SELECT id, prima_neta FROM polizas ORDER BY id LIMIT 1")).first()
+        db.execute(text("UPDATE polizas SET contratante_id = :c WHERE id = :p"), {"c": cid, "p": pid})
+        invalidar(db)
+        db.commit()
+        db.close()
+        d = client.get("/contratantes?limit=500").json()
+        fila = next(c for c in d["data"] if c["id"] == cid)
+        assert fila["num_polizas"] == 1 and fila["prima_total"] == pytest.approx(prima or 0)
+
+        vistos, after = [], None
+        while True:
+            d = client.get("/contratantes?limit=2" + (f"&after={after}" if after else "")).json()
+            vistos += [c["id"] for c in d["data"]]
+            after = d["next_cursor"]
+            if not after:
+                break
+        assert vistos == [c["id"] for c in client.get("/contratantes?limit=500").json()["data"]]
+
     def test_referrals(self, client):
         d = client.get("/contratantes").json()
         refs = [c for c in d if c.get("referido_por_nombre")]
@@ -322,6 +539,44 @@ class TestSolicitudes:
     def test_update_404(self, client):
         assert client.put("/solicitudes/999999", json={"estado": "X"}).status_code == 404
 
+    def test_indicadores_cuadran(self, client):
+        db = _Session()
+        etapas = [("VIDA", 1, "POLIZA_ENVIADA", 10), ("VIDA", 1, "RECHAZO_AUT_INFO_AD", 4),
+                  ("SALUD", 2, "RECHAZO_EMISION", -1), ("SALUD", 2, None, None), ("VIDA", None, "CANCELADO", 6)]
+        for i, (ramo, mes, etapa, dias) in enumerate(etapas):
+            db.add(EtapaSolicitud(nosol=f"E2E-IND-{i}", nomramo=ramo, mes_recepcion=mes, ano_recepcion=2033,
+                                  etapa=etapa, dias_tramite=dias, nuevo=i % 2, numsolicitantes=2))
+        invalidar(db)
+        db.commit()
+        db.close()
+
+        d = client.get("/indicadores-solicitudes?anio=2033").json()
+        k = d["kpis"]
+        assert (k["total_solicitudes"], k["emitidas"], k["rechazos_autorizacion"], k["rechazos_emision"],
+                k["canceladas"], k["en_tramite"]) == (5, 1, 1, 1, 1, 1)
+        assert k["promedio_dias_tramite"] == pytest.approx(20 / 3, abs=0.05)
+        assert k["promedio_dias_emision"] == 10
+        assert (k["nuevos"], k["reingresos"], k["total_solicitantes"]) == (2, 3, 10)
+        assert [(m["mes"], m["total"], m["rechazadas"]) for m in d["por_mes"]] == [(1, 2, 1), (2, 2, 1)]
+        assert {r["ramo"]: r["emitidas"] for r in d["por_ramo"]} == {"VIDA": 1, "SALUD": 0}
+        assert sum(e["count"] for e in d["etapas"]) == 4
+        assert {p["nombre"]: p["total"] for p in d["pivot_ramo"]} == {"VIDA": 2, "SALUD": 2}
+        assert 2033 in d["anios_disponibles"]
+
+    def test_trazabilidad_por_match_key(self, client):
+        db = _Session()
+        pol = db.execute(text("SELECT poliza_original, match_key FROM polizas WHERE poliza_original LIKE '00764%' "
+                              "ORDER BY id LIMIT 1")).one()
+        db.add(Solicitud(nosol="E2E-MK-1", folio="E2E-MK-1", poliza_numero=pol.match_key, match_key=pol.match_key))
+        db.add(Pago(poliza_numero="0" + pol.poliza_original, poliza_match="0" + pol.poliza_original,
+                    match_key=pol.match_key, fecha_aplicacion="2025-02-01", prima_neta=1234.0))
+        db.commit()
+        db.close()
+
+        d = client.get("/solicitudes/E2E-MK-1/trazabilidad").json()
+        assert d["poliza"]["poliza_original"] == pol.poliza_original
+        assert [p["prima_neta"] for p in d["pagos"]] == [1234.0]
+
 
 # ═══════════════════════════════════════════════════════════════════
 # 9. COMISIONES
@@ -420,6 +675,44 @@ class TestConciliacion:
     def test_returns_200(self, client):
         assert client.get("/conciliacion").status_code == 200
 
+    def test_resumen_cuadra(self, client):
+        d = client.get("/conciliacion").json()
+        r = d["resumen"]
+        assert r["total"] == r["coincide"] + r["diferencia"] + r["solo_axa"]
+        assert len(d["conciliacion"]) == r["total"] + r["solo_interno"]
+        assert {c["status"] for c in d["conciliacion"]} <= {"COINCIDE", "DIFERENCIA", "SOLO_AXA", "SOLO_INTERNO"}
+
+    def test_persistida_y_recalculada_al_cambiar_datos(self, client):
+        periodo = client.get("/conciliacion").json()["periodos"][0]
+        db = _Session()
+        fecha = db.execute(text("SELECT MAX(fecha_conciliacion) FROM conciliaciones WHERE periodo = :p"),
+                           {"p": periodo}).scalar()
+        client.get(f"/conciliacion?periodo={periodo}")
+        assert db.execute(text("SELECT MAX(fecha_conciliacion) FROM conciliaciones WHERE periodo = :p"),
+                          {"p": periodo}).scalar() == fecha
+
+        db.execute(text("INSERT INTO indicadores_axa (periodo, poliza, es_nueva_axa) VALUES (:p, 'E2E-NO-EXISTE', 1)"),
+                   {"p": periodo})
+        invalidar(db)
+        db.commit()
+        db.close()
+        d = client.get(f"/conciliacion?periodo={periodo}").json()
+        fila = next(c for c in d["conciliacion"] if c["poliza"] == "E2E-NO-EXISTE")
+        assert fila["status"] == "SOLO_AXA"
+
+    def test_recalculo_concurrente_no_duplica(self, client):
+        from concurrent.futures import ThreadPoolExecutor
+        periodo = client.get("/conciliacion").json()["periodos"][0]
+        db = _Session()
+        invalidar(db)
+        db.commit()
+        with ThreadPoolExecutor(4) as pool:
+            respuestas = list(pool.map(lambda _: client.get(f"/conciliacion?periodo={periodo}"), range(4)))
+        assert all(r.status_code == 200 for r in respuestas)
+        filas = db.execute(text("SELECT COUNT(*) FROM conciliaciones WHERE periodo = :p"), {"p": periodo}).scalar()
+        db.close()
+        assert {len(r.json()["conciliacion"]) for r in respuestas} == {filas}
+
 
 # ═══════════════════════════════════════════════════════════════════
 # 12. EXPORTACIÓN (endpoint: /exportar/polizas-excel)
@@ -432,6 +725,217 @@ class TestExportacion:
         ct = r.headers.get("content-type", "")
         assert "spreadsheet" in ct or "octet-stream" in ct or "excel" in ct
 
+    def test_formatos_mismas_filas(self, client):
+        import csv as csv_mod
+        import openpyxl
+        total = client.get("/polizas?anio=2025&limit=1").json()["total"]
+
+        r = client.get("/exportar/polizas-excel?anio=2025")
+        assert 'filename="polizas_2025_' in r.headers["content-disposition"]
+        hoja = openpyxl.load_workbook(io.BytesIO(r.content), read_only=True)["Pólizas"]
+        filas = list(hoja.iter_rows(values_only=True))
+        assert filas[0][0] == "poliza_original" and len(filas) == total + 1
+        assert isinstance(filas[1][9], (int, float))          # prima_neta como número
+
+        r = client.get("/exportar/polizas-excel?anio=2025&formato=csv")
+        assert r.status_code == 200 and r.headers["content-type"].startswith("text/csv")
+        lineas = list(csv_mod.reader(io.StringIO(r.content.decode("utf-8-sig"))))
+        assert lineas[0][0] == "poliza_original" and len(lineas) == total + 1
+        assert [l[0] for l in lineas[1:]] == [f[0] for f in filas[1:]]
+
+        r = client.get("/exportar/polizas-excel?formato=parquet")
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            assert r.status_code == 400
+        else:
+            assert pq.read_table(io.BytesIO(r.content)).num_rows == client.get("/polizas?limit=1").json()["total"]
+        assert client.get("/exportar/polizas-excel?formato=pdf").status_code == 400
+
+    def test_lotes_y_bloques(self, client, monkeypatch):
+        import api.exportacion as exportacion
+        db = _Session()
+        sql, params = exportacion.consulta_polizas(anio=2025)
+        lotes = list(exportacion.lotes_consulta(db, sql, params, lote=7))
+        assert len(lotes) > 1 and all(len(l) <= 7 for l in lotes)
+        # El CSV sale un chunk por lote; el xlsx en bloques de BLOQUE_RESPUESTA
+        monkeypatch.setattr(exportacion, "LOTE_EXPORTACION", 7)
+        monkeypatch.setattr(exportacion, "BLOQUE_RESPUESTA", 1024)
+        csv_chunks = list(exportacion.generar(db, sql, params, exportacion.COLUMNAS_POLIZAS, "csv"))
+        xlsx_chunks = list(exportacion.generar(db, sql, params, exportacion.COLUMNAS_POLIZAS, "xlsx"))
+        db.close()
+        assert len(csv_chunks) == len(lotes) + 1
+        assert len(xlsx_chunks) > 1 and all(len(c) <= 1024 for c in xlsx_chunks)
+
+    @staticmethod
+    def _esperar(client, trabajo_id):
+        import time
+        for _ in range(200):
+            t = client.get(f"/exportar/jobs/{trabajo_id}").json()
+            if t["estado"] not in ("pendiente", "en_proceso"):
+                return t
+            time.sleep(0.05)
+        raise AssertionError(f"La exportación {trabajo_id} no terminó")
+
+    def test_trabajo_asincrono(self, client, monkeypatch, tmp_path):
+        import api.trabajos_exportacion as trabajos
+        monkeypatch.setattr(trabajos, "EXPORT_DIR", str(tmp_path))
+        sincrono = client.get("/exportar/polizas-excel?anio=2025&ramo=vida&formato=csv").content
+
+        r = client.post("/exportar/jobs", json={"tipo": "polizas", "formato": "csv", "filtros": {"anio": 2025, "ramo": "vida"}})
+        assert r.status_code == 202 and r.json()["estado"] in ("pendiente", "en_proceso", "listo")
+        t = self._esperar(client, r.json()["id"])
+        assert t["estado"] == "listo" and t["progreso"] == 100
+        assert t["filas_total"] == t["filas_procesadas"] == len(sincrono.decode("utf-8-sig").splitlines()) - 1
+        d = client.get(t["url_descarga"])
+        assert d.status_code == 200 and d.content == sincrono
+        assert 'filename="polizas_2025_' in d.headers["content-disposition"]
+
+        # Mismos filtros (otra forma de escribirlos) → mismo archivo, sin recalcular
+        r2 = client.post("/exportar/jobs", json={"tipo": "polizas", "formato": "csv", "filtros": {"ramo": " VIDA ", "anio": "2025", "agente_codigo": ""}})
+        assert r2.status_code == 202 and r2.json()["id"] == t["id"] and r2.json()["desde_cache"]
+
+        # Datos nuevos → otra versión → otro trabajo
+        db = _Session()
+        invalidar(db)
+        db.commit()
+        db.close()
+        r3 = client.post("/exportar/jobs", json={"tipo": "polizas", "formato": "csv", "filtros": {"anio": 2025, "ramo": "vida"}})
+        assert r3.json()["id"] != t["id"] and not r3.json()["desde_cache"]
+        assert self._esperar(client, r3.json()["id"])["estado"] == "listo"
+
+        r = client.post("/exportar/jobs", json={"tipo": "icp-2026", "filtros": {"anio": 2026}})
+        t = self._esperar(client, r.json()["id"])
+        assert t["estado"] == "listo" and t["nombre_archivo"].startswith("Reporte_ICP_2026_")
+        assert client.get(t["url_descarga"]).content[:2] == b"PK"
+
+    def test_latido_en_la_bd(self, client, monkeypatch, tmp_path):
+        import json
+        import uuid
+        import api.exportacion as exportacion
+        import api.trabajos_exportacion as trabajos
+        from api.database import TrabajoExportacion
+        monkeypatch.setattr(trabajos, "EXPORT_DIR", str(tmp_path))
+        monkeypatch.setattr(trabajos, "EXPORT_LATIDO_LOTES", 2)
+        monkeypatch.setattr(exportacion, "LOTE_EXPORTACION", 3)
+        db = _Session()
+
+        def nuevo():
+            trabajo = TrabajoExportacion(id=uuid.uuid4().hex, tipo="polizas", formato="csv",
+                                         filtros=json.dumps({"anio": 2025}), clave=uuid.uuid4().hex,
+                                         version=0, estado="en_proceso", filas_procesadas=0,
+                                         updated_at="2000-01-01T00:00:00")
+            db.add(trabajo)
+            db.commit()
+            return trabajo
+
+        # Otra instancia ve el avance y el updated_at del último latido
+        trabajo = nuevo()
+        assert trabajos._abandonado(trabajo)
+        trabajos._latido(_Session, trabajo.id, 42)
+        db.refresh(trabajo)
+        assert trabajos.estado(trabajo)["filas_procesadas"] == 42 and not trabajos._abandonado(trabajo)
+
+        # Un latido cada EXPORT_LATIDO_LOTES lotes (en SQLite el worker no lo escribe: se simula PostgreSQL)
+        latidos = []
+        monkeypatch.setattr(trabajos, "SIN_LATIDO", ())
+        monkeypatch.setattr(trabajos, "_latido", lambda fabrica, trabajo_id, filas: latidos.append(filas))
+        trabajo = nuevo()
+        trabajos.ejecutar(_Session, trabajo.id)
+        db.refresh(trabajo)
+        assert trabajo.estado == "listo"
+        assert len(latidos) > 1 and latidos == sorted(set(latidos)) and latidos[-1] <= trabajo.filas_total
+        db.close()
+
+    def test_trabajo_errores(self, client):
+        assert client.post("/exportar/jobs", json={"tipo": "siniestros"}).status_code == 400
+        assert client.post("/exportar/jobs", json={"tipo": "polizas", "formato": "pdf"}).status_code == 400
+        assert client.post("/exportar/jobs", json={"tipo": "icp-2026", "formato": "csv"}).status_code == 400
+        assert client.post("/exportar/jobs", json={"tipo": "polizas", "filtros": {"color": "rojo"}}).status_code == 400
+        assert client.post("/exportar/jobs", json={"tipo": "polizas", "filtros": {"anio": "dos mil"}}).status_code == 400
+        assert client.get("/exportar/jobs/no-existe").status_code == 404
+        assert client.get("/exportar/jobs/no-existe/descarga").status_code == 404
+
+
+class TestDocumentos:
+    @pytest.fixture
+    def origen(self, monkeypatch, tmp_path):
+        """Servidor de documentos simulado; `pedidos` registra cada petición que le llega."""
+        import httpx
+        import api.documentos as documentos
+        pdfs = {f"{n}.pdf": b"%PDF-1.4 " + bytes([n]) * 4000 for n in (1, 2, 3)}
+        pedidos = []
+
+        def responder(request):
+            pedidos.append(request)
+            nombre = request.url.path.rsplit("/", 1)[-1]
+            if nombre not in pdfs:
+                return httpx.Response(404)
+            etag = f'"v1-{nombre}"'
+            if request.headers.get("if-none-match") == etag:
+                return httpx.Response(304, headers={"etag": etag})
+            return httpx.Response(200, content=pdfs[nombre], headers={"etag": etag, "content-type": "application/pdf"})
+
+        http = httpx.AsyncClient(transport=httpx.MockTransport(responder))
+        monkeypatch.setattr(documentos, "cliente", lambda: http)
+        monkeypatch.setattr(documentos, "_cache", documentos._CacheDisco(str(tmp_path), 9000))
+        return pdfs, pedidos
+
+    def test_cache_y_validadores(self, client, origen):
+        pdfs, pedidos = origen
+        r = client.get("/documentos/poliza/1")
+        assert r.status_code == 200 and r.content == pdfs["1.pdf"] and r.headers["x-cache"] == "MISS"
+        assert r.headers["etag"] == '"v1-1.pdf"' and pedidos[0].url.path.endswith("/1.pdf")
+
+        # Segunda apertura: desde disco, sin ir al origen
+        r = client.get("/documentos/poliza/1")
+        assert r.content == pdfs["1.pdf"] and r.headers["x-cache"] == "HIT" and len(pedidos) == 1
+        assert client.get("/documentos/poliza/1", headers={"If-None-Match": '"v1-1.pdf"'}).status_code == 304
+        r = client.get("/documentos/poliza/1", headers={"Range": "bytes=0-7"})
+        assert r.status_code == 206 and r.content == b"%PDF-1.4"
+        assert len(pedidos) == 1
+
+        assert client.get("/documentos/solicitud/9").status_code == 404
+        assert pedidos[-1].url.path.endswith("/solicitudes/9.pdf")
+
+    def test_lru_y_rangos_sin_cache(self, client, origen):
+        pdfs, pedidos = origen
+        # Rango de un PDF que no está en caché: se reenvía al origen y no se guarda
+        client.get("/documentos/poliza/3", headers={"Range": "bytes=0-7"})
+        assert pedidos[-1].headers["range"] == "bytes=0-7"
+        # La caché admite dos PDFs: el tercero desaloja al menos reciente
+        for n in (1, 2, 1, 3):
+            client.get(f"/documentos/poliza/{n}")
+        n_pedidos = len(pedidos)
+        assert client.get("/documentos/poliza/1").headers["x-cache"] == "HIT"
+        assert client.get("/documentos/poliza/2").headers["x-cache"] == "MISS"
+        assert len(pedidos) == n_pedidos + 1
+
+
+    def test_disco_fuera_del_event_loop(self, client, origen, monkeypatch):
+        import asyncio
+        import api.documentos as documentos
+        pdfs, _ = origen
+        cache, en_loop = documentos._cache, []
+
+        def espiar(metodo):
+            def envuelto(*args):
+                try:
+                    asyncio.get_running_loop()
+                    en_loop.append(metodo.__name__)
+                except RuntimeError:
+                    pass
+                return metodo(*args)
+            return envuelto
+
+        for nombre in ("leer", "abrir", "guardar", "renovar"):
+            monkeypatch.setattr(cache, nombre, espiar(getattr(cache, nombre)))
+        # TTL 0: la segunda apertura revalida con el origen (304 → renovar)
+        monkeypatch.setattr(documentos, "DOC_CACHE_TTL", 0)
+        assert client.get("/documentos/poliza/2").content == pdfs["2.pdf"]
+        r = client.get("/documentos/poliza/2")
+        assert r.content == pdfs["2.pdf"] and r.headers["x-cache"] == "HIT"
+        assert en_loop == []
 
 # ═══════════════════════════════════════════════════════════════════
 # 13. DATA INTEGRITY
@@ -477,3 +981,226 @@ class TestErrors:
             "agente_id": aid, "porcentaje": 20, "nombre_beneficiario": "Y", "tipo": "SUBAGENTE"
         })
         assert r.status_code == 400
+
+
+# ═══════════════════════════════════════════════════════════════════
+# 15. PLANES DE CONSULTA (índices de api/database.py)
+# ═══════════════════════════════════════════════════════════════════
+
+N_GRANDE = 20000
+
+# Tablas grandes: ninguna consulta caliente puede recorrerlas completas
+TABLAS_GRANDES = {"polizas", "etapas_solicitudes", "pagos", "indicadores_axa", "conciliaciones",
+                  "contratantes", "contratantes_resumen", "deudores_prima", "recibos_cobranza"}
+
+# Endpoints calientes: se piden dos veces (la primera completa las tablas
+# derivadas) y se revisa el plan de cada sentencia que ejecuta la segunda
+ENDPOINTS_CALIENTES = {
+    "dashboard": "/dashboard?anio=2025",
+    "dashboard_ejecutivo": "/dashboard/ejecutivo?anio=2025",
+    "dashboard_ejecutivo_agente": "/dashboard/ejecutivo?anio=2025&agente_codigo=A7",
+    "polizas_offset": "/polizas?anio=2025&page=3&limit=50",
+    "polizas_keyset": "/polizas?after=2020-06-15,9000&conteo=ninguno",
+    "polizas_agente": "/polizas?agente=A7&conteo=ninguno",
+    "contratantes": "/contratantes?limit=50",
+    "contratantes_keyset": "/contratantes?limit=50&after=CLIENTE 0150,150",
+    "cobranza_resumen": "/cobranza/resumen?anio=2025",
+    "cobranza_deudores": "/cobranza/deudores?anio=2025&prioridad=critico",
+    "cobranza_deudores_cursor": "/cobranza/deudores?anio=2025&after=1,20,500&conteo=ninguno",
+    "cobranza_deudores_por_pendiente": "/cobranza/deudores?anio=2025&orden=prima_pendiente&conteo=ninguno",
+    "cobranza_renovaciones": "/cobranza/renovaciones?conteo=ninguno",
+    "conciliacion": "/conciliacion?periodo=2025-03",
+    "indicadores_solicitudes": "/indicadores-solicitudes?anio=2025",
+    "indicadores_solicitudes_agente": "/indicadores-solicitudes?anio=2025&agente=A7",
+}
+
+# Motores fuera de los endpoints de lectura: función(db) que corre la ruta de producción
+MOTORES_CALIENTES = {
+    "merge_polizas": lambda db: merge_staging(db, "polizas", ("poliza_original", "fecha_inicio"), [
+        {"poliza_original": "0000007X00", "fecha_inicio": "2021-08-08", "prima_neta": 5.0}]),
+    "merge_pagos": lambda db: merge_staging(db, "pagos", ("comprobante",), [
+        {"comprobante": "C7", "poliza_numero": "0000007X00", "prima_neta": 5.0}]),
+    "conciliar_periodo": lambda db: conciliar_periodo(db, "2025-03"),
+    "cobranza_por_claves": lambda db: refrescar_cobranza(db, match_keys={"0000007X"}),
+    "cobranza_cambio_de_dia": lambda db: actualizar_corte(db, date.today() + timedelta(days=1)),
+}
+
+
+@pytest.fixture(scope="module")
+def db_grande():
+    """BD en memoria con volumen suficiente para que el planner prefiera un recorrido si falta un índice."""
+    # Una sola conexión compartida: los endpoints corren en otro hilo
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    bulk_insert(db, "agentes", [
+        {"id": i, "codigo_agente": f"A{i}", "nombre_completo": f"Agente {i}",
+         "situacion": "ACTIVO" if i % 4 else "CANCELADO"} for i in range(1, 401)])
+    bulk_insert(db, "productos", [
+        {"id": i, "ramo_codigo": (11, 34, 90)[i % 3], "ramo_nombre": ("VIDA", "GMM", "AUTOS")[i % 3],
+         "plan": f"PLAN {i}", "gama": "G"} for i in range(1, 41)])
+    polizas, etapas, pagos = [], [], []
+    for i in range(1, N_GRANDE + 1):
+        anio, mes = 2014 + i % 13, 1 + i % 12
+        fi = f"{anio}-{mes:02d}-{1 + i % 28:02d}"
+        ff = f"{anio + 1}-{mes:02d}-{1 + i % 28:02d}"
+        polizas.append({
+            "id": i, "poliza_original": f"{i:07d}X00", "poliza_estandar": f"{i:07d}X", "match_key": f"{i:07d}X",
+            "agente_id": 1 + i % 400, "producto_id": 1 + i % 40, "contratante_id": 1 + i % 3000,
+            "fecha_inicio": fi, "fecha_fin": ff, "fecha_fin_d": fecha_nativa(ff) if i % 10 else None,
+            "anio_aplicacion": anio, "periodo_aplicacion": fi[:7], "flag_nueva_formal": i % 2, "prima_neta": 1000.0,
+        })
+        etapas.append({"id": i, "nosol": f"S{i}", "ano_recepcion": anio, "mes_recepcion": mes,
+                       "idagente": f"A{1 + i % 400}", "etapa": "POLIZA_ENVIADA", "nomramo": "VIDA"})
+        pagos.append({"id": i, "poliza_numero": f"{i:07d}X00", "comprobante": f"C{i}",
+                      "match_key": f"{i:07d}X", "prima_neta": 100.0})
+    bulk_insert(db, "contratantes", [{"id": i, "nombre": f"CLIENTE {i:04d}"} for i in range(1, 3001)])
+    bulk_insert(db, "contratantes_resumen", [
+        {"contratante_id": i, "num_polizas": 1, "prima_total": 1.0, "version": 1} for i in range(1, 3001)])
+    bulk_insert(db, "polizas", polizas)
+    bulk_insert(db, "etapas_solicitudes", etapas)
+    bulk_insert(db, "pagos", pagos)
+    bulk_insert(db, "indicadores_axa", [
+        {"id": i, "periodo": f"{2014 + i % 13}-{1 + i % 12:02d}", "poliza": f"{i:07d}X00",
+         "match_key": f"{i:07d}X"} for i in range(1, N_GRANDE + 1, 2)])
+    bulk_insert(db, "conciliaciones", [
+        {"id": i, "periodo": f"{2014 + i % 13}-{1 + i % 12:02d}", "poliza_id": i, "status": "COINCIDE",
+         "fecha_conciliacion": "2025-01-01"} for i in range(1, N_GRANDE + 1)])
+    refrescar_cobranza(db, hoy=date(2025, 3, 1))
+    refrescar_produccion(db)
+    db.execute(text("ANALYZE"))
+    db.commit()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+_TABLA_Y_ALIAS = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.I)
+
+
+def _recorridos_completos(sql: str, pasos: list) -> list:
+    """
+    Pasos del plan de `sql` sobre tablas grandes que no usan ningún índice:
+    SCAN sin índice, SEARCH sin índice o índice AUTOMATIC (SQLite lo construye
+    en cada consulta). Recorrer un índice en orden (LIMIT/OFFSET, COUNT) sí vale.
+    """
+    tablas = {}
+    for tabla, alias in _TABLA_Y_ALIAS.findall(sql):
+        tablas[tabla] = tabla
+        if alias:
+            tablas[alias] = tabla
+    return [paso for paso in pasos
+            if paso.split()[0] in ("SCAN", "SEARCH") and tablas.get(paso.split()[1]) in TABLAS_GRANDES
+            and ("USING" not in paso or "AUTOMATIC" in paso)]
+
+
+@contextmanager
+def _planes_ejecutados(engine):
+    """
+    {sentencia: pasos del plan} de cada SELECT/INSERT/UPDATE/DELETE que ejecuta
+    el bloque sobre `engine`. El plan se pide al ejecutarla, mientras existen
+    las tablas temporales (stg_*) que usa.
+    """
+    planes = {}
+
+    def anotar(conn, cursor, statement, parameters, context, executemany):
+        if executemany or statement.split(None, 1)[0].upper() not in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE"):
+            return
+        plan = cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        planes[statement] = [fila[-1] for fila in plan]
+
+    event.listen(engine, "before_cursor_execute", anotar)
+    try:
+        yield planes
+    finally:
+        event.remove(engine, "before_cursor_execute", anotar)
+
+
+@pytest.fixture(scope="class")
+def cliente_grande(db_grande):
+    """El app real sobre db_grande, sin caché de respuestas."""
+    from main import app
+    import api.cache_respuestas as cache
+    fabrica = sessionmaker(bind=db_grande.get_bind())
+
+    def db_override():
+        db = fabrica()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    ttl, anterior = cache.CACHE_TTL, app.dependency_overrides.get(get_db)
+    cache.CACHE_TTL = 0
+    app.dependency_overrides[get_db] = db_override
+    yield TestClient(app)
+    cache.CACHE_TTL = ttl
+    if anterior is None:
+        app.dependency_overrides.pop(get_db, None)
+    else:
+        app.dependency_overrides[get_db] = anterior
+
+
+class TestPlanesConsulta:
+    @pytest.mark.parametrize("nombre", list(ENDPOINTS_CALIENTES))
+    def test_endpoint_caliente_usa_indices(self, db_grande, cliente_grande, nombre):
+        url = ENDPOINTS_CALIENTES[nombre]
+        assert cliente_grande.get(url).status_code == 200
+        with _planes_ejecutados(db_grande.get_bind()) as planes:
+            assert cliente_grande.get(url).status_code == 200
+        assert planes
+        assert {sql: pasos for sql, pasos in planes.items() if _recorridos_completos(sql, pasos)} == {}
+
+    @pytest.mark.parametrize("nombre", list(MOTORES_CALIENTES))
+    def test_motor_caliente_usa_indices(self, db_grande, nombre):
+        try:
+            with _planes_ejecutados(db_grande.get_bind()) as planes:
+                MOTORES_CALIENTES[nombre](db_grande)
+        finally:
+            db_grande.rollback()
+        assert planes
+        assert {sql: pasos for sql, pasos in planes.items() if _recorridos_completos(sql, pasos)} == {}
+
+    def test_detecta_recorrido_sin_indice(self, db_grande):
+        # Control: sin predicado indexable el plan sí reporta el recorrido
+        sql = "SELECT p.id FROM polizas p WHERE p.prima_neta > 0"
+        pasos = [fila[-1] for fila in db_grande.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        assert _recorridos_completos(sql, pasos)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# 16. BÚSQUEDA UNIFICADA (/buscar)
+# ═══════════════════════════════════════════════════════════════════
+
+class TestBusqueda:
+    def test_tipos_y_relevancia(self, client):
+        d = client.get("/buscar?q=gonzalez").json()
+        assert d["total"] == len(d["hits"]) > 0
+        assert d["hits"][0]["tipo"] == "contratantes"
+        assert d["hits"][0]["titulo"] == "GONZALEZ RUIZ, ANA MARIA"
+        puntajes = [h["puntaje"] for h in d["hits"]]
+        assert puntajes == sorted(puntajes, reverse=True)
+
+    def test_sin_acentos_ni_mayusculas(self, client):
+        hits = client.get("/buscar?q=hernandez luna&tipos=polizas").json()["hits"]
+        assert hits and all(h["tipo"] == "polizas" and h["subtitulo"] == "HERNÁNDEZ LUNA, SOFÍA" for h in hits)
+        folio = client.get("/buscar?q=sol-202502-0003&tipos=solicitudes").json()["hits"]
+        assert [h["titulo"] for h in folio] == ["SOL-202502-0003"]
+
+    def test_escritura_y_filas_pendientes(self, client):
+        cid = client.post("/contratantes", json={"nombre": "ZÚÑIGA BÚSQUEDA, ÍÑIGO"}).json()["id"]
+        hits = client.get("/buscar?q=zuniga&tipos=contratantes").json()["hits"]
+        assert [h["id"] for h in hits] == [cid]
+        # Filas escritas sin la columna (scripts, BD previa) se completan al buscar
+        db = _Session()
+        db.execute(text("UPDATE contratantes SET busqueda = NULL WHERE id = :id"), {"id": cid})
+        invalidar(db)
+        db.commit()
+        db.close()
+        hits = client.get("/buscar?q=inigo&tipos=contratantes").json()["hits"]
+        assert [h["id"] for h in hits] == [cid]
+
+    def test_validaciones(self, client):
+        assert client.get("/buscar?q=ab").status_code == 422
+        assert client.get("/buscar?q=gonzalez&tipos=polizas,clientes").status_code == 400
+        assert client.get("/buscar?q=ZZZZNOTEXIST").json()["total"] == 0
@@ -0,0 +1,770 @@
+"""
+Tests — Motores de importación masiva
+=====================================
+Cubre la limpieza vectorizada y la inserción en lotes de los importadores
+(api/importar_polizas.py, api/importar_pagos.py), el cargador masivo
+compartido (api/bulk_loader.py) la sincronización incremental
+(api/sync_incremental.py) y el orquestador Oracle (api/pipeline_oracle.py)
+contra una BD SQLite en memoria.
+
+Ejecutar: python -m pytest tests/test_importacion.py -v
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import io
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from api.database import Base, Poliza
+from api.bulk_loader import bulk_insert, soporta_copy, _copy_lote
+from api.sync_incremental import sincronizar, consulta_incremental, leer_marca
+from api.pipeline_oracle import ejecutar_pipeline, etapa_reglas
+from api.recalculo_reglas import recalcular_reglas, recalcular_reglas_paralelo
+from api.rules import aplicar_reglas_batch
+from api.seed import seed_demo
+from api.produccion_agg import refrescar_produccion, filas_produccion
+from api.ejecutivo import acumular
+from api.importar_polizas import leer_csv, limpiar_polizas_df, importar_polizas_df, a_fecha_iso
+from api.importar_pagos import spool_a_temporal, iter_bloques, importar_pagtotal_archivo
+from api.fechas_nativas import leer_fecha, sql_rango_fecha
+
+
+CSV_POLIZAS = """POLIZA,AGENTE,RAMO,NOMRAMO,FECINI,FECFIN,PRIMANETA,ASEGS,STATUS,MON
+0076384A00,47968,11,VIDA,05-JAN-25,2026-01-05,"12,500.50",1,PAGADA,MN
+1234567U01,385201,,GASTOS MEDICOS,15/02/2025,,30000,2,,UDIS
+,47968,34,,2025-01-01,,1,,,
+9999,XXX,90,AUTOS,2025-03-01,,100,abc,,
+5555,NOEXISTE,77,OTRO RAMO,2025-04-01,,100,,,
+""".encode("utf-8")
+
+
+@pytest.fixture()
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    seed_demo(session)
+    session.execute(text("DELETE FROM polizas"))
+    session.execute(text("DELETE FROM produccion_mensual_agg"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+class TestLimpiezaPolizas:
+    def test_fechas_y_montos(self):
+        df, errores = limpiar_polizas_df(leer_csv(CSV_POLIZAS))
+        vida = df[df["po"] == "0076384A00"].iloc[0]
+        assert vida["fi"] == "2025-01-05"
+        assert vida["ff"] == "2026-01-05"
+        assert vida["pn"] == 12500.50
+        assert vida["per"] == "2025-01"
+        gmm = df[df["po"] == "1234567U01"].iloc[0]
+        assert gmm["fi"] == "2025-02-15"
+        assert gmm["sr"] == "VIGENTE"
+
+    def test_ramo_por_nombre(self):
+        df, _ = limpiar_polizas_df(leer_csv(CSV_POLIZAS))
+        assert df.set_index("po").loc["1234567U01", "ramo_codigo"] == 34
+        assert df.set_index("po").loc["0076384A00", "ramo_codigo"] == 11
+
+    def test_match_key(self):
+        df, _ = limpiar_polizas_df(leer_csv(CSV_POLIZAS))
+        assert df.set_index("po").loc["0076384A00", "mk"] == "76384A00"
+
+    def test_filas_invalidas_excluidas(self):
+        df, errores = limpiar_polizas_df(leer_csv(CSV_POLIZAS))
+        assert "9999" not in set(df["po"])
+        assert len(df) == 3
+        assert errores == ["Fila 5: could not convert string to float: 'abc'"]
+
+    def test_fechas_vacias_con_cadenas_pyarrow(self):
+        pytest.importorskip("pyarrow")
+        import pandas as pd
+        s = pd.Series(["2025-01-05 00:00:00", None, "05/01/2025", ""],
+                      dtype="string[pyarrow]")
+        out = a_fecha_iso(s)
+        assert out[0] == "2025-01-05"
+        assert out[2] == "2025-01-05"
+        assert out.isna()[[1, 3]].all()
+
+
+class TestImportarPolizas:
+    def test_inserta_y_reporta_errores(self, db):
+        errores = []
+        nuevos = importar_polizas_df(db, leer_csv(CSV_POLIZAS), errores)
+        db.commit()
+        assert nuevos == 3
+        assert db.execute(text("SELECT COUNT(*) FROM polizas")).scalar() == 3
+        assert any(e.startswith("Fila 5:") for e in errores)
+
+    def test_resuelve_agentes_y_productos(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        rows = dict(db.execute(text(
+            "SELECT p.poliza_original, a.codigo_agente FROM polizas p "
+            "LEFT JOIN agentes a ON p.agente_id = a.id"
+        )).all())
+        assert rows["0076384A00"] == "47968"
+        assert rows["5555"] is None
+
+    def test_fechas_nativas_y_mes_generado(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        r = db.execute(text(
+            "SELECT fecha_inicio_d, fecha_fin_d, mes_periodo FROM polizas WHERE poliza_original = '0076384A00'"
+        )).one()
+        assert (r.fecha_inicio_d, r.fecha_fin_d, r.mes_periodo) == ("2025-01-05", "2026-01-05", 1)
+        pol = db.query(Poliza).filter(Poliza.poliza_original == "1234567U01").one()
+        assert pol.fecha_inicio_d == datetime(2025, 2, 15).date()
+        assert pol.fecha_fin_d is None
+
+    def test_crea_producto_faltante(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        nombre = db.execute(text("SELECT ramo_nombre FROM productos WHERE ramo_codigo = 77")).scalar()
+        assert nombre == "OTRO RAMO"
+
+    def test_reglas_aplicadas(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        r = db.execute(text(
+            "SELECT poliza_estandar, prima_anual_pesos, trimestre FROM polizas "
+            "WHERE poliza_original = '1234567U01'"
+        )).one()
+        assert r.prima_anual_pesos == pytest.approx(30000 * 8.56)
+        assert r.trimestre == "Q1"
+
+    def test_recalculo_por_bloques_igual_a_batch(self, db):
+        csv = CSV_POLIZAS + b"0076384A01,47968,11,VIDA,2026-01-05,,100,1,PAGADA,MN\n"
+        importar_polizas_df(db, leer_csv(csv), [])
+        db.execute(text("UPDATE polizas SET trimestre = NULL, num_reexpediciones = NULL"))
+        assert recalcular_reglas(db, chunk_size=2) == 4
+
+        rows = db.execute(text(
+            "SELECT p.*, pr.ramo_codigo, pr.ramo_nombre FROM polizas p "
+            "LEFT JOIN productos pr ON p.producto_id = pr.id ORDER BY p.id"
+        )).mappings().all()
+        esperado = aplicar_reglas_batch([dict(r) for r in rows])
+        for r, e in zip(rows, esperado):
+            assert r["trimestre"] == e["trimestre"]
+            assert r["num_reexpediciones"] == e["num_reexpediciones"]
+        # Reexpediciones contadas sobre todo el conjunto, no por bloque
+        assert {r["poliza_original"]: r["num_reexpediciones"] for r in rows}["0076384A01"] == 2
+
+    def test_recalculo_reescribe_tipo_opcional(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.execute(text("UPDATE polizas SET tipo_poliza = 'X'"))
+        recalcular_reglas(db)
+        assert db.execute(text("SELECT COUNT(*) FROM polizas WHERE tipo_poliza = 'X'")).scalar() == 3
+        recalcular_reglas(db, incluir_tipo=True)
+        # NO_APLICA (ramo 77: ni vida ni GMM) conserva el tipo existente; las clasificables se reescriben
+        tipos = dict(db.execute(text("SELECT poliza_original, tipo_poliza FROM polizas")).all())
+        assert tipos == {"0076384A00": "NUEVA", "1234567U01": "NUEVA", "5555": "X"}
+
+    def test_recalculo_filtrado(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.execute(text("UPDATE polizas SET trimestre = NULL"))
+        assert recalcular_reglas(db, "pr.ramo_codigo = 34") == 1
+        sin_recalcular = db.execute(text("SELECT COUNT(*) FROM polizas WHERE trimestre IS NULL")).scalar()
+        assert sin_recalcular == 2
+
+    def test_recalculo_paralelo_igual_a_serial(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'mag.db'}")
+        Base.metadata.create_all(bind=engine)
+        fabrica = sessionmaker(bind=engine)
+        db = fabrica()
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.commit()
+        columnas = "id, trimestre, raiz_poliza_6, num_reexpediciones, tipo_poliza, mystatus"
+        recalcular_reglas(db, incluir_tipo=True)
+        db.commit()
+        serial = db.execute(text(f"SELECT {columnas} FROM polizas ORDER BY id")).fetchall()
+        db.execute(text("UPDATE polizas SET trimestre = NULL, num_reexpediciones = NULL, raiz_poliza_6 = NULL"))
+        db.commit()
+        db.close()
+
+        stats = recalcular_reglas_paralelo(fabrica, procesos=2, shard_size=1, incluir_tipo=True)
+        assert stats["shards"] == 3 and stats["reanudados"] == 0
+        db = fabrica()
+        assert db.execute(text(f"SELECT {columnas} FROM polizas ORDER BY id")).fetchall() == serial
+        db.close()
+        engine.dispose()
+
+    def _interrumpir_ultimo_shard(self, db):
+        db.execute(text("UPDATE recalculo_shards SET estado = 'pendiente' WHERE id = (SELECT MAX(id) FROM recalculo_shards)"))
+        db.commit()
+
+    def test_recalculo_paralelo_reanuda_shards_pendientes(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.commit()
+        fabrica = sessionmaker(bind=db.get_bind())
+        primera = recalcular_reglas_paralelo(fabrica, shard_size=1)
+        # Simula una corrida interrumpida: el último shard quedó sin checkpoint
+        self._interrumpir_ultimo_shard(db)
+        reanudada = recalcular_reglas_paralelo(fabrica, shard_size=1, reanudar=True)
+        assert reanudada["corrida"] == primera["corrida"]
+        assert reanudada["reanudados"] == 2
+        assert reanudada["actualizadas"] == 1
+        assert reanudada["polizas"] == 3
+        pendientes = db.execute(text("SELECT COUNT(*) FROM recalculo_shards WHERE estado <> 'ok'")).scalar()
+        assert pendientes == 0
+
+    def test_recalculo_paralelo_no_reanuda_por_defecto_ni_corridas_viejas(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.commit()
+        fabrica = sessionmaker(bind=db.get_bind())
+        primera = recalcular_reglas_paralelo(fabrica, shard_size=1)
+        self._interrumpir_ultimo_shard(db)
+        nueva = recalcular_reglas_paralelo(fabrica, shard_size=1)
+        assert nueva["corrida"] != primera["corrida"] and nueva["reanudados"] == 0
+        assert db.execute(text("SELECT estado FROM recalculo_shards WHERE corrida = :c ORDER BY id DESC"),
+                          {"c": primera["corrida"]}).scalar() == "expirado"
+
+        # Interrumpida hace días, o con otra versión de reglas: se planifica de cero
+        self._interrumpir_ultimo_shard(db)
+        db.execute(text("UPDATE recalculo_shards SET corrida = '2020-01-01T00:00:00' WHERE corrida = :c"),
+                   {"c": nueva["corrida"]})
+        db.commit()
+        vieja = recalcular_reglas_paralelo(fabrica, shard_size=1, reanudar=True)
+        assert vieja["corrida"] != "2020-01-01T00:00:00" and vieja["reanudados"] == 0
+        self._interrumpir_ultimo_shard(db)
+        otra_version = recalcular_reglas_paralelo(fabrica, shard_size=1, reanudar=True, incluir_tipo=True)
+        assert otra_version["corrida"] != vieja["corrida"] and otra_version["reanudados"] == 0
+
+    def test_recalculo_paralelo_cubre_polizas_nuevas(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.commit()
+        fabrica = sessionmaker(bind=db.get_bind())
+        primera = recalcular_reglas_paralelo(fabrica, shard_size=1)
+        self._interrumpir_ultimo_shard(db)
+        # Póliza insertada después del plan: id mayor que el último shard
+        db.execute(text("UPDATE polizas SET trimestre = NULL"))
+        db.execute(text("INSERT INTO polizas (poliza_original, poliza_estandar, fecha_inicio, prima_neta) "
+                        "VALUES ('NUEVA', 'NUEVA', '2025-06-01', 1)"))
+        db.commit()
+        reanudada = recalcular_reglas_paralelo(fabrica, shard_size=1, reanudar=True)
+        assert reanudada["corrida"] == primera["corrida"]
+        assert reanudada["shards"] == 4
+        # trimestre quedó en NULL para todas; solo el shard retomado y el nuevo la recalculan
+        trimestres = dict(db.execute(text("SELECT poliza_original, trimestre FROM polizas")).all())
+        assert trimestres["NUEVA"] is not None
+        assert sum(t is None for t in trimestres.values()) == 2
+
+    def test_lote_fallido_reintenta_por_fila(self, db):
+        csv = CSV_POLIZAS + b"8888,,34,,garbage,,1,,,\n"
+        errores = []
+        nuevos = importar_polizas_df(db, leer_csv(csv), errores, batch_size=2)
+        assert nuevos == 3
+        assert any(e.startswith("Fila 7:") for e in errores)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Producción mensual pre-agregada
+# ═══════════════════════════════════════════════════════════════════
+
+def _agregado(db):
+    return db.execute(text("""
+        SELECT anio, periodo, ramo_codigo, agente_id, tipo, polizas, asegurados, prima_neta
+        FROM produccion_mensual_agg ORDER BY anio, periodo, ramo_codigo, agente_id, tipo
+    """)).fetchall()
+
+
+class TestProduccionAgg:
+    def test_importar_refresca_agregado(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        total, prima = db.execute(text(
+            "SELECT SUM(polizas), SUM(prima_neta) FROM produccion_mensual_agg"
+        )).one()
+        assert total == 3
+        assert prima == pytest.approx(12500.50 + 30000 + 100)
+
+    def test_agregado_igual_a_polizas(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        directo = db.execute(text(f"""
+            SELECT anio, tipo, SUM(polizas), SUM(equivalencias), SUM(prima_neta)
+            FROM ({filas_produccion()}) f WHERE anio IS NOT NULL GROUP BY anio, tipo ORDER BY anio, tipo
+        """)).fetchall()
+        agregado = db.execute(text("""
+            SELECT anio, tipo, SUM(polizas), SUM(equivalencias), SUM(prima_neta)
+            FROM produccion_mensual_agg GROUP BY anio, tipo ORDER BY anio, tipo
+        """)).fetchall()
+        assert agregado == directo
+
+    def test_refresco_incremental_por_anio(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        antes = _agregado(db)
+        db.execute(text("UPDATE polizas SET prima_neta = 0, anio_aplicacion = 2024 WHERE poliza_original = '5555'"))
+        refrescar_produccion(db, [2030])
+        assert _agregado(db) == antes
+        refrescar_produccion(db, [2024, 2025])
+        assert db.execute(text(
+            "SELECT SUM(polizas) FROM produccion_mensual_agg WHERE anio = 2024"
+        )).scalar() == 1
+
+    def test_asegurados_nulos_cuentan_uno_y_ceros_cero(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.execute(text("UPDATE polizas SET num_asegurados = 0 WHERE poliza_original = '0076384A00'"))
+        refrescar_produccion(db)
+        asegurados = db.execute(text("SELECT SUM(asegurados) FROM produccion_mensual_agg")).scalar()
+        # 0076384A00 → 0, 1234567U01 → 2, 5555 sin ASEGS (NULL) → 1
+        assert asegurados == 3
+
+    def test_ultimo_mes_ignora_filas_sin_periodo(self, db):
+        from api.routers import _kpis_por_anio
+        db.execute(text("""
+            INSERT INTO produccion_mensual_agg (anio, periodo, mes, ramo_codigo, tipo, polizas)
+            VALUES (2031, '2031-03', 3, 11, 'NUEVA', 2), (2031, NULL, 12, 11, 'NUEVA', 1)
+        """))
+        kpis = _kpis_por_anio(db, [2031, 2032])
+        assert kpis[2031]["ultimo_mes"] == 3
+        assert kpis[2031]["total"] == 3
+        assert kpis[2032]["ultimo_mes"] is None and kpis[2032][11, "NUEVA"]["polizas"] == 0
+
+    def test_recalculo_reglas_refresca_agregado(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.execute(text("DELETE FROM produccion_mensual_agg"))
+        recalcular_reglas(db)
+        assert db.execute(text("SELECT SUM(polizas) FROM produccion_mensual_agg")).scalar() == 3
+
+
+def _fila_ejecutivo(anio, ramo, tipo, periodo, agente="A1", seg="ALFA", n=1, prima=100.0, equiv=0.0):
+    return {
+        "anio": anio, "ramo_codigo": ramo, "tipo": tipo, "periodo": periodo,
+        "codigo_agente": agente, "nombre_completo": agente, "segmento_nombre": seg,
+        "segmento_agrupado": seg, "gestion_comercial": None, "situacion": "ACTIVO", "estado": None,
+        "polizas": n, "asegurados": n, "equivalencias": equiv, "prima": prima,
+    }
+
+
+class TestEjecutivoUnaPasada:
+    def test_acumula_secciones_en_un_recorrido(self):
+        filas = iter([
+            _fila_ejecutivo(2025, 11, "NUEVA", "2025-03", n=2, prima=200, equiv=1.5),
+            _fila_ejecutivo(2025, 11, "SUBSECUENTE", "2025-03", prima=50),
+            _fila_ejecutivo(2024, 11, "NUEVA", "2024-03", prima=80, equiv=1.0),
+            _fila_ejecutivo(2025, 34, "NUEVA", "2025-07", agente="B1", seg=None, n=3, prima=300),
+            _fila_ejecutivo(2025, 90, "OTRA", "2025-07", agente="B1", seg=None),
+        ])
+        acum = acumular(filas, 2025, 2024)
+
+        vida = acum["comparativo"]["vida"]
+        assert vida["act"]["NUEVA"]["polizas"] == 2
+        assert vida["act"]["SUBSECUENTE"]["prima"] == 50
+        assert vida["ant"]["NUEVA"]["equivalencias"] == 1.0
+        assert acum["comparativo"]["autos"]["act"]["NUEVA"]["polizas"] == 0
+
+        assert acum["segmentos"]["ALFA"]["polizas_vida"] == 2
+        assert acum["segmentos"]["SIN SEGMENTO"]["polizas_gmm"] == 3
+        assert acum["segmentos"]["SIN SEGMENTO"]["agentes"] == {"B1"}
+
+        a1 = acum["agentes"]["A1"]
+        assert (a1["polizas_vida"], a1["vida_polizas_ant"], a1["vida_prima_sub_act"]) == (2, 1, 50)
+        assert acum["agentes"]["B1"]["asegurados_gmm"] == 3
+
+        assert acum["mensual"]["vida"]["act"][3] == {"polizas": 2, "prima": 200}
+        assert acum["mensual"]["gmm"]["act"][7]["polizas"] == 3
+
+
+# ═══════════════════════════════════════════════════════════════════
+# PAGTOTAL en streaming
+# ═══════════════════════════════════════════════════════════════════
+
+PAGTOTAL_FILAS = [
+    ["POLIZA", "AGENTE", "RAMO", "MON", "PERINI", "FECAPLI", "NETA", "COMISION", "CONTRATANTE"],
+    ["0076384A00", "47968", "VIDA", "MN", "2025-01-05", "2025-01-20", "1,000.50", "100", "PÉREZ, JUAN"],
+    ["1234567U01", "385201", "GMM", "", "05-FEB-25", "10/03/2025", "2500", "", ""],
+    ["", "47968", "VIDA", "MN", "", "2025-01-01", "10", "", ""],
+    ["5555", "", "GMM", "MN", "", "", "x", "", ""],
+]
+
+
+def _archivo(tmp_path, nombre, contenido: bytes):
+    path = tmp_path / nombre
+    path.write_bytes(contenido)
+    return str(path)
+
+
+def _csv_pagtotal(encoding="utf-8") -> bytes:
+    return "\n".join(",".join(f'"{v}"' for v in fila) for fila in PAGTOTAL_FILAS).encode(encoding)
+
+
+class TestPagtotalStreaming:
+    def test_spool_conserva_extension(self):
+        path = spool_a_temporal(io.BytesIO(b"POLIZA\n1\n"), "PAGTOTAL.CSV")
+        try:
+            assert path.endswith(".csv")
+            with open(path, "rb") as f:
+                assert f.read() == b"POLIZA\n1\n"
+        finally:
+            os.unlink(path)
+
+    def test_csv_por_bloques(self, tmp_path):
+        path = _archivo(tmp_path, "pagtotal.csv", _csv_pagtotal())
+        bloques = list(iter_bloques(path, "pagtotal.csv", chunk_size=2))
+        assert [len(b) for b in bloques] == [2, 2]
+        assert bloques[1].index.tolist() == [2, 3]
+
+    def test_csv_latin1(self, db, tmp_path):
+        path = _archivo(tmp_path, "pagtotal.csv", _csv_pagtotal("latin-1"))
+        errores = []
+        assert importar_pagtotal_archivo(db, path, "pagtotal.csv", errores, chunk_size=2) == 3
+        nombre = db.execute(text("SELECT contratante FROM pagos WHERE poliza_numero='0076384A00'")).scalar()
+        assert nombre == "PÉREZ, JUAN"
+
+    def test_campos_parseados(self, db, tmp_path):
+        path = _archivo(tmp_path, "pagtotal.csv", _csv_pagtotal())
+        importar_pagtotal_archivo(db, path, "pagtotal.csv", [], chunk_size=2)
+        r = db.execute(text(
+            "SELECT fecha_inicio, fecha_aplicacion, periodo_aplicacion, anio_aplicacion, "
+            "prima_neta, comision, moneda, poliza_match FROM pagos WHERE poliza_numero='1234567U01'"
+        )).one()
+        assert r.fecha_inicio == "2025-02-05"
+        assert r.fecha_aplicacion == "2025-03-10"
+        assert r.periodo_aplicacion == "2025-03"
+        assert r.anio_aplicacion == 2025
+        assert r.prima_neta == 2500.0
+        assert r.comision == 0.0
+        assert r.moneda == "MN"
+        assert r.poliza_match == "1234567U01"
+        assert db.execute(text("SELECT prima_neta FROM pagos WHERE poliza_numero='5555'")).scalar() == 0.0
+        assert db.execute(text(
+            "SELECT fecha_aplicacion_d FROM pagos WHERE poliza_numero='1234567U01'")).scalar() == "2025-03-10"
+
+    def test_match_key_cruza_con_polizas(self, db, tmp_path):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        filas = [f[:] for f in PAGTOTAL_FILAS]
+        filas[1][0] = "00076384A00"          # ceros extra: mismo match_key que 0076384A00
+        path = _archivo(tmp_path, "pagtotal.csv",
+                        "\n".join(",".join(f'"{v}"' for v in f) for f in filas).encode())
+        importar_pagtotal_archivo(db, path, "pagtotal.csv", [], chunk_size=2)
+
+        assert db.execute(text(
+            "SELECT match_key FROM pagos WHERE poliza_numero='00076384A00'")).scalar() == "76384A00"
+        cruzadas = dict(db.execute(text(
+            "SELECT p.poliza_original, SUM(pg.prima_neta) FROM polizas p "
+            "JOIN pagos pg ON pg.match_key = p.match_key GROUP BY p.poliza_original"
+        )).all())
+        assert cruzadas == {"0076384A00": 1000.50, "1234567U01": 2500.0, "5555": 0.0}
+
+    def test_xlsx_read_only(self, db, tmp_path):
+        import openpyxl
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        for fila in PAGTOTAL_FILAS:
+            ws.append([v or None for v in fila])
+        ws["F2"] = datetime(2025, 1, 20)
+        buf = io.BytesIO()
+        wb.save(buf)
+        path = _archivo(tmp_path, "pagtotal.xlsx", buf.getvalue())
+        errores = []
+        assert importar_pagtotal_archivo(db, path, "pagtotal.xlsx", errores, chunk_size=3) == 3
+        assert any("Leyendo hoja" in e for e in errores)
+        assert db.execute(text(
+            "SELECT fecha_aplicacion FROM pagos WHERE poliza_numero='0076384A00'"
+        )).scalar() == "2025-01-20"
+
+    @staticmethod
+    def _falla_en_segundo_bloque(monkeypatch):
+        import api.importar_pagos as mod
+        original = mod.limpiar_pagos_df
+        llamadas = []
+
+        def limpiar(chunk):
+            llamadas.append(1)
+            if len(llamadas) == 2:
+                raise ValueError("bloque corrupto")
+            return original(chunk)
+        monkeypatch.setattr(mod, "limpiar_pagos_df", limpiar)
+
+    def test_error_sin_confirmar_bloques_revierte_todo(self, db, tmp_path, monkeypatch):
+        path = _archivo(tmp_path, "pagtotal.csv", _csv_pagtotal())
+        antes = importar_pagtotal_archivo(db, path, "pagtotal.csv", [], chunk_size=2)
+        self._falla_en_segundo_bloque(monkeypatch)
+        db.execute(text("DELETE FROM pagos"))
+        with pytest.raises(ValueError):
+            importar_pagtotal_archivo(db, path, "pagtotal.csv", [], chunk_size=2,
+                                      confirmar_bloques=False)
+        db.rollback()
+        assert db.execute(text("SELECT COUNT(*) FROM pagos")).scalar() == antes
+
+    def test_error_confirmando_bloques_conserva_previos(self, db, tmp_path, monkeypatch):
+        db.execute(text("DELETE FROM pagos"))
+        db.commit()
+        self._falla_en_segundo_bloque(monkeypatch)
+        path = _archivo(tmp_path, "pagtotal.csv", _csv_pagtotal())
+        with pytest.raises(ValueError):
+            importar_pagtotal_archivo(db, path, "pagtotal.csv", [], chunk_size=2)
+        db.rollback()
+        assert db.execute(text("SELECT COUNT(*) FROM pagos")).scalar() == 2
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Carga masiva (COPY / executemany)
+# ═══════════════════════════════════════════════════════════════════
+
+class TestFechasNativas:
+    def test_leer_fecha_dual(self):
+        assert leer_fecha({"fecha_fin": "2025-03-01", "fecha_fin_d": None}, "fecha_fin") == datetime(2025, 3, 1).date()
+        assert leer_fecha({"fecha_fin": "basura", "fecha_fin_d": "2025-03-02"}, "fecha_fin") == datetime(2025, 3, 2).date()
+        assert leer_fecha({"fecha_fin": "", "fecha_fin_d": None}, "fecha_fin") is None
+
+    def test_rango_incluye_filas_sin_migrar(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.execute(text("UPDATE polizas SET fecha_inicio_d = NULL WHERE poliza_original = '1234567U01'"))
+        polizas = db.execute(text(
+            f"SELECT poliza_original FROM polizas p WHERE {sql_rango_fecha('p', 'fecha_inicio')} ORDER BY 1"
+        ), {"desde": "2025-01-01", "hasta": "2025-02-28"}).scalars().all()
+        assert polizas == ["0076384A00", "1234567U01"]
+
+
+class TestBulkLoader:
+    def test_sqlite_usa_executemany(self, db):
+        assert not soporta_copy(db)
+        filas = ({"poliza_numero": f"P{i}", "prima_neta": float(i), "fuente": "TEST"} for i in range(7))
+        avances = []
+        assert bulk_insert(db, "pagos", filas, batch_size=3, progreso=avances.append) == 7
+        assert avances == [3, 6, 7]
+        assert db.execute(text("SELECT SUM(prima_neta) FROM pagos WHERE fuente='TEST'")).scalar() == 21.0
+
+    def test_vacio(self, db):
+        assert bulk_insert(db, "pagos", iter([])) == 0
+
+    def test_table_descarta_llaves_y_aplica_defaults(self, db):
+        fila = {"poliza_original": "X1", "poliza_estandar": "X1", "fecha_inicio": "2025-01-01",
+                "ramo": "VIDA", "fuente": "TEST"}
+        assert bulk_insert(db, Poliza.__table__, [fila]) == 1
+        r = db.execute(text(
+            "SELECT created_at, moneda, num_asegurados FROM polizas WHERE poliza_original='X1'"
+        )).one()
+        assert r.created_at is not None
+        assert (r.moneda, r.num_asegurados) == ("MN", 1)
+
+    def test_copy_formato_csv(self):
+        class Cursor:
+            def copy_expert(self, sql, buf):
+                self.sql, self.data = sql, buf.read()
+            def close(self):
+                pass
+
+        cursor = Cursor()
+        conn = type("C", (), {})()
+        conn.connection = type("R", (), {"dbapi_connection": type("D", (), {"cursor": lambda self: cursor})()})()
+        _copy_lote(conn, "pagos", ["poliza_numero", "contratante", "flag"],
+                   [{"poliza_numero": "A1", "contratante": "PÉREZ, JUAN", "flag": True},
+                    {"poliza_numero": "A2", "contratante": None, "flag": False}])
+        assert cursor.sql.startswith("COPY pagos (poliza_numero, contratante, flag) FROM STDIN")
+        assert cursor.data.splitlines() == ['A1,"PÉREZ, JUAN",t', r"A2,\N,f"]
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Sincronización incremental (marca de agua + MERGE)
+# ═══════════════════════════════════════════════════════════════════
+
+def _oracle_sol(nosol, etapa, fecetapa):
+    return {"NOSOL": nosol, "ETAPA": etapa, "FECETAPA": fecetapa}
+
+
+def _mapear_sol(data):
+    return {
+        "nosol": data["NOSOL"],
+        "ultima_etapa": data["ETAPA"],
+        "fecha_ultima_etapa": str(data["FECETAPA"])[:10],
+        "fuente": "TEST",
+        "updated_at": datetime.now().isoformat(),
+    }
+
+
+class TestSyncIncremental:
+    def test_primera_corrida_inserta_y_guarda_marca(self, db):
+        db.execute(text("DELETE FROM solicitudes"))
+        registros = [
+            _oracle_sol("S1", "RECEPCION", datetime(2025, 3, 1)),
+            _oracle_sol("S2", "EMISION", datetime(2025, 3, 4)),
+            _oracle_sol(None, "EMISION", datetime(2025, 3, 9)),
+        ]
+        stats = sincronizar(db, "solicitudes", registros, _mapear_sol)
+        db.commit()
+        assert (stats["insertadas"], stats["actualizadas"], stats["sin_llave"]) == (2, 0, 1)
+        assert leer_marca(db, "solicitudes") == "2025-03-09T00:00:00"
+
+    def test_solo_reescribe_cambios(self, db):
+        db.execute(text("DELETE FROM solicitudes"))
+        base = [_oracle_sol("S1", "RECEPCION", datetime(2025, 3, 1)),
+                _oracle_sol("S2", "EMISION", datetime(2025, 3, 4))]
+        sincronizar(db, "solicitudes", base, _mapear_sol)
+        db.commit()
+        creado = db.execute(text("SELECT created_at FROM solicitudes WHERE nosol='S1'")).scalar()
+
+        delta = [_oracle_sol("S1", "POLIZA_ENVIADA", datetime(2025, 3, 10)),
+                 _oracle_sol("S2", "EMISION", datetime(2025, 3, 4)),
+                 _oracle_sol("S3", "RECEPCION", datetime(2025, 3, 11))]
+        stats = sincronizar(db, "solicitudes", delta, _mapear_sol)
+        db.commit()
+        assert (stats["insertadas"], stats["actualizadas"], stats["sin_cambios"]) == (1, 1, 1)
+        r = db.execute(text(
+            "SELECT ultima_etapa, created_at FROM solicitudes WHERE nosol='S1'"
+        )).one()
+        assert r.ultima_etapa == "POLIZA_ENVIADA"
+        assert r.created_at == creado
+        assert db.execute(text("SELECT COUNT(*) FROM solicitudes WHERE fuente='TEST'")).scalar() == 3
+
+    def test_llave_compuesta_polizas(self, db):
+        def mapear(d):
+            return {"poliza_original": d["POLIZA"], "poliza_estandar": d["POLIZA"],
+                    "fecha_inicio": d["FECINI"], "prima_neta": d["NETA"], "ramo": "VIDA"}
+
+        filas = [{"POLIZA": "P1", "FECINI": "2025-01-01", "NETA": 100.0},
+                 {"POLIZA": "P1", "FECINI": "2026-01-01", "NETA": 120.0}]
+        assert sincronizar(db, "polizas", filas, mapear)["insertadas"] == 2
+        filas[1]["NETA"] = 150.0
+        stats = sincronizar(db, "polizas", filas, mapear)
+        assert (stats["insertadas"], stats["actualizadas"]) == (0, 1)
+        assert db.execute(text(
+            "SELECT prima_neta FROM polizas WHERE fecha_inicio='2026-01-01'"
+        )).scalar() == 150.0
+
+    def test_polizas_sin_fecha_inicio(self, db):
+        def mapear(d):
+            return {"poliza_original": d["POLIZA"], "poliza_estandar": d["POLIZA"],
+                    "fecha_inicio": d["FECINI"], "prima_neta": d["NETA"], "fuente": "ORACLE_MAESTRO"}
+
+        filas = [{"POLIZA": "V1", "FECINI": "", "NETA": 10.0},
+                 {"POLIZA": "V2", "FECINI": "", "NETA": 20.0}]
+        stats = sincronizar(db, "polizas", filas, mapear)
+        assert (stats["insertadas"], stats["sin_llave"]) == (2, 0)
+        filas[0]["NETA"] = 11.0
+        stats = sincronizar(db, "polizas", filas, mapear)
+        assert (stats["insertadas"], stats["actualizadas"], stats["eliminadas"]) == (0, 1, 0)
+        assert db.execute(text(
+            "SELECT COUNT(*) FROM polizas WHERE poliza_original IN ('V1', 'V2')")).scalar() == 2
+
+    def test_pagos_sin_comprobante_por_llave_alterna(self, db):
+        def mapear(d):
+            return {"poliza_numero": d["POLIZA"], "fecha_aplicacion": d["FECAPLI"],
+                    "endoso": d["ENDOSO"], "comprobante": d["COMPROBANTE"], "prima_neta": d["NETA"]}
+
+        db.execute(text("DELETE FROM pagos"))
+        filas = [{"POLIZA": "P1", "FECAPLI": "2025-03-01", "ENDOSO": "", "COMPROBANTE": "C1", "NETA": 10.0},
+                 {"POLIZA": "P1", "FECAPLI": "2025-03-01", "ENDOSO": "", "COMPROBANTE": None, "NETA": 20.0},
+                 {"POLIZA": "P1", "FECAPLI": "2025-03-01", "ENDOSO": "E1", "COMPROBANTE": "", "NETA": 30.0},
+                 {"POLIZA": "P1", "FECAPLI": "", "ENDOSO": "", "COMPROBANTE": None, "NETA": 40.0}]
+        stats = sincronizar(db, "pagos", filas, mapear)
+        assert (stats["insertadas"], stats["llave_alterna"], stats["sin_llave"]) == (3, 2, 1)
+
+        # Releer la ventana no duplica; el pago sin comprobante se actualiza en su lugar
+        filas[1]["NETA"] = 25.0
+        stats = sincronizar(db, "pagos", filas, mapear)
+        assert (stats["insertadas"], stats["actualizadas"], stats["sin_cambios"]) == (0, 1, 2)
+        netas = db.execute(text(
+            "SELECT comprobante, endoso, prima_neta FROM pagos ORDER BY prima_neta")).all()
+        assert [tuple(r) for r in netas] == [("C1", "", 10.0), (None, "", 25.0), (None, "E1", 30.0)]
+
+    def test_pagos_sin_comprobante_repetidos_suman_montos(self, db):
+        def mapear(d):
+            return {"poliza_numero": d["POLIZA"], "fecha_aplicacion": d["FECAPLI"],
+                    "endoso": "", "comprobante": None, "prima_neta": d["NETA"]}
+
+        db.execute(text("DELETE FROM pagos"))
+        filas = [{"POLIZA": "P1", "FECAPLI": "2025-03-01", "NETA": 20.0},
+                 {"POLIZA": "P1", "FECAPLI": "2025-03-01", "NETA": 5.0}]
+        stats = sincronizar(db, "pagos", filas, mapear)
+        assert (stats["insertadas"], stats["colisiones"]) == (1, 1)
+        # La re-lectura de la ventana trae los mismos pagos: el total no cambia
+        stats = sincronizar(db, "pagos", filas, mapear)
+        assert (stats["insertadas"], stats["actualizadas"], stats["sin_cambios"]) == (0, 0, 1)
+        assert db.execute(text("SELECT SUM(prima_neta) FROM pagos")).scalar() == 25.0
+
+    def test_consulta_usa_marca_con_ventana(self, db):
+        sql, params = consulta_incremental(db, "solicitudes")
+        assert "WHERE" not in sql and params == {}
+        sincronizar(db, "solicitudes", [_oracle_sol("S9", "X", datetime(2025, 3, 20))], _mapear_sol)
+        sql, params = consulta_incremental(db, "solicitudes")
+        assert sql.endswith("WHERE FECETAPA >= :desde")
+        assert params["desde"] == datetime(2025, 3, 13)
+        sql, _ = consulta_incremental(db, "pagos", completo=True)
+        assert sql == "SELECT * FROM PAGTOTAL"
+
+    def test_polizas_completa_y_borra_ausentes(self, db):
+        def mapear(d):
+            if d.get("POLIZA") == "X":
+                return None
+            return {"poliza_original": d["POLIZA"], "poliza_estandar": d["POLIZA"],
+                    "fecha_inicio": d["FECINI"], "prima_neta": d["NETA"], "fuente": "ORACLE_MAESTRO"}
+
+        # Sin columna de modificación: pólizas siempre se extrae completa, aunque haya marca
+        filas = [{"POLIZA": p, "FECINI": "2020-01-01", "NETA": 10.0, "FECEMI": datetime(2020, 1, 1)}
+                 for p in ("Q1", "Q2", "Q3")]
+        sincronizar(db, "polizas", filas, mapear)
+        assert consulta_incremental(db, "polizas") == ("SELECT * FROM UCARTERA.POLIZAS_01", {})
+        q2 = db.execute(text("SELECT id FROM polizas WHERE poliza_original='Q2'")).scalar()
+        db.execute(text("INSERT INTO recibos (poliza_id, comprobante) VALUES (:id, 'R1')"), {"id": q2})
+
+        # Q1 cambia de prima (emisión vieja), Q2 desaparece de Oracle, X se descarta
+        filas = [{"POLIZA": "Q1", "FECINI": "2020-01-01", "NETA": 99.0},
+                 {"POLIZA": "Q3", "FECINI": "2020-01-01", "NETA": 10.0},
+                 {"POLIZA": "X", "FECINI": "2020-01-01", "NETA": 1.0}]
+        stats = sincronizar(db, "polizas", filas, mapear)
+        assert (stats["actualizadas"], stats["eliminadas"], stats["descartadas"]) == (1, 1, 1)
+        vivas = db.execute(text("SELECT poliza_original FROM polizas WHERE poliza_original LIKE 'Q%' ORDER BY 1")).scalars().all()
+        assert vivas == ["Q1", "Q3"]
+        assert db.execute(text("SELECT COUNT(*) FROM recibos WHERE poliza_id = :id"), {"id": q2}).scalar() == 0
+        # Una extracción vacía no borra la cartera
+        assert sincronizar(db, "polizas", [], mapear)["eliminadas"] == 0
+        assert db.execute(text("SELECT COUNT(*) FROM polizas WHERE poliza_original LIKE 'Q%'")).scalar() == 2
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Orquestador del pipeline Oracle
+# ═══════════════════════════════════════════════════════════════════
+
+class TestPipelineOracle:
+    def _factory(self, db):
+        return sessionmaker(bind=db.get_bind())
+
+    def test_respeta_dependencias_y_reporta_metricas(self, db):
+        orden = []
+
+        def etapa(nombre, filas):
+            def fn(sesion, completo):
+                orden.append(nombre)
+                return {"filas": filas, "insertadas": filas}
+            return fn
+
+        etapas = {
+            "polizas": (etapa("polizas", 10), ()),
+            "pagtotal": (etapa("pagtotal", 20), ()),
+            "solicitudes": (etapa("solicitudes", 5), ("polizas", "pagtotal")),
+            "reglas": (etapa("reglas", 10), ("solicitudes",)),
+        }
+        estado = ejecutar_pipeline(session_factory=self._factory(db), etapas=etapas)
+        assert estado["exito"]
+        assert set(orden[:2]) == {"polizas", "pagtotal"}
+        assert orden[2:] == ["solicitudes", "reglas"]
+        m = estado["etapas"]["pagtotal"]
+        assert (m["estado"], m["filas"], m["detalle"]) == ("ok", 20, {"insertadas": 20})
+        assert m["duracion_segundos"] >= 0
+
+    def test_etapa_reglas_reclasifica_tipo(self, db):
+        importar_polizas_df(db, leer_csv(CSV_POLIZAS), [])
+        db.execute(text("UPDATE polizas SET tipo_poliza = 'X'"))
+        etapa_reglas(db)
+        tipos = dict(db.execute(text("SELECT poliza_original, tipo_poliza FROM polizas")).all())
+        assert tipos == {"0076384A00": "NUEVA", "1234567U01": "NUEVA", "5555": "X"}
+
+    def test_falla_omite_dependientes(self, db):
+        def falla(sesion, completo):
+            raise RuntimeError("ORA-12541: no listener")
+
+        etapas = {
+            "polizas": (falla, ()),
+            "pagtotal": (lambda s, c: {"filas": 1}, ()),
+            "solicitudes": (lambda s, c: {"filas": 1}, ("polizas", "pagtotal")),
+            "reglas": (lambda s, c: {"filas": 1}, ("solicitudes",)),
+        }
+        estado = ejecutar_pipeline(session_factory=self._factory(db), etapas=etapas)
+        assert not estado["exito"]
+        assert {n: m["estado"] for n, m in estado["etapas"].items()} == {
+            "polizas": "error", "pagtotal": "ok", "solicitudes": "omitida", "reglas": "omitida",
+        }
+        assert "ORA-12541" in estado["etapas"]["polizas"]["error"]
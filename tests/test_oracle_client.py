@@ -0,0 +1,115 @@
+"""
+Tests — Cliente Oracle (pool de sesiones y array-fetch)
+=======================================================
+Sin servidor Oracle: se sustituye oracledb.create_pool por un pool falso
+para verificar que el pool y el modo Thick se inicializan una sola vez
+y que stream_query no materializa el resultado.
+
+Ejecutar: python -m pytest tests/test_oracle_client.py -v
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from api import oracle_client
+
+
+class CursorFalso:
+    def __init__(self, filas):
+        self._filas = list(filas)
+        self.description = [("POLIZA",), ("NETA",)]
+        self.arraysize = 100
+        self.prefetchrows = 2
+        self.fetches = 0
+
+    def execute(self, query, params):
+        self.query, self.params = query, params
+
+    def fetchmany(self):
+        self.fetches += 1
+        lote, self._filas = self._filas[:self.arraysize], self._filas[self.arraysize:]
+        return lote
+
+    def close(self):
+        pass
+
+
+class ConexionFalsa:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        self.pool.cursor = CursorFalso(self.pool.filas)
+        return self.pool.cursor
+
+    def close(self):
+        self.pool.devueltas += 1
+
+
+class PoolFalso:
+    def __init__(self, filas):
+        self.filas = filas
+        self.adquiridas = 0
+        self.devueltas = 0
+
+    def acquire(self):
+        self.adquiridas += 1
+        return ConexionFalsa(self)
+
+
+@pytest.fixture()
+def pool(monkeypatch):
+    filas = [(f"P{i}", float(i)) for i in range(5)]
+    creados = []
+    inits = []
+
+    def create_pool(**kwargs):
+        creados.append(kwargs)
+        return PoolFalso(filas)
+
+    monkeypatch.setattr(oracle_client.oracledb, "create_pool", create_pool)
+    monkeypatch.setattr(oracle_client.oracledb, "init_oracle_client", lambda **kw: inits.append(kw))
+    monkeypatch.setattr(oracle_client, "_pool", None)
+    monkeypatch.setattr(oracle_client, "_modo_inicializado", False)
+    monkeypatch.setattr(oracle_client, "ORACLE_ARRAYSIZE", 2)
+    yield {"creados": creados, "inits": inits}
+    monkeypatch.setattr(oracle_client, "_pool", None)
+
+
+class TestPool:
+    def test_pool_y_thick_una_sola_vez(self, pool):
+        for _ in range(3):
+            oracle_client.get_oracle_connection(thick_mode=True).close()
+        assert len(pool["creados"]) == 1
+        assert len(pool["inits"]) == 1
+        p = oracle_client.get_pool()
+        assert (p.adquiridas, p.devueltas) == (3, 3)
+
+    def test_limites_configurables(self, pool):
+        oracle_client.get_pool(thick_mode=False)
+        assert pool["inits"] == []
+        kwargs = pool["creados"][0]
+        assert (kwargs["min"], kwargs["max"]) == (oracle_client.ORACLE_POOL_MIN, oracle_client.ORACLE_POOL_MAX)
+
+
+class TestStreamQuery:
+    def test_tuplas_con_arraysize(self, pool):
+        columnas = []
+        filas = list(oracle_client.stream_query("SELECT 1", columnas=columnas))
+        assert columnas == ["POLIZA", "NETA"]
+        assert filas[0] == ("P0", 0.0) and len(filas) == 5
+        cursor = oracle_client.get_pool().cursor
+        assert cursor.arraysize == 2
+        assert cursor.prefetchrows == oracle_client.ORACLE_PREFETCHROWS
+        assert cursor.fetches == 4          # 2 + 2 + 1 + fin
+        assert oracle_client.get_pool().devueltas == 1
+
+    def test_lotes_por_columna(self, pool):
+        lotes = list(oracle_client.stream_query("SELECT 1", lotes=True))
+        assert lotes[0] == {"POLIZA": ["P0", "P1"], "NETA": [0.0, 1.0]}
+        assert [len(l["POLIZA"]) for l in lotes] == [2, 2, 1]
+
+    def test_execute_query_dicts(self, pool):
+        rows = oracle_client.execute_query("SELECT 1")
+        assert rows[4] == {"POLIZA": "P4", "NETA": 4.0}
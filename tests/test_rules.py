@@ -10,6 +10,7 @@ import sys, os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import pytest
+import pandas as pd
 from datetime import datetime, timedelta
 
 
@@ -24,7 +25,8 @@ from api.rules import (
     es_reexpedicion,
     extraer_raiz_poliza,
     calcular_mystatus,
-    normalizar_poliza,supa
+    normalizar_poliza,
+    clave_cruce,
     agrupar_segmento,
     mapear_estatus_cubo,
     clasificar_cy,
@@ -49,6 +51,7 @@ from api.rules import (
     # Orquestador
     aplicar_reglas_poliza,
     aplicar_reglas_batch,
+    aplicar_reglas_dataframe,
     # Constantes
     CATALOGO_ESTATUS,
     ESTATUS_CUBO_MAP,
@@ -224,6 +227,16 @@ class TestNormalizarPoliza:
     def test_normalizar(self, entrada, esperado):
         assert normalizar_poliza(entrada) == esperado
 
+    @pytest.mark.parametrize("entrada,esperado", [
+        (" 0076384A ", "76384A"),
+        ('"00123U00"', "123U00"),
+        ("", None),
+        ("  ", None),
+        (None, None),
+    ])
+    def test_clave_cruce(self, entrada, esperado):
+        assert clave_cruce(entrada) == esperado
+
 
 # ══════════════════════════════════════════════════════════════════
 # Segmentos
@@ -729,6 +742,74 @@ class TestAplicarReglasBatch:
         assert all("num_reexpediciones" in r for r in results)
 
 
+# ══════════════════════════════════════════════════════════════════
+# COLUMNAR: aplicar_reglas_dataframe == aplicar_reglas_batch
+# ══════════════════════════════════════════════════════════════════
+
+def _hace(dias: int) -> str:
+    return (datetime.now() - timedelta(days=dias)).strftime("%Y-%m-%d")
+
+
+POLIZAS_PARIDAD = [
+    # Fixtures de TestAplicarReglasPoliza / TestAplicarReglasBatch
+    {"poliza_original": "17958V00", "fecha_inicio": "2025-03-15", "prima_neta": 25000.0,
+     "moneda": "MN", "mystatus": "PAGADA TOTAL", "status_recibo": "PAGADA",
+     "anio_aplicacion": 2025, "fecha_aplicacion": "2025-04-01", "es_nueva": True, "ramo_codigo": 11},
+    {"poliza_original": "18104U00", "fecha_inicio": "2025-01-01", "prima_neta": 12000.0,
+     "moneda": "MN", "mystatus": "CANCELADA CADUCADA", "status_recibo": "CANCELADA",
+     "anio_aplicacion": 2025, "fecha_aplicacion": "", "es_nueva": False, "ramo_codigo": 34},
+    {"poliza_original": "17958V01", "fecha_inicio": "2025-06-01", "prima_neta": 25000.0,
+     "moneda": "MN", "mystatus": "PAGADA TOTAL", "status_recibo": "PAGADA",
+     "anio_aplicacion": 2025, "fecha_aplicacion": "2025-07-01", "ramo_nombre": "VIDA"},
+    {"poliza_original": "18200U00", "fecha_inicio": "2025-02-01", "prima_neta": 15000.0,
+     "moneda": "MN", "mystatus": "", "status_recibo": "PAGADA",
+     "anio_aplicacion": 2025, "fecha_aplicacion": "2025-03-01", "ramo_nombre": "GASTOS MEDICOS"},
+    # Monedas y redondeo (2.675 es un empate binario: round() da 2.67)
+    {"poliza_original": " 0076384A02 ", "fecha_inicio": "2024-02-29", "prima_neta": 2.675,
+     "moneda": "usd", "status_recibo": " pagada", "anio_aplicacion": 2024, "ramo_codigo": 11},
+    {"poliza_original": "0076384A", "fecha_inicio": "2024-07-01", "prima_neta": 1234.565,
+     "moneda": "UDIS", "mystatus": "AL CORRIENTE", "anio_aplicacion": 2024, "ramo_codigo": 34,
+     "tipo_poliza": "SUBSECUENTE"},
+    # Fecha de aplicación: "-", primer pago, inferida de fecha_inicio
+    {"poliza_original": "55501H00", "fecha_inicio": _hace(10), "prima_neta": 60000.0,
+     "fecha_aplicacion": "-", "fecha_primer_pago": _hace(5), "ramo_codigo": 11,
+     "tipo_poliza": "NUEVA", "anio_aplicacion": datetime.now().year},
+    {"poliza_original": "55502H00", "fecha_inicio": _hace(-20), "prima_neta": 9000.0,
+     "mystatus": "CANC/X F.PAGO", "ramo_codigo": 11, "prima_acumulada_basica": 500.0},
+    {"poliza_original": "55503H00", "fecha_inicio": "2026-01-15", "prima_neta": 18000.0,
+     "status_recibo": "VIGENTE", "anio_aplicacion": 2026, "ramo_codigo": 34},
+    # Vacíos y faltantes
+    {"poliza_original": None, "fecha_inicio": None, "prima_neta": None, "moneda": None,
+     "mystatus": None, "status_recibo": None, "anio_aplicacion": None},
+    {"poliza_original": "", "fecha_inicio": "2023-05-01", "prima_neta": 0,
+     "fecha_aplicacion": "2022-12-31", "neta_acumulada": 300.0, "ramo_nombre_raw": "GMM",
+     "periodo_aplicacion": "2022-12"},
+]
+
+
+class TestAplicarReglasDataframe:
+    def test_paridad_con_batch(self):
+        esperado = aplicar_reglas_batch(POLIZAS_PARIDAD)
+        obtenido = aplicar_reglas_dataframe(pd.DataFrame(POLIZAS_PARIDAD)).to_dict("records")
+        assert len(obtenido) == len(esperado)
+        for i, (e, o) in enumerate(zip(esperado, obtenido)):
+            assert o == e, f"Fila {i}: {[(k, e[k], o[k]) for k in e if e[k] != o[k]]}"
+            assert all(type(o[k]) is type(e[k]) for k in e if e[k] is not None and not isinstance(e[k], float)), \
+                f"Fila {i}: tipos distintos"
+
+    def test_paridad_ramo_fijo(self):
+        esperado = aplicar_reglas_batch(POLIZAS_PARIDAD, ramo_codigo=34)
+        obtenido = aplicar_reglas_dataframe(pd.DataFrame(POLIZAS_PARIDAD), ramo_codigo=34)
+        assert obtenido.to_dict("records") == esperado
+
+    def test_conserva_indice(self):
+        df = pd.DataFrame(POLIZAS_PARIDAD[:2], index=[10, 20])
+        r = aplicar_reglas_dataframe(df)
+        assert list(r.index) == [10, 20]
+        assert r.loc[10, "mes_aplicacion"] == "ABRIL"
+        assert r.loc[20, "flag_cancelada"] == 0
+
+
 # ══════════════════════════════════════════════════════════════════
 # Constantes y catálogos
 # ══════════════════════════════════════════════════════════════════